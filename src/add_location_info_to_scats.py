@@ -1,99 +1,72 @@
 """
 add location to scats in "auto" fields
-locations are cached in locations.json
 
-"""
-
-from tinydb import TinyDB, Query
-
-db = TinyDB("locations.json")
-
-Row = Query()
-
-# db.insert({'xy': 1, 'geolocation': })
+the scats are geocoded by batch (see geocoding.py):
+municipality, province and region from the comuni and geo_info tables.
+The scats outside Italy are geocoded by Nominatim (one request by second) only with the --nominatim option.
+The location_auto field is kept if the geocoder does not return a location.
 
-import psycopg2
-import psycopg2.extras
-import functions as fn
+usage: python add_location_info_to_scats.py [--nominatim]
+"""
 
-import subprocess
 import sys
+import time
 
+from sqlalchemy import text
 
-connection = fn.get_connection()
-cursor = connection.cursor(cursor_factory=psycopg2.extras.DictCursor)
-
-cursor.execute(
-    (
-        "SELECT scat_id, sampling_type, path_id, "
-        "st_x(geometry_utm)::integer AS x, st_y(geometry_utm)::integer AS y "
-        "FROM scats ORDER BY scat_id"
-    )
-)
-scats = cursor.fetchall()
-for row in scats:
-    print(
-        f"scat ID: {row['scat_id']}, Coordinates UTM: {row['x']}, {row['y']}",
-        file=sys.stderr,
+import functions as fn
+import geocoding
+
+t0 = time.time()
+
+with fn.db_connection() as con:
+    scats = (
+        con.execute(
+            text(
+                "SELECT scat_id, "
+                "ST_X(ST_Transform(geometry_utm, 4326)) AS longitude, "
+                "ST_Y(ST_Transform(geometry_utm, 4326)) AS latitude "
+                "FROM scats WHERE geometry_utm IS NOT NULL ORDER BY scat_id"
+            )
+        )
+        .mappings()
+        .all()
     )
 
-    r = db.search(Row.xy == f"{row['x']} {row['y']}")
-    # print(r)
-    if r:
-        d = r[0]["geolocation"]
-        print(f"found in db: {d}", file=sys.stderr)
-
-    else:
-        print("NOT FOUND in db", file=sys.stderr)
-        out, error = subprocess.Popen(
-            f"wget -O - http://127.0.0.1:5000/rev_geocoding/{row['x']}/{row['y']}/32N",
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            shell=True,
-        ).communicate()
-
-        out = out.decode("utf-8")
-        # print(out)
-        try:
-            d = eval(out)
-            db.update({"xy": f"{row['x']} {row['y']}", "geolocation": d})
-        except Exception:
-            print(f"{out=}", file=sys.stderr)
-            d = {
-                "continent": "",
-                "country": "NOT FOUND",
-                "location": "NOT FOUND",
-                "municipality": "NOT FOUND",
-                "province": "NOT FOUND",
-                "province_code": "NOT FOUND",
-                "region": "NOT FOUND",
-            }
-            # raise
-        # print(d, file=sys.stderr)
-
-    print(
-        d["region"],
-        d["province_code"],
-        d["municipality"],
-        d["location"],
-        file=sys.stderr,
-    )
+print(f"{len(scats)} scats", file=sys.stderr)
 
-    sql = "UPDATE scats SET region_auto = %s, province_auto = %s, municipality_auto = %s, location_auto = %s WHERE scat_id = %s; "
+locations = geocoding.reverse_geocoding_batch(
+    [(row["longitude"], row["latitude"]) for row in scats],
+    nominatim="--nominatim" in sys.argv[1:],
+)
 
-    out = cursor.mogrify(
-        sql,
-        [
-            d["region"],
-            d["province_code"],
-            d["municipality"],
-            d["location"],
-            row["scat_id"],
-        ],
+found = [(row["scat_id"], d) for row, d in zip(scats, locations) if d is not None]
+for row, d in zip(scats, locations):
+    if d is None:
+        print(f"scat ID: {row['scat_id']} NOT FOUND", file=sys.stderr)
+
+with fn.db_connection() as con:
+    con.execute(
+        text(
+            "UPDATE scats s "
+            "SET region_auto = u.region, "
+            "    province_auto = u.province_code, "
+            "    municipality_auto = u.municipality, "
+            "    location_auto = COALESCE(NULLIF(u.location, ''), s.location_auto) "
+            "FROM unnest(CAST(:scat_id AS text[]), CAST(:region AS text[]), CAST(:province_code AS text[]), "
+            "            CAST(:municipality AS text[]), CAST(:location AS text[])) "
+            "     AS u(scat_id, region, province_code, municipality, location) "
+            "WHERE s.scat_id = u.scat_id"
+        ),
+        {
+            "scat_id": [scat_id for scat_id, _ in found],
+            "region": [d["region"] for _, d in found],
+            "province_code": [d["province_code"] for _, d in found],
+            "municipality": [d["municipality"] for _, d in found],
+            "location": [d["location"] for _, d in found],
+        },
     )
 
-    print(out.decode("utf-8"))
-
-    # cursor.execute(sql, [d['region'] ,d['province_code'], d['municipality'], d['location'], row["scat_id"]])
-
-    # connection.commit()
+print(
+    f"{len(found)} scats updated in {round(time.time() - t0, 1)} seconds", file=sys.stderr
+)
@@ -1,124 +1,74 @@
 """
-add location to transects
-locations are cached in locations.json
-
-"""
-
-import redis
-
-rdis = redis.Redis(db=3)
+add location to transects (location of the first point of the transect)
 
+the transects are geocoded by batch (see geocoding.py):
+municipality, province and region from the comuni and geo_info tables.
+The transects outside Italy are geocoded by Nominatim (one request by second) only with the --nominatim option.
+The location field is kept if the geocoder does not return a location.
 
-import psycopg2
-import psycopg2.extras
-import functions as fn
+usage: python add_location_info_to_transects.py [--nominatim]
+"""
 
-import subprocess
 import sys
-import json
 
+from sqlalchemy import text
 
-connection = fn.get_connection()
-cursor = connection.cursor(cursor_factory=psycopg2.extras.DictCursor)
+import functions as fn
+import geocoding
+
+with fn.db_connection() as con:
+    transects = (
+        con.execute(
+            text(
+                "SELECT transect_id, "
+                "ST_X(ST_Transform(ST_StartPoint(ST_GeometryN(multilines, 1)), 4326)) AS longitude, "
+                "ST_Y(ST_Transform(ST_StartPoint(ST_GeometryN(multilines, 1)), 4326)) AS latitude "
+                "FROM transects WHERE multilines IS NOT NULL ORDER BY transect_id"
+            )
+        )
+        .mappings()
+        .all()
+    )
 
-cursor.execute(
-    "SELECT transect_id, ST_AsGeoJSON(multilines) AS transect_geojson FROM transects"
+locations = geocoding.reverse_geocoding_batch(
+    [(row["longitude"], row["latitude"]) for row in transects],
+    nominatim="--nominatim" in sys.argv[1:],
 )
-transects = cursor.fetchall()
-for row in transects:
-    print(file=sys.stderr)
-
-    geojson = json.loads(row["transect_geojson"])
-
-    if geojson["type"] == "MultiLineString":
-        print(f"{row['transect_id']}\tMultiLineString\t", end="", file=sys.stderr)
-
-        for line in geojson["coordinates"]:
-            for points in line:
-                start_position = points
-                break
-
-        print(f"{points}", file=sys.stderr)
-
-    if geojson["type"] == "LineString":
-        raise
-
-    x, y = points
-    loc_str = rdis.get(f"{x} {y}")
-    if loc_str is not None:
-        d = json.loads(loc_str)
-        print(f"found in db: {d}", file=sys.stderr)
-
-        if d["province_code"] == "":
-            print(f"Province code missing. Query OSM", file=sys.stderr)
-            loc_str = None
-
-    if loc_str is None:
-        print("NOT FOUND in DB", file=sys.stderr)
-
-        out, error = subprocess.Popen(
-            f"wget -O - http://127.0.0.1:5000/rev_geocoding/{x}/{y}/32N",
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            shell=True,
-        ).communicate()
-
-        out = out.decode("utf-8")
-
-        print(f"OSM results: {out}", file=sys.stderr)
-
-        try:
-            d = eval(out)
-            if d["province_code"] == "":
-                print("Province code NOT FOUND", file=sys.stderr)
-                break
-
-            # db.update({"xy": f"{x} {y}", "geolocation": d})
-            rdis.set(f"{x} {y}", out)
-        except:
-            print("NOT FOUND ON OSM:", file=sys.stderr)
-            print(f"{out=}", file=sys.stderr)
-            d = {
-                "continent": "",
-                "country": "NOT FOUND",
-                "location": "NOT FOUND",
-                "municipality": "NOT FOUND",
-                "province": "NOT FOUND",
-                "province_code": "NOT FOUND",
-                "region": "NOT FOUND",
-            }
-            # raise
-        # print(d, file=sys.stderr)
 
+found: list = []
+for row, d in zip(transects, locations):
+    if d is None or d["province_code"] == "":
+        print(f"{row['transect_id']}\tProvince code NOT FOUND", file=sys.stderr)
+        continue
     print(
         (
-            f"Region: {d['region']}\tprovince: {d['province_code']}\t"
+            f"{row['transect_id']}\tRegion: {d['region']}\tprovince: {d['province_code']}\t"
             f"Municipality: {d['municipality']}\tLocation: {d['location']}"
         ),
         file=sys.stderr,
     )
-
-    if d["province_code"] == "":
-        print("Province code NOT FOUND", file=sys.stderr)
-        break
-
-    sql = "UPDATE transect SET region = %s, province = %s, municipality = %s, location = %s WHERE transect_id = %s; "
-
-    out = cursor.mogrify(
-        sql,
-        [
-            d["region"],
-            d["province"],
-            d["municipality"],
-            d["location"],
-            row["transect_id"],
-        ],
+    found.append((row["transect_id"], d))
+
+with fn.db_connection() as con:
+    con.execute(
+        text(
+            "UPDATE transects t "
+            "SET region = u.region, "
+            "    province = u.province, "
+            "    municipality = u.municipality, "
+            "    location = COALESCE(NULLIF(u.location, ''), t.location) "
+            "FROM unnest(CAST(:transect_id AS text[]), CAST(:region AS text[]), CAST(:province AS text[]), "
+            "            CAST(:municipality AS text[]), CAST(:location AS text[])) "
+            "     AS u(transect_id, region, province, municipality, location) "
+            "WHERE t.transect_id = u.transect_id"
+        ),
+        {
+            "transect_id": [transect_id for transect_id, _ in found],
+            "region": [d["region"] for _, d in found],
+            "province": [d["province"] for _, d in found],
+            "municipality": [d["municipality"] for _, d in found],
+            "location": [d["location"] for _, d in found],
+        },
     )
 
-    print(out.decode("utf-8"))
-
-    """
-    # cursor.execute(sql, [d['region'] ,d['province_code'], d['municipality'], d['location'], row["scat_id"]])
-
-    # connection.commit()
-    """
+print(f"{len(found)} transects updated", file=sys.stderr)
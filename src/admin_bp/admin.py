@@ -7,11 +7,11 @@ flask blueprint for service administration
 
 import sys
 from flask import render_template, session, current_app, flash, redirect, Blueprint
-import subprocess
 from sqlalchemy import text
 
 from config import config
 import functions as fn
+import job_queue
 
 app = Blueprint("admin", __name__, template_folder="templates")
 
@@ -29,7 +29,7 @@ def admin():
 
     if session.get("role", "").lower() == "administrator":
         # users list
-        with fn.conn_alchemy().connect() as con:
+        with fn.db_connection() as con:
             users = con.execute(text("SELECT * FROM users")).mappings().all()
 
         return render_template(
@@ -53,11 +53,19 @@ def update_redis():
 
     !require the update_redis.py file
     """
-    _ = subprocess.Popen([sys.executable, "update_redis.py"])
+    job_id = job_queue.submit(
+        session["email"],
+        kind="update_redis",
+        title="Update Redis with WA and genotypes loci values",
+        command=[sys.executable, "update_redis.py"],
+    )
+    if job_id is None:
+        flash(fn.alert_danger("Too many jobs running. Wait for their completion."))
+        return redirect("/admin")
 
     flash(
         fn.alert_success(
-            "Redis updating with WA and genotypes loci in progress.<br>It will take several minutes to complete."
+            "Redis updating with WA and genotypes loci in progress.<br>It will take several minutes to complete (see the <a href='/jobs'>jobs page</a>)."
         )
     )
 
@@ -72,11 +80,19 @@ def update_redis_with_genotypes_loci():
 
     !require the update_redis_with_genotypes_loci_values file
     """
-    _ = subprocess.Popen([sys.executable, "update_redis_with_genotypes_loci_values.py"])
+    job_id = job_queue.submit(
+        session["email"],
+        kind="update_redis_genotypes",
+        title="Update Redis with genotypes loci values",
+        command=[sys.executable, "update_redis_with_genotypes_loci_values.py"],
+    )
+    if job_id is None:
+        flash(fn.alert_danger("Too many jobs running. Wait for their completion."))
+        return redirect("/admin")
 
     flash(
         fn.alert_success(
-            "Redis updating with genotypes loci in progress.<br>It will take several minutes to complete."
+            "Redis updating with genotypes loci in progress.<br>It will take several minutes to complete (see the <a href='/jobs'>jobs page</a>)."
         )
     )
 
@@ -91,11 +107,19 @@ def update_redis_with_wa_loci():
 
     !require the update_redis_with_wa_loci_values.py file
     """
-    _ = subprocess.Popen([sys.executable, "update_redis_with_wa_loci_values.py"])
+    job_id = job_queue.submit(
+        session["email"],
+        kind="update_redis_wa",
+        title="Update Redis with WA loci values",
+        command=[sys.executable, "update_redis_with_wa_loci_values.py"],
+    )
+    if job_id is None:
+        flash(fn.alert_danger("Too many jobs running. Wait for their completion."))
+        return redirect("/admin")
 
     flash(
         fn.alert_success(
-            "Redis updating with WA loci in progress.<br>It will take several minutes to complete."
+            "Redis updating with WA loci in progress.<br>It will take several minutes to complete (see the <a href='/jobs'>jobs page</a>)."
         )
     )
 
@@ -6,21 +6,19 @@ flask blueprint for data analysis
 """
 
 import flask
-from flask import render_template, redirect, request, flash, make_response, session
-from sqlalchemy import text
+from flask import render_template, redirect, request, flash, session
 from config import config
 import pathlib as pl
 import os
 import functions as fn
-import paths_completeness
 import datetime as dt
-import copy
 import uuid
 import sys
-import subprocess
 import time
 import zipfile
 import fiona
+import job_queue
+import transects_activity
 
 # from . import cell_occupancy as cell_occupancy_module
 
@@ -63,13 +61,19 @@ def analysis():
 
 
 @app.route("/path_completeness")
+@app.route("/path_completeness/<file_format>")
 @fn.check_login
-def path_completeness():
+def path_completeness(file_format: str = "shp"):
     """
-    create shapefile with paths completeness
+    create a file with paths completeness
+    file_format: shp (zipped ESRI Shapefile), gpkg (GeoPackage) or fgb (FlatGeobuf)
     require paths_completeness module
     """
 
+    if file_format not in ("shp", "gpkg", "fgb"):
+        flash(fn.alert_danger(f"File format not found: {file_format}"))
+        return redirect("/analysis")
+
     dir_prefix = (
         pl.Path(pl.Path(app.static_url_path).name)
         / pl.Path("results")
@@ -79,8 +83,8 @@ def path_completeness():
     dir_prefix.mkdir(exist_ok=True)
 
     # remove files older than 48 hours
-    for path in dir_prefix.glob("paths_completeness*.zip"):
-        if time.time() - os.path.getctime(path) > 86400 * 2:
+    for path in dir_prefix.glob("paths_completeness*.*"):
+        if path.is_file() and time.time() - os.path.getctime(path) > 86400 * 2:
             os.remove(path)
 
     dir_path = dir_prefix / pl.Path(
@@ -91,14 +95,62 @@ def path_completeness():
         )
     )
 
-    zip_file_name = paths_completeness.paths_completeness_shapefile(
-        dir_path=dir_path,
-        log_file="/tmp/paths_completeness.log",
-        start_date=session["start_date"],
-        end_date=session["end_date"],
+    job_id = job_queue.submit(
+        session["email"],
+        kind="paths_completeness",
+        title=f"Paths completeness ({file_format}) from {session['start_date']} to {session['end_date']}",
+        function="paths_completeness:paths_completeness_shapefile",
+        kwargs={
+            "dir_path": str(dir_path),
+            "log_file": "/tmp/paths_completeness.log",
+            "start_date": session["start_date"],
+            "end_date": session["end_date"],
+            "file_format": file_format,
+        },
+    )
+    if job_id is None:
+        flash(
+            fn.alert_danger(
+                f"You have already {job_queue.JOBS_MAX_PER_USER} jobs running. Wait for their completion."
+            )
+        )
+
+    return redirect("/jobs")
+
+
+def transects_paths_values(value, file_name: str):
+    """
+    CSV file with a value of the paths of every transect (ordered by date)
+    for the dates interval of the session
+
+    Args:
+        value (Callable): function returning the value (str) of a path (see transects_activity.transects_paths)
+        file_name (str): name of the CSV file
+    """
+    sep = ";"
+
+    year_init = session["start_date"][:4]
+
+    transects = transects_activity.transects_paths(
+        session["start_date"], session["end_date"]
     )
+    n_paths, values = transects_activity.paths_values(transects, value)
+
+    def rows():
+        yield sep.join(
+            ["Transect ID"] + [f"{year_init}-{i + 1}" for i in range(n_paths)]
+        ) + "\n"
+        for transect_id in values:
+            yield sep.join(
+                [transect_id]
+                + values[transect_id]
+                + ["NA"] * (n_paths - len(values[transect_id]))
+            ) + "\n"
+
+    response = flask.Response(rows(), mimetype="text/csv")
+    response.headers["Content-disposition"] = f"attachment; filename={file_name}.csv"
 
-    return redirect("/my_results")
+    return response
 
 
 @app.route("/transects_n_samples/<mode>")
@@ -112,282 +164,33 @@ def transects_samples(mode: str):
                     "presence": presence of samples (1/0)
     """
 
-    sep = ";"
-
-    year_init = session["start_date"][:4]
-
-    with fn.conn_alchemy().connect() as con:
-        # check if path based on transect exist
-        transects = (
-            con.execute(text("SELECT * FROM transects ORDER BY transect_id"))
-            .mappings()
-            .all()
+    if mode == "number":
+        return transects_paths_values(
+            lambda path: str(path["n_samples"]), "transects_n-samples"
         )
-
-        out: dict = {}
-        template: dict = {}
-        header = f"Transect ID{sep}"
-        # check max number of sampling by year
-        result = (
-            con.execute(
-                text(
-                    "SELECT MAX(c) AS n_paths "
-                    "FROM "
-                    "(SELECT COUNT(*) AS c FROM paths "
-                    "      WHERE transect_id != '' "
-                    "            AND date BETWEEN :start_date AND :end_date "
-                    "      GROUP BY transect_id "
-                    ") x"
-                ),
-                {"start_date": session["start_date"], "end_date": session["end_date"]},
-            )
-            .mappings()
-            .fetchone()
+    if mode == "presence":
+        return transects_paths_values(
+            lambda path: str(1 if path["n_samples"] > 0 else 0),
+            "transects_samples_presence-samples",
         )
-        template = ["NA"] * result["n_paths"]
-        for i in range(result["n_paths"]):
-            header += f"{year_init}-{i + 1}{sep}"
-
-        for transect in transects:
-            row_out = copy.deepcopy(template)
-
-            paths = (
-                con.execute(
-                    text(
-                        "SELECT path_id FROM paths WHERE transect_id = :transect_id AND date BETWEEN :start_date AND :end_date ORDER BY date"
-                    ),
-                    {
-                        "transect_id": transect["transect_id"],
-                        "start_date": session["start_date"],
-                        "end_date": session["end_date"],
-                    },
-                )
-                .mappings()
-                .all()
-            )
 
-            idx = 0
-            for path in paths:
-                scats = (
-                    con.execute(
-                        text(
-                            "SELECT count(*) AS n_scats FROM scats WHERE path_id = :path_id"
-                        ),
-                        {"path_id": path["path_id"]},
-                    )
-                    .mappings()
-                    .fetchone()
-                )
-                if mode == "number":
-                    row_out[idx] = str(scats["n_scats"])
-                if mode == "presence":
-                    row_out[idx] = str(1 if scats["n_scats"] > 0 else 0)
-                idx += 1
-
-            out[transect["transect_id"]] = copy.deepcopy(row_out)
-
-        out_str = header[:-1] + "\n"
-        for transect in out:
-            out_str += transect + sep
-            out_str += sep.join(out[transect])
-            out_str += sep
-            out_str = out_str[:-1] + "\n"
-
-        response = make_response(out_str, 200)
-
-        if mode == "number":
-            file_name = "transects_n-samples"
-        if mode == "presence":
-            file_name = "transects_samples_presence-samples"
-
-        if sep == "\t":
-            response.headers["Content-type"] = "text/tab-separated-values"
-            extension = "tsv"
-        if sep in (",", ";"):
-            response.headers["Content-type"] = "text/csv"
-            extension = "csv"
-
-        response.headers["Content-disposition"] = (
-            f"attachment; filename={file_name}.{extension}"
-        )
-
-        return response
+    flash(fn.alert_danger(f"Mode not found: {mode}"))
+    return redirect("/analysis")
 
 
 @app.route("/transects_dates")
 @fn.check_login
 def transects_dates():
-    sep = ";"
-
-    year_init = session["start_date"][:4]
-
-    with fn.conn_alchemy().connect() as con:
-        # check if path based on transect exist
-        transects = (
-            con.execute(text("SELECT * FROM transects ORDER BY transect_id"))
-            .mappings()
-            .all()
-        )
-
-        out: dict = {}
-        template: dict = {}
-        header = f"Transect ID{sep}"
-        # check max number of sampling
-        result = (
-            con.execute(
-                text(
-                    "SELECT MAX(c) AS n_paths "
-                    "FROM "
-                    "(SELECT COUNT(*) AS c FROM paths "
-                    "      WHERE transect_id != '' "
-                    "            AND date BETWEEN :start_date AND :end_date "
-                    "      GROUP BY transect_id "
-                    ") x"
-                ),
-                {
-                    "start_date": session["start_date"],
-                    "end_date": session["end_date"],
-                },
-            )
-            .mappings()
-            .fetchone()
-        )
-        template = ["NA"] * result["n_paths"]
-        for i in range(result["n_paths"]):
-            header += f"{year_init}-{i + 1}{sep}"
-
-        for transect in transects:
-            row_out = copy.deepcopy(template)
-
-            paths = (
-                con.execute(
-                    text(
-                        "SELECT path_id, date::date as date FROM paths "
-                        "WHERE transect_id = :transect_id "
-                        "AND date BETWEEN :start_date AND :end_date "
-                        "ORDER BY date"
-                    ),
-                    {
-                        "transect_id": transect["transect_id"],
-                        "start_date": session["start_date"],
-                        "end_date": session["end_date"],
-                    },
-                )
-                .mappings()
-                .all()
-            )
-            idx = 0
-            for path in paths:
-                row_out[idx] = str(path["date"])
-                idx += 1
-
-            out[transect["transect_id"]] = copy.deepcopy(row_out)
-
-    out_str = header[:-1] + "\n"
-    for transect in out:
-        out_str += transect + sep
-        out_str += sep.join(out[transect])
-        out_str += sep
-        out_str = out_str[:-1] + "\n"
-
-    response = make_response(out_str, 200)
-    if sep == "\t":
-        response.headers["Content-type"] = "text/tab-separated-values"
-        response.headers["Content-disposition"] = (
-            "attachment; filename=transects_dates.tsv"
-        )
-
-    if sep in (",", ";"):
-        response.headers["Content-type"] = "text/csv"
-        response.headers["Content-disposition"] = (
-            "attachment; filename=transects_dates.csv"
-        )
-
-    return response
+    return transects_paths_values(lambda path: str(path["date"]), "transects_dates")
 
 
 @app.route("/transects_completeness")
 @fn.check_login
 def transects_completeness():
-    sep = ";"
-    year_init = session["start_date"][:4]
-
-    with fn.conn_alchemy().connect() as con:
-        # check if path based on transect exist
-        transects = (
-            con.execute(text("SELECT * FROM transects ORDER BY transect_id"))
-            .mappings()
-            .all()
-        )
-
-        out: dict = {}
-        template: dict = {}
-        header = f"Transect ID{sep}"
-        # check max number of sampling
-        result = con.execute(
-            text(
-                "SELECT MAX(c) AS n_paths "
-                "FROM "
-                "(SELECT COUNT(*) AS c FROM paths "
-                "      WHERE transect_id != '' "
-                "            AND date BETWEEN :start_date AND :end_date "
-                "      GROUP BY transect_id "
-                ") x"
-            ),
-            {"start_date": session["start_date"], "end_date": session["end_date"]},
-        )
-
-        template = ["NA"] * result["n_paths"]
-        for i in range(result["n_paths"]):
-            header += f"{year_init}-{i + 1}{sep}"
-
-        for transect in transects:
-            row_out = copy.deepcopy(template)
-
-            paths = (
-                con.execute(
-                    text(
-                        "SELECT completeness FROM paths "
-                        "WHERE transect_id = :transect_id "
-                        "AND date BETWEEN :start_date AND :end_date ORDER BY date"
-                    ),
-                    {
-                        "transect_id": transect["transect_id"],
-                        "start_date": session["start_date"],
-                        "end_date": session["end_date"],
-                    },
-                )
-                .mappings()
-                .all()
-            )
-            idx = 0
-            for path in paths:
-                row_out[idx] = str(path["completeness"])
-                idx += 1
-
-            out[transect["transect_id"]] = copy.deepcopy(row_out)
-
-    out_str = header[:-1] + "\n"
-    for transect in out:
-        out_str += transect + sep
-        out_str += sep.join(out[transect])
-        out_str += sep
-        out_str = out_str[:-1] + "\n"
-
-    response = make_response(out_str, 200)
-
-    if sep == "\t":
-        response.headers["Content-type"] = "text/tab-separated-values"
-        extension = "tsv"
-    if sep in (",", ";"):
-        response.headers["Content-type"] = "text/csv"
-        extension = "csv"
-    response.headers["Content-disposition"] = (
-        f"attachment; filename=transects_completeness.{extension}"
+    return transects_paths_values(
+        lambda path: str(path["completeness"]), "transects_completeness"
     )
 
-    return response
-
 
 @app.route("/cell_occupancy", methods=("GET", "POST"))
 @fn.check_login
@@ -497,18 +300,27 @@ def cell_occupancy():
             f"cell_occupancy_from_{session['start_date']}_to_{session['end_date']}_requested_at_{dt.datetime.now():%Y-%m-%d_%H%M%S}.zip"
         )
 
-        _ = subprocess.Popen(
-            [
-                "python3",
+        job_id = job_queue.submit(
+            session["email"],
+            kind="cell_occupancy",
+            title=f"Cell occupancy ({pl.Path(new_file.filename).name}) from {session['start_date']} to {session['end_date']}",
+            command=[
+                sys.executable,
                 "cell_occupancy.py",
                 shp_file_path,
                 session["start_date"],
                 session["end_date"],
                 str(output_path),
-            ]
+            ],
         )
+        if job_id is None:
+            flash(
+                fn.alert_danger(
+                    f"You have already {job_queue.JOBS_MAX_PER_USER} jobs running. Wait for their completion."
+                )
+            )
 
-        return redirect("/my_results")
+        return redirect("/jobs")
         """return redirect(f"/cell_occupancy_check_results/{str(output_path).replace('/', '@@@')}")"""
 
 
@@ -13,6 +13,7 @@ import psycopg2.extras
 
 sys.path.insert(1, os.path.join(sys.path[0], ".."))
 import functions as fn
+import paths_truncation
 
 
 if len(sys.argv) != 3:
@@ -31,6 +32,7 @@ if mode not in ["by_cell", "by_date"]:
 
 distances = {}
 n_transects = {}
+transects_cache = {}
 
 for shape in shapes:
     id = shape["id"]
@@ -73,23 +75,13 @@ for shape in shapes:
         paths = cursor.fetchall()
         for path in paths:
             if path["completeness"]:
-                tot_dist = 0
-                new_list = []
-                for idx, point in enumerate(transect_geojson["coordinates"][0]):
-                    if idx == 0:
-                        continue
-                    d = (
-                        (point[0] - transect_geojson["coordinates"][0][idx - 1][0]) ** 2
-                        + (point[1] - transect_geojson["coordinates"][0][idx - 1][1])
-                        ** 2
-                    ) ** 0.5
-                    tot_dist += d
-
-                    if (
-                        round((tot_dist / transect["transect_length"]) * 100)
-                        >= path["completeness"]
-                    ):
-                        break
+                _, tot_dist = paths_truncation.truncated_path(
+                    transects_cache,
+                    transect["transect_id"],
+                    transect_geojson["coordinates"][0],
+                    transect["transect_length"],
+                    path["completeness"],
+                )
 
                 print(
                     f"path_id: {path['path_id']}  distance: {round((tot_dist / transect['transect_length']) * 100)}",
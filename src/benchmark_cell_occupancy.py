@@ -0,0 +1,101 @@
+"""
+benchmark of the cell occupancy engines (see cell_occupancy.py)
+
+A synthetic grid of square cells covering the transects is created
+and the legacy engine (one query by cell, transect and path) is compared
+with the set-based engine (temporary table of cells and spatial joins).
+
+usage:
+export WOLFDB_CONFIG_PATH=PATH_TO/config.ini; python benchmark_cell_occupancy.py START_DATE END_DATE [CELL_SIZE_M] [MAX_CELLS]
+"""
+
+import sys
+import tempfile
+import time
+import pathlib as pl
+
+import fiona
+import psycopg2.extras
+
+import cell_occupancy
+import functions as fn
+
+
+def synthetic_grid(shp_path: str, cell_size: int, max_cells: int) -> int:
+    """
+    write a shapefile (EPSG:32632) with square cells covering the transects extent
+    """
+    connection = fn.get_connection()
+    cursor = connection.cursor(cursor_factory=psycopg2.extras.DictCursor)
+    cursor.execute(
+        "SELECT ST_XMin(e) AS xmin, ST_YMin(e) AS ymin, ST_XMax(e) AS xmax, ST_YMax(e) AS ymax "
+        "FROM (SELECT ST_Extent(multilines) AS e FROM transects) extent"
+    )
+    extent = cursor.fetchone()
+
+    schema = {"geometry": "Polygon", "properties": {"cell": "int"}}
+    n_cells = 0
+    with fiona.open(
+        shp_path, "w", driver="ESRI Shapefile", crs="EPSG:32632", schema=schema
+    ) as shp:
+        y = extent["ymin"]
+        while y < extent["ymax"] and n_cells < max_cells:
+            x = extent["xmin"]
+            while x < extent["xmax"] and n_cells < max_cells:
+                shp.write(
+                    {
+                        "geometry": {
+                            "type": "Polygon",
+                            "coordinates": [
+                                [
+                                    (x, y),
+                                    (x + cell_size, y),
+                                    (x + cell_size, y + cell_size),
+                                    (x, y + cell_size),
+                                    (x, y),
+                                ]
+                            ],
+                        },
+                        "properties": {"cell": n_cells},
+                    }
+                )
+                n_cells += 1
+                x += cell_size
+            y += cell_size
+
+    return n_cells
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 3:
+        print(__doc__)
+        sys.exit(1)
+
+    start_date, end_date = sys.argv[1], sys.argv[2]
+    cell_size = int(sys.argv[3]) if len(sys.argv) > 3 else 10000
+    max_cells = int(sys.argv[4]) if len(sys.argv) > 4 else 500
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        shp_path = str(pl.Path(tmp_dir) / pl.Path("grid.shp"))
+        n_cells = synthetic_grid(shp_path, cell_size, max_cells)
+        print(f"{n_cells} cells of {cell_size} m")
+
+        shapes = fiona.open(shp_path)
+        crs = int(shapes.crs["init"].replace("epsg:", ""))
+        cursor = fn.get_connection().cursor(cursor_factory=psycopg2.extras.DictCursor)
+
+        results = {}
+        for engine in (cell_occupancy.occupancy_legacy, cell_occupancy.occupancy):
+            t0 = time.time()
+            results[engine.__name__] = engine(cursor, shapes, crs, start_date, end_date)
+            print(f"{engine.__name__}: {time.time() - t0:.2f} s")
+
+    def rounded(distances: dict) -> dict:
+        return {
+            id: {date: round(distances[id][date]) for date in distances[id]}
+            for id in distances
+        }
+
+    legacy, new = results["occupancy_legacy"], results["occupancy"]
+    print(f"same samples number: {legacy[0] == new[0]}")
+    print(f"same distances: {rounded(legacy[1]) == rounded(new[1])}")
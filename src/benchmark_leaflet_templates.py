@@ -0,0 +1,89 @@
+"""
+benchmark of the rendering of the Leaflet maps (see functions.leaflet_geojson)
+
+The previous rendering (template compiled from its source at every call,
+features converted to string by Jinja) is compared with the current one
+(template compiled once by the Flask Jinja environment, features serialized in JSON).
+
+usage:
+export WOLFDB_CONFIG_PATH=PATH_TO/config.ini; python benchmark_leaflet_templates.py [N_POINTS] [N_RENDERS]
+"""
+
+import random
+import sys
+import time
+import pathlib as pl
+
+from flask import Flask
+from jinja2 import Template
+
+import functions as fn
+
+
+def features(n_points: int) -> list:
+    """
+    random scats features around the default center of the maps
+    """
+    return [
+        {
+            "geometry": {
+                "type": "Point",
+                "coordinates": [7 + random.random(), 45 + random.random()],
+            },
+            "type": "Feature",
+            "properties": {
+                "popupContent": f"""Scat ID: <a href="/view_scat/S{idx}" target="_blank">S{idx}</a>""",
+            },
+            "id": f"S{idx}",
+        }
+        for idx in range(n_points)
+    ]
+
+
+def render_old(source: str, scats: list) -> str:
+    return Template(source).render(
+        {
+            "transects": [],
+            "transects_color": fn.params["transect_color"],
+            "tracks": [],
+            "tracks_color": fn.params["track_color"],
+            "scats": scats,
+            "scats_color": fn.params["scat_color"],
+            "dead_wolves": [],
+            "dead_wolves_color": fn.params["dead_wolf_color"],
+            "center": "45, 7",
+            "zoom": 13,
+            "fit": [[45, 7], [46, 8]],
+            "add_polygon": False,
+            "samples": "genotypes",
+        }
+    )
+
+
+def render_new(scats: list) -> str:
+    return fn.leaflet_geojson({"scats": scats, "fit": [[45, 7], [46, 8]]})
+
+
+if __name__ == "__main__":
+    n_points = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    n_renders = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+
+    templates_dir = pl.Path(__file__).resolve().parent / pl.Path("templates")
+    source = (templates_dir / pl.Path("leaflet_geojson.html")).read_text()
+    app = Flask(__name__, template_folder=str(templates_dir))
+
+    scats = features(n_points)
+    print(f"{n_points} points, {n_renders} renders")
+
+    t0 = time.perf_counter()
+    for _ in range(n_renders):
+        old_map = render_old(source, scats)
+    print(f"old: {(time.perf_counter() - t0) / n_renders * 1000:.1f} ms by map ({len(old_map)} bytes)")
+
+    with app.app_context():
+        t0 = time.perf_counter()
+        for _ in range(n_renders):
+            new_map = render_new(scats)
+        print(f"new: {(time.perf_counter() - t0) / n_renders * 1000:.1f} ms by map ({len(new_map)} bytes)")
+
+    print(f"JSON encoder: {'orjson' if fn.orjson is not None else 'json'}")
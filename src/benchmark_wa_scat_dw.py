@@ -0,0 +1,106 @@
+"""
+benchmark of the main queries of the genetic pages
+on the view wa_scat_dw_src (previous wa_scat_dw_all: scats ⋈ wa_results UNION ALL dead_wolves ⋈ wa_results)
+and on the materialized table wa_scat_dw_mat (see database/wa_scat_dw_mat.sql)
+
+usage:
+export WOLFDB_CONFIG_PATH=PATH_TO/config.ini; python benchmark_wa_scat_dw.py [START_DATE] [END_DATE] [N_RUNS]
+"""
+
+import sys
+import time
+
+from sqlalchemy import text
+
+import functions as fn
+
+QUERIES: dict = {
+    # genotypes_list_all
+    "genotypes list": (
+        "SELECT g.genotype_id, w.n_recaptures, w.date_first_capture "
+        "FROM genotypes g "
+        "LEFT JOIN (SELECT genotype_id, count(*) AS n_recaptures, min(date) AS date_first_capture "
+        "           FROM {table} GROUP BY genotype_id) w ON w.genotype_id = g.genotype_id "
+        "ORDER BY g.genotype_id"
+    ),
+    # wa_genetic_samples_all
+    "WA genetic samples": (
+        "SELECT w.*, g.working_notes, g.status, g.pack "
+        "FROM {table} w LEFT JOIN genotypes g ON g.genotype_id = w.genotype_id "
+        "WHERE w.date BETWEEN :start_date AND :end_date "
+        "ORDER BY w.wa_code"
+    ),
+    # plot_wa_clusters / wa_analysis
+    "DBSCAN clusters (500 m)": (
+        "SELECT wa_code, "
+        "ST_ClusterDBSCAN(geometry_utm, eps:= 500, minpoints:= 1) OVER(ORDER BY wa_code) AS cluster_id "
+        "FROM {table} "
+        "WHERE mtdna != 'Poor DNA' AND date BETWEEN :start_date AND :end_date"
+    ),
+    # view_wa_polygon / wa_analysis_group (polygon of 20 km around the first WA code)
+    "WA codes in polygon": (
+        "SELECT wa_code FROM {table} "
+        "WHERE ST_Within(geometry_utm, "
+        "                (SELECT ST_Buffer(geometry_utm, 20000) FROM wa_scat_dw_mat "
+        "                 WHERE geometry_utm IS NOT NULL ORDER BY wa_code LIMIT 1)) "
+        "AND date BETWEEN :start_date AND :end_date"
+    ),
+    # get_genotypes_from_wa
+    "genotypes of WA codes": (
+        "SELECT genotype_id, count(wa_code) AS n_recap, sex_id "
+        "FROM {table} "
+        "WHERE wa_code = ANY(:wa_codes) "
+        "GROUP BY genotype_id, sex_id ORDER BY genotype_id"
+    ),
+    # view_genotype
+    "WA codes of a genotype": (
+        "SELECT * FROM {table} WHERE genotype_id = :genotype_id ORDER BY date"
+    ),
+}
+
+
+def run(con, sql: str, parameters: dict, n_runs: int) -> tuple[float, int]:
+    """
+    returns the mean duration (ms) and the number of rows of the query
+    """
+    t0 = time.perf_counter()
+    for _ in range(n_runs):
+        n_rows = len(con.execute(text(sql), parameters).all())
+    return (time.perf_counter() - t0) / n_runs * 1000, n_rows
+
+
+if __name__ == "__main__":
+    start_date = sys.argv[1] if len(sys.argv) > 1 else "1900-01-01"
+    end_date = sys.argv[2] if len(sys.argv) > 2 else "2100-12-31"
+    n_runs = int(sys.argv[3]) if len(sys.argv) > 3 else 5
+
+    with fn.db_connection() as con:
+        wa_codes = [
+            row[0]
+            for row in con.execute(
+                text("SELECT wa_code FROM wa_scat_dw_mat ORDER BY wa_code LIMIT 200")
+            )
+        ]
+        genotype_id = con.execute(
+            text(
+                "SELECT genotype_id FROM wa_scat_dw_mat WHERE genotype_id IS NOT NULL "
+                "GROUP BY genotype_id ORDER BY count(*) DESC LIMIT 1"
+            )
+        ).scalar()
+
+        parameters = {
+            "start_date": start_date,
+            "end_date": end_date,
+            "wa_codes": wa_codes,
+            "genotype_id": genotype_id,
+        }
+
+        print(f"from {start_date} to {end_date}, {n_runs} runs\n")
+        print(f"{'query':<28}{'view (ms)':>12}{'table (ms)':>12}{'speed-up':>10}{'rows':>8}")
+        for name, sql in QUERIES.items():
+            before, n_rows = run(con, sql.format(table="wa_scat_dw_src"), parameters, n_runs)
+            after, _ = run(con, sql.format(table="wa_scat_dw_mat"), parameters, n_runs)
+            print(
+                f"{name:<28}{before:>12.1f}{after:>12.1f}"
+                f"{before / after if after else 0:>9.1f}x{n_rows:>8}"
+            )
@@ -0,0 +1,144 @@
+"""
+WolfDB web service
+(c) Olivier Friard
+
+bulk import of the validated rows of the spreadsheets (scats, paths, tracks, tissues, WA results and loci)
+
+The rows are copied (COPY) in a temporary staging table with the types of the columns of the table
+and merged in the table by one set-based statement (merge: INSERT ... ON CONFLICT, insert: INSERT ... SELECT).
+All the statements of an import run in one transaction: the file is loaded completely or not at all.
+The caches (tiles, WA clusters, transects activity, loci values) are refreshed by the caller
+after the transaction, once for every modified key.
+
+usage:
+    with bulk_import.transaction() as con:
+        staging = bulk_import.stage(con, "scats", columns, rows)
+        bulk_import.merge(con, "scats", staging, "scat_id", columns)
+"""
+
+import time
+from contextlib import contextmanager
+
+from sqlalchemy import text
+
+import functions as fn
+
+TEXT_TYPES = ("text", "character varying", "character")
+
+
+@contextmanager
+def transaction():
+    """
+    returns a connection in a transaction (committed at the end of the block, rolled back on error).
+    The connection is not the connection of the request (see fn.db_connection)
+    """
+    with fn.conn_alchemy().connect() as con:
+        con.execution_options(isolation_level="READ COMMITTED")
+        with con.begin():
+            yield con
+
+
+def stage(con, table: str, columns: tuple, rows: list) -> str:
+    """
+    copy the rows in a temporary staging table (dropped at the end of the transaction)
+
+    Args:
+        table (str): table of the rows (the columns of the staging table have the types of this table)
+        columns (tuple): columns of the rows
+        rows (list): rows (dict with the columns as keys)
+
+    Returns:
+        str: name of the staging table
+    """
+    staging = f"{table}_staging"
+    con.execute(
+        text(
+            f"CREATE TEMPORARY TABLE {staging} ON COMMIT DROP AS "
+            f"SELECT {', '.join(columns)} FROM {table} WITH NO DATA"
+        )
+    )
+    # order of the rows in the file
+    con.execute(text(f"ALTER TABLE {staging} ADD COLUMN staging_row serial"))
+
+    with con.connection.cursor() as cursor:
+        with cursor.copy(f"COPY {staging} ({', '.join(columns)}) FROM STDIN") as copy:
+            for row in rows:
+                copy.write_row([row[column] for column in columns])
+
+    return staging
+
+
+def text_columns(con, table: str) -> set:
+    """
+    returns the text columns of the table
+    """
+    return set(
+        con.execute(
+            text(
+                "SELECT column_name FROM information_schema.columns "
+                "WHERE table_schema = 'public' AND table_name = :table AND data_type = ANY(:types)"
+            ),
+            {"table": table, "types": list(TEXT_TYPES)},
+        )
+        .scalars()
+        .all()
+    )
+
+
+def merge(con, table: str, staging: str, key: str, columns: tuple, replace: bool = False) -> None:
+    """
+    insert the rows of the staging table in the table, the rows with an existing key are updated.
+    If the key is repeated in the file the last row is used.
+
+    Args:
+        key (str): column of the unique constraint
+        columns (tuple): columns of the staging table
+        replace (bool): the values of the existing rows are replaced,
+                        otherwise the empty values (NULL or '') of the file keep the current values
+    """
+    if replace:
+        update = [f"{column} = EXCLUDED.{column}" for column in columns if column != key]
+    else:
+        text_cols = text_columns(con, table)
+        update = [
+            f"{column} = COALESCE(NULLIF(EXCLUDED.{column}, ''), {table}.{column})"
+            if column in text_cols
+            else f"{column} = COALESCE(EXCLUDED.{column}, {table}.{column})"
+            for column in columns
+            if column != key
+        ]
+
+    con.execute(
+        text(
+            f"INSERT INTO {table} ({', '.join(columns)}) "
+            f"SELECT DISTINCT ON ({key}) {', '.join(columns)} FROM {staging} "
+            f"ORDER BY {key}, staging_row DESC "
+            f"ON CONFLICT ({key}) DO UPDATE SET {', '.join(update)}"
+        )
+    )
+
+
+def insert(con, table: str, staging: str, columns: tuple, values: dict | None = None) -> None:
+    """
+    insert all the rows of the staging table in the table (in the order of the file)
+
+    Args:
+        columns (tuple): columns of the staging table
+        values (dict): other columns of the table -> SQL expression (ex: {"timestamp": "NOW()"})
+    """
+    values = values or {}
+    con.execute(
+        text(
+            f"INSERT INTO {table} ({', '.join(list(columns) + list(values))}) "
+            f"SELECT {', '.join(list(columns) + list(values.values()))} FROM {staging} "
+            "ORDER BY staging_row"
+        )
+    )
+
+
+def rate(n_rows: int, t0: float) -> str:
+    """
+    returns the number of rows by second since t0 (for the messages of the imports)
+    """
+    duration = max(time.time() - t0, 0.001)
+    return f"{n_rows} rows in {duration:.1f} s ({round(n_rows / duration)} rows/s)"
@@ -19,44 +19,44 @@ from shapely.geometry import MultiPolygon, Polygon
 
 from config import config
 import functions as fn
+import job_queue
+import paths_truncation
 
 params = config()
 
 
-def get_cell_occupancy(shp_path: str, start_date: str, end_date: str, output_path: str):
+CELLS_TABLE = "cell_occupancy_cells"
+
+
+def cell_multipolygon(shape) -> MultiPolygon | None:
     """
-    calculate the cell occupancy from a shapefile as input from start date to end date.
-    The files produced are:
-    sample number
-    sample presence
-    dates
-    cell distances
+    returns the MultiPolygon of the shapefile cell (None if geometry is not Polygon or MultiPolygon)
     """
+    if shape["geometry"]["type"] == "Polygon":
+        return MultiPolygon([Polygon(x) for x in shape["geometry"]["coordinates"]])
+    elif shape["geometry"]["type"] == "MultiPolygon":
+        return MultiPolygon([Polygon(x[0]) for x in shape["geometry"]["coordinates"]])
+    return None
 
-    sep = ";"
-    extension = "csv"
-    year_init = start_date[:4]
 
-    shapes = fiona.open(shp_path)
-
-    data, distances, n_transects = {}, {}, {}
+def occupancy_legacy(cursor, shapes, crs: int, start_date: str, end_date: str):
+    """
+    calculate samples number and distances by cell and by date
+    with one query by cell, transect and path (legacy engine, used for benchmark)
+    """
 
-    connection = fn.get_connection()
-    cursor = connection.cursor(cursor_factory=psycopg2.extras.DictCursor)
+    data, distances = {}, {}
+    transects_cache: dict = {}
 
-    crs = int(shapes.crs["init"].replace("epsg:", ""))
     for shape in shapes:
         id = shape["id"]
 
         data[id] = {}
         distances[id] = {}
 
-        if shape["geometry"]["type"] == "Polygon":
-            mp = MultiPolygon([Polygon(x) for x in shape["geometry"]["coordinates"]])
-        elif shape["geometry"]["type"] == "MultiPolygon":
-            mp = MultiPolygon([Polygon(x[0]) for x in shape["geometry"]["coordinates"]])
-        else:
-            return (0, "geometry not Polygon or Multipolygon")
+        mp = cell_multipolygon(shape)
+        if mp is None:
+            return None
 
         sql = (
             f"SELECT *, "
@@ -69,8 +69,6 @@ def get_cell_occupancy(shp_path: str, start_date: str, end_date: str, output_pat
         cursor.execute(sql)
         transects = cursor.fetchall()
 
-        n_transects[id] = len(transects) if transects is not None else 0
-
         for transect in transects:
             transect_geojson = json.loads(transect["transect_geojson"])
 
@@ -100,32 +98,162 @@ def get_cell_occupancy(shp_path: str, start_date: str, end_date: str, output_pat
                 scat = cursor.fetchone()
                 data[id][path_date] += scat["count"]
 
-                completeness = (
-                    path["completeness"] if path["completeness"] is not None else 100
-                )
-
-                tot_dist = 0
-                for idx, point in enumerate(transect_geojson["coordinates"][0]):
-                    if idx == 0:
-                        continue
-                    d = (
-                        (point[0] - transect_geojson["coordinates"][0][idx - 1][0]) ** 2
-                        + (point[1] - transect_geojson["coordinates"][0][idx - 1][1])
-                        ** 2
-                    ) ** 0.5
-                    tot_dist += d
-
-                    if (
-                        round((tot_dist / transect["transect_length"]) * 100)
-                        >= completeness
-                    ):
-                        break
-
-                path_date = f"{path['date']:%Y-%m-%d}"
                 if path_date not in distances[id]:
                     distances[id][path_date] = 0
 
-                distances[id][path_date] += tot_dist
+                distances[id][path_date] += paths_truncation.truncated_path(
+                    transects_cache,
+                    transect["transect_id"],
+                    transect_geojson["coordinates"][0],
+                    transect["transect_length"],
+                    path["completeness"],
+                )[1]
+
+    return data, distances
+
+
+def occupancy(cursor, shapes, crs: int, start_date: str, end_date: str):
+    """
+    calculate samples number and distances by cell and by date.
+    The cells are loaded once in a temporary table (with GiST index)
+    and the paths and samples are retrieved with spatial joins
+    """
+
+    data, distances = {}, {}
+    cells: list = []
+    for shape in shapes:
+        mp = cell_multipolygon(shape)
+        if mp is None:
+            return None
+        data[shape["id"]] = {}
+        distances[shape["id"]] = {}
+        cells.append((shape["id"], mp.wkt))
+
+    cursor.execute(f"DROP TABLE IF EXISTS {CELLS_TABLE}")
+    cursor.execute(
+        (
+            f"CREATE TEMPORARY TABLE {CELLS_TABLE} "
+            "(id text PRIMARY KEY, geom geometry, geom_buffer geometry)"
+        )
+    )
+    psycopg2.extras.execute_values(
+        cursor,
+        (
+            f"INSERT INTO {CELLS_TABLE} (id, geom, geom_buffer) "
+            "SELECT v.id, g.geom, ST_Buffer(g.geom, 0) "
+            "FROM (VALUES %s) AS v(id, wkt) "
+            f"CROSS JOIN LATERAL (SELECT ST_Transform(ST_GeomFromText(v.wkt, {crs}), 32632) AS geom) g"
+        ),
+        cells,
+    )
+    cursor.execute(f"CREATE INDEX ON {CELLS_TABLE} USING gist (geom)")
+    cursor.execute(f"CREATE INDEX ON {CELLS_TABLE} USING gist (geom_buffer)")
+    cursor.execute(f"ANALYZE {CELLS_TABLE}")
+
+    # paths of the transects intersecting the cells
+    cursor.execute(
+        (
+            "SELECT c.id, t.transect_id, p.path_id, p.date::date AS date, p.completeness "
+            f"FROM {CELLS_TABLE} c "
+            "JOIN transects t ON ST_INTERSECTS(c.geom_buffer, t.multilines) "
+            "JOIN paths p ON p.transect_id = t.transect_id "
+            "WHERE p.date BETWEEN %s AND %s"
+        ),
+        [start_date, end_date],
+    )
+    cell_paths = cursor.fetchall()
+
+    job_queue.progress(40, "paths selected")
+
+    # number of samples by cell and path
+    cursor.execute(
+        (
+            "SELECT c.id, s.path_id, COUNT(s.scat_id) AS count "
+            f"FROM {CELLS_TABLE} c "
+            "JOIN scats s ON ST_CONTAINS(c.geom, s.geometry_utm) "
+            "WHERE s.path_id IN (SELECT path_id FROM paths WHERE date BETWEEN %s AND %s) "
+            "GROUP BY c.id, s.path_id"
+        ),
+        [start_date, end_date],
+    )
+    n_samples = {
+        (row["id"], row["path_id"]): row["count"] for row in cursor.fetchall()
+    }
+
+    job_queue.progress(80, "samples counted")
+
+    # geometry of the transects
+    cursor.execute(
+        (
+            "SELECT transect_id, "
+            "ST_AsGeoJSON(multilines) AS transect_geojson, "
+            "ROUND(ST_Length(multilines)) AS transect_length "
+            "FROM transects "
+            "WHERE transect_id = ANY(%s)"
+        ),
+        [list({row["transect_id"] for row in cell_paths})],
+    )
+    transects = {
+        row["transect_id"]: (
+            json.loads(row["transect_geojson"]),
+            row["transect_length"],
+        )
+        for row in cursor.fetchall()
+    }
+
+    cursor.execute(f"DROP TABLE IF EXISTS {CELLS_TABLE}")
+
+    transects_cache: dict = {}
+    for row in cell_paths:
+        id = row["id"]
+        path_date = f"{row['date']:%Y-%m-%d}"
+
+        if path_date not in data[id]:
+            data[id][path_date] = 0
+        data[id][path_date] += n_samples.get((id, row["path_id"]), 0)
+
+        transect_geojson, transect_length = transects[row["transect_id"]]
+
+        if path_date not in distances[id]:
+            distances[id][path_date] = 0
+        distances[id][path_date] += paths_truncation.truncated_path(
+            transects_cache,
+            row["transect_id"],
+            transect_geojson["coordinates"][0],
+            transect_length,
+            row["completeness"],
+        )[1]
+
+    return data, distances
+
+
+def get_cell_occupancy(shp_path: str, start_date: str, end_date: str, output_path: str):
+    """
+    calculate the cell occupancy from a shapefile as input from start date to end date.
+    The files produced are:
+    sample number
+    sample presence
+    dates
+    cell distances
+    """
+
+    sep = ";"
+    extension = "csv"
+    year_init = start_date[:4]
+
+    shapes = fiona.open(shp_path)
+
+    connection = fn.get_connection()
+    cursor = connection.cursor(cursor_factory=psycopg2.extras.DictCursor)
+
+    crs = int(shapes.crs["init"].replace("epsg:", ""))
+
+    job_queue.progress(0, f"{len(shapes)} cells")
+
+    result = occupancy(cursor, shapes, crs, start_date, end_date)
+    if result is None:
+        return (0, "geometry not Polygon or Multipolygon")
+    data, distances = result
 
     header = f"Cell index{sep}"
 
@@ -5,13 +5,13 @@ The output file contains the closest transect for every systematic scat
 
 This script is required by wolfdb.py
 
-
-see https://gist.github.com/NihalHarish/8597e5691889cd719e6c to improve with multiprocessing
+The closest transect and track of all the scats are found by one query (see nearest.py)
 
 """
 
 from sqlalchemy import text
 import functions as fn
+import nearest
 import datetime
 import os
 import sys
@@ -40,151 +40,103 @@ with open(LOCK_FILE_NAME_PATH, "w") as f_out:
 output: str = ""
 
 
-with fn.conn_alchemy().connect() as con:
-    scats = (
+# closest transect and track of the scats (see nearest.py)
+scats = nearest.scats(
+    "AND sampling_type != 'Opportunistic' AND date between :start_date AND :end_date ",
+    {
+        "start_date": start_date,
+        "end_date": end_date,
+    },
+)
+
+with fn.db_connection() as con:
+    transect_ids = set(
+        con.execute(text("SELECT transect_id FROM transects")).scalars().all()
+    )
+    track_ids = set(
+        con.execute(text("SELECT snowtrack_id FROM snow_tracks")).scalars().all()
+    )
+    # paths of the closest transects at the date of the scats
+    path_ids = set(
         con.execute(
-            text(
-                (
-                    "SELECT scat_id, sampling_type, path_id, snowtrack_id, st_x(geometry_utm)::integer AS x, st_y(geometry_utm)::integer AS y "
-                    "FROM scats "
-                    "WHERE sampling_type != 'Opportunistic' "
-                    "AND date between :start_date AND :end_date "
-                )
-            ),
+            text("SELECT path_id FROM paths WHERE path_id = ANY(:path_ids)"),
             {
-                "start_date": start_date,
-                "end_date": end_date,
+                "path_ids": [
+                    f"{row['closest_transect_id']}|{row['scat_id'][1:7]}"
+                    for row in scats
+                    if row["closest_transect_id"] is not None
+                ]
             },
         )
-        .mappings()
+        .scalars()
         .all()
     )
 
-    out2 = ""
-    c = 0
-    for row in scats:
-        # check if transect_id exists
-        if "|" in row["path_id"]:
-            transect_id_to_search = row["path_id"].split("|")[0]
-            row2 = (
-                con.execute(
-                    text(
-                        "SELECT transect_id FROM transects WHERE transect_id = :transect_id_to_search"
-                    ),
-                    {"transect_id_to_search": transect_id_to_search},
-                )
-                .mappings()
-                .fetchone()
-            )
-            if row2 is not None:
-                transect_id_found = row2["transect_id"]
-            else:
-                transect_id_found = ""
-        else:
-            transect_id_found = ""
-
-        # check if track ID exists
-        track_id_to_search = row["snowtrack_id"]
-        row3 = (
-            con.execute(
-                text(
-                    "SELECT snowtrack_id FROM snow_tracks WHERE snowtrack_id = :track_id_to_search"
-                ),
-                {"track_id_to_search": track_id_to_search},
-            )
-            .mappings()
-            .fetchone()
-        )
-        if row3 is not None:
-            track_id_found = row3["snowtrack_id"]
-        else:
-            track_id_found = ""
-
-        sql = text(
-            (
-                f" SELECT snowtrack_id, st_distance(ST_GeomFromText('POINT({row['x']} {row['y']})',32632), multilines)::integer AS distance "
-                "FROM snow_tracks "
-                f"WHERE multilines is not null "
-                f"AND st_distance(ST_GeomFromText('POINT({row['x']} {row['y']})',32632), multilines) = (SELECT min(st_distance(ST_GeomFromText('POINT({row['x']} {row['y']})',32632), multilines)) FROM snow_tracks) "
-            )
-        )
-        track = con.execute(sql).mappings().fetchone()
+out2 = ""
+c = 0
+for row in scats:
+    # check if transect_id exists
+    transect_id_found = ""
+    if "|" in row["path_id"] and row["path_id"].split("|")[0] in transect_ids:
+        transect_id_found = row["path_id"].split("|")[0]
 
-        sql = text(
-            (
-                f" SELECT transect_id, st_distance(ST_GeomFromText('POINT({row['x']} {row['y']})',32632), multilines)::integer AS distance "
-                "FROM transects "
-                f"WHERE st_distance(ST_GeomFromText('POINT({row['x']} {row['y']})',32632), multilines) = (SELECT min(st_distance(ST_GeomFromText('POINT({row['x']} {row['y']})',32632), multilines)) FROM transects) "
-            )
-        )
+    # check if track ID exists
+    track_id_found = row["snowtrack_id"] if row["snowtrack_id"] in track_ids else ""
+
+    closest_transect_id = row["closest_transect_id"] or ""
 
-        transect = con.execute(sql).mappings().fetchone()
+    path_id = row["path_id"].replace(" ", "|")
 
-        path_id = row["path_id"].replace(" ", "|")
+    if path_id.startswith(closest_transect_id + "|"):
+        match = "OK"
+        out2 += "<tr>"
+    else:
+        match = "NO"
+        c += 1
+        out2 += '<tr class="table-danger">'
 
-        if path_id.startswith(transect["transect_id"] + "|"):
-            match = "OK"
-            out2 += "<tr>"
+        transect_scat = closest_transect_id + "|" + row["scat_id"][1:7]
+        if transect_scat in path_ids:
+            new_path_id = transect_scat
         else:
-            match = "NO"
-            c += 1
-            out2 += '<tr class="table-danger">'
-
-            sql = text("SELECT path_id FROM paths WHERE path_id = :transect_scat")
-            results = (
-                con.execute(
-                    sql,
-                    {
-                        "transect_scat": transect["transect_id"]
-                        + "|"
-                        + row["scat_id"][1:7]
-                    },
-                )
-                .mappings()
-                .fetchone()
-            )
-            if results is not None:
-                new_path_id = results["path_id"]
-            else:
-                new_path_id = f"""path ID {transect["transect_id"] + "|" + row["scat_id"][1:7]} NOT FOUND"""
-
-            transect["transect_id"]
-
-        if match == "NO":
-            if "NOT FOUND" in new_path_id:
-                out2 += (
-                    f"""<td><a href="/view_scat/{row["scat_id"]}">{row["scat_id"]}</a></td>"""
-                    f"""<td>{row["sampling_type"]}</td>"""
-                    f"""<td><a href="/view_path/{row["path_id"]}">{path_id}</a></td>"""
-                    f"""<td>{"<b>NOT FOUND</b>" if transect_id_found == "" else transect_id_found}</td>"""
-                    f"""<td><a href="/view_transect/{transect["transect_id"]}">{transect["transect_id"]}</a></td>"""
-                    f"""<td>{transect["distance"]}</td>"""
-                    f"""<td>{new_path_id}</td>"""
-                )
+            new_path_id = f"""path ID {transect_scat} NOT FOUND"""
 
-            else:
-                out2 += (
-                    f"""<td><a href="/view_scat/{row["scat_id"]}">{row["scat_id"]}</a></td>"""
-                    f"""<td>{row["sampling_type"]}</td>"""
-                    f"""<td><a href="/view_path/{row["path_id"]}">{path_id}</a></td>"""
-                    f"""<td>{"<b>NOT FOUND</b>" if transect_id_found == "" else transect_id_found}</td>"""
-                    f"""<td><a href="/view_transect/{transect["transect_id"]}">{transect["transect_id"]}</a></td>"""
-                    f"""<td>{transect["distance"]}</td>"""
-                    f"""<td><a class="btn btn-danger btn-small" href="/set_path_id/{row["scat_id"]}/{new_path_id}" onclick="return confirm('Are you sure to set the path ID?')">Set {new_path_id} as path ID</a></td>"""
-                )
-
-            if track_id_found:
-                out2 += f"""<td><a href="/view_track/{row["snowtrack_id"]}">{row["snowtrack_id"]}</a></td>"""
-            else:
-                if row["snowtrack_id"]:
-                    out2 += f"""<td>{row["snowtrack_id"]} NOT FOUND IN DB</a></td>"""
-                else:
-                    out2 += "<td></td>"
+    if match == "NO":
+        if "NOT FOUND" in new_path_id:
+            out2 += (
+                f"""<td><a href="/view_scat/{row["scat_id"]}">{row["scat_id"]}</a></td>"""
+                f"""<td>{row["sampling_type"]}</td>"""
+                f"""<td><a href="/view_path/{row["path_id"]}">{path_id}</a></td>"""
+                f"""<td>{"<b>NOT FOUND</b>" if transect_id_found == "" else transect_id_found}</td>"""
+                f"""<td><a href="/view_transect/{closest_transect_id}">{closest_transect_id}</a></td>"""
+                f"""<td>{row["closest_transect_distance"]}</td>"""
+                f"""<td>{new_path_id}</td>"""
+            )
 
+        else:
             out2 += (
-                f"""<td>{track["snowtrack_id"]}</td>""" f"<td>{track['distance']}</td>"
+                f"""<td><a href="/view_scat/{row["scat_id"]}">{row["scat_id"]}</a></td>"""
+                f"""<td>{row["sampling_type"]}</td>"""
+                f"""<td><a href="/view_path/{row["path_id"]}">{path_id}</a></td>"""
+                f"""<td>{"<b>NOT FOUND</b>" if transect_id_found == "" else transect_id_found}</td>"""
+                f"""<td><a href="/view_transect/{closest_transect_id}">{closest_transect_id}</a></td>"""
+                f"""<td>{row["closest_transect_distance"]}</td>"""
+                f"""<td><a class="btn btn-danger btn-small" href="/set_path_id/{row["scat_id"]}/{new_path_id}" onclick="return confirm('Are you sure to set the path ID?')">Set {new_path_id} as path ID</a></td>"""
             )
 
+        if track_id_found:
+            out2 += f"""<td><a href="/view_track/{row["snowtrack_id"]}">{row["snowtrack_id"]}</a></td>"""
+        else:
+            if row["snowtrack_id"]:
+                out2 += f"""<td>{row["snowtrack_id"]} NOT FOUND IN DB</a></td>"""
+            else:
+                out2 += "<td></td>"
+
+        out2 += (
+            f"""<td>{row["closest_track_id"] or ""}</td>"""
+            f"""<td>{row["closest_track_distance"] if row["closest_track_distance"] is not None else ""}</td>"""
+        )
+
 
 output += f"Check done at {datetime.datetime.now().replace(microsecond=0).isoformat().replace('T', ' ')}<br><br>\n"
 
@@ -68,9 +68,12 @@ CREATE VIEW wa_scat AS
 
 -- wa_scat_dw_mat
 
-drop MATERIALIZED view IF EXISTS wa_scat_dw_mat;
+-- wa_scat_dw_mat is now a table updated by triggers, see wa_scat_dw_mat.sql
 
-CREATE MATERIALIZED VIEW wa_scat_dw_mat AS
+-- wa_scat_dw_src (source of wa_scat_dw_mat, used by its trigger functions)
+-- is dropped by "drop view wa_scat CASCADE": it is created again here (same definition as in wa_scat_dw_mat.sql)
+
+CREATE OR REPLACE VIEW public.wa_scat_dw_src AS
  SELECT wa_scat.wa_code,
     wa_scat.sample_id,
     wa_scat.date,
@@ -89,10 +92,8 @@ CREATE MATERIALIZED VIEW wa_scat_dw_mat AS
     wa_scat.sex_id,
     wa_scat.sample_type,
     wa_scat.box_number
-
-   FROM wa_scat
-
-UNION
+   FROM public.wa_scat
+UNION ALL
  SELECT wa_dw.wa_code,
     wa_dw.sample_id,
     wa_dw.date,
@@ -111,17 +112,9 @@ UNION
     wa_dw.sex_id,
     wa_dw.sample_type,
     wa_dw.box_number
+   FROM public.wa_dw;
 
-   FROM wa_dw
-
-  WITH NO DATA;
-
-
-CREATE INDEX idx_wa_scat_dw_mat_date ON wa_scat_dw_mat(date);
-CREATE INDEX idx_wa_scat_dw_mat_genotypeid ON wa_scat_dw_mat(genotype_id);
-CREATE INDEX idx_wa_scat_dw_mat_mtdna ON wa_scat_dw_mat(mtdna);
-CREATE INDEX idx_wa_scat_dw_mat_good_mtdna ON wa_scat_dw_mat (genotype_id, sample_id) WHERE mtdna <> 'Poor DNA';
-CREATE INDEX idx_wa_scat_dw_mat_wa_code ON wa_scat_dw_mat(wa_code);
+ALTER VIEW public.wa_scat_dw_src OWNER TO wolf_user;
 
 
 
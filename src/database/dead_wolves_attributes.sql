@@ -0,0 +1,130 @@
+-- values of the fields of the dead wolves in one row by dead wolf (dead_wolves_attributes)
+--
+-- attributes: JSONB object field_id -> value of dead_wolves_values
+--             (only the fields of dead_wolves_fields_definition)
+--
+-- dead_wolves_attributes is updated by statement triggers on dead_wolves_values (in the transaction
+-- of the insertion or the modification of the values) and rebuilt after a modification
+-- of dead_wolves_fields_definition.
+-- The lists (dead_wolves_list, dead_wolves_full_list), the search and the exports read this table
+-- instead of dead_wolves_values.
+--
+-- requires pg_trgm (see genotypes_summary.sql)
+-- full rebuild: SELECT dead_wolves_attributes_refresh(NULL);
+
+
+CREATE TABLE IF NOT EXISTS public.dead_wolves_attributes (
+    id integer NOT NULL PRIMARY KEY,
+    attributes jsonb NOT NULL,
+    updated_at timestamp without time zone DEFAULT now() NOT NULL
+);
+
+ALTER TABLE public.dead_wolves_attributes OWNER TO wolf_user;
+
+-- the refresh (values of a dead wolf) uses the existing unique index id_fieldid (id, field_id)
+-- of dead_wolves_values
+
+
+-- refresh the attributes of the dead wolves (all dead wolves if ids is NULL)
+
+CREATE OR REPLACE FUNCTION public.dead_wolves_attributes_refresh(ids integer[])
+RETURNS void
+LANGUAGE plpgsql AS $$
+BEGIN
+    INSERT INTO public.dead_wolves_attributes (id, attributes)
+    SELECT v.id, jsonb_object_agg(v.field_id::text, v.val)
+      FROM public.dead_wolves_values v
+      JOIN public.dead_wolves_fields_definition f ON f.field_id = v.field_id
+     WHERE v.id IS NOT NULL
+       AND (ids IS NULL OR v.id = ANY(ids))
+     GROUP BY v.id
+    ON CONFLICT (id) DO UPDATE SET attributes = EXCLUDED.attributes, updated_at = now();
+
+    -- dead wolves without values
+    DELETE FROM public.dead_wolves_attributes a
+     WHERE (ids IS NULL OR a.id = ANY(ids))
+       AND NOT EXISTS (
+           SELECT 1 FROM public.dead_wolves_values v
+             JOIN public.dead_wolves_fields_definition f ON f.field_id = v.field_id
+            WHERE v.id = a.id);
+END;
+$$;
+
+
+-- statement trigger: the dead wolves are read from the transition tables (old_rows, new_rows)
+
+CREATE OR REPLACE FUNCTION public.dead_wolves_attributes_trigger()
+RETURNS trigger
+LANGUAGE plpgsql AS $$
+DECLARE
+    ids integer[];
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        SELECT array_agg(DISTINCT id) INTO ids
+          FROM new_rows WHERE id IS NOT NULL;
+    ELSIF TG_OP = 'UPDATE' THEN
+        SELECT array_agg(DISTINCT id) INTO ids
+          FROM (SELECT id FROM old_rows UNION SELECT id FROM new_rows) r
+         WHERE id IS NOT NULL;
+    ELSE
+        SELECT array_agg(DISTINCT id) INTO ids
+          FROM old_rows WHERE id IS NOT NULL;
+    END IF;
+
+    IF ids IS NOT NULL THEN
+        PERFORM public.dead_wolves_attributes_refresh(ids);
+    END IF;
+    RETURN NULL;
+END;
+$$;
+
+DROP TRIGGER IF EXISTS dead_wolves_attributes_insert ON public.dead_wolves_values;
+DROP TRIGGER IF EXISTS dead_wolves_attributes_update ON public.dead_wolves_values;
+DROP TRIGGER IF EXISTS dead_wolves_attributes_delete ON public.dead_wolves_values;
+
+CREATE TRIGGER dead_wolves_attributes_insert AFTER INSERT ON public.dead_wolves_values
+  REFERENCING NEW TABLE AS new_rows
+  FOR EACH STATEMENT EXECUTE FUNCTION public.dead_wolves_attributes_trigger();
+CREATE TRIGGER dead_wolves_attributes_update AFTER UPDATE ON public.dead_wolves_values
+  REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+  FOR EACH STATEMENT EXECUTE FUNCTION public.dead_wolves_attributes_trigger();
+CREATE TRIGGER dead_wolves_attributes_delete AFTER DELETE ON public.dead_wolves_values
+  REFERENCING OLD TABLE AS old_rows
+  FOR EACH STATEMENT EXECUTE FUNCTION public.dead_wolves_attributes_trigger();
+
+
+-- full rebuild after a modification of the fields definition
+
+CREATE OR REPLACE FUNCTION public.dead_wolves_attributes_rebuild_trigger()
+RETURNS trigger
+LANGUAGE plpgsql AS $$
+BEGIN
+    PERFORM public.dead_wolves_attributes_refresh(NULL);
+    RETURN NULL;
+END;
+$$;
+
+DROP TRIGGER IF EXISTS dead_wolves_attributes_rebuild ON public.dead_wolves_fields_definition;
+
+CREATE TRIGGER dead_wolves_attributes_rebuild
+  AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON public.dead_wolves_fields_definition
+  FOR EACH STATEMENT EXECUTE FUNCTION public.dead_wolves_attributes_rebuild_trigger();
+
+SELECT public.dead_wolves_attributes_refresh(NULL);
+
+
+-- text of the values (free-text search of the dead wolves, see search.py)
+
+CREATE OR REPLACE FUNCTION public.dead_wolf_attributes_text(attributes jsonb)
+RETURNS text
+LANGUAGE sql IMMUTABLE PARALLEL SAFE AS $$
+    SELECT string_agg(value, chr(31) ORDER BY key) FROM jsonb_each_text(attributes)
+$$;
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS dead_wolves_attributes_text_trgm_idx
+  ON public.dead_wolves_attributes USING gin (
+    public.dead_wolf_attributes_text(attributes)
+    gin_trgm_ops);
+
+-- the values are no longer searched in dead_wolves_values
+DROP INDEX CONCURRENTLY IF EXISTS public.dead_wolves_values_val_trgm_idx;
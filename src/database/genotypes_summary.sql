@@ -0,0 +1,159 @@
+-- genotypes summary (number of recaptures, dead recovery and date of first capture by genotype)
+--
+-- genotypes_summary replaces the aggregation of wa_scat_dw_all in the genotypes_list_all view.
+-- It is updated by statement triggers on wa_scat_dw_mat (see wa_scat_dw_mat.sql),
+-- itself updated after the modification of scats, dead wolves and WA results.
+--
+-- trigram indexes (pg_trgm) are used by the search of the genotypes list (ILIKE '%...%')
+--
+-- requires wa_scat_dw_mat.sql
+-- full rebuild: SELECT genotypes_summary_refresh(NULL);
+
+
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+
+CREATE TABLE IF NOT EXISTS public.genotypes_summary (
+    genotype_id character varying(100) NOT NULL PRIMARY KEY,
+    n_recaptures bigint NOT NULL,
+    dead_recovery boolean NOT NULL,
+    date_first_capture date,
+    updated_at timestamp without time zone DEFAULT now() NOT NULL
+);
+
+ALTER TABLE public.genotypes_summary OWNER TO wolf_user;
+
+CREATE INDEX IF NOT EXISTS genotypes_summary_date_first_capture_idx
+  ON public.genotypes_summary USING btree (date_first_capture);
+
+
+-- refresh the summary of the genotypes (all genotypes if genotype_ids is NULL)
+
+CREATE OR REPLACE FUNCTION public.genotypes_summary_refresh(genotype_ids text[])
+RETURNS void
+LANGUAGE plpgsql AS $$
+BEGIN
+    DELETE FROM public.genotypes_summary
+     WHERE genotype_ids IS NULL OR genotype_id::text = ANY(genotype_ids);
+
+    INSERT INTO public.genotypes_summary (genotype_id, n_recaptures, dead_recovery, date_first_capture)
+    SELECT genotype_id,
+           count(*),
+           bool_or(sample_id::text LIKE 'T%' OR sample_id::text LIKE 'M%'),
+           min(date)
+      FROM public.wa_scat_dw_mat
+     WHERE genotype_id IS NOT NULL
+       AND (genotype_ids IS NULL OR genotype_id::text = ANY(genotype_ids))
+     GROUP BY genotype_id;
+END;
+$$;
+
+
+-- statement trigger: the genotypes are read from the transition tables (old_rows, new_rows)
+
+CREATE OR REPLACE FUNCTION public.genotypes_summary_trigger()
+RETURNS trigger
+LANGUAGE plpgsql AS $$
+DECLARE
+    genotype_ids text[];
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        SELECT array_agg(DISTINCT genotype_id::text) INTO genotype_ids
+          FROM new_rows WHERE genotype_id IS NOT NULL;
+    ELSIF TG_OP = 'UPDATE' THEN
+        SELECT array_agg(DISTINCT genotype_id) INTO genotype_ids
+          FROM (SELECT genotype_id::text FROM old_rows UNION SELECT genotype_id::text FROM new_rows) r
+         WHERE genotype_id IS NOT NULL;
+    ELSE
+        SELECT array_agg(DISTINCT genotype_id::text) INTO genotype_ids
+          FROM old_rows WHERE genotype_id IS NOT NULL;
+    END IF;
+
+    IF genotype_ids IS NOT NULL THEN
+        PERFORM public.genotypes_summary_refresh(genotype_ids);
+    END IF;
+    RETURN NULL;
+END;
+$$;
+
+DROP TRIGGER IF EXISTS genotypes_summary_insert ON public.wa_scat_dw_mat;
+DROP TRIGGER IF EXISTS genotypes_summary_update ON public.wa_scat_dw_mat;
+DROP TRIGGER IF EXISTS genotypes_summary_delete ON public.wa_scat_dw_mat;
+
+CREATE TRIGGER genotypes_summary_insert AFTER INSERT ON public.wa_scat_dw_mat
+  REFERENCING NEW TABLE AS new_rows
+  FOR EACH STATEMENT EXECUTE FUNCTION public.genotypes_summary_trigger();
+CREATE TRIGGER genotypes_summary_update AFTER UPDATE ON public.wa_scat_dw_mat
+  REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+  FOR EACH STATEMENT EXECUTE FUNCTION public.genotypes_summary_trigger();
+CREATE TRIGGER genotypes_summary_delete AFTER DELETE ON public.wa_scat_dw_mat
+  REFERENCING OLD TABLE AS old_rows
+  FOR EACH STATEMENT EXECUTE FUNCTION public.genotypes_summary_trigger();
+
+SELECT public.genotypes_summary_refresh(NULL);
+
+
+-- text of the free-text search of the genotypes list (genotype ID, notes, other ID, date, pack, sex, status, working notes)
+-- the fields are separated by the unit separator (a search term cannot match across two fields)
+
+CREATE OR REPLACE FUNCTION public.genotype_search_text(
+    genotype_id text, notes text, tmp_id text, date date,
+    pack text, sex text, status text, working_notes text)
+RETURNS text
+LANGUAGE sql IMMUTABLE PARALLEL SAFE AS $$
+    SELECT concat_ws(chr(31), genotype_id, notes, tmp_id, to_char(date, 'YYYY-MM-DD'),
+                     pack, sex, status, working_notes)
+$$;
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS genotypes_search_text_trgm_idx
+  ON public.genotypes USING gin (
+    public.genotype_search_text(genotype_id, notes, tmp_id, date, pack, sex, status, working_notes)
+    gin_trgm_ops);
+
+-- field search (field: value)
+CREATE INDEX CONCURRENTLY IF NOT EXISTS genotypes_genotype_id_trgm_idx
+  ON public.genotypes USING gin (genotype_id gin_trgm_ops);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS genotypes_notes_trgm_idx
+  ON public.genotypes USING gin (notes gin_trgm_ops);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS genotypes_tmp_id_trgm_idx
+  ON public.genotypes USING gin (tmp_id gin_trgm_ops);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS genotypes_pack_trgm_idx
+  ON public.genotypes USING gin (pack gin_trgm_ops);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS genotypes_status_trgm_idx
+  ON public.genotypes USING gin (status gin_trgm_ops);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS genotypes_working_notes_trgm_idx
+  ON public.genotypes USING gin (working_notes gin_trgm_ops);
+
+-- keyset pagination of the genotypes list (ORDER BY genotype_id)
+CREATE INDEX CONCURRENTLY IF NOT EXISTS genotypes_record_status_genotype_id_idx
+  ON public.genotypes USING btree (record_status, genotype_id);
+
+
+-- genotypes_list_all reads the summary (same columns, the pages order the rows)
+
+CREATE OR REPLACE VIEW public.genotypes_list_all AS
+ SELECT g.genotype_id,
+    g.date,
+    g.pack,
+    g.sex,
+    g.age_first_capture,
+    g.status_first_capture,
+    g.dispersal,
+    g.record_status,
+    g.tmp_id,
+    g.notes,
+    g.status,
+    g.working_notes,
+    g.changed_status,
+    g.mother,
+    g.father,
+    g.hybrid,
+    g.mtdna,
+    COALESCE(s.n_recaptures, (0)::bigint) AS n_recaptures,
+        CASE
+            WHEN s.dead_recovery THEN 'Yes'::text
+            ELSE NULL::text
+        END AS dead_recovery,
+    s.date_first_capture
+   FROM (public.genotypes g
+     LEFT JOIN public.genotypes_summary s ON (((s.genotype_id)::text = (g.genotype_id)::text)));
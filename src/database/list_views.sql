@@ -0,0 +1,26 @@
+-- views of the paginated lists without ORDER BY
+--
+-- the lists (scats_list_limit, /wa, wa_genetic_samples3) are paginated by keyset (see functions.paginate):
+-- the pages order the rows and the conditions on the ordering column (scat_id, wa_code)
+-- can use the indexes of the tables.
+-- The other queries on these views order their rows.
+--
+-- the final ORDER BY is removed from the current definition of the views
+
+DO $$
+DECLARE
+    view_name text;
+    definition text;
+BEGIN
+    FOREACH view_name IN ARRAY ARRAY['scats_list_all', 'wa_genetic_samples_all'] LOOP
+        definition := rtrim(pg_get_viewdef(('public.' || view_name)::regclass, true), E'; \n');
+        definition := regexp_replace(definition, '\s+ORDER BY [^()]*$', '');
+        EXECUTE format('CREATE OR REPLACE VIEW public.%I AS %s', view_name, definition);
+    END LOOP;
+END;
+$$;
+
+
+-- keyset pagination on the scats of a period
+CREATE INDEX CONCURRENTLY IF NOT EXISTS scats_date_scat_id_idx
+  ON public.scats USING btree (date, scat_id);
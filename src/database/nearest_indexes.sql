@@ -0,0 +1,11 @@
+-- indexes used by the search of the closest transect and track (see nearest.py)
+-- KNN ordering (<->) on the geometries of the transects and tracks
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS transects_multilines_idx
+  ON public.transects USING gist (multilines);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS snow_tracks_multilines_idx
+  ON public.snow_tracks USING gist (multilines);
+
+ANALYZE public.transects;
+ANALYZE public.snow_tracks;
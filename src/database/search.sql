@@ -0,0 +1,68 @@
+-- search documents of the lists (scats, genotypes, WA codes, dead wolves)
+--
+-- the searchable columns of a row are concatenated by search_text (separated by the unit separator:
+-- a search term cannot match across two fields) and indexed by GIN trigram indexes (pg_trgm):
+-- the free-text search (ILIKE '%...%') and the field search (field: value) of search.py use these indexes.
+-- The indexed expressions must be identical to the documents of search.py.
+--
+-- requires genotypes_summary.sql (pg_trgm, genotype_search_text), wa_scat_dw_mat.sql
+-- and dead_wolves_attributes.sql
+
+
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+
+CREATE OR REPLACE FUNCTION public.search_text(VARIADIC fields text[])
+RETURNS text
+LANGUAGE sql IMMUTABLE PARALLEL SAFE AS $$
+    SELECT concat_ws(chr(31), VARIADIC fields)
+$$;
+
+-- text of a date in the search documents (independent of DateStyle)
+CREATE OR REPLACE FUNCTION public.search_date(date date)
+RETURNS text
+LANGUAGE sql IMMUTABLE PARALLEL SAFE AS $$
+    SELECT to_char(date, 'YYYY-MM-DD')
+$$;
+
+
+-- scats (scats_list_all)
+CREATE INDEX CONCURRENTLY IF NOT EXISTS scats_search_text_trgm_idx
+  ON public.scats USING gin (
+    public.search_text(scat_id, public.search_date(date), wa_code, sampling_season, sampling_type,
+                       path_id, snowtrack_id, location, municipality, province, region, deposition,
+                       matrix, collected_scat, genetic_sample, observer, institution, notes,
+                       region_auto, province_auto, municipality_auto, location_auto,
+                       sample_type, box_number, ispra_id)
+    gin_trgm_ops);
+
+-- genotype of the WA code of the scats
+CREATE INDEX CONCURRENTLY IF NOT EXISTS wa_scat_dw_mat_genotype_id_trgm_idx
+  ON public.wa_scat_dw_mat USING gin (genotype_id gin_trgm_ops);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS scats_wa_code_idx
+  ON public.scats USING btree (wa_code);
+
+
+-- WA codes (wa_genetic_samples_all)
+CREATE INDEX CONCURRENTLY IF NOT EXISTS wa_scat_dw_mat_search_text_trgm_idx
+  ON public.wa_scat_dw_mat USING gin (
+    public.search_text(wa_code, sample_id, public.search_date(date), municipality, province,
+                       genotype_id, tmp_id, sex_id, box_number)
+    gin_trgm_ops);
+
+-- genotype of the WA codes (working_notes is the notes column of wa_genetic_samples_all)
+CREATE INDEX CONCURRENTLY IF NOT EXISTS genotypes_wa_search_text_trgm_idx
+  ON public.genotypes USING gin (
+    public.search_text(working_notes, pack, hybrid)
+    gin_trgm_ops);
+
+
+-- dead wolves (dead_wolves_list, dead_wolves_full_list)
+CREATE INDEX CONCURRENTLY IF NOT EXISTS dead_wolves_search_text_trgm_idx
+  ON public.dead_wolves USING gin (
+    public.search_text(tissue_id, genotype_id, wa_code, public.search_date(discovery_date),
+                       location, municipality, province, region, box_number, scalp_category, notes,
+                       sampling_season, operator, institution)
+    gin_trgm_ops);
+
+-- the values of the fields of the dead wolves are indexed in dead_wolves_attributes.sql
@@ -0,0 +1,15 @@
+-- indexes used by the vector tiles (see tiles_bp/tiles.py)
+-- the tiles are computed in Web Mercator (EPSG:3857)
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS scats_geometry_3857_idx
+  ON public.scats USING gist (ST_Transform(geometry_utm, 3857));
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS transects_multilines_3857_idx
+  ON public.transects USING gist (ST_Transform(multilines, 3857));
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS snow_tracks_multilines_3857_idx
+  ON public.snow_tracks USING gist (ST_Transform(multilines, 3857));
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS dead_wolves_geometry_3857_idx
+  ON public.dead_wolves USING gist (ST_Transform(geometry_utm, 3857))
+  WHERE deleted IS NULL;
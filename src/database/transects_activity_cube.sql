@@ -0,0 +1,53 @@
+-- transects activity cube
+-- one row by transect, year and month with the paths (ordered by date),
+-- their completeness and their number of samples
+-- maintained by transects_activity.py (refresh_cube) after the edition or the import of paths and scats
+-- used by /transects_analysis, /transects_n_samples_by_month, /transects_n_samples, /transects_dates and /transects_completeness
+
+CREATE TABLE IF NOT EXISTS public.transects_activity_cube (
+    transect_id character varying(20) NOT NULL,
+    sampling_season character varying(9) NOT NULL,
+    year integer NOT NULL,
+    month integer NOT NULL,
+    n_paths integer NOT NULL,
+    path_ids text[] NOT NULL,
+    dates date[] NOT NULL,
+    completeness integer[] NOT NULL,
+    path_n_samples integer[] NOT NULL,
+    n_samples integer NOT NULL,
+    updated_at timestamp without time zone DEFAULT now() NOT NULL,
+    PRIMARY KEY (transect_id, year, month)
+);
+
+ALTER TABLE public.transects_activity_cube OWNER TO wolf_user;
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS transects_activity_cube_season_idx
+  ON public.transects_activity_cube USING btree (sampling_season, transect_id);
+
+-- the number of samples by path uses the existing index scats_path_id_idx (scats.path_id)
+
+
+-- initial population (or full rebuild), same query as transects_activity.CUBE_SQL
+
+INSERT INTO transects_activity_cube
+    (transect_id, sampling_season, year, month, n_paths,
+     path_ids, dates, completeness, path_n_samples, n_samples)
+SELECT
+    p.transect_id,
+    CASE WHEN EXTRACT(MONTH FROM p.date) >= 5
+         THEN EXTRACT(YEAR FROM p.date)::int || '-' || (EXTRACT(YEAR FROM p.date)::int + 1)
+         ELSE (EXTRACT(YEAR FROM p.date)::int - 1) || '-' || EXTRACT(YEAR FROM p.date)::int
+    END AS sampling_season,
+    EXTRACT(YEAR FROM p.date)::int AS year,
+    EXTRACT(MONTH FROM p.date)::int AS month,
+    COUNT(*) AS n_paths,
+    array_agg(p.path_id::text ORDER BY p.date, p.path_id) AS path_ids,
+    array_agg(p.date ORDER BY p.date, p.path_id) AS dates,
+    array_agg(p.completeness ORDER BY p.date, p.path_id) AS completeness,
+    array_agg(s.n_samples ORDER BY p.date, p.path_id) AS path_n_samples,
+    SUM(s.n_samples) AS n_samples
+FROM paths p
+CROSS JOIN LATERAL (SELECT COUNT(*)::int AS n_samples FROM scats WHERE scats.path_id = p.path_id) s
+WHERE p.transect_id IS NOT NULL AND p.transect_id != '' AND p.date IS NOT NULL
+GROUP BY p.transect_id, EXTRACT(YEAR FROM p.date), EXTRACT(MONTH FROM p.date)
+ON CONFLICT (transect_id, year, month) DO NOTHING;
@@ -0,0 +1,62 @@
+-- genetic profile index
+-- one row per WA code with the latest allele values in loci.position order (SRY excluded)
+-- NULL is used for missing values
+-- maintained by genetic_bp/genetic_profile.py (update_loci_values_cache)
+-- used by /check_genetic_profile
+
+CREATE TABLE IF NOT EXISTS public.wa_genetic_profile (
+    wa_code character varying(100) NOT NULL PRIMARY KEY,
+    profile integer[] NOT NULL,
+    n_values integer NOT NULL,
+    updated_at timestamp without time zone DEFAULT now() NOT NULL
+);
+
+ALTER TABLE public.wa_genetic_profile OWNER TO wolf_user;
+
+-- wa_code has the same type as wa_results.wa_code:
+-- upgrade of the tables created by the previous revision of this script (character varying(50)),
+-- no effect on the tables created above
+ALTER TABLE public.wa_genetic_profile ALTER COLUMN wa_code TYPE character varying(100);
+
+-- exact match
+CREATE INDEX CONCURRENTLY IF NOT EXISTS wa_genetic_profile_profile_idx
+  ON public.wa_genetic_profile USING btree (profile);
+
+-- search with up to k differences:
+-- the tokens of a profile are the position (from 1) * 100000 + value of the non missing values.
+-- The candidates are selected on the GIN index of the tokens (see genetic_profile.search_profile)
+CREATE OR REPLACE FUNCTION public.wa_profile_tokens(profile integer[])
+RETURNS integer[]
+LANGUAGE sql IMMUTABLE PARALLEL SAFE AS $$
+    SELECT COALESCE(array_agg(i * 100000 + profile[i]) FILTER (WHERE profile[i] IS NOT NULL), '{}')
+    FROM generate_subscripts(profile, 1) AS i
+$$;
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS wa_genetic_profile_tokens_idx
+  ON public.wa_genetic_profile USING gin (public.wa_profile_tokens(profile));
+
+
+-- initial population (or full rebuild)
+
+INSERT INTO wa_genetic_profile (wa_code, profile, n_values)
+SELECT
+    w.wa_code,
+    array_agg(lv.val ORDER BY l."position", a.allele) AS profile,
+    count(lv.val) AS n_values
+FROM (SELECT DISTINCT wa_code FROM wa_locus) w
+CROSS JOIN loci l
+CROSS JOIN (VALUES ('a'), ('b')) a(allele)
+LEFT JOIN LATERAL (
+    SELECT wl.val
+    FROM wa_locus wl
+    WHERE wl.wa_code = w.wa_code AND wl.locus = l.name AND wl.allele = a.allele
+    ORDER BY wl."timestamp" DESC
+    LIMIT 1
+) lv ON TRUE
+WHERE l.name != 'SRY'
+  AND (a.allele = 'a' OR l.n_alleles > 1)
+GROUP BY w.wa_code
+ON CONFLICT (wa_code) DO UPDATE
+SET profile = EXCLUDED.profile,
+    n_values = EXCLUDED.n_values,
+    updated_at = now();
@@ -0,0 +1,29 @@
+-- quality flags of the WA codes (see genetic_bp/wa_flags.py)
+--
+-- has_values: at least one allele with a value
+-- has_open_notes: at least one allele with a history not definitive (red flag)
+-- n_divergent_alleles: number of alleles with a value different from the value of the genotype (orange flag)
+-- last_changed: time of the last computation
+--
+-- the flags are computed by the web application (update_loci_values_cache, modification of a genotype)
+-- and used by the filters and the pagination of the WA codes lists (get_wa, wa_genetic_samples)
+--
+-- populate the flags after the creation of the columns with:
+-- python update_db_with_wa_loci_values.py
+
+
+ALTER TABLE public.wa_loci_values
+  ADD COLUMN IF NOT EXISTS has_values boolean DEFAULT false NOT NULL,
+  ADD COLUMN IF NOT EXISTS has_open_notes boolean DEFAULT false NOT NULL,
+  ADD COLUMN IF NOT EXISTS n_divergent_alleles integer DEFAULT 0 NOT NULL,
+  ADD COLUMN IF NOT EXISTS last_changed timestamp without time zone;
+
+-- filters of the lists (WA codes with values, with notes, with divergent alleles)
+CREATE INDEX CONCURRENTLY IF NOT EXISTS wa_loci_values_has_values_idx
+  ON public.wa_loci_values USING btree (wa_code) WHERE has_values;
+CREATE INDEX CONCURRENTLY IF NOT EXISTS wa_loci_values_has_open_notes_idx
+  ON public.wa_loci_values USING btree (wa_code) WHERE has_open_notes;
+CREATE INDEX CONCURRENTLY IF NOT EXISTS wa_loci_values_divergent_idx
+  ON public.wa_loci_values USING btree (wa_code) WHERE n_divergent_alleles > 0;
+CREATE INDEX CONCURRENTLY IF NOT EXISTS wa_loci_values_last_changed_idx
+  ON public.wa_loci_values USING btree (last_changed);
@@ -0,0 +1,198 @@
+-- materialized WA codes of scats and dead wolves (wa_scat_dw_mat)
+--
+-- wa_scat_dw_src: the previous definition of wa_scat_dw_all
+--                 (scats ⋈ wa_results UNION ALL dead_wolves ⋈ wa_results)
+-- wa_scat_dw_mat: table with the rows of wa_scat_dw_src, indexed (GiST on geometry_utm,
+--                 B-tree on wa_code, genotype_id and date)
+-- wa_scat_dw_all: now a view on wa_scat_dw_mat (same columns),
+--                 the queries and the views using wa_scat_dw_all (genotypes_list_all, scats_list_all,
+--                 wa_genetic_samples_all) read the indexed table
+--
+-- wa_scat_dw_mat is updated incrementally by statement triggers on scats, dead_wolves and wa_results:
+-- the rows of the modified WA codes are deleted and inserted again from wa_scat_dw_src.
+--
+-- full rebuild: SELECT wa_scat_dw_mat_refresh(NULL);
+--
+-- The materialized view wa_scat_dw_mat of create_materialized_views.sql is replaced by the table.
+-- At the first run the materialized view is dropped with CASCADE: the materialized views using it
+-- are dropped too:
+--   genotypes_list_mat
+--   scats_list_mat
+--   wa_genetic_samples_mat
+-- they must be created again with create_materialized_views.sql if they are used.
+-- The script can be run again (the materialized view is dropped only if it exists).
+
+
+-- also created by create_materialized_views.sql (after wa_scat): keep the two definitions identical
+CREATE OR REPLACE VIEW public.wa_scat_dw_src AS
+ SELECT wa_scat.wa_code,
+    wa_scat.sample_id,
+    wa_scat.date,
+    wa_scat.coord_east,
+    wa_scat.coord_north,
+    wa_scat.coord_zone,
+    wa_scat.geometry_utm,
+    wa_scat.location,
+    wa_scat.municipality,
+    wa_scat.province,
+    wa_scat.region,
+    wa_scat.quality_genotype,
+    wa_scat.genotype_id,
+    wa_scat.tmp_id,
+    wa_scat.mtdna,
+    wa_scat.sex_id,
+    wa_scat.sample_type,
+    wa_scat.box_number
+   FROM public.wa_scat
+UNION ALL
+ SELECT wa_dw.wa_code,
+    wa_dw.sample_id,
+    wa_dw.date,
+    wa_dw.coord_east,
+    wa_dw.coord_north,
+    wa_dw.coord_zone,
+    wa_dw.geometry_utm,
+    wa_dw.location,
+    wa_dw.municipality,
+    wa_dw.province,
+    wa_dw.region,
+    wa_dw.quality_genotype,
+    wa_dw.genotype_id,
+    wa_dw.tmp_id,
+    wa_dw.mtdna,
+    wa_dw.sex_id,
+    wa_dw.sample_type,
+    wa_dw.box_number
+   FROM public.wa_dw;
+
+ALTER VIEW public.wa_scat_dw_src OWNER TO wolf_user;
+
+
+-- DROP MATERIALIZED VIEW fails if wa_scat_dw_mat is already the table (second run)
+DO $$
+BEGIN
+    IF EXISTS (SELECT 1 FROM pg_matviews WHERE schemaname = 'public' AND matviewname = 'wa_scat_dw_mat') THEN
+        DROP MATERIALIZED VIEW public.wa_scat_dw_mat CASCADE;
+    END IF;
+END
+$$;
+
+CREATE TABLE IF NOT EXISTS public.wa_scat_dw_mat AS
+  SELECT * FROM public.wa_scat_dw_src;
+
+ALTER TABLE public.wa_scat_dw_mat OWNER TO wolf_user;
+
+CREATE INDEX IF NOT EXISTS wa_scat_dw_mat_geometry_utm_idx
+  ON public.wa_scat_dw_mat USING gist (geometry_utm);
+CREATE INDEX IF NOT EXISTS wa_scat_dw_mat_wa_code_idx
+  ON public.wa_scat_dw_mat USING btree (wa_code);
+CREATE INDEX IF NOT EXISTS wa_scat_dw_mat_genotype_id_idx
+  ON public.wa_scat_dw_mat USING btree (genotype_id);
+CREATE INDEX IF NOT EXISTS wa_scat_dw_mat_date_idx
+  ON public.wa_scat_dw_mat USING btree (date);
+CREATE INDEX IF NOT EXISTS wa_scat_dw_mat_sample_id_idx
+  ON public.wa_scat_dw_mat USING btree (sample_id);
+
+-- used by the refresh (dead wolves of the WA codes)
+CREATE INDEX IF NOT EXISTS dead_wolves_wa_code_idx
+  ON public.dead_wolves USING btree (wa_code);
+
+ANALYZE public.wa_scat_dw_mat;
+
+
+-- refresh the rows of the WA codes (all rows if wa_codes is NULL)
+
+CREATE OR REPLACE FUNCTION public.wa_scat_dw_mat_refresh(wa_codes text[])
+RETURNS void
+LANGUAGE plpgsql AS $$
+BEGIN
+    IF wa_codes IS NULL THEN
+        DELETE FROM public.wa_scat_dw_mat;
+        INSERT INTO public.wa_scat_dw_mat SELECT * FROM public.wa_scat_dw_src;
+    ELSE
+        DELETE FROM public.wa_scat_dw_mat WHERE wa_code::text = ANY(wa_codes);
+        INSERT INTO public.wa_scat_dw_mat
+          SELECT * FROM public.wa_scat_dw_src WHERE wa_code::text = ANY(wa_codes);
+    END IF;
+END;
+$$;
+
+
+-- statement trigger: the WA codes are read from the transition tables (old_rows, new_rows)
+
+CREATE OR REPLACE FUNCTION public.wa_scat_dw_mat_trigger()
+RETURNS trigger
+LANGUAGE plpgsql AS $$
+DECLARE
+    wa_codes text[];
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        SELECT array_agg(DISTINCT wa_code::text) INTO wa_codes
+          FROM new_rows WHERE wa_code IS NOT NULL;
+    ELSIF TG_OP = 'UPDATE' THEN
+        SELECT array_agg(DISTINCT wa_code) INTO wa_codes
+          FROM (SELECT wa_code::text FROM old_rows UNION SELECT wa_code::text FROM new_rows) r
+         WHERE wa_code IS NOT NULL;
+    ELSE
+        SELECT array_agg(DISTINCT wa_code::text) INTO wa_codes
+          FROM old_rows WHERE wa_code IS NOT NULL;
+    END IF;
+
+    IF wa_codes IS NOT NULL THEN
+        PERFORM public.wa_scat_dw_mat_refresh(wa_codes);
+    END IF;
+    RETURN NULL;
+END;
+$$;
+
+
+-- the transition tables require one trigger by event
+
+DO $$
+DECLARE
+    tbl text;
+BEGIN
+    FOREACH tbl IN ARRAY ARRAY['scats', 'dead_wolves', 'wa_results'] LOOP
+        EXECUTE format('DROP TRIGGER IF EXISTS wa_scat_dw_mat_insert ON public.%I', tbl);
+        EXECUTE format('DROP TRIGGER IF EXISTS wa_scat_dw_mat_update ON public.%I', tbl);
+        EXECUTE format('DROP TRIGGER IF EXISTS wa_scat_dw_mat_delete ON public.%I', tbl);
+
+        EXECUTE format(
+            'CREATE TRIGGER wa_scat_dw_mat_insert AFTER INSERT ON public.%I '
+            'REFERENCING NEW TABLE AS new_rows '
+            'FOR EACH STATEMENT EXECUTE FUNCTION public.wa_scat_dw_mat_trigger()', tbl);
+        EXECUTE format(
+            'CREATE TRIGGER wa_scat_dw_mat_update AFTER UPDATE ON public.%I '
+            'REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows '
+            'FOR EACH STATEMENT EXECUTE FUNCTION public.wa_scat_dw_mat_trigger()', tbl);
+        EXECUTE format(
+            'CREATE TRIGGER wa_scat_dw_mat_delete AFTER DELETE ON public.%I '
+            'REFERENCING OLD TABLE AS old_rows '
+            'FOR EACH STATEMENT EXECUTE FUNCTION public.wa_scat_dw_mat_trigger()', tbl);
+    END LOOP;
+END;
+$$;
+
+
+-- wa_scat_dw_all reads the materialized rows
+
+CREATE OR REPLACE VIEW public.wa_scat_dw_all AS
+ SELECT wa_code,
+    sample_id,
+    date,
+    coord_east,
+    coord_north,
+    coord_zone,
+    geometry_utm,
+    location,
+    municipality,
+    province,
+    region,
+    quality_genotype,
+    genotype_id,
+    tmp_id,
+    mtdna,
+    sex_id,
+    sample_type,
+    box_number
+   FROM public.wa_scat_dw_mat;
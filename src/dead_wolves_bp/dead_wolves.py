@@ -26,6 +26,10 @@ from markupsafe import Markup
 from sqlalchemy import exc, text
 
 import functions as fn
+import geocoding
+import job_queue
+import search
+import upload_staging
 from config import config
 
 from . import tissues_import
@@ -44,7 +48,7 @@ def view_tissue(tissue_id: str):
     show dead wolf corresponding to tissue ID
     """
 
-    with fn.conn_alchemy().connect() as con:
+    with fn.db_connection() as con:
         row = (
             con.execute(
                 text("SELECT id FROM dead_wolves WHERE tissue_id = :tissue_id"),
@@ -60,13 +64,42 @@ def view_tissue(tissue_id: str):
             return redirect("/dead_wolves_list")
 
 
+def write_field_values(con, id: int, fields_list: list) -> None:
+    """
+    insert or update the values of the fields of a dead wolf from the form.
+    The values are written by one statement: dead_wolves_attributes is updated by the triggers
+    of dead_wolves_values in the same transaction (see database/dead_wolves_attributes.sql)
+    """
+    field_ids: list = []
+    field_values: list = []
+    for field in fields_list:
+        if f"field{field['field_id']}" not in request.form:
+            continue
+        field_ids.append(field["field_id"])
+        # empty date
+        if field["field_id"] in (8, 9, 11) and request.form[f"field{field['field_id']}"] == "":
+            field_values.append(None)
+        else:
+            field_values.append(request.form[f"field{field['field_id']}"])
+
+    con.execute(
+        text(
+            "INSERT INTO dead_wolves_values (id, field_id, val) "
+            "SELECT :id, field_id, val "
+            "FROM unnest(CAST(:field_ids AS integer[]), CAST(:field_values AS text[])) AS v(field_id, val) "
+            "ON CONFLICT (id, field_id) DO UPDATE SET val = EXCLUDED.val"
+        ),
+        {"id": id, "field_ids": field_ids, "field_values": field_values},
+    )
+
+
 @app.route("/view_dead_wolf_id/<int:id>")
 @fn.check_login
 def view_dead_wolf_id(id: int):
     """
     visualize dead wolf data (by id)
     """
-    with fn.conn_alchemy().connect() as con:
+    with fn.db_connection() as con:
         dead_wolf = (
             con.execute(
                 text(
@@ -99,10 +132,9 @@ def view_dead_wolf_id(id: int):
         rows = (
             con.execute(
                 text(
-                    "SELECT id, name, val "
-                    "FROM dead_wolves_values, dead_wolves_fields_definition "
-                    "WHERE dead_wolves_values.field_id=dead_wolves_fields_definition.field_id "
-                    "AND id = :id"
+                    "SELECT f.name, a.attributes ->> f.field_id::text AS val "
+                    "FROM dead_wolves_attributes a, dead_wolves_fields_definition f "
+                    "WHERE a.id = :id AND a.attributes ? f.field_id::text"
                 ),
                 {"id": id},
             )
@@ -164,7 +196,7 @@ def plot_dead_wolves():
     """
     plot dead wolves
     """
-    with fn.conn_alchemy().connect() as con:
+    with fn.db_connection() as con:
         tot_min_lat = 90
         tot_min_lon = 90
         tot_max_lat = -90
@@ -288,7 +320,7 @@ def new_dead_wolf():
         if not form.validate():
             return not_valid(form, "Dead wolf form NOT validated. See details below.")
 
-        with fn.conn_alchemy().connect() as con:
+        with fn.db_connection() as con:
             # check tissue id
             if request.form["tissue_id"]:
                 tissue_id = (
@@ -346,7 +378,7 @@ def new_dead_wolf():
                     return not_valid(
                         form, f"Check the UTM coordinates ({error.args[0]})"
                     )
-                r = fn.reverse_geocoding(lat_lon[::-1])
+                r = geocoding.reverse_geocoding(lat_lon[::-1])
                 if not location:
                     location = r["location"]
                 if not municipality:
@@ -484,6 +516,8 @@ def new_dead_wolf():
                     )
                 else:
                     return not_valid(form, f"Error {error.args[0]}")
+            fn.invalidate_tiles("dead_wolves")
+            fn.invalidate_wa_clusters()
 
             # get last id
             row = (
@@ -504,31 +538,7 @@ def new_dead_wolf():
                 .all()
             )
 
-            for field in fields_list:
-                if f"field{field['field_id']}" in request.form:
-                    # date
-                    if (
-                        field["field_id"] in (8, 9, 11)
-                        and request.form[f"field{field['field_id']}"] == ""
-                    ):
-                        con.execute(
-                            text(
-                                "INSERT INTO dead_wolves_values (id, field_id, val) VALUES (:new_id, :field_id, NULL)"
-                            ),
-                            {"new_id": new_id, "field_id": field["field_id"]},
-                        )
-
-                    else:
-                        con.execute(
-                            text(
-                                "INSERT INTO dead_wolves_values (id, field_id, val) VALUES (:new_id, :field_id, :value)"
-                            ),
-                            {
-                                "new_id": new_id,
-                                "field_id": field["field_id"],
-                                "value": request.form[f"field{field['field_id']}"],
-                            },
-                        )
+            write_field_values(con, new_id, fields_list)
 
         return redirect(f"/view_dead_wolf_id/{new_id}")
 
@@ -558,7 +568,7 @@ def edit_dead_wolf(id: int):
         )
 
     if request.method == "GET":
-        with fn.conn_alchemy().connect() as con:
+        with fn.db_connection() as con:
             dead_wolf = (
                 con.execute(
                     text(
@@ -580,9 +590,9 @@ def edit_dead_wolf(id: int):
             rows = (
                 con.execute(
                     text(
-                        "SELECT id, dead_wolves_values.field_id AS field_id, name, val "
-                        "FROM dead_wolves_values, dead_wolves_fields_definition "
-                        "WHERE dead_wolves_values.field_id=dead_wolves_fields_definition.field_id AND id = :id"
+                        "SELECT f.field_id, f.name, a.attributes ->> f.field_id::text AS val "
+                        "FROM dead_wolves_attributes a, dead_wolves_fields_definition f "
+                        "WHERE a.id = :id AND a.attributes ? f.field_id::text"
                     ),
                     {"id": id},
                 )
@@ -685,7 +695,7 @@ def edit_dead_wolf(id: int):
         ):
             return not_valid(form, "UTM zone number is missing")
 
-        with fn.conn_alchemy().connect() as con:
+        with fn.db_connection() as con:
             # add region
             region: str = ""
             if request.form["province"]:
@@ -805,6 +815,8 @@ def edit_dead_wolf(id: int):
                     "region": region if region else None,
                 },
             )
+            fn.invalidate_tiles("dead_wolves")
+            fn.invalidate_wa_clusters()
 
             fields_list = (
                 con.execute(
@@ -816,33 +828,7 @@ def edit_dead_wolf(id: int):
                 .all()
             )
 
-            for row in fields_list:
-                if f"field{row['field_id']}" in request.form:
-                    # date
-                    if (
-                        row["field_id"] in (8, 9, 11)
-                        and request.form[f"field{row['field_id']}"] == ""
-                    ):
-                        con.execute(
-                            text(
-                                "INSERT INTO dead_wolves_values (id, field_id, val) VALUES (:id, :field_id, NULL)"
-                                "ON CONFLICT (id, field_id) DO UPDATE SET val = NULL"
-                            ),
-                            {"id": id, "field_id": row["field_id"]},
-                        )
-                    else:
-                        con.execute(
-                            text(
-                                "INSERT INTO dead_wolves_values VALUES (:id, :field_id, :value) "
-                                "ON CONFLICT (id, field_id) DO UPDATE "
-                                "SET val = :value"
-                            ),
-                            {
-                                "id": id,
-                                "field_id": row["field_id"],
-                                "value": request.form[f"field{row['field_id']}"],
-                            },
-                        )
+            write_field_values(con, id, fields_list)
 
         return redirect(f"/view_dead_wolf_id/{id}")
 
@@ -853,11 +839,13 @@ def del_dead_wolf(id):
     """
     set dead wolf as deleted
     """
-    with fn.conn_alchemy().connect() as con:
+    with fn.db_connection() as con:
         con.execute(
             text("UPDATE dead_wolves SET deleted = NOW() WHERE id = :dead_wolf_id"),
             {"dead_wolf_id": id},
         )
+    fn.invalidate_tiles("dead_wolves")
+    fn.invalidate_wa_clusters()
 
     flash(fn.alert_success(f"Dead wolf <b>#{id}</b> deleted"))
 
@@ -884,9 +872,9 @@ def dead_wolves_list():
     sql: str = (
         "SELECT id, tissue_id, wa_code, genotype_id, discovery_date, location, municipality, province, region, utm_east, utm_north, utm_zone, "
         "(SELECT genotype_id FROM genotypes WHERE genotype_id=dw.genotype_id) AS genotype_id_verif, "
-        "(SELECT val FROM dead_wolves_values WHERE field_id = 12 AND id = dw.id) AS main_mortality, "
-        "(SELECT val FROM dead_wolves_values WHERE field_id = 13 AND id = dw.id) AS specific_mortality "
-        "FROM dead_wolves dw "
+        "a.attributes ->> '12' AS main_mortality, "
+        "a.attributes ->> '13' AS specific_mortality "
+        "FROM dead_wolves dw LEFT JOIN dead_wolves_attributes a USING (id) "
         "WHERE "
         "deleted is NULL "
         "AND (discovery_date BETWEEN :start_date AND :end_date OR discovery_date IS NULL) "
@@ -906,28 +894,21 @@ def dead_wolves_list():
         else:
             search_term = request.args.get("search")
 
-    if search_term:
-        if request.form["selected_field"] == "all":
-            sql += (
-                "AND (genotype_id ILIKE :search "
-                "OR tissue_id ILIKE :search "
-                "OR wa_code ILIKE :search "
-                "OR discovery_date::text ILIKE :search "
-                "OR province ILIKE :search "
-                ")"
-            )
-        else:
-            if request.form["selected_field"] == "mortality":
-                sql += "AND id in (SELECT id FROM dead_wolves_values WHERE field_id IN (12,13) AND val ILIKE :search)"
-
-            else:
-                sql += f" AND {request.form['selected_field']} ILIKE :search "
+    # free text or field search (see search.py)
+    try:
+        conditions, values = search.where(
+            "dead_wolves", search_term, request.form.get("selected_field", "all")
+        )
+    except ValueError as e:
+        flash(fn.alert_danger(f"<b>{e}</b>"))
+        search_term, conditions, values = "", "", {}
 
-        fields_dict["search"] = f"%{search_term}%"
+    sql += conditions
+    fields_dict.update(values)
 
-    sql += " ORDER BY id"
+    sql += f" ORDER BY {search.rank('dead_wolves')}, id" if search_term else " ORDER BY id"
 
-    with fn.conn_alchemy().connect() as con:
+    with fn.db_connection() as con:
         results = (
             con.execute(
                 text(sql),
@@ -1018,7 +999,7 @@ def dead_wolves_full_list():
         "institution",
     ]
 
-    with fn.conn_alchemy().connect() as con:
+    with fn.db_connection() as con:
         # Load all dynamic fields and keep their display order.
         dynamic_fields = (
             con.execute(
@@ -1032,6 +1013,18 @@ def dead_wolves_full_list():
             .all()
         )
 
+        # free text or field search (see search.py), the dynamic fields are searched in dead_wolves_attributes
+        try:
+            conditions, values = search.where(
+                "dead_wolves",
+                search_term,
+                selected_field,
+                {field["name"]: search.dead_wolf_field(field["field_id"]) for field in dynamic_fields},
+            )
+        except ValueError as e:
+            flash(fn.alert_danger(f"<b>{e}</b>"))
+            search_term, conditions, values = "", "", {}
+
         # Load base columns from dead_wolves for the active date range.
         base_results = (
             con.execute(
@@ -1042,61 +1035,33 @@ def dead_wolves_full_list():
                     "dw.utm_east, dw.utm_north, dw.utm_zone, "
                     "dw.box_number, dw.scalp_category, dw.notes, dw.sampling_season, "
                     "dw.operator, dw.institution, "
-                    "(SELECT genotype_id FROM genotypes WHERE genotype_id = dw.genotype_id) AS genotype_id_verif "
-                    "FROM dead_wolves dw "
+                    "(SELECT genotype_id FROM genotypes WHERE genotype_id = dw.genotype_id) AS genotype_id_verif, "
+                    "a.attributes "
+                    "FROM dead_wolves dw LEFT JOIN dead_wolves_attributes a USING (id) "
                     "WHERE dw.deleted IS NULL "
                     "AND (dw.discovery_date BETWEEN :start_date AND :end_date OR dw.discovery_date IS NULL) "
-                    "ORDER BY dw.id"
-                ),
-                {
-                    "start_date": session["start_date"],
-                    "end_date": session["end_date"],
-                },
-            )
-            .mappings()
-            .all()
-        )
-
-        # Load all dynamic values tied to dead wolves in the same date range.
-        dynamic_values_rows = (
-            con.execute(
-                text(
-                    "SELECT dv.id, dv.field_id, dv.val "
-                    "FROM dead_wolves_values dv "
-                    "JOIN dead_wolves dw ON dw.id = dv.id "
-                    "WHERE dw.deleted IS NULL "
-                    "AND (dw.discovery_date BETWEEN :start_date AND :end_date OR dw.discovery_date IS NULL)"
+                    + conditions
+                    + (f"ORDER BY {search.rank('dead_wolves')}, dw.id" if search_term else "ORDER BY dw.id")
                 ),
                 {
                     "start_date": session["start_date"],
                     "end_date": session["end_date"],
+                    **values,
                 },
             )
             .mappings()
             .all()
         )
 
-    field_id_to_name: dict[int, str] = {
-        field["field_id"]: field["name"] for field in dynamic_fields
-    }
-
     results_by_id: dict[int, dict] = {}
     for row in base_results:
         row_dict = dict(row)
-        # Pre-fill dynamic columns so each row has all headers.
+        # values of the dynamic fields (field_id -> value)
+        attributes = row_dict.pop("attributes") or {}
         for field in dynamic_fields:
-            row_dict[field["name"]] = None
+            row_dict[field["name"]] = attributes.get(str(field["field_id"]))
         results_by_id[row["id"]] = row_dict
 
-    for row in dynamic_values_rows:
-        # Ignore orphan values if no matching dead wolf is present.
-        if row["id"] not in results_by_id:
-            continue
-        field_name = field_id_to_name.get(row["field_id"])
-        if field_name is None:
-            continue
-        results_by_id[row["id"]][field_name] = row["val"]
-
     # Clean legacy bad values produced by older import logic.
     for row in results_by_id.values():
         for field_name in ("operator", "institution"):
@@ -1112,27 +1077,6 @@ def dead_wolves_full_list():
 
     results = list(results_by_id.values())
 
-    if search_term:
-        search_lower = search_term.lower()
-
-        def matches(row: dict) -> bool:
-            if selected_field == "all":
-                fields_to_search = searchable_columns
-            else:
-                fields_to_search = (
-                    [selected_field] if selected_field in searchable_columns else []
-                )
-
-            for field in fields_to_search:
-                value = row.get(field)
-                if value is None:
-                    continue
-                if search_lower in str(value).lower():
-                    return True
-            return False
-
-        results = [row for row in results if matches(row)]
-
     if action == "search":
         return render_template(
             "dead_wolves_full_list.html",
@@ -1250,7 +1194,9 @@ def load_tissue_from_spreadsheet():
             )
             return redirect(url_for("dead_wolves.load_tissue_from_spreadsheet"))
 
-        r, msg, all_data = tissues_import.extract_tissue_data_from_spreadsheet(filename)
+        r, msg, all_data = upload_staging.extract(
+            filename, tissues_import.extract_tissue_data_from_spreadsheet
+        )
         if r:
             flash(
                 Markup(f"File name: <b>{new_file.filename}</b>")
@@ -1261,7 +1207,7 @@ def load_tissue_from_spreadsheet():
 
         else:
             # check if tissue_id already in DB
-            with fn.conn_alchemy().connect() as con:
+            with fn.db_connection() as con:
                 tissue_list = "','".join(
                     [all_data[idx]["tissue_id"] for idx in all_data]
                 )
@@ -1291,100 +1237,34 @@ def confirm_load_tissue_spreadsheet(filename, mode):
         flash(fn.alert_danger("Error: mode not allowed"))
         return redirect(url_for("dead_wolves.load_tissue_from_spreadsheet"))
 
-    r, msg, all_data = tissues_import.extract_tissue_data_from_spreadsheet(filename)
+    # rows parsed and validated at the upload (see upload_staging.py)
+    r, msg, _ = upload_staging.extract(
+        filename, tissues_import.extract_tissue_data_from_spreadsheet
+    )
     if r:
         flash(msg)
         return redirect(url_for("dead_wolves.load_tissue_from_spreadsheet"))
 
-    with fn.conn_alchemy().connect() as con:
-        # check if tissue already in DB
-        tissues_list = "','".join([all_data[idx]["tissue_id"] for idx in all_data])
-        sql = text(
-            f"SELECT tissue_id FROM dead_wolves WHERE tissue_id in ('{tissues_list}')"
-        )
-
-        tissues_to_update = [
-            row["tissue_id"] for row in con.execute(sql).mappings().all()
-        ]
-
-        count_added: int = 0
-        count_updated: int = 0
-
-        for idx in all_data:
-            data = dict(all_data[idx])
-
-            if mode == "new" and (data["tissue_id"] in tissues_to_update):
-                continue
-
-            sql = text(
-                "INSERT INTO dead_wolves (tissue_id, genotype_id, discovery_date, wa_code, location, municipality, province, region, "
-                "utm_east, utm_north, utm_zone,"
-                "geometry_utm, box_number, "
-                "scalp_category, notes, sampling_season,"
-                "operator, institution"
-                ")"
-                "VALUES("
-                ":tissue_id, :genotype_id, :discovery_date, :wa_code, :location, :municipality, :province, :region, "
-                ":utm_east, :utm_north, :utm_zone, "
-                f"{data['geometry_utm']}, :box_number, "
-                ":scalp_category, :notes, :sampling_season,"
-                ":operator, :institution"
-                ") "
-                "ON CONFLICT (tissue_id) "
-                "DO UPDATE SET "
-                "genotype_id = CASE WHEN EXCLUDED.genotype_id <> '' THEN EXCLUDED.genotype_id ELSE dead_wolves.genotype_id END,"
-                "discovery_date = CASE WHEN EXCLUDED.discovery_date IS NOT NULL THEN EXCLUDED.discovery_date ELSE dead_wolves.discovery_date END,"
-                "wa_code = CASE WHEN EXCLUDED.wa_code <> '' THEN EXCLUDED.wa_code ELSE dead_wolves.wa_code END,"
-                "location = CASE WHEN EXCLUDED.location <> '' THEN EXCLUDED.location ELSE dead_wolves.location END,"
-                "municipality = CASE WHEN EXCLUDED.municipality <> '' THEN EXCLUDED.municipality ELSE dead_wolves.municipality END,"
-                "province = CASE WHEN EXCLUDED.province <> '' THEN EXCLUDED.province ELSE dead_wolves.province END,"
-                "region = CASE WHEN EXCLUDED.region <> '' THEN EXCLUDED.region ELSE dead_wolves.region END,"
-                "utm_east = CASE WHEN EXCLUDED.utm_east  IS NOT NULL  THEN EXCLUDED.utm_east ELSE dead_wolves.utm_east END,"
-                "utm_north = CASE WHEN EXCLUDED.utm_north  IS NOT NULL  THEN EXCLUDED.utm_north ELSE dead_wolves.utm_north END,"
-                "utm_zone = CASE WHEN EXCLUDED.utm_zone <> '' THEN EXCLUDED.utm_zone ELSE dead_wolves.utm_zone END,"
-                "geometry_utm = CASE WHEN EXCLUDED.geometry_utm <> '' THEN EXCLUDED.geometry_utm ELSE dead_wolves.geometry_utm END,"
-                "box_number = CASE WHEN EXCLUDED.box_number <> '' THEN EXCLUDED.box_number ELSE dead_wolves.box_number END,"
-                "scalp_category = CASE WHEN EXCLUDED.scalp_category <> '' THEN EXCLUDED.scalp_category ELSE dead_wolves.scalp_category END,"
-                "notes = CASE WHEN EXCLUDED.notes <> '' THEN EXCLUDED.notes ELSE dead_wolves.notes END,"
-                "sampling_season = CASE WHEN EXCLUDED.sampling_season <> '' THEN EXCLUDED.sampling_season ELSE dead_wolves.sampling_season END,"
-                "operator = CASE WHEN EXCLUDED.operator <> '' THEN EXCLUDED.operator ELSE dead_wolves.operator END,"
-                "institution = CASE WHEN EXCLUDED.institution <> '' THEN EXCLUDED.institution ELSE dead_wolves.institution END"
+    # the rows are imported by a background job (see job_queue.py)
+    job_id = job_queue.submit(
+        session["email"],
+        kind="import_tissues",
+        title="Import of tissues from spreadsheet file",
+        function="dead_wolves_bp.tissues_import:import_tissues",
+        kwargs={"filename": filename, "mode": mode},
+    )
+    if job_id is None:
+        flash(
+            fn.alert_danger(
+                f"You have already {job_queue.JOBS_MAX_PER_USER} jobs running. Wait for their completion."
             )
+        )
+        return redirect(url_for("dead_wolves.load_tissue_from_spreadsheet"))
 
-            params = {
-                "tissue_id": data["tissue_id"].strip(),
-                "genotype_id": data["genotype_id"].strip(),
-                "discovery_date": data["date"],
-                "wa_code": data["wa_code"].strip(),
-                "location": data["location"].strip(),
-                "municipality": data["municipality"].strip(),
-                "province": data["province"].strip().upper(),
-                "region": data["region"],
-                "utm_east": data["coord_east"],
-                "utm_north": data["coord_north"],
-                "utm_zone": data["coord_zone"].strip(),
-                "box_number": data["box_number"],
-                "scalp_category": data["scalp_category"],
-                "notes": data["notes"],
-                "sampling_season": fn.sampling_season(data["date"]),
-                # Keep raw text values for operator/institution.
-                "operator": data["operator"],
-                "institution": data["institution"],
-            }
-
-            if data["tissue_id"] in tissues_to_update:
-                count_updated += 1
-            else:
-                count_added += 1
-            try:
-                con.execute(sql, params)
-            except Exception:
-                return (
-                    "An error occured during the loading of tissues. Contact the administrator.<br>"
-                    + fn.error_info(sys.exc_info())
-                )
-
-    msg = f"Tissues successfully loaded from spreadsheet file. {count_added} tissue(s) added, {count_updated} tissue(s) updated."
-    flash(fn.alert_success(msg))
+    flash(
+        fn.alert_success(
+            "The tissues are being imported.<br>See the <a href='/jobs'>jobs page</a> for the result of the import."
+        )
+    )
 
-    return redirect("/")
+    return redirect("/jobs")
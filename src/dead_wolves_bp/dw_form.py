@@ -100,7 +100,7 @@ class Dead_wolf(Form):
     location = StringField("Location", [], default="")
     municipality = StringField("Municipality", [], default="")
 
-    with fn.conn_alchemy().connect() as con:
+    with fn.db_connection() as con:
         provinces = (
             con.execute(
                 text(
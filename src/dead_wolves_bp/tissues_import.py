@@ -1,11 +1,16 @@
 from pathlib import Path
+import time
 import pandas as pd
 import datetime as dt
 import utm
 from markupsafe import Markup
+from sqlalchemy import text
 
 from config import config
+import bulk_import
 import functions as fn
+import job_queue
+import upload_staging
 
 
 DEBUG = False
@@ -142,11 +147,15 @@ def extract_tissue_data_from_spreadsheet(filename: str):
                 {},
             )  # , {}, {}
 
+    # reference tables (loaded once)
+    province_codes: set = set(fn.province_code_list())
+    province_regions: dict = fn.province_code2region_dict()
+
     # check province code
     for idx, province in enumerate(dw_df["province"]):
         if isinstance(province, int):
             province = f"{province:02}"
-        if province not in fn.province_code_list():
+        if province not in province_codes:
             return (
                 True,
                 fn.alert_danger(f"Province '{province}' not found at row {idx + 2}"),
@@ -188,7 +197,7 @@ def extract_tissue_data_from_spreadsheet(filename: str):
             data["box_number"] = row["box_number"]
 
         # add region from province code
-        data["region"] = fn.province_code2region(data["province"])
+        data["region"] = province_regions.get(str(data["province"]).upper().strip())
 
         # UTM coord conversion
         # check zone
@@ -227,7 +236,7 @@ def extract_tissue_data_from_spreadsheet(filename: str):
             )
         srid = zone + (32600 if hemisphere == "N" else 32700)
         data["geometry_utm"] = (
-            f"ST_GeomFromText('POINT({data['coord_east']} {data['coord_north']})', {srid})"
+            f"SRID={srid};POINT({data['coord_east']} {data['coord_north']})"
         )
 
         # sampling_type
@@ -289,3 +298,87 @@ def extract_tissue_data_from_spreadsheet(filename: str):
     """
 
     return False, "", tissues_data  # , all_paths, all_tracks
+
+
+def import_tissues(filename: str, mode: str) -> None:
+    """
+    import the tissues of the uploaded file (background job, see job_queue.py)
+
+    Args:
+        filename (str): name of the uploaded file (UUID)
+        mode (str): new (only the new tissues are imported) or all (new and existing tissues)
+    """
+
+    # rows parsed and validated at the upload (see upload_staging.py)
+    r, msg, all_data = upload_staging.extract(filename, extract_tissue_data_from_spreadsheet)
+    if r:
+        raise ValueError(Markup(msg).striptags())
+
+    t0 = time.time()
+
+    with fn.db_connection() as con:
+        # check if tissue already in DB
+        tissues_to_update = set(
+            con.execute(
+                text("SELECT tissue_id FROM dead_wolves WHERE tissue_id = ANY(:tissue_ids)"),
+                {"tissue_ids": [all_data[idx]["tissue_id"].strip() for idx in all_data]},
+            )
+            .scalars()
+            .all()
+        )
+
+    rows: list = []
+    for idx in all_data:
+        data = dict(all_data[idx])
+
+        if mode == "new" and (data["tissue_id"].strip() in tissues_to_update):
+            continue
+
+        rows.append(
+            {
+                "tissue_id": data["tissue_id"].strip(),
+                "genotype_id": data["genotype_id"].strip(),
+                "discovery_date": data["date"],
+                "wa_code": data["wa_code"].strip(),
+                "location": data["location"].strip(),
+                "municipality": data["municipality"].strip(),
+                "province": data["province"].strip().upper(),
+                "region": data["region"],
+                "utm_east": data["coord_east"],
+                "utm_north": data["coord_north"],
+                "utm_zone": data["coord_zone"].strip(),
+                "geometry_utm": data["geometry_utm"],
+                "box_number": data["box_number"],
+                "scalp_category": data["scalp_category"],
+                "notes": data["notes"],
+                "sampling_season": fn.sampling_season(data["date"]),
+                # Keep raw text values for operator/institution.
+                "operator": data["operator"],
+                "institution": data["institution"],
+            }
+        )
+
+    count_updated: int = len([row for row in rows if row["tissue_id"] in tissues_to_update])
+    count_added: int = len(rows) - count_updated
+
+    job_queue.progress(10, f"{len(rows)} tissues to import")
+
+    # staging table and one upsert (see bulk_import.py)
+    if rows:
+        columns: tuple = tuple(rows[0])
+        with bulk_import.transaction() as con:
+            staging = bulk_import.stage(con, "dead_wolves", columns, rows)
+            bulk_import.merge(con, "dead_wolves", staging, "tissue_id", columns)
+
+    upload_staging.discard(filename)
+
+    fn.invalidate_tiles("dead_wolves")
+    fn.invalidate_wa_clusters()
+
+    job_queue.progress(
+        100,
+        (
+            f"{count_added} tissue(s) added, {count_updated} tissue(s) updated "
+            f"({bulk_import.rate(len(rows), t0)})."
+        ),
+    )
@@ -12,6 +12,7 @@ from sqlalchemy import text
 
 sys.path.insert(1, os.path.join(sys.path[0], ".."))
 import functions as fn
+import paths_truncation
 
 
 def create_shapefile(dir_path: str, log_file: str):
@@ -40,6 +41,8 @@ def create_shapefile(dir_path: str, log_file: str):
         dir_path, mode="w", driver="ESRI Shapefile", schema=schema, crs="EPSG:32632"
     )
 
+    transects_cache: dict = {}
+
     for path in paths:
         print(file=log)
         print(path, file=log)
@@ -73,30 +76,19 @@ def create_shapefile(dir_path: str, log_file: str):
             if len(transect_geojson["coordinates"]) == 1:
                 # print(transect_geojson["coordinates"])
 
-                tot_dist = 0
-                new_list = []
-                for idx, point in enumerate(transect_geojson["coordinates"][0]):
-                    if idx == 0:  # skip first point
-                        continue
-                    d = (
-                        (point[0] - transect_geojson["coordinates"][0][idx - 1][0]) ** 2
-                        + (point[1] - transect_geojson["coordinates"][0][idx - 1][1])
-                        ** 2
-                    ) ** 0.5
-                    tot_dist += d
-
-                    # print(point, d, tot_dist, transect["transect_length"], file=log)
-
-                    new_list.append(point)
-                    if (
-                        round((tot_dist / transect["transect_length"]) * 100)
-                        >= path["completeness"]
-                    ):
-                        break
-
-                if (
-                    round((tot_dist / transect["transect_length"]) * 100)
-                    >= path["completeness"]
+                new_list, tot_dist = paths_truncation.truncated_path(
+                    transects_cache,
+                    path["transect_id"],
+                    transect_geojson["coordinates"][0],
+                    transect["transect_length"],
+                    path["completeness"],
+                )
+
+                if paths_truncation.completeness_reached(
+                    transects_cache,
+                    path["transect_id"],
+                    transect["transect_length"],
+                    path["completeness"],
                 ):
                     print(
                         f"{path['completeness']} COMPLETE OK  {tot_dist / transect['transect_length']}",
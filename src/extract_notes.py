@@ -28,7 +28,7 @@ loci_list: dict = fn.get_loci_list()
 
 data = {}
 
-with fn.conn_alchemy().connect() as con:
+with fn.db_connection() as con:
     sql = text("SELECT * FROM wa_locus ORDER BY wa_code,locus,allele,timestamp")
     wa_codes = con.execute(sql).mappings().all()
     for r in wa_codes:
@@ -6,27 +6,95 @@ functions module
 
 """
 
+import base64
+import binascii
+import hashlib
 import json
 import os
+import threading
+import time
 import urllib.error
 import urllib.request
+from contextlib import contextmanager
 from functools import wraps
 
 import matplotlib.pyplot as plt
 import psycopg2
 import psycopg2.extras
 import redis
-from flask import redirect, session, url_for
-from jinja2 import Template
+from flask import g, has_app_context, redirect, render_template, session, url_for
 from markupsafe import Markup
 from sqlalchemy import create_engine, text
 
 from config import config
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 params = config()
 
 rdis = redis.Redis(db=(0 if params["database"] == "wolf" else 1))
 
+# cache of the vector tiles (see tiles_bp)
+TILES_REDIS_DB = int(
+    params.get("tiles_redis_db", 4 if params["database"] == "wolf" else 5)
+)
+TILES_CACHE_TTL = int(params.get("tiles_cache_ttl", 86400))
+rtiles = redis.Redis(db=TILES_REDIS_DB)
+
+# cache of the DBSCAN clusters of the WA codes (in the tiles cache db, see genetic_bp/wa_clusters.py)
+WA_CLUSTERS_CACHE_TTL = int(params.get("wa_clusters_cache_ttl", 86400))
+
+
+def tiles_version(layer: str) -> int:
+    """
+    returns the current version of the tiles of the layer (part of the tiles cache keys)
+    """
+    try:
+        return int(rtiles.get(f"tiles:version:{layer}") or 0)
+    except redis.exceptions.ConnectionError:
+        return 0
+
+
+def invalidate_tiles(*layers: str) -> None:
+    """
+    invalidate the cached vector tiles of the layers (scats, transects, tracks, dead_wolves)
+    after an insertion, a modification or a deletion.
+    The old tiles are no longer used and expire after TILES_CACHE_TTL
+    """
+    try:
+        with rtiles.pipeline(transaction=False) as pipe:
+            for layer in layers:
+                pipe.incr(f"tiles:version:{layer}")
+            pipe.execute()
+    except redis.exceptions.ConnectionError:
+        pass
+
+
+def wa_clusters_version() -> int:
+    """
+    returns the current version of the WA codes data (part of the DBSCAN clusters cache keys,
+    see genetic_bp/wa_clusters.py)
+    """
+    try:
+        return int(rtiles.get("wa_clusters:version") or 0)
+    except redis.exceptions.ConnectionError:
+        return 0
+
+
+def invalidate_wa_clusters() -> None:
+    """
+    invalidate the cached DBSCAN clusters of the WA codes
+    after a modification of the scats, of the dead wolves or of the WA results.
+    The old clusters are no longer used and expire after WA_CLUSTERS_CACHE_TTL
+    """
+    try:
+        rtiles.incr("wa_clusters:version")
+    except redis.exceptions.ConnectionError:
+        pass
+
 
 def check_login(f):
     @wraps(f)
@@ -38,21 +106,111 @@ def check_login(f):
     return decorated_function
 
 
+# database connection pool settings (can be overridden in config.ini)
+DB_POOL_SIZE = int(params.get("db_pool_size", 5))
+DB_MAX_OVERFLOW = int(params.get("db_max_overflow", 10))
+DB_POOL_RECYCLE = int(params.get("db_pool_recycle", 1800))
+
+# one engine (and one psycopg2 connection) per process, see conn_alchemy and get_connection
+_engine = None
+_engine_pid: int | None = None
+_pg_connection = None
+_pg_connection_pid: int | None = None
+_db_lock = threading.Lock()
+
+
 def get_connection():
-    return psycopg2.connect(
-        user=params["user"],
-        password=params["password"],
-        host=params["host"],
-        # port="5432",
-        database=params["database"],
-    )
+    """
+    returns the psycopg2 connection of the current process.
+    The connection is created at first call and re-created after a fork
+    or if it was closed by the caller
+    """
+    global _pg_connection, _pg_connection_pid
+
+    with _db_lock:
+        if (
+            _pg_connection is None
+            or _pg_connection.closed
+            or _pg_connection_pid != os.getpid()
+        ):
+            _pg_connection = psycopg2.connect(
+                user=params["user"],
+                password=params["password"],
+                host=params["host"],
+                # port="5432",
+                database=params["database"],
+            )
+            _pg_connection_pid = os.getpid()
+
+        elif (
+            _pg_connection.info.transaction_status
+            == psycopg2.extensions.TRANSACTION_STATUS_INERROR
+        ):
+            # a previous caller left the connection in a failed transaction
+            _pg_connection.rollback()
+
+    return _pg_connection
 
 
 def conn_alchemy():
-    return create_engine(
-        f"postgresql+psycopg://{params['user']}@{params['host']}:5432/{params['database']}",
-        isolation_level="AUTOCOMMIT",
-    )
+    """
+    returns the SQLAlchemy engine of the current process.
+    The engine (and its connection pool) is created lazily at first call.
+    After a fork (gunicorn workers) the connections inherited from the parent
+    are discarded and a new engine is created.
+    """
+    global _engine, _engine_pid
+
+    if _engine is not None and _engine_pid == os.getpid():
+        return _engine
+
+    with _db_lock:
+        if _engine is None or _engine_pid != os.getpid():
+            if _engine is not None:
+                # do not close the connections of the parent process
+                _engine.dispose(close=False)
+            _engine = create_engine(
+                f"postgresql+psycopg://{params['user']}@{params['host']}:5432/{params['database']}",
+                isolation_level="AUTOCOMMIT",
+                pool_size=DB_POOL_SIZE,
+                max_overflow=DB_MAX_OVERFLOW,
+                pool_recycle=DB_POOL_RECYCLE,
+                pool_pre_ping=True,
+            )
+            _engine_pid = os.getpid()
+
+    return _engine
+
+
+@contextmanager
+def db_connection():
+    """
+    returns a database connection.
+    Inside a Flask request the same connection is shared by all the blueprints
+    and functions and returned to the pool at the end of the request (see close_db).
+    Outside a request (scripts, background processes) a pooled connection is used.
+
+    usage:
+        with fn.db_connection() as con:
+            con.execute(...)
+    """
+    if has_app_context():
+        if "db_con" not in g:
+            g.db_con = conn_alchemy().connect()
+        yield g.db_con
+    else:
+        with conn_alchemy().connect() as con:
+            yield con
+
+
+def close_db(exception=None) -> None:
+    """
+    return the request-scoped connection to the pool
+    (registered with app.teardown_appcontext)
+    """
+    con = g.pop("db_con", None)
+    if con is not None:
+        con.close()
 
 
 def get_cmap(n, name="viridis"):
@@ -93,7 +251,7 @@ def get_loci_list() -> dict:
         dict:
     """
 
-    with conn_alchemy().connect() as con:
+    with db_connection() as con:
         loci_list: dict = {}
         for row in (
             con.execute(text("SELECT name, n_alleles FROM loci ORDER BY position ASC"))
@@ -117,12 +275,170 @@ def content_type(file_format: str) -> str | None:
     return None
 
 
+# pagination of the lists (see paginate and cached_count)
+# the counts are cached in the tiles cache db and refreshed in background after COUNT_CACHE_TTL seconds
+COUNT_CACHE_TTL = int(params.get("count_cache_ttl", 60))
+
+
+def encode_cursor(row, order_by: tuple) -> str:
+    """
+    returns the cursor (URL-safe string) of the row for the ordering columns
+    """
+    return (
+        base64.urlsafe_b64encode(
+            json.dumps([str(row[column]) for column in order_by]).encode()
+        )
+        .decode()
+        .rstrip("=")
+    )
+
+
+def decode_cursor(cursor: str | None, order_by: tuple) -> list | None:
+    """
+    returns the values of the cursor (None if the cursor is not valid)
+    """
+    if not cursor:
+        return None
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    except (ValueError, binascii.Error):
+        return None
+    if not isinstance(values, list) or len(values) != len(order_by):
+        return None
+    return values
+
+
+def paginate(
+    sql: str,
+    values: dict,
+    order_by: tuple,
+    limit: int | str,
+    offset: int = 0,
+    after: str | None = None,
+    before: str | None = None,
+) -> tuple[list, dict]:
+    """
+    returns one page of the rows of the query.
+
+    The pages are selected by keyset on the ordering columns (natural ID and/or date, NOT NULL columns):
+    the cursor of the next page (after) is the last row of the page,
+    the cursor of the previous page (before) is the first row of the page.
+    Without cursor the page is selected with OFFSET (URLs with an offset only).
+
+    Args:
+        sql (str): query without ORDER BY and LIMIT
+        values (dict): parameters of the query
+        order_by (tuple): ordering columns
+        limit (int | str): number of rows of the page ("ALL" for all rows)
+
+    Returns:
+        list: rows of the page
+        dict: {"previous": cursor or None, "next": cursor or None}
+    """
+
+    columns = ", ".join(order_by)
+    values = dict(values)
+
+    if str(limit).upper() == "ALL":
+        with db_connection() as con:
+            rows = con.execute(
+                text(f"SELECT * FROM ({sql}) AS page ORDER BY {columns}"), values
+            ).mappings().all()
+        return rows, {"previous": None, "next": None}
+
+    keys = ", ".join(f":cursor{idx}" for idx in range(len(order_by)))
+    after_values = decode_cursor(after, order_by)
+    before_values = decode_cursor(before, order_by)
+
+    if after_values is not None:
+        values.update({f"cursor{idx}": x for idx, x in enumerate(after_values)})
+        page_sql = (
+            f"SELECT * FROM ({sql}) AS page WHERE ({columns}) > ({keys}) "
+            f"ORDER BY {columns} LIMIT {int(limit) + 1}"
+        )
+    elif before_values is not None:
+        values.update({f"cursor{idx}": x for idx, x in enumerate(before_values)})
+        page_sql = (
+            f"SELECT * FROM ({sql}) AS page WHERE ({columns}) < ({keys}) "
+            f"ORDER BY {', '.join(f'{column} DESC' for column in order_by)} LIMIT {int(limit) + 1}"
+        )
+    else:
+        page_sql = (
+            f"SELECT * FROM ({sql}) AS page "
+            f"ORDER BY {columns} LIMIT {int(limit) + 1} OFFSET {max(0, int(offset))}"
+        )
+
+    with db_connection() as con:
+        rows = list(con.execute(text(page_sql), values).mappings().all())
+
+    # one more row is fetched to know if there is a page after (or before)
+    has_more = len(rows) > int(limit)
+    rows = rows[: int(limit)]
+    if before_values is not None:
+        rows.reverse()
+        has_previous, has_next = has_more, True
+    else:
+        has_previous = after_values is not None or int(offset) > 0
+        has_next = has_more
+
+    return rows, {
+        "previous": encode_cursor(rows[0], order_by) if rows and has_previous else None,
+        "next": encode_cursor(rows[-1], order_by) if rows and has_next else None,
+    }
+
+
+def _count(key: str, sql: str, values: dict) -> int:
+    """
+    count the rows of the query and cache the result (see cached_count)
+    """
+    with db_connection() as con:
+        n_rows = con.execute(text(f"SELECT count(*) FROM ({sql}) AS q"), values).scalar()
+    try:
+        rtiles.set(key, json.dumps([n_rows, time.time()]), ex=COUNT_CACHE_TTL * 60)
+        rtiles.delete(f"{key}:refresh")
+    except redis.exceptions.ConnectionError:
+        pass
+    return n_rows
+
+
+def cached_count(sql: str, values: dict) -> int:
+    """
+    returns the number of rows of the query.
+    The count is cached in redis: an expired count (older than COUNT_CACHE_TTL) is returned
+    and refreshed in a background thread
+    """
+    key = "count:" + hashlib.sha1(
+        json.dumps([sql, values], sort_keys=True, default=str).encode()
+    ).hexdigest()
+
+    try:
+        cached = rtiles.get(key)
+    except redis.exceptions.ConnectionError:
+        cached = None
+
+    if cached is None:
+        return _count(key, sql, values)
+
+    n_rows, timestamp = json.loads(cached)
+    try:
+        if time.time() - timestamp > COUNT_CACHE_TTL and rtiles.set(
+            f"{key}:refresh", 1, nx=True, ex=COUNT_CACHE_TTL
+        ):
+            # the thread uses its own connection (no application context)
+            threading.Thread(
+                target=_count, args=(key, sql, dict(values)), daemon=True
+            ).start()
+    except redis.exceptions.ConnectionError:
+        pass
+    return n_rows
+
+
 def get_allele_modifier(email: str) -> bool:
     """
     check if current user can modify allele value (allele modifier)
     """
 
-    with conn_alchemy().connect() as con:
+    with db_connection() as con:
         return (
             con.execute(
                 text("SELECT allele_modifier FROM users WHERE email = :email"),
@@ -140,25 +456,7 @@ def get_wa_loci_values_redis(wa_code: str) -> dict | None:
     if not found in loci_values table use get_wa_loci_values function
     """
 
-    r = rdis.get(wa_code)
-    if r is not None:
-        return json.loads(r)
-    else:  # try from loci_values table
-        with conn_alchemy().connect() as con:
-            wa_loci = (
-                con.execute(
-                    text(
-                        "SELECT loci_values FROM wa_loci_values WHERE wa_code = :wa_code"
-                    ),
-                    {"wa_code": wa_code},
-                )
-                .mappings()
-                .fetchone()
-            )
-        if wa_loci is not None:
-            return wa_loci
-        else:
-            return get_wa_loci_values(wa_code, get_loci_list())[0]
+    return get_wa_loci_values_bulk([wa_code]).get(wa_code)
 
 
 def get_wa_loci_values(wa_code: str, loci_list: dict) -> tuple[dict, bool]:
@@ -169,21 +467,44 @@ def get_wa_loci_values(wa_code: str, loci_list: dict) -> tuple[dict, bool]:
         value, notes, has_history, epoch, user_id, date, definitive
       }
     """
+    return get_wa_loci_values_multi([wa_code], loci_list)[wa_code]
+
+
+def get_wa_loci_values_multi(wa_codes: list, loci_list: dict) -> dict:
+    """
+    get loci values of many WA codes with one query (see get_wa_loci_values)
+
+    Return:
+      dict: {wa_code: (loci_values, has_loci_notes)}
+    """
     # prepare required tuple (locus, allele)
     requested: list = []
     for locus, n_alleles in loci_list.items():
         for allele in ("a", "b")[:n_alleles]:
             requested.append((locus, allele))
 
-    loci_values: dict = {locus: {} for locus in loci_list}
-    has_loci_notes = False
+    # init default (anche per coppie senza righe nel DB)
+    out: dict = {}
+    for wa_code in wa_codes:
+        loci_values: dict = {locus: {} for locus in loci_list}
+        for locus, allele in requested:
+            loci_values[locus][allele] = {
+                "value": "-",
+                "notes": "",
+                "has_history": False,
+                "epoch": "",
+                "user_id": "",
+                "date": "",
+                "definitive": False,
+            }
+        out[wa_code] = (loci_values, False)
 
-    if not requested:
-        return loci_values, False
+    if not requested or not wa_codes:
+        return out
 
     #
     values_sql = ", ".join(f"(:locus{i}, :allele{i})" for i in range(len(requested)))
-    params = {"wa_code": wa_code}
+    params = {"wa_codes": list(wa_codes)}
     for i, (locus, allele) in enumerate(requested):
         params[f"locus{i}"] = locus
         params[f"allele{i}"] = allele
@@ -193,7 +514,8 @@ def get_wa_loci_values(wa_code: str, loci_list: dict) -> tuple[dict, bool]:
             VALUES {values_sql}
         ),
         latest AS (
-            SELECT DISTINCT ON (wl.locus, wl.allele)
+            SELECT DISTINCT ON (wl.wa_code, wl.locus, wl.allele)
+                wl.wa_code,
                 wl.locus,
                 wl.allele,
                 wl.val,
@@ -204,21 +526,22 @@ def get_wa_loci_values(wa_code: str, loci_list: dict) -> tuple[dict, bool]:
             FROM wa_locus wl
             JOIN req r
               ON r.locus = wl.locus AND r.allele = wl.allele
-            WHERE wl.wa_code = :wa_code
-            ORDER BY wl.locus, wl.allele, wl."timestamp" DESC
+            WHERE wl.wa_code = ANY(:wa_codes)
+            ORDER BY wl.wa_code, wl.locus, wl.allele, wl."timestamp" DESC
         ),
         hist AS (
-            SELECT h.locus, h.allele, TRUE AS has_history
+            SELECT h.wa_code, h.locus, h.allele, TRUE AS has_history
             FROM wa_locus h
             JOIN req r
               ON r.locus = h.locus AND r.allele = h.allele
-            WHERE h.wa_code = :wa_code
+            WHERE h.wa_code = ANY(:wa_codes)
               AND h.user_id IS NOT NULL
-            GROUP BY h.locus, h.allele
+            GROUP BY h.wa_code, h.locus, h.allele
         )
         SELECT
-            r.locus,
-            r.allele,
+            l.wa_code,
+            l.locus,
+            l.allele,
             l.val,
             l.notes,
             extract(epoch from l."timestamp")::integer AS epoch,
@@ -226,35 +549,20 @@ def get_wa_loci_values(wa_code: str, loci_list: dict) -> tuple[dict, bool]:
             l.definitive,
             to_char(l."timestamp", 'YYYY-MM-DD HH24:MI:SS') AS formatted_timestamp,
             COALESCE(h.has_history, FALSE) AS has_history
-        FROM req r
-        LEFT JOIN latest l ON l.locus = r.locus AND l.allele = r.allele
-        LEFT JOIN hist   h ON h.locus = r.locus AND h.allele = r.allele
+        FROM latest l
+        LEFT JOIN hist h
+          ON h.wa_code = l.wa_code AND h.locus = l.locus AND h.allele = l.allele
     """)
 
-    with conn_alchemy().connect() as con:
+    with db_connection() as con:
         rows = con.execute(sql, params).mappings().all()
 
-    # init default (anche per coppie senza righe nel DB)
-    for locus, n_alleles in loci_list.items():
-        for allele in ("a", "b")[:n_alleles]:
-            loci_values[locus][allele] = {
-                "value": "-",
-                "notes": "",
-                "has_history": False,
-                "epoch": "",
-                "user_id": "",
-                "date": "",
-                "definitive": False,
-            }
-
     for row in rows:
-        locus = row["locus"]
-        allele = row["allele"]
+        loci_values, has_loci_notes = out[row["wa_code"]]
 
         has_history = bool(row["has_history"])
-        has_loci_notes = has_loci_notes or has_history
 
-        loci_values[locus][allele] = {
+        loci_values[row["locus"]][row["allele"]] = {
             "value": row["val"] if row["val"] is not None else "-",
             "notes": row["notes"] if row["notes"] is not None else "",
             "has_history": has_history,
@@ -267,8 +575,68 @@ def get_wa_loci_values(wa_code: str, loci_list: dict) -> tuple[dict, bool]:
             if row["definitive"] is not None
             else False,
         }
+        out[row["wa_code"]] = (loci_values, has_loci_notes or has_history)
+
+    return out
+
+
+def get_wa_loci_values_bulk(wa_codes: list) -> dict:
+    """
+    get loci values of many WA codes
+    with one pipelined MGET on redis.
+    The WA codes not found in redis are retrieved with one query on the wa_loci_values table,
+    the remaining ones with get_wa_loci_values_multi.
+    The values not found in redis are written back in redis in one pipeline.
+
+    Return:
+      dict: {wa_code: loci_values}
+    """
+
+    wa_codes = list(dict.fromkeys(x for x in wa_codes if x is not None))
+    if not wa_codes:
+        return {}
 
-    return loci_values, has_loci_notes
+    out: dict = {}
+    redis_ok = True
+    try:
+        for wa_code, r in zip(wa_codes, rdis.mget(wa_codes)):
+            if r is not None:
+                out[wa_code] = json.loads(r)
+    except redis.exceptions.ConnectionError:
+        redis_ok = False
+
+    missing: list = [x for x in wa_codes if x not in out]
+    if not missing:
+        return out
+
+    # try from loci_values table
+    with db_connection() as con:
+        for row in con.execute(
+            text(
+                "SELECT wa_code, loci_values FROM wa_loci_values WHERE wa_code = ANY(:wa_codes)"
+            ),
+            {"wa_codes": missing},
+        ).mappings():
+            out[row["wa_code"]] = row["loci_values"]
+
+    not_in_table: list = [x for x in missing if x not in out]
+    if not_in_table:
+        for wa_code, (loci_values, _) in get_wa_loci_values_multi(
+            not_in_table, get_loci_list()
+        ).items():
+            out[wa_code] = loci_values
+
+    # write back in redis
+    if redis_ok:
+        try:
+            with rdis.pipeline(transaction=False) as pipe:
+                for wa_code in missing:
+                    pipe.set(wa_code, json.dumps(out[wa_code]))
+                pipe.execute()
+        except redis.exceptions.ConnectionError:
+            pass
+
+    return out
 
 
 def get_genotype_loci_values_redis(genotype_id: str | None) -> dict | None:
@@ -277,14 +645,51 @@ def get_genotype_loci_values_redis(genotype_id: str | None) -> dict | None:
     """
     if genotype_id is None:
         return None
+
+    return get_genotype_loci_values_bulk([genotype_id]).get(genotype_id)
+
+
+def get_genotype_loci_values_bulk(genotype_ids: list) -> dict:
+    """
+    get loci values of many genotypes
+    with one pipelined MGET on redis.
+    The genotypes not found in redis are retrieved from the PostgreSQL db
+    and written back in redis in one pipeline.
+
+    Return:
+      dict: {genotype_id: loci_values}
+    """
+
+    genotype_ids = list(dict.fromkeys(x for x in genotype_ids if x is not None))
+    if not genotype_ids:
+        return {}
+
+    out: dict = {}
+    redis_ok = True
     try:
-        r = rdis.get(genotype_id)
-        if r is not None:
-            return json.loads(r)
-        else:
-            return get_genotype_loci_values(genotype_id, get_loci_list())
+        for genotype_id, r in zip(genotype_ids, rdis.mget(genotype_ids)):
+            if r is not None:
+                out[genotype_id] = json.loads(r)
     except redis.exceptions.ConnectionError:
-        return get_genotype_loci_values(genotype_id, get_loci_list())
+        redis_ok = False
+
+    missing: list = [x for x in genotype_ids if x not in out]
+    if not missing:
+        return out
+
+    out.update(get_genotypes_loci_values_multi(missing, get_loci_list()))
+
+    # write back in redis
+    if redis_ok:
+        try:
+            with rdis.pipeline(transaction=False) as pipe:
+                for genotype_id in missing:
+                    pipe.set(genotype_id, json.dumps(out[genotype_id]))
+                pipe.execute()
+        except redis.exceptions.ConnectionError:
+            pass
+
+    return out
 
 
 def get_genotype_loci_values(genotype_id: str, loci_list: list) -> dict:
@@ -292,80 +697,103 @@ def get_genotype_loci_values(genotype_id: str, loci_list: list) -> dict:
     get genotype loci values from postgresql db
     """
 
-    loci_values: dict = {}
+    return get_genotypes_loci_values_multi([genotype_id], loci_list)[genotype_id]
 
-    with conn_alchemy().connect() as con:
-        for locus in loci_list:
-            loci_values[locus] = {}
 
-            for allele in ("a", "b")[: loci_list[locus]]:
-                locus_val = (
-                    con.execute(
-                        text(
-                            (
-                                "SELECT val, notes, validated, user_id, extract(epoch from timestamp)::integer AS epoch, "
-                                "(SELECT COUNT(*) FROM genotype_locus "
-                                "WHERE genotype_id=gl.genotype_id "
-                                "      AND locus=gl.locus "
-                                "      AND allele=gl.allele "
-                                "      AND user_id IS NOT NULL) AS has_history "
-                                # "(SELECT notes FROM genotype_locus "
-                                # "WHERE genotype_id=gl.genotype_id "
-                                # "      AND locus=gl.locus "
-                                # "      AND allele=gl.allele "
-                                # "      AND notes != '' "
-                                # "      AND notes IS NOT NULL "
-                                # "      ORDER BY timestamp DESC LIMIT 1) AS last_note "  # last note
-                                "FROM genotype_locus gl "
-                                "WHERE genotype_id = :genotype_id AND locus = :locus AND allele = :allele "
-                                "ORDER BY timestamp DESC LIMIT 1"
-                            )
-                        ),
-                        {"allele": allele, "genotype_id": genotype_id, "locus": locus},
-                    )
-                    .mappings()
-                    .fetchone()
-                )
+def get_genotypes_loci_values_multi(genotype_ids: list, loci_list: dict) -> dict:
+    """
+    get loci values of many genotypes from postgresql db with one query
 
-                # if genotype_id == "BI-18" and locus == "SRY":
-                #    print(f"{locus_val=}")
-                #    print(f"{locus_val["val"] is None=}")
-
-                if locus_val is None:
-                    val: str = "-"
-                    notes: str = ""
-                    has_history: int = 0
-                    validated: bool = False
-                    user_id: str = ""
-                    epoch: str = ""
-
-                else:
-                    val = locus_val["val"] if locus_val["val"] is not None else "-"
-                    notes = locus_val["notes"] if locus_val["notes"] is not None else ""
-                    has_history = locus_val["has_history"]
-                    validated = (
-                        locus_val["validated"]
-                        if locus_val["validated"] is not None
-                        else ""
-                    )
-                    user_id = (
-                        locus_val["user_id"] if locus_val["user_id"] is not None else ""
-                    )
-                    epoch = locus_val["epoch"] if locus_val["epoch"] is not None else ""
-
-                loci_values[locus][allele] = {
-                    "value": val,
-                    "notes": notes,
-                    "has_history": has_history,
-                    "validated": validated,
-                    "user_id": user_id,
-                    "epoch": epoch,
+    Return:
+      dict: {genotype_id: loci_values}
+      loci_values[locus][allele] = {
+        value, notes, has_history, validated, user_id, epoch
+      }
+    """
+
+    # init default
+    out: dict = {}
+    for genotype_id in genotype_ids:
+        out[genotype_id] = {}
+        for locus in loci_list:
+            out[genotype_id][locus] = {}
+            for allele in ("a", "b")[: loci_list[locus]]:
+                out[genotype_id][locus][allele] = {
+                    "value": "-",
+                    "notes": "",
+                    "has_history": 0,
+                    "validated": False,
+                    "user_id": "",
+                    "epoch": "",
                 }
 
-    # if genotype_id == "BI-18":
-    #    print(f"{loci_values=}")
+    if not genotype_ids or not loci_list:
+        return out
+
+    sql = text("""
+        WITH latest AS (
+            SELECT DISTINCT ON (gl.genotype_id, gl.locus, gl.allele)
+                gl.genotype_id,
+                gl.locus,
+                gl.allele,
+                gl.val,
+                gl.notes,
+                gl.validated,
+                gl.user_id,
+                gl."timestamp"
+            FROM genotype_locus gl
+            WHERE gl.genotype_id = ANY(:genotype_ids)
+              AND gl.locus = ANY(:loci)
+            ORDER BY gl.genotype_id, gl.locus, gl.allele, gl."timestamp" DESC
+        ),
+        hist AS (
+            SELECT h.genotype_id, h.locus, h.allele, COUNT(*) AS has_history
+            FROM genotype_locus h
+            WHERE h.genotype_id = ANY(:genotype_ids)
+              AND h.locus = ANY(:loci)
+              AND h.user_id IS NOT NULL
+            GROUP BY h.genotype_id, h.locus, h.allele
+        )
+        SELECT
+            l.genotype_id,
+            l.locus,
+            l.allele,
+            l.val,
+            l.notes,
+            l.validated,
+            l.user_id,
+            extract(epoch from l."timestamp")::integer AS epoch,
+            COALESCE(h.has_history, 0) AS has_history
+        FROM latest l
+        LEFT JOIN hist h
+          ON h.genotype_id = l.genotype_id AND h.locus = l.locus AND h.allele = l.allele
+    """)
 
-    return loci_values
+    with db_connection() as con:
+        rows = (
+            con.execute(
+                sql, {"genotype_ids": list(genotype_ids), "loci": list(loci_list)}
+            )
+            .mappings()
+            .all()
+        )
+
+    for row in rows:
+        loci_values = out[row["genotype_id"]]
+        # skip alleles not in loci list (e.g. 'b' allele of single allele locus)
+        if row["allele"] not in loci_values[row["locus"]]:
+            continue
+
+        loci_values[row["locus"]][row["allele"]] = {
+            "value": row["val"] if row["val"] is not None else "-",
+            "notes": row["notes"] if row["notes"] is not None else "",
+            "has_history": row["has_history"],
+            "validated": row["validated"] if row["validated"] is not None else "",
+            "user_id": row["user_id"] if row["user_id"] is not None else "",
+            "epoch": row["epoch"] if row["epoch"] is not None else "",
+        }
+
+    return out
 
 
 def alert_danger(text: str) -> str:
@@ -394,7 +822,7 @@ def all_transect_id() -> list:
     """
     returns a list of all transect_id in the transects table
     """
-    with conn_alchemy().connect() as con:
+    with db_connection() as con:
         return [
             x["transect_id"].strip()
             for x in con.execute(
@@ -409,7 +837,7 @@ def all_path_id() -> list:
     """
     return all path ID (transect ID and date)
     """
-    with conn_alchemy().connect() as con:
+    with db_connection() as con:
         return [
             x["transect_date"].strip()
             for x in con.execute(
@@ -426,7 +854,7 @@ def all_snow_tracks_id() -> list:
     """
     returns a list of all snowtrack_id in the snow_tracks table
     """
-    with conn_alchemy().connect() as con:
+    with db_connection() as con:
         return [
             x["snowtrack_id"].strip()
             for x in con.execute(
@@ -459,7 +887,7 @@ def province_code_list() -> list:
     return list of upper case province code
     (using geo_info table)
     """
-    with conn_alchemy().connect() as con:
+    with db_connection() as con:
         return [
             row["province_code"]
             for row in con.execute(
@@ -476,7 +904,7 @@ def check_province_code(province_code) -> str | None:
     Returns province code or None if not found
     using geo_info table
     """
-    with conn_alchemy().connect() as con:
+    with db_connection() as con:
         result = (
             con.execute(
                 text(
@@ -494,7 +922,7 @@ def prov_code2prov_name(province_code: str) -> str | None:
     """
     returns the province name for the province code provided (None if not found)
     """
-    with conn_alchemy().connect() as con:
+    with db_connection() as con:
         result = (
             con.execute(
                 text(
@@ -510,7 +938,7 @@ def prov_code2prov_name(province_code: str) -> str | None:
 
 
 def province_code2region_dict() -> dict:
-    with conn_alchemy().connect() as con:
+    with db_connection() as con:
         return dict(
             [
                 (row["province_code"].upper(), row["region"])
@@ -530,7 +958,7 @@ def province_code2region(province_code):
     if province_code is None:
         return None
 
-    with conn_alchemy().connect() as con:
+    with db_connection() as con:
         result = (
             con.execute(
                 text(
@@ -550,7 +978,7 @@ def province_name_list() -> list:
     return list of upper case province name
     (using geo_info table)
     """
-    with conn_alchemy().connect() as con:
+    with db_connection() as con:
         return [
             row["province_name"].upper()
             for row in con.execute(text("SELECT province_name FROM geo_info"))
@@ -564,7 +992,7 @@ def province_name2code(province_name: str) -> str | None:
     returns province code from province name
     using geo_info table
     """
-    with conn_alchemy().connect() as con:
+    with db_connection() as con:
         result = (
             con.execute(
                 text(
@@ -584,7 +1012,7 @@ def province_name2code_dict() -> dict:
     returns dict of upper case province code for upper case province name
     (using geo_info table)
     """
-    with conn_alchemy().connect() as con:
+    with db_connection() as con:
         return dict(
             [
                 (row["province_name"], row["province_code"])
@@ -604,7 +1032,7 @@ def province_name2region(province_name) -> str:
     get region by province name
     """
 
-    with conn_alchemy().connect() as con:
+    with db_connection() as con:
         result = (
             con.execute(
                 text(
@@ -633,7 +1061,7 @@ def prov_name2prov_code(province_name) -> str:
     get province code (sigla)  by province name
     """
 
-    with conn_alchemy().connect() as con:
+    with db_connection() as con:
         result = (
             con.execute(
                 text(
@@ -648,9 +1076,13 @@ def prov_name2prov_code(province_name) -> str:
     return result["province_code"] if result is not None else ""
 
 
-def reverse_geocoding(lon_lat: list) -> dict | None:
+def reverse_geocoding(lon_lat: list, raise_errors: bool = False) -> dict | None:
     """
     get place from GPS coordinates with nominatum (OSM)
+    (used by geocoding.py for the points outside the comuni layer)
+
+    Returns None if no address is found.
+    The request errors (HTTP, URL, timeout) are raised if raise_errors is True, otherwise None is returned.
     """
 
     longitude, latitude = lon_lat
@@ -933,6 +1365,8 @@ def reverse_geocoding(lon_lat: list) -> dict | None:
             "utf-8"
         )
     except (urllib.error.HTTPError, urllib.error.URLError, TimeoutError):
+        if raise_errors:
+            raise
         return None
 
     d = json.loads(response)
@@ -1012,6 +1446,15 @@ def reverse_geocoding(lon_lat: list) -> dict | None:
     }
 
 
+def to_json(obj) -> str:
+    """
+    serialize obj in compact JSON (with orjson if available) for the Leaflet templates
+    """
+    if orjson is not None:
+        return orjson.dumps(obj, default=str).decode()
+    return json.dumps(obj, separators=(",", ":"), default=str)
+
+
 def leaflet_geojson(
     data: dict, add_polygon: bool = False, samples: str = "genotypes"
 ) -> str:
@@ -1030,233 +1473,21 @@ def leaflet_geojson(
     DEAD_WOLVES_COLOR_DEFAULT = params["dead_wolf_color"]
     CENTER_DEFAULT = "45, 7"
 
-    map = Template(
-        """
-<link rel="stylesheet" href="https://unpkg.com/leaflet@1.9.4/dist/leaflet.css"
-     integrity="sha256-p4NxAoJBhIIN+hmNHrzRCf9tD/miZyoHS5obTRR9BMY="
-     crossorigin=""/>
-
-
-<script src="https://unpkg.com/leaflet@1.9.4/dist/leaflet.js"
-     integrity="sha256-20nQCchB9co0qIjJZRGuk2/Z9VM+kNiyxNV1lvTlZBo="
-     crossorigin="">
-</script>
-
-{% if add_polygon %}
-<link rel="stylesheet" href="https://cdnjs.cloudflare.com/ajax/libs/leaflet.draw/1.0.4/leaflet.draw.css" />
-<script src="https://cdnjs.cloudflare.com/ajax/libs/leaflet.draw/1.0.4/leaflet.draw.js"></script>
-{% endif %}
-
-<script>
-var transects = {
-    "type": "FeatureCollection",
-    "features": {{ transects}}
-};
-
-var tracks = {
-    "type": "FeatureCollection",
-    "features": {{ tracks}}
-};
-
-var scats = {
-    "type": "FeatureCollection",
-    "features": {{ scats }}
-};
-
-var dead_wolves = {
-    "type": "FeatureCollection",
-    "features": {{ dead_wolves }}
-};
-
-var Esri_WorldImagery = L.tileLayer('https://server.arcgisonline.com/ArcGIS/rest/services/World_Imagery/MapServer/tile/{z}/{y}/{x}', {
-	attribution: 'Tiles &copy; Esri &mdash; Source: Esri, i-cubed, USDA, USGS, AEX, GeoEye, Getmapping, Aerogrid, IGN, IGP, UPR-EGP, and the GIS User Community'
-});
-
-var Stadia_AlidadeSatellite = L.tileLayer('https://tiles.stadiamaps.com/tiles/alidade_satellite/{z}/{x}/{y}{r}.{ext}', {
-	minZoom: 0,
-	maxZoom: 20,
-	attribution: '&copy; CNES, Distribution Airbus DS, © Airbus DS, © PlanetObserver (Contains Copernicus Data) | &copy; <a href="https://www.stadiamaps.com/" target="_blank">Stadia Maps</a> &copy; <a href="https://openmaptiles.org/" target="_blank">OpenMapTiles</a> &copy; <a href="https://www.openstreetmap.org/copyright">OpenStreetMap</a> contributors',
-	ext: 'jpg'
-});
-
-var osm = L.tileLayer('http://{s}.tile.osm.org/{z}/{x}/{y}.png', {
-    attribution: '&copy; <a href="http://osm.org/copyright">OpenStreetMap</a> contributors'})
-
-var opentopomap = L.tileLayer('https://a.tile.opentopomap.org/{z}/{x}/{y}.png', {
-	attribution: 'Map data: &copy; <a href="https://www.openstreetmap.org/copyright">OpenStreetMap</a> contributors, <a href="http://viewfinderpanoramas.org">SRTM</a> | Map style: &copy; <a href="https://opentopomap.org">OpenTopoMap</a> (<a href="https://creativecommons.org/licenses/by-sa/3.0/">CC-BY-SA</a>)'
-})
-
-var map = L.map('map', {center: [{{ center }}], zoom: {{ zoom }}, layers: [Esri_WorldImagery, Stadia_AlidadeSatellite, osm, opentopomap]});
-
-var baseMaps = {
-    "ESRI World Imagery": Esri_WorldImagery,
-    "Stadia map": Stadia_AlidadeSatellite,
-    "OpenStreetMap": osm,
-    "OpenTopoMap": opentopomap,
-};
-
-var layerControl = L.control.layers(baseMaps).addTo(map);
-
-function onEachFeature(feature, layer) {
-    var popupContent = "";
-    if (feature.properties && feature.properties.popupContent) {
-        popupContent += feature.properties.popupContent;
-    }
-    layer.bindPopup(popupContent);
-}
-
-L.geoJSON([dead_wolves], {
-
-    style: function (feature) { return feature.properties && feature.properties.style; },
-
-    onEachFeature: onEachFeature,
-
-    pointToLayer: function (feature, latlng) {
-        return L.circleMarker(latlng, {
-            color: '{{ dead_wolves_color }}',
-            fillcolor: '{{ dead_wolves_color }}',
-            radius: 8,
-            weight: 1,
-            opacity: 1,
-            fillOpacity: 1
-        });
-    }
-}).addTo(map);
-
-
-
-L.geoJSON(transects, {
-    style: function(feature) { return { color: '{{ transects_color }}' } },
-    onEachFeature: onEachFeature,
-}).addTo(map);
-
-
-L.geoJSON(tracks, {
-    style: function(feature) { return { color: '{{ tracks_color }}' } },
-    onEachFeature: onEachFeature,
-}).addTo(map);
-
-
-L.geoJSON([scats], {
-    style: function (feature) { return feature.properties && feature.properties.style; },
-    onEachFeature: onEachFeature,
-    pointToLayer: function (feature, latlng) {
-        return L.circleMarker(latlng, {
-            color: '{{ scats_color }}',
-            fillcolor: '{{ scats_color }}',
-            radius: 8,
-            weight: 1,
-            opacity: 1,
-            fillOpacity: 1,
-        });
-    }
-}).addTo(map);
-
-
- // Creating scale control
-var scale = L.control.scale();
-scale.addTo(map);
-
-var markerBounds = L.latLngBounds([{{ fit }}]);
-map.fitBounds(markerBounds);
-
-
-{% if add_polygon %}
-// Initialise draw tools
-var drawnItems = new L.FeatureGroup();
-map.addLayer(drawnItems);
-
-var drawControl = new L.Control.Draw({
-    edit: {
-        featureGroup: drawnItems
-    },
-    draw: {
-        polygon: true,
-        polyline: false,
-        rectangle: false,
-        circle: false,
-        marker: false,
-        circlemarker: false,
-        edit: false,
-
-    }
-});
-map.addControl(drawControl);
-
-// event triggered when user finish a draw
-map.on('draw:created', function (event) {
-    var layer = event.layer;
-    drawnItems.addLayer(layer);
-
-    var coords = layer.getLatLngs()[0].map(function(latlng) {
-        return [latlng.lng, latlng.lat];
-    });
-
-    // send coordinates via POST AJAX
-
-{% if samples == 'genotypes' %}
-    fetch('/select_on_map/genotypes',
-{% endif %}
-{% if samples == 'wa' %}
-    fetch('/select_on_map/wa',
-{% endif %}
-
-         {
-        method: 'POST',
-        headers: {
-            'Content-Type': 'application/json'
-        },
-        body: JSON.stringify({ coordinates: coords })
-    })
-    .then(response => response.json())
-    .then(data => {
-        if (data['status'] == 'error')
-            {
-            alert(data['message']);
-            console.log('server Response:', data);
-            drawnItems.clearLayers();
-            }
-        else
-            {
-{% if samples == 'genotypes' %}
-            window.location.href = "/wa_analysis_group/" + data['message'] + "/web";
-{% endif %}
-{% if samples == 'wa' %}
-            window.location.href = "/view_wa_polygon/" + data['message'] + "/web";
-{% endif %}
-
-            };
-
-
-    })
-    .catch(error => {
-        console.error('Error:', error);
-    });
-});
-{% endif %}
-
-</script>
-"""
-    )
-
-    return map.render(
-        {
-            "transects": data.get("transects", []),
-            "transects_color": data.get("transects_color", TRANSECTS_COLOR_DEFAULT),
-            "tracks": data.get("tracks", []),
-            "tracks_color": data.get("tracks_color", TRACKS_COLOR_DEFAULT),
-            "scats": data.get("scats", []),
-            "scats_color": data.get("scats_color", SCATS_COLOR_DEFAULT),
-            "dead_wolves": data.get("dead_wolves", []),
-            "dead_wolves_color": data.get(
-                "dead_wolves_color", DEAD_WOLVES_COLOR_DEFAULT
-            ),
-            "center": data.get("center", CENTER_DEFAULT),
-            "zoom": data.get("zoom", 13),
-            "fit": data.get("fit", ""),
-            "add_polygon": add_polygon,
-            "samples": samples,
-        }
+    return render_template(
+        "leaflet_geojson.html",
+        transects=to_json(data.get("transects", [])),
+        transects_color=data.get("transects_color", TRANSECTS_COLOR_DEFAULT),
+        tracks=to_json(data.get("tracks", [])),
+        tracks_color=data.get("tracks_color", TRACKS_COLOR_DEFAULT),
+        scats=to_json(data.get("scats", [])),
+        scats_color=data.get("scats_color", SCATS_COLOR_DEFAULT),
+        dead_wolves=to_json(data.get("dead_wolves", [])),
+        dead_wolves_color=data.get("dead_wolves_color", DEAD_WOLVES_COLOR_DEFAULT),
+        center=data.get("center", CENTER_DEFAULT),
+        zoom=data.get("zoom", 13),
+        fit=data.get("fit", ""),
+        add_polygon=add_polygon,
+        samples=samples,
     )
 
 
@@ -1278,268 +1509,22 @@ def leaflet_geojson_label(
     DEAD_WOLVES_COLOR_DEFAULT = params["dead_wolf_color"]
     CENTER_DEFAULT = "45, 7"
 
-    map = Template(
-        """
-<link rel="stylesheet" href="https://unpkg.com/leaflet@1.9.4/dist/leaflet.css"
-     integrity="sha256-p4NxAoJBhIIN+hmNHrzRCf9tD/miZyoHS5obTRR9BMY="
-     crossorigin=""/>
-
-
-<script src="https://unpkg.com/leaflet@1.9.4/dist/leaflet.js"
-     integrity="sha256-20nQCchB9co0qIjJZRGuk2/Z9VM+kNiyxNV1lvTlZBo="
-     crossorigin="">
-</script>
-
-{% if add_polygon %}
-<link rel="stylesheet" href="https://cdnjs.cloudflare.com/ajax/libs/leaflet.draw/1.0.4/leaflet.draw.css" />
-<script src="https://cdnjs.cloudflare.com/ajax/libs/leaflet.draw/1.0.4/leaflet.draw.js"></script>
-{% endif %}
-
-<script>
-var transects = {
-    "type": "FeatureCollection",
-    "features": {{ transects}}
-};
-
-var tracks = {
-    "type": "FeatureCollection",
-    "features": {{ tracks}}
-};
-
-var scats = {
-    "type": "FeatureCollection",
-    "features": {{ scats }}
-};
-
-var scat_markers = {{ scat_markers }};
-
-var dead_wolves = {
-    "type": "FeatureCollection",
-    "features": {{ dead_wolves }}
-};
-
-var Esri_WorldImagery = L.tileLayer('https://server.arcgisonline.com/ArcGIS/rest/services/World_Imagery/MapServer/tile/{z}/{y}/{x}', {
-	attribution: 'Tiles &copy; Esri &mdash; Source: Esri, i-cubed, USDA, USGS, AEX, GeoEye, Getmapping, Aerogrid, IGN, IGP, UPR-EGP, and the GIS User Community'
-});
-
-var Stadia_AlidadeSatellite = L.tileLayer('https://tiles.stadiamaps.com/tiles/alidade_satellite/{z}/{x}/{y}{r}.{ext}', {
-	minZoom: 0,
-	maxZoom: 20,
-	attribution: '&copy; CNES, Distribution Airbus DS, © Airbus DS, © PlanetObserver (Contains Copernicus Data) | &copy; <a href="https://www.stadiamaps.com/" target="_blank">Stadia Maps</a> &copy; <a href="https://openmaptiles.org/" target="_blank">OpenMapTiles</a> &copy; <a href="https://www.openstreetmap.org/copyright">OpenStreetMap</a> contributors',
-	ext: 'jpg'
-});
-
-var osm = L.tileLayer('http://{s}.tile.osm.org/{z}/{x}/{y}.png', {
-    attribution: '&copy; <a href="http://osm.org/copyright">OpenStreetMap</a> contributors'})
-
-var opentopomap = L.tileLayer('https://a.tile.opentopomap.org/{z}/{x}/{y}.png', {
-	attribution: 'Map data: &copy; <a href="https://www.openstreetmap.org/copyright">OpenStreetMap</a> contributors, <a href="http://viewfinderpanoramas.org">SRTM</a> | Map style: &copy; <a href="https://opentopomap.org">OpenTopoMap</a> (<a href="https://creativecommons.org/licenses/by-sa/3.0/">CC-BY-SA</a>)'
-})
-
-var map = L.map('map', {center: [{{ center }}], zoom: {{ zoom }}, layers: [Esri_WorldImagery, Stadia_AlidadeSatellite, osm, opentopomap]});
-
-var baseMaps = {
-    "ESRI World Imagery": Esri_WorldImagery,
-    "Stadia map": Stadia_AlidadeSatellite,
-    "OpenStreetMap": osm,
-    "OpenTopoMap": opentopomap,
-};
-
-var layerControl = L.control.layers(baseMaps).addTo(map);
-
-function onEachFeature(feature, layer) {
-    var popupContent = "";
-    if (feature.properties && feature.properties.popupContent) {
-        popupContent += feature.properties.popupContent;
-    }
-    layer.bindPopup(popupContent);
-}
-
-L.geoJSON([dead_wolves], {
-
-    style: function (feature) { return feature.properties && feature.properties.style; },
-
-    onEachFeature: onEachFeature,
-
-    pointToLayer: function (feature, latlng) {
-        return L.circleMarker(latlng, {
-            color: '{{ dead_wolves_color }}',
-            fillcolor: '{{ dead_wolves_color }}',
-            radius: 8,
-            weight: 1,
-            opacity: 1,
-            fillOpacity: 1
-        });
-    }
-}).addTo(map);
-
-
-
-L.geoJSON(transects, {
-    style: function(feature) { return { color: '{{ transects_color }}' } },
-    onEachFeature: onEachFeature,
-}).addTo(map);
-
-
-L.geoJSON(tracks, {
-    style: function(feature) { return { color: '{{ tracks_color }}' } },
-    onEachFeature: onEachFeature,
-}).addTo(map);
-
-var markerLayers = [];
-// Ajouter les markers à la carte
-scat_markers.forEach(function(data) {
-    var marker = L.circleMarker(data.coords, {
-        color: '#ff00ff',
-        fillColor: '#ff00ff',
-        fillOpacity: 1,
-        weight: 1,
-        opacity: 1,
-        radius: 8
-    }).addTo(map);
-
-    if (data.label) {
-    var tooltip = L.tooltip({
-        permanent: true,
-        direction: "top",
-        opacity: 1
-    }).setContent(data.label);
-    marker.bindTooltip(tooltip);
-}
-    var popup = L.popup().setContent(data.popup);
-    marker.bindPopup(popup);
-
-    markerLayers.push({ marker: marker, tooltip: tooltip });
-
-});
-
-
-
- // Creating scale control
-var scale = L.control.scale();
-scale.addTo(map);
-
-var markerBounds = L.latLngBounds([{{ fit }}]);
-map.fitBounds(markerBounds);
-
-var zoomThreshold = 12;
-// Fonction pour afficher/masquer les étiquettes selon le niveau de zoom
-function updateTooltipVisibility() {
-    var currentZoom = map.getZoom();
-    markerLayers.forEach(function(layer) {
-        if (currentZoom >= zoomThreshold) {
-            layer.marker.openTooltip(); // Affiche l'étiquette
-        } else {
-            layer.marker.closeTooltip(); // Cache l'étiquette
-        }
-    });
-}
-
-// Vérifier l'affichage des étiquettes au chargement
-updateTooltipVisibility();
-
-// Écouter l'événement de zoom pour mettre à jour l'affichage
-map.on('zoomend', updateTooltipVisibility);
-
-
-
-{% if add_polygon %}
-// Initialise draw tools
-var drawnItems = new L.FeatureGroup();
-map.addLayer(drawnItems);
-
-var drawControl = new L.Control.Draw({
-    edit: {
-        featureGroup: drawnItems
-    },
-    draw: {
-        polygon: true,
-        polyline: false,
-        rectangle: false,
-        circle: false,
-        marker: false,
-        circlemarker: false,
-        edit: false,
-
-    }
-});
-map.addControl(drawControl);
-
-// event triggered when user finish a draw
-map.on('draw:created', function (event) {
-    var layer = event.layer;
-    drawnItems.addLayer(layer);
-
-    var coords = layer.getLatLngs()[0].map(function(latlng) {
-        return [latlng.lng, latlng.lat];
-    });
-
-    // send coordinates via POST AJAX
-
-{% if samples == 'genotypes' %}
-    fetch('/select_on_map/genotypes',
-{% endif %}
-{% if samples == 'wa' %}
-    fetch('/select_on_map/wa',
-{% endif %}
-
-         {
-        method: 'POST',
-        headers: {
-            'Content-Type': 'application/json'
-        },
-        body: JSON.stringify({ coordinates: coords })
-    })
-    .then(response => response.json())
-    .then(data => {
-        if (data['status'] == 'error')
-            {
-            alert(data['message']);
-            console.log('server Response:', data);
-            drawnItems.clearLayers();
-            }
-        else
-            {
-{% if samples == 'genotypes' %}
-            window.location.href = "/wa_analysis_group/" + data['message'] + "/web";
-{% endif %}
-{% if samples == 'wa' %}
-            window.location.href = "/view_wa_polygon/" + data['message'] + "/web";
-{% endif %}
-
-            };
-
-
-    })
-    .catch(error => {
-        console.error('Error:', error);
-    });
-});
-{% endif %}
-
-</script>
-"""
-    )
-
-    return map.render(
-        {
-            "transects": data.get("transects", []),
-            "transects_color": data.get("transects_color", TRANSECTS_COLOR_DEFAULT),
-            "tracks": data.get("tracks", []),
-            "tracks_color": data.get("tracks_color", TRACKS_COLOR_DEFAULT),
-            "scats": data.get("scats", []),
-            "scat_markers": data.get("scat_markers", ""),
-            "scats_color": data.get("scats_color", SCATS_COLOR_DEFAULT),
-            "dead_wolves": data.get("dead_wolves", []),
-            "dead_wolves_color": data.get(
-                "dead_wolves_color", DEAD_WOLVES_COLOR_DEFAULT
-            ),
-            "center": data.get("center", CENTER_DEFAULT),
-            "zoom": data.get("zoom", 13),
-            "fit": data.get("fit", ""),
-            "add_polygon": add_polygon,
-            "samples": samples,
-        }
+    return render_template(
+        "leaflet_geojson_label.html",
+        transects=to_json(data.get("transects", [])),
+        transects_color=data.get("transects_color", TRANSECTS_COLOR_DEFAULT),
+        tracks=to_json(data.get("tracks", [])),
+        tracks_color=data.get("tracks_color", TRACKS_COLOR_DEFAULT),
+        scats=to_json(data.get("scats", [])),
+        scat_markers=data.get("scat_markers", ""),
+        scats_color=data.get("scats_color", SCATS_COLOR_DEFAULT),
+        dead_wolves=to_json(data.get("dead_wolves", [])),
+        dead_wolves_color=data.get("dead_wolves_color", DEAD_WOLVES_COLOR_DEFAULT),
+        center=data.get("center", CENTER_DEFAULT),
+        zoom=data.get("zoom", 13),
+        fit=data.get("fit", ""),
+        add_polygon=add_polygon,
+        samples=samples,
     )
 
 
@@ -1554,168 +1539,17 @@ def leaflet_markercluster_geojson(data: dict) -> str:
     DEAD_WOLVES_COLOR_DEFAULT = params["dead_wolf_color"]
     CENTER_DEFAULT = "45, 7"
 
-    map = Template(
-        """
- <link rel="stylesheet" href="https://unpkg.com/leaflet@1.9.4/dist/leaflet.css"
-     integrity="sha256-p4NxAoJBhIIN+hmNHrzRCf9tD/miZyoHS5obTRR9BMY="
-     crossorigin=""/>
-
-<script src="https://unpkg.com/leaflet@1.9.4/dist/leaflet.js"
-     integrity="sha256-20nQCchB9co0qIjJZRGuk2/Z9VM+kNiyxNV1lvTlZBo="
-     crossorigin=""></script>
-
-
-<link rel="stylesheet" href="/static/MarkerCluster.Default.css">
-<script src="/static/leaflet.markercluster.js"></script>
-
-<script>
-
-var transects = {
-    "type": "FeatureCollection",
-    "features": {{ transects}}
-};
-
-var tracks = {
-    "type": "FeatureCollection",
-    "features": {{ tracks}}
-};
-
-var scats = {
-    "type": "FeatureCollection",
-    "features": {{ scats }}
-};
-
-var dead_wolves = {
-    "type": "FeatureCollection",
-    "features": {{ dead_wolves }}
-};
-
-var Esri_WorldImagery = L.tileLayer('https://server.arcgisonline.com/ArcGIS/rest/services/World_Imagery/MapServer/tile/{z}/{y}/{x}', {
-	attribution: 'Tiles &copy; Esri &mdash; Source: Esri, i-cubed, USDA, USGS, AEX, GeoEye, Getmapping, Aerogrid, IGN, IGP, UPR-EGP, and the GIS User Community'
-});
-
-var Stadia_AlidadeSatellite = L.tileLayer('https://tiles.stadiamaps.com/tiles/alidade_satellite/{z}/{x}/{y}{r}.{ext}', {
-	minZoom: 0,
-	maxZoom: 20,
-	attribution: '&copy; CNES, Distribution Airbus DS, © Airbus DS, © PlanetObserver (Contains Copernicus Data) | &copy; <a href="https://www.stadiamaps.com/" target="_blank">Stadia Maps</a> &copy; <a href="https://openmaptiles.org/" target="_blank">OpenMapTiles</a> &copy; <a href="https://www.openstreetmap.org/copyright">OpenStreetMap</a> contributors',
-	ext: 'jpg'
-});
-
-
-var osm = L.tileLayer('http://{s}.tile.osm.org/{z}/{x}/{y}.png', {
-    attribution: '&copy; <a href="http://osm.org/copyright">OpenStreetMap</a> contributors'})
-
-var opentopomap = L.tileLayer('https://a.tile.opentopomap.org/{z}/{x}/{y}.png', {
-	attribution: 'Map data: &copy; <a href="https://www.openstreetmap.org/copyright">OpenStreetMap</a> contributors, <a href="http://viewfinderpanoramas.org">SRTM</a> | Map style: &copy; <a href="https://opentopomap.org">OpenTopoMap</a> (<a href="https://creativecommons.org/licenses/by-sa/3.0/">CC-BY-SA</a>)'
-})
-
-var map = L.map('map', {center: [{{ center }}], zoom: {{ zoom }}, layers: [Esri_WorldImagery, Stadia_AlidadeSatellite, osm, opentopomap]});
-
-var baseMaps = {
-    "ESRI World Imagery": Esri_WorldImagery,
-    "Stadia map": Stadia_AlidadeSatellite,
-    "OpenStreetMap": osm,
-    "OpenTopoMap": opentopomap,
-};
-
-var layerControl = L.control.layers(baseMaps).addTo(map);
-
-
-function onEachFeature(feature, layer) {
-    var popupContent = "";
-    if (feature.properties && feature.properties.popupContent) {
-        popupContent += feature.properties.popupContent;
-    }
-    layer.bindPopup(popupContent);
-}
-
-
-var scat_markers = L.geoJson(scats,
-                       {onEachFeature: onEachFeature,
-                        pointToLayer: function(feature, latlng)
-                                          {
-                                          return L.circleMarker(latlng, {
-                                                            color: '{{ scats_color }}',
-                                                            fillcolor: '{{ scats_color }}',
-                                                            radius: 8,
-                                                            weight: 1,
-                                                            opacity: 1,
-                                                            fillOpacity: 1
-                                                  });
-                                          }
-                        }
-                      );
-
-var scats_clusters = L.markerClusterGroup();
-scats_clusters.addLayer(scat_markers);
-map.addLayer(scats_clusters);
-
-
-L.geoJSON([dead_wolves], {
-
-    style: function (feature) { return feature.properties && feature.properties.style; },
-
-    onEachFeature: onEachFeature,
-
-    pointToLayer: function (feature, latlng) {
-        return L.circleMarker(latlng, {
-            color: '{{ dead_wolves_color }}',
-            fillcolor: '{{ dead_wolves_color }}',
-            radius: 8,
-            weight: 1,
-            opacity: 1,
-            fillOpacity: 1
-        });
-    }
-}).addTo(map);
-
-
-
-
-
-L.geoJSON(transects, {
-
-    style: function(feature) { return { color: '{{ transects_color }}' } },
-
-    onEachFeature: onEachFeature,
-
-}).addTo(map);
-
-
-L.geoJSON(tracks, {
-
-    style: function(feature) { return { color: '{{ tracks_color }}' } },
-
-    onEachFeature: onEachFeature,
-
-}).addTo(map);
-
-
- // Creating scale control
-var scale = L.control.scale();
-scale.addTo(map);
-
-var markerBounds = L.latLngBounds([{{ fit }}]);
-map.fitBounds(markerBounds);
-
-</script>
-"""
-    )
-
-    return map.render(
-        {
-            "transects": data.get("transects", []),
-            "transects_color": data.get("transects_color", TRANSECTS_COLOR_DEFAULT),
-            "tracks": data.get("tracks", []),
-            "tracks_color": data.get("tracks_color", TRACKS_COLOR_DEFAULT),
-            "scats": data.get("scats", []),
-            "scats_color": data.get("scats_color", SCATS_COLOR_DEFAULT),
-            "dead_wolves": data.get("dead_wolves", []),
-            "dead_wolves_color": data.get(
-                "dead_wolves_color", DEAD_WOLVES_COLOR_DEFAULT
-            ),
-            "center": data.get("center", CENTER_DEFAULT),
-            "zoom": data.get("zoom", 13),
-            "fit": data.get("fit", ""),
-        }
+    return render_template(
+        "leaflet_markercluster_geojson.html",
+        transects=to_json(data.get("transects", [])),
+        transects_color=data.get("transects_color", TRANSECTS_COLOR_DEFAULT),
+        tracks=to_json(data.get("tracks", [])),
+        tracks_color=data.get("tracks_color", TRACKS_COLOR_DEFAULT),
+        scats=to_json(data.get("scats", [])),
+        scats_color=data.get("scats_color", SCATS_COLOR_DEFAULT),
+        dead_wolves=to_json(data.get("dead_wolves", [])),
+        dead_wolves_color=data.get("dead_wolves_color", DEAD_WOLVES_COLOR_DEFAULT),
+        center=data.get("center", CENTER_DEFAULT),
+        zoom=data.get("zoom", 13),
+        fit=data.get("fit", ""),
     )
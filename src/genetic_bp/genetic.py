@@ -7,7 +7,6 @@ flask blueprint for genetic data management
 
 import datetime as dt
 import json
-import subprocess
 import sys
 import time
 import uuid
@@ -15,6 +14,7 @@ from pathlib import Path
 
 import jinja2
 import matplotlib
+import numpy as np
 import redis
 from flask import (
     Blueprint,
@@ -34,9 +34,12 @@ from sqlalchemy import bindparam, text
 from sqlalchemy.dialects.postgresql import JSONB
 
 import functions as fn
+import job_queue
+import search
+import upload_staging
 from config import config
 
-from . import export, import_, wa_import
+from . import export, genetic_profile, import_, loci_matrix, wa_clusters, wa_flags, wa_import
 
 app = Blueprint("genetic", __name__, template_folder="templates")
 
@@ -49,26 +52,47 @@ rdis = redis.Redis(db=(0 if params["database"] == "wolf" else 1))
 
 def update_loci_values_cache(wa_code: str, loci_list: dict):
     """
-    update redis and wa_loci_values table
+    update redis, wa_loci_values table (loci values and quality flags) and genetic profile index
     """
-    loci_values = fn.get_wa_loci_values(wa_code, loci_list)[0]
-    # update redis
-    rdis.set(wa_code, json.dumps(loci_values))
-    # update DB
-    with fn.conn_alchemy().connect() as con:
-        _ = con.execute(
-            text(
-                "INSERT INTO wa_loci_values (wa_code, loci_values) "
-                "VALUES (:wa_code, :loci_values) "
-                "ON CONFLICT (wa_code) "
-                "DO UPDATE "
-                "SET loci_values = EXCLUDED.loci_values; "
-            ).bindparams(bindparam("loci_values", type_=JSONB)),
-            {
-                "wa_code": wa_code,
-                "loci_values": loci_values,
-            },
-        )
+    update_loci_values_cache_multi([wa_code], loci_list)
+
+
+def update_loci_values_cache_multi(wa_codes: list, loci_list: dict, chunk_size: int = 1000):
+    """
+    update redis, wa_loci_values table (loci values and quality flags) and genetic profile index
+    of many WA codes (one query by chunk of WA codes)
+    """
+    wa_codes = list(dict.fromkeys(wa_codes))
+    for idx in range(0, len(wa_codes), chunk_size):
+        chunk = wa_codes[idx : idx + chunk_size]
+        loci_values: dict = {
+            wa_code: values[0]
+            for wa_code, values in fn.get_wa_loci_values_multi(chunk, loci_list).items()
+        }
+        # update redis
+        pipe = rdis.pipeline()
+        for wa_code in chunk:
+            pipe.set(wa_code, json.dumps(loci_values[wa_code]))
+        pipe.execute()
+        # update DB
+        with fn.db_connection() as con:
+            _ = con.execute(
+                text(
+                    "INSERT INTO wa_loci_values (wa_code, loci_values) "
+                    "VALUES (:wa_code, :loci_values) "
+                    "ON CONFLICT (wa_code) "
+                    "DO UPDATE "
+                    "SET loci_values = EXCLUDED.loci_values; "
+                ).bindparams(bindparam("loci_values", type_=JSONB)),
+                [
+                    {"wa_code": wa_code, "loci_values": loci_values[wa_code]}
+                    for wa_code in chunk
+                ],
+            )
+        # update genetic profile index
+        genetic_profile.update_profiles(loci_values, loci_list)
+        # update quality flags
+        wa_flags.update(chunk)
 
 
 @app.route("/del_genotype/<genotype_id>")
@@ -77,20 +101,27 @@ def del_genotype(genotype_id):
     """
     set genotype as deleted (record_status field)
     """
-    with fn.conn_alchemy().connect() as con:
+    with fn.db_connection() as con:
         con.execute(
             text(
                 "UPDATE genotypes SET record_status = 'deleted' WHERE genotype_id = :genotype_id"
             ),
             {"genotype_id": genotype_id},
         )
-        con.execute(
-            text(
-                "UPDATE wa_results SET genotype_id = NULL WHERE genotype_id = :genotype_id"
-            ),
-            {"genotype_id": genotype_id},
+        wa_codes = (
+            con.execute(
+                text(
+                    "UPDATE wa_results SET genotype_id = NULL WHERE genotype_id = :genotype_id "
+                    "RETURNING wa_code"
+                ),
+                {"genotype_id": genotype_id},
+            )
+            .scalars()
+            .all()
         )
 
+    wa_flags.update(wa_codes)
+
     flash(fn.alert_success(f"<b>Genotype {genotype_id} deleted</b>"))
 
     return redirect(request.referrer)
@@ -102,7 +133,7 @@ def undel_genotype(genotype_id):
     """
     set genotype as temp (record_status field)
     """
-    with fn.conn_alchemy().connect() as con:
+    with fn.db_connection() as con:
         con.execute(
             text(
                 "UPDATE genotypes SET record_status = 'temp' WHERE genotype_id = :genotype_id"
@@ -121,7 +152,7 @@ def def_genotype(genotype_id):
     """
     set genotype as definitive (record_status field)
     """
-    with fn.conn_alchemy().connect() as con:
+    with fn.db_connection() as con:
         con.execute(
             text(
                 "UPDATE genotypes SET record_status = 'OK' WHERE genotype_id = :genotype_id"
@@ -140,7 +171,7 @@ def temp_genotype(genotype_id):
     """
     set genotype as temporary (record_status field)
     """
-    with fn.conn_alchemy().connect() as con:
+    with fn.db_connection() as con:
         con.execute(
             text(
                 "UPDATE genotypes SET record_status = 'temp' WHERE genotype_id = :genotype_id"
@@ -162,7 +193,7 @@ def view_genotype(genotype_id: str):
 
     return_to = request.args.get("return_to", default=request.referrer)
 
-    with fn.conn_alchemy().connect() as con:
+    with fn.db_connection() as con:
         genotype = (
             con.execute(
                 text(
@@ -213,7 +244,7 @@ def view_genotype(genotype_id: str):
     loci_list: dict = fn.get_loci_list()
 
     samples_features: list = []
-    loci_values: dict = {}
+    loci_values: dict = fn.get_wa_loci_values_bulk([row["wa_code"] for row in wa_codes])
     count_wa_code: int = 0
     sum_lon: float = 0.0
     sum_lat: float = 0.0
@@ -251,8 +282,6 @@ def view_genotype(genotype_id: str):
         }
         samples_features.append(sample_feature)
 
-        loci_values[row["wa_code"]] = fn.get_wa_loci_values_redis(row["wa_code"])
-
     if count_wa_code:
         map = Markup(
             fn.leaflet_geojson(
@@ -356,80 +385,40 @@ def genotypes_list(offset: int, limit: int | str, type: str, mode="web"):
         else:
             search_term: str = ""
 
+    # free text or field search (see search.py)
+    try:
+        conditions, values = search.where("genotypes", search_term)
+    except ValueError as e:
+        flash(fn.alert_danger(f"<b>{e}</b>"))
+        return redirect(session.get("url_genotypes_list", f"/genotypes_list/0/{limit}/{type}"))
+
     sql: str = (
-        f"SELECT *, count(*) OVER() AS n_genotypes FROM genotypes_list_all {filter} "
+        "SELECT *"
+        + (f", {search.rank('genotypes')} AS search_rank " if search_term else " ")
+        + f"FROM genotypes_list_all {filter} "
+        + conditions
     )
+    order_by: tuple = ("search_rank", "genotype_id") if search_term else ("genotype_id",)
 
-    values: dict = {}
-    if ":" in search_term:
-        research_fields: dict = {
-            "genotype": "genotype_id",
-            "notes": "notes",
-            "tmp id": "tmp id",
-            "date": "date",
-            "pack": "pack",
-            "sex": "sex",
-            "status": "status",
-            "working notes": "working notes",
+    values.update(
+        {
+            "start_date": session["start_date"],
+            "end_date": session["end_date"],
         }
-        for idx, field_term in enumerate(search_term.split(";")):
-            field, value = [x.strip().lower() for x in field_term.split(":")]
-            if field not in research_fields:
-                flash(
-                    fn.alert_danger(
-                        f"<b>Search term not found</b>. Must be {', '.join(research_fields.keys())}"
-                    )
-                )
-                return redirect(session["url_wa_list"])
-            # convert field
-            field = research_fields[field]
-
-            sql += f" AND ({field} ILIKE :search{idx}) "
-            values[f"search{idx}"] = f"%{value}%"
-
-    elif search_term:  # search in all fields
-        values = {"search": f"%{search_term}%"}
-
-        sql += (
-            " AND ("
-            "genotype_id ILIKE :search "
-            "OR notes ILIKE :search "
-            "OR tmp_id ILIKE :search "
-            "OR date::text ILIKE :search "
-            "OR pack ILIKE :search "
-            "OR sex ILIKE :search "
-            "OR status ILIKE :search "
-            "OR working_notes ILIKE :search "
-            ") "
-        )
+    )
 
-    # add limits
-    sql += f" LIMIT {limit} OFFSET {offset} "
-
-    with fn.conn_alchemy().connect() as con:
-        results = (
-            con.execute(
-                text(sql),
-                dict(
-                    {
-                        "start_date": session["start_date"],
-                        "end_date": session["end_date"],
-                    },
-                    **values,
-                ),
-            )
-            .mappings()
-            .all()
-        )
+    # keyset pagination (offset is used for the display and for the URLs without cursor)
+    after: str | None = request.args.get("after")
+    before: str | None = request.args.get("before")
+    results, pages = fn.paginate(sql, values, order_by, limit, offset, after, before)
+    n_genotypes: int = fn.cached_count(sql, values)
 
     # loci list
     loci_list: dict = fn.get_loci_list()
 
-    loci_values: dict = {}
-    for row in results:
-        loci_values[row["genotype_id"]] = fn.get_genotype_loci_values_redis(
-            row["genotype_id"]
-        )
+    loci_values: dict = fn.get_genotype_loci_values_bulk(
+        [row["genotype_id"] for row in results]
+    )
 
     if mode.startswith("export_"):
         _, file_format, loci_notes = mode.split("_")
@@ -452,12 +441,14 @@ def genotypes_list(offset: int, limit: int | str, type: str, mode="web"):
     else:
         session["url_genotypes_list"] = (
             f"/genotypes_list/{offset}/{limit}/{type}?search={search_term}"
+            + (f"&after={after}" if after is not None else "")
+            + (f"&before={before}" if before is not None else "")
         )
         if "url_wa_list" in session:
             del session["url_wa_list"]
 
         if results:
-            title = f"List of {results[0]['n_genotypes']} {type} genotypes".replace(
+            title = f"List of {n_genotypes} {type} genotypes".replace(
                 " all", ""
             ).replace("_short", "")
         else:
@@ -470,8 +461,9 @@ def genotypes_list(offset: int, limit: int | str, type: str, mode="web"):
             limit=limit,
             offset=offset,
             type=type,
-            n_genotypes=results[0]["n_genotypes"] if results else 0,
+            n_genotypes=n_genotypes,
             results=results,
+            pages=pages,
             loci_list=loci_list,
             loci_values=loci_values,
             short="",
@@ -496,7 +488,7 @@ def genotype_without_wa_loci():
             AND genotype_id NOT IN (SELECT genotype_id FROM genotype_locus)
             ORDER BY genotype_id;
           """)
-    with fn.conn_alchemy().connect() as con:
+    with fn.db_connection() as con:
         out: list = ['<table class="table">']
         out.append(
             "<thead><tr><th>Genotype ID</th><th>Number of recaptures</th><th>WA codes / mtDna</th></tr></thead>\n"
@@ -529,7 +521,7 @@ def view_wa(wa_code: str):
 
     return_to = request.args.get("return_to", default=request.referrer)
 
-    with fn.conn_alchemy().connect() as con:
+    with fn.db_connection() as con:
         result = (
             con.execute(
                 text(
@@ -592,7 +584,7 @@ def plot_all_wa(add_polygon: bool = False, samples: str = "genotypes"):
     tot_max_lon: float = -90
 
     t0 = time.time()
-    with fn.conn_alchemy().connect() as con:
+    with fn.db_connection() as con:
         for row in (
             con.execute(
                 text(
@@ -686,7 +678,7 @@ def plot_all_wa2(add_polygon: bool = False, samples: str = "genotypes"):
     scat_markers: str = ""
 
     t0 = time.time()
-    with fn.conn_alchemy().connect() as con:
+    with fn.db_connection() as con:
         wa_count: int = 0
         for row in (
             con.execute(
@@ -768,21 +760,20 @@ def plot_wa_clusters(distance: int):
     plot WA clusters using ST_ClusterDBSCAN function
     """
 
-    MINPOINT = 1
-
-    print(f"{session["start_date"]=}")
-    print(f"{session["end_date"]=}")
-    print(f"{distance=}")
+    # cluster ID of the WA codes (cached, see wa_clusters.py)
+    cluster_ids: dict = wa_clusters.assignments(
+        distance, session["start_date"], session["end_date"]
+    )
 
-    with fn.conn_alchemy().connect() as con:
-        results = (
-            con.execute(
+    with fn.db_connection() as con:
+        results = [
+            dict(row) | {"cid": cluster_ids.get(row["wa_code"])}
+            for row in con.execute(
                 text(
                     "SELECT wa_code, sample_id, genotype_id, "
                     "coord_east, coord_north, "
                     "ST_X(st_transform(geometry_utm, 4326)) as longitude, "
-                    "ST_Y(st_transform(geometry_utm, 4326)) as latitude, "
-                    "ST_ClusterDBSCAN(geometry_utm, eps:=:distance, minpoints:=:minpoint) OVER(ORDER BY wa_code) AS cid "
+                    "ST_Y(st_transform(geometry_utm, 4326)) as latitude "
                     "FROM wa_scat_dw_all "
                     "WHERE mtdna != 'Poor DNA' "
                     "AND date BETWEEN :start_date AND :end_date"
@@ -790,13 +781,9 @@ def plot_wa_clusters(distance: int):
                 {
                     "start_date": session["start_date"],
                     "end_date": session["end_date"],
-                    "distance": distance,
-                    "minpoint": MINPOINT,
                 },
-            )
-            .mappings()
-            .all()
-        )
+            ).mappings()
+        ]
 
     print(f"{len(results)=}")
 
@@ -835,6 +822,10 @@ def plot_wa_clusters(distance: int):
             print()
     """
 
+    wa_loci_values: dict = fn.get_wa_loci_values_bulk(
+        [row["wa_code"] for row in results]
+    )
+
     scat_features: list = []
     min_lon, min_lat, max_lon, max_lat = 90, 90, -90, -90
     for row in results:
@@ -848,7 +839,7 @@ def plot_wa_clusters(distance: int):
 
         flag_ok = False
 
-        d = fn.get_wa_loci_values_redis(row["wa_code"])
+        d = wa_loci_values[row["wa_code"]]
 
         for locus in d:
             for allele in d[locus]:
@@ -904,7 +895,7 @@ def plot_wa_clusters(distance: int):
             )
         ),
         distance=int(distance),
-        minpoint=MINPOINT,
+        minpoint=wa_clusters.MINPOINTS,
         clusters_number=len(cluster_id_count),
     )
 
@@ -965,179 +956,62 @@ def wa_genetic_samples(offset: int, limit: int | str, filter="all", mode="web"):
         else:
             search_term: str = ""
 
-    sql_all: str = "SELECT * FROM wa_genetic_samples_all WHERE (date BETWEEN :start_date AND :end_date OR date IS NULL) "
-
-    with fn.conn_alchemy().connect() as con:
-        if ":" in search_term:
-            sql_search = sql_all
-            values: dict = {}
-            for idx, field_term in enumerate(search_term.split(";")):
-                field, value = [x.strip().lower() for x in field_term.split(":")]
-                research_fields = (
-                    "wa",
-                    "date",
-                    "sample id",
-                    "municipality",
-                    "province",
-                    "genotype id",
-                    "sex",
-                    "hybrid",
-                    "tmp id",
-                    "notes",
-                    "pack",
-                    "box",
-                )
-                if field not in research_fields:
-                    flash(
-                        fn.alert_danger(
-                            f"Search term not found. Must be {'","'.join(research_fields)}"
-                        )
-                    )
-                    return redirect(session["url_wa_list"])
-
-                field = field.replace(" ", "_")
-                if field == "wa":
-                    field = "wa_code"
-                if field == "sex":
-                    field = "sex_id"
-                    values[f"search{idx}"] = value
-                    sql_search += f" AND ({field} = :search{idx}) "
-                elif field == "box":
-                    field = "box_number"
-                    values[f"search{idx}"] = value
-                    sql_search += f" AND ({field} = :search{idx}) "
-                else:
-                    sql_search += f" AND ({field} ILIKE :search{idx}) "
-                    values[f"search{idx}"] = f"%{value}%"
+    # free text or field search (see search.py)
+    try:
+        conditions, values = search.where("wa", search_term)
+    except ValueError as e:
+        flash(fn.alert_danger(f"<b>{e}</b>"))
+        return redirect(session.get("url_wa_list", f"/wa_genetic_samples/0/{limit}/{filter}"))
 
-        else:
-            values = {"search": f"%{search_term}%"}
-            sql_search = sql_all + (
-                " AND ("
-                "wa_code ILIKE :search "
-                "OR sample_id ILIKE :search "
-                "OR date::text ILIKE :search "
-                "OR municipality ILIKE :search "
-                "OR genotype_id ILIKE :search "
-                "OR hybrid ILIKE :search "
-                "OR tmp_id ILIKE :search "
-                "OR notes ILIKE :search "
-                "OR pack ILIKE :search "
-                "OR box_number::text = :search "
-                ") "
-            )
+    # quality flags of the WA codes (see wa_flags.py)
+    sql: str = (
+        "SELECT w.*, "
+        "COALESCE(f.has_values, FALSE) AS has_values, "
+        "COALESCE(f.has_open_notes, FALSE) AS has_open_notes, "
+        "COALESCE(f.n_divergent_alleles, 0) AS n_divergent_alleles"
+        + (f", {search.rank('wa')} AS search_rank " if search_term else " ")
+        + "FROM wa_genetic_samples_all w LEFT JOIN wa_loci_values f USING (wa_code) "
+        "WHERE (date BETWEEN :start_date AND :end_date OR date IS NULL) "
+        + conditions
+    )
+    match filter:
+        case "all":
+            sql += "AND (f.has_values OR f.has_open_notes) "
+        case "with_notes":
+            sql += (
+                "AND (f.has_values OR f.has_open_notes) "
+                "AND ((notes != '' AND notes IS NOT NULL) OR f.has_open_notes) "
+            )
+        case "red_flag":
+            sql += "AND f.has_open_notes "
+
+    values.update(
+        {
+            "start_date": session["start_date"],
+            "end_date": session["end_date"],
+        }
+    )
 
-        wa_scats = (
-            con.execute(
-                text(sql_all if not search_term else sql_search),
-                dict(
-                    {
-                        "start_date": session["start_date"],
-                        "end_date": session["end_date"],
-                    },
-                    **values,
-                ),
-            )
-            .mappings()
-            .all()
-        )
+    # keyset pagination (offset is used for the display and for the URLs without cursor)
+    # the export contains all the WA codes
+    wa_scats, pages = fn.paginate(
+        sql,
+        values,
+        ("search_rank", "wa_code") if search_term else ("wa_code",),
+        "ALL" if mode == "export" else limit,
+        offset,
+        request.args.get("after"),
+        request.args.get("before"),
+    )
+    n_wa: int = len(wa_scats) if mode == "export" else fn.cached_count(sql, values)
 
     # loci list
     loci_list: dict = fn.get_loci_list()
 
-    out: list = []
-    loci_values: list = {}
-    locus_notes: dict = {}
-    mem_genotype_loci: dict = {}
-    for row in wa_scats:
-        # genotype working notes
-        has_genotype_notes = (
-            True if (row["notes"] is not None and row["notes"]) else False
-        )
-
-        loci_val = fn.get_wa_loci_values_redis(row["wa_code"])
-        loci_values[row["wa_code"]] = dict(loci_val)
+    # colors of the loci of the page
+    loci_values, locus_notes = wa_flags.decorate(wa_scats)
 
-        has_loci_notes = False
-        has_orange_loci_notes = False
-        has_loci_values = False
-
-        # check if loci have notes and values and corresponds to genotype loci
-        for x in loci_values[row["wa_code"]]:
-            for allele in ("a", "b"):
-                if allele not in loci_values[row["wa_code"]][x]:
-                    continue
-
-                loci_values[row["wa_code"]][x][allele]["divergent_allele"] = ""
-
-                if loci_values[row["wa_code"]][x][allele]["has_history"]:
-                    if loci_values[row["wa_code"]][x][allele]["definitive"]:
-                        loci_values[row["wa_code"]][x][allele]["color"] = params[
-                            "green_note"
-                        ]
-                    else:
-                        loci_values[row["wa_code"]][x][allele]["color"] = params[
-                            "red_note"
-                        ]
-                        has_loci_notes = True
-
-                if loci_values[row["wa_code"]][x][allele]["value"] not in (0, "-"):
-                    has_loci_values = True
-
-                # check if wa loci corresponds to genotype loci (if not the background colo will be orange)
-                if row["genotype_id"]:
-                    genotype_loci_val = {}
-                    if mem_genotype_loci.get(row["genotype_id"], False):
-                        genotype_loci_val = mem_genotype_loci[row["genotype_id"]]
-                    else:
-                        genotype_loci_val = fn.get_genotype_loci_values_redis(
-                            row["genotype_id"]
-                        )
-                        if genotype_loci_val is not None:
-                            mem_genotype_loci[row["genotype_id"]] = genotype_loci_val
-                        else:
-                            print(
-                                f"Loci not found {row["genotype_id"]=}  {row["wa_code"]=}"
-                            )
-
-                    try:
-                        if (
-                            genotype_loci_val
-                            and genotype_loci_val[x][allele]["value"]
-                            != loci_val[x][allele]["value"]
-                            and loci_val[x][allele]["value"] not in (0, "-")
-                            and loci_val[x][allele]["value"] not in (0, "-")
-                        ):
-                            has_orange_loci_notes = True
-                            loci_values[row["wa_code"]][x][allele][
-                                "divergent_allele"
-                            ] = Markup('<span style="font-size:24px">&#128312;</span>')
-                            # check if allele has already a color
-                    except Exception:
-                        pass
-
-        if filter == "no_values":
-            out.append(dict(row))
-
-        # skip if no loci values and no notes
-        if not has_loci_values and not has_loci_notes:
-            continue
-
-        if (filter == "red_flag") and (has_loci_notes):
-            out.append(dict(row))
-
-        if (filter == "all") or (
-            filter == "with_notes" and (has_genotype_notes or has_loci_notes)
-        ):
-            out.append(dict(row))
-
-        if has_loci_notes:
-            locus_notes[row["wa_code"]] = Markup("&#128681;")  # red flag
-        if has_orange_loci_notes:
-            if row["wa_code"] in locus_notes:
-                locus_notes[row["wa_code"]] += Markup("&#128312;")  # orange
-            else:
-                locus_notes[row["wa_code"]] = Markup("&#128312;")  # orange
+    out: list = [dict(row) for row in wa_scats]
 
     if mode == "export":
         file_content = export.export_wa_genetic_samples(
@@ -1155,11 +1029,6 @@ def wa_genetic_samples(offset: int, limit: int | str, filter="all", mode="web"):
         return response
 
     else:
-        # apply offset and limit
-        n_wa = len(out)
-        if limit != "ALL":
-            out = out[offset : offset + limit]
-
         if n_wa:
             title = f"Genetic data of {n_wa} WA codes"
             match filter:
@@ -1172,8 +1041,14 @@ def wa_genetic_samples(offset: int, limit: int | str, filter="all", mode="web"):
         else:
             title = "No WA code found"
 
-        session["url_wa_list"] = (
-            f"/wa_genetic_samples/{offset}/{limit}/{filter}?search={search_term}"
+        session["url_wa_list"] = url_for(
+            "genetic.wa_genetic_samples",
+            offset=offset,
+            limit=limit,
+            filter=filter,
+            search=search_term,
+            after=request.args.get("after"),
+            before=request.args.get("before"),
         )
         if "url_scats_list" in session:
             del session["url_scats_list"]
@@ -1187,6 +1062,7 @@ def wa_genetic_samples(offset: int, limit: int | str, filter="all", mode="web"):
             n_wa=n_wa,
             limit=limit,
             offset=offset,
+            pages=pages,
             loci_list=loci_list,
             wa_scats=out,
             loci_values=loci_values,
@@ -1229,7 +1105,7 @@ def wa_genetic_samples3():
     print(f"{mode=}")
     print("-" * 20)
 
-    out, loci_values, locus_notes, total_n_wa = get_wa(
+    out, loci_values, locus_notes, total_n_wa, pages = get_wa(
         offset, limit, with_genotype_notes, with_loci_values, with_loci_notes
     )
 
@@ -1268,6 +1144,7 @@ def wa_genetic_samples3():
         loci_values=loci_values,
         locus_notes=locus_notes,
         total_n_wa=total_n_wa,
+        pages=pages,
         view_wa_code=view_wa_code,
     )
 
@@ -1280,65 +1157,38 @@ def get_wa(
     with_loci_notes: int = 0,
     not_poor_dna: int = 0,
     search_str: str = "",
+    after: str | None = None,
+    before: str | None = None,
 ):
     """
     get genetic data for wa_codes
+
+    Returns:
+        list: rows of the page
+        dict: loci values
+        dict: loci notes
+        int: number of WA codes
+        dict: cursors of the previous and next pages (see fn.paginate)
     """
 
-    out: list = []
-    loci_values: dict = {}
-    locus_notes: dict = {}
-    values: dict = {}
-    mem_genotype_loci: dict = {}
+    # free text or field search (see search.py)
+    try:
+        conditions, values = search.where("wa", search_str)
+    except ValueError:
+        return [], {}, {}, 0, {"previous": None, "next": None}
 
+    # quality flags of the WA codes (see wa_flags.py)
     sql_base: str = (
-        "SELECT COUNT(*) OVER () AS total_count, * FROM wa_genetic_samples_all "
+        "SELECT w.*, "
+        "COALESCE(f.has_values, FALSE) AS has_values, "
+        "COALESCE(f.has_open_notes, FALSE) AS has_open_notes, "
+        "COALESCE(f.n_divergent_alleles, 0) AS n_divergent_alleles"
+        + (f", {search.rank('wa')} AS search_rank " if search_str else " ")
+        + "FROM wa_genetic_samples_all w LEFT JOIN wa_loci_values f USING (wa_code) "
         "WHERE (date BETWEEN :start_date AND :end_date OR date IS NULL) "
+        + conditions
     )
 
-    # search term
-    if search_str:
-        if ":" in search_str:
-            research_fields = {
-                "wa": "wa_code",
-                "date": "date",
-                "sample id": "sample_id",
-                "municipality": "municipality",
-                "province": "province",
-                "genotype id": "genotype_id",
-                "sex": "sex_id",
-                "hybrid": "hybrid",
-                "tmp id": "tmp_id",
-                "pack": "pack",
-                "box": "box_number",
-            }
-            for idx, field_term in enumerate(search_str.split(";")):
-                field, value = [x.strip() for x in field_term.split(":")]
-                if field not in research_fields:
-                    return out, loci_values, locus_notes, 0
-
-                # convert field
-                field = research_fields[field]
-
-                sql_base += f" AND ({field} ILIKE :search{idx}) "
-                values[f"search{idx}"] = f"%{value}%"
-
-        else:
-            sql_base += (
-                " AND ("
-                "wa_code ILIKE :search_term "
-                "OR sample_id ILIKE :search_term "
-                "OR date::text ILIKE :search_term "
-                "OR municipality ILIKE :search_term "
-                "OR genotype_id ILIKE :search_term "
-                "OR hybrid ILIKE :search_term "
-                "OR tmp_id ILIKE :search_term "
-                "OR notes ILIKE :search_term "
-                "OR pack ILIKE :search_term "
-                "OR box_number::text = :search_term "
-                ") "
-            )
-
     # poor dna
     if not_poor_dna:
         sql_base += "AND mtdna not ilike '%poor DNA%' "
@@ -1347,145 +1197,36 @@ def get_wa(
         sql_base += "AND notes != '' AND notes IS NOT NULL "
 
     if with_loci_values:
-        sql_base += (
-            " AND wa_code IN "
-            "(SELECT w.wa_code "
-            "FROM wa_loci_values w "
-            "WHERE EXISTS ( "
-            "SELECT 1 "
-            "FROM jsonb_each(w.loci_values) AS l(locus, alleles) "
-            "WHERE "
-            "(NULLIF(alleles #>> '{a,value}', '') IS NOT NULL AND (alleles #>> '{a,value}') NOT IN ('-', '0')) "
-            "OR "
-            "(NULLIF(alleles #>> '{b,value}', '') IS NOT NULL AND (alleles #>> '{b,value}') NOT IN ('-', '0')) "
-            ")) "
-        )
+        sql_base += "AND f.has_values "
 
     if with_loci_notes:
-        sql_base += (
-            "AND wa_code IN "
-            "(SELECT w.wa_code "
-            "FROM wa_loci_values w "
-            "WHERE EXISTS ( "
-            "SELECT 1 "
-            "FROM jsonb_each(w.loci_values) AS l(locus, alleles) "
-            "WHERE "
-            "( "
-            " COALESCE((alleles #>> '{a,has_history}')::boolean, false) = true "
-            " AND COALESCE((alleles #>> '{a,definitive}')::boolean, false) = false "
-            ") "
-            "OR "
-            "( "
-            " COALESCE((alleles #>> '{b,has_history}')::boolean, false) = true "
-            " AND COALESCE((alleles #>> '{b,definitive}')::boolean, false) = false "
-            ") "
-            ")) "
-        )
-
-    # offset and limit
-    sql_base += " ORDER BY wa_code OFFSET :offset "
-    if limit == "All":
-        sql_base += "LIMIT ALL "
-    else:
-        sql_base += "LIMIT :limit "
-
-    with fn.conn_alchemy().connect() as con:
-        while True:
-            wa_scats = (
-                con.execute(
-                    text(sql_base),
-                    dict(
-                        {
-                            "start_date": session["start_date"],
-                            "end_date": session["end_date"],
-                            "offset": offset,
-                            "limit": limit,
-                            "search_term": f"%{search_str}%",
-                        },
-                        **values,
-                    ),
-                )
-                .mappings()
-                .all()
-            )
-            total_n_wa = wa_scats[0].total_count if wa_scats else 0
-
-            if limit != "All" and offset >= total_n_wa:
-                offset = max(0, total_n_wa - limit)
-            break
+        sql_base += "AND f.has_open_notes "
 
-    for row in wa_scats:
-        loci_val = fn.get_wa_loci_values_redis(row["wa_code"])
-        loci_values[row["wa_code"]] = dict(loci_val)
-
-        # loci_val = dict(row['loci_values'])
-        # loci_values[row["wa_code"]] = dict(loci_val)
-
-        has_loci_notes = False
-        has_orange_loci_notes = False
-
-        # check if loci have notes and values and corresponds to genotype loci
-        for x in loci_values[row["wa_code"]]:
-            for allele in ("a", "b"):
-                if allele not in loci_values[row["wa_code"]][x]:
-                    continue
+    values.update(
+        {
+            "start_date": session["start_date"],
+            "end_date": session["end_date"],
+        }
+    )
 
-                loci_values[row["wa_code"]][x][allele]["divergent_allele"] = ""
+    # keyset pagination (offset is used for the display and for the requests without cursor)
+    wa_scats, pages = fn.paginate(
+        sql_base,
+        values,
+        ("search_rank", "wa_code") if search_str else ("wa_code",),
+        limit,
+        offset,
+        after,
+        before,
+    )
+    total_n_wa: int = fn.cached_count(sql_base, values)
 
-                if loci_values[row["wa_code"]][x][allele]["has_history"]:
-                    if loci_values[row["wa_code"]][x][allele]["definitive"]:
-                        loci_values[row["wa_code"]][x][allele]["color"] = params[
-                            "green_note"
-                        ]
-                    else:
-                        loci_values[row["wa_code"]][x][allele]["color"] = params[
-                            "red_note"
-                        ]
-                        has_loci_notes = True
-
-                # check if wa loci corresponds to genotype loci (if not the background color will be orange)
-                if row["genotype_id"]:
-                    genotype_loci_val = {}
-                    if mem_genotype_loci.get(row["genotype_id"], False):
-                        genotype_loci_val = mem_genotype_loci[row["genotype_id"]]
-                    else:
-                        genotype_loci_val = fn.get_genotype_loci_values_redis(
-                            row["genotype_id"]
-                        )
-                        if genotype_loci_val is not None:
-                            mem_genotype_loci[row["genotype_id"]] = genotype_loci_val
-                        else:
-                            print(
-                                f"Loci not found {row["genotype_id"]=}  {row["wa_code"]=}"
-                            )
+    # colors of the loci of the page
+    loci_values, locus_notes = wa_flags.decorate(wa_scats)
 
-                    try:
-                        if (
-                            genotype_loci_val
-                            and genotype_loci_val[x][allele]["value"]
-                            != loci_val[x][allele]["value"]
-                            and loci_val[x][allele]["value"] not in (0, "-")
-                            and loci_val[x][allele]["value"] not in (0, "-")
-                        ):
-                            has_orange_loci_notes = True
-                            loci_values[row["wa_code"]][x][allele][
-                                "divergent_allele"
-                            ] = Markup('<span style="font-size:24px">&#128312;</span>')
-                            # check if allele has already a color
-                    except Exception:
-                        pass
-
-        out.append(dict(row))
-
-        if has_loci_notes:
-            locus_notes[row["wa_code"]] = Markup("&#128681;")  # red flag
-        if has_orange_loci_notes:
-            if row["wa_code"] in locus_notes:
-                locus_notes[row["wa_code"]] += Markup("&#128312;")  # orange
-            else:
-                locus_notes[row["wa_code"]] = Markup("&#128312;")  # orange
+    out: list = [dict(row) for row in wa_scats]
 
-    return out, loci_values, locus_notes, total_n_wa
+    return out, loci_values, locus_notes, total_n_wa, pages
 
 
 @app.get("/wa")
@@ -1517,7 +1258,7 @@ def wa():
         print("=" * 20)
 
     time0 = time.time()
-    out, loci_values, locus_notes, total_n_wa = get_wa(
+    out, loci_values, locus_notes, total_n_wa, pages = get_wa(
         offset,
         limit,
         with_genotype_notes,
@@ -1525,6 +1266,8 @@ def wa():
         with_loci_notes,
         not_poor_dna,
         search_str,
+        request.args.get("after"),
+        request.args.get("before"),
     )
     time1 = time.time() - time0
 
@@ -1556,6 +1299,7 @@ def wa():
         loci_values=loci_values,
         locus_notes=locus_notes,
         total_n_wa=total_n_wa,
+        pages=pages,
     )
 
 
@@ -1570,33 +1314,14 @@ def wa_analysis(distance: int, cluster_id: int, mode: str = "web"):
     if mode not in ("web", "export", "ml-relate", "colony"):
         return "error: mode must be web, export or ml-relate"
 
-    with fn.conn_alchemy().connect() as con:
+    with fn.db_connection() as con:
         # loci list
         loci_list: list = fn.get_loci_list()
 
-        # DBScan
-        wa_list: list = []
-        for row in (
-            con.execute(
-                text(
-                    "SELECT wa_code, sample_id, municipality, cluster_id FROM "
-                    "(SELECT wa_code, sample_id, municipality, "
-                    "ST_ClusterDBSCAN(geometry_utm, eps:= :distance, minpoints:=1) OVER(ORDER BY wa_code) AS cluster_id "
-                    "FROM wa_scat_dw_all "
-                    "WHERE mtdna != 'Poor DNA' "
-                    "AND date BETWEEN :start_date AND :end_date) q WHERE cluster_id = :cluster_id "
-                ),
-                {
-                    "start_date": session["start_date"],
-                    "end_date": session["end_date"],
-                    "distance": distance,
-                    "cluster_id": cluster_id,
-                },
-            )
-            .mappings()
-            .all()
-        ):
-            wa_list.append(row["wa_code"])
+        # DBScan (cached, see wa_clusters.py)
+        wa_list: list = wa_clusters.cluster_wa_codes(
+            int(distance), cluster_id, session["start_date"], session["end_date"]
+        )
         # wa_list_str = "','".join(wa_list)
 
         wa_scats = (
@@ -1652,72 +1377,26 @@ def wa_analysis(distance: int, cluster_id: int, mode: str = "web"):
             .all()
         )
 
-        loci_values: dict = {}
-        count_samples_with_data: int = 0
-
-        ml_relate: list = [f"Cluster id {cluster_id}"]
-
-        # check if almost one value for locus (ML-Relate)
-        for loci in loci_list:
-            has_loci_values: bool = False
-            for row in wa_scats:
-                loci_values[row["wa_code"]] = fn.get_wa_loci_values_redis(
-                    row["wa_code"]
-                )
-
-                for allele in ("a", "b"):
-                    if allele not in loci_values[row["wa_code"]][loci]:
-                        continue
-                    if loci_values[row["wa_code"]][loci][allele]["value"] not in (
-                        0,
-                        "-",
-                    ):
-                        has_loci_values = True
-
-            if has_loci_values:
-                ml_relate.append(loci)
-
-        ml_relate.append("Pop")
-
-        out: list = []
-        for row in wa_scats:
-            if row["wa_code"] not in loci_values:
-                continue
-
-            # check if almost one locus has a value
-            has_loci_values = False
-            for locus in loci_values[row["wa_code"]]:
-                for allele in ("a", "b"):
-                    if allele not in loci_values[row["wa_code"]][loci]:
-                        continue
-                    if loci_values[row["wa_code"]][locus][allele]["value"] not in (
-                        0,
-                        "-",
-                    ):
-                        has_loci_values = True
-                if has_loci_values:
-                    break
-
-            # Genepop / ML-relate
-            mrl = row["wa_code"] + "\t,\t"
-            for x in loci_values[row["wa_code"]]:
-                if locus not in ml_relate:  # no value for locus
-                    continue
-                for allele in ("a", "b"):
-                    if allele not in loci_values[row["wa_code"]][locus] or loci_values[
-                        row["wa_code"]
-                    ][locus][allele]["value"] in (0, "-"):
-                        mrl += "000"
-                    else:
-                        mrl += (
-                            f"{loci_values[row['wa_code']][locus][allele]['value']:03}"
-                        )
-                mrl += "\t"
+        # loci values retrieved once for all WA codes
+        loci_values, wa_codes, matrix = loci_matrix.from_wa_codes(
+            [row["wa_code"] for row in wa_scats], loci_list
+        )
 
-            if has_loci_values:
-                out.append(row)
-                ml_relate.append(mrl.strip())
-                count_samples_with_data += 1
+        # WA codes with almost one locus value
+        rows_mask = loci_matrix.rows_with_values(matrix)
+        with_values: set = {
+            wa_code for wa_code, has_values in zip(wa_codes, rows_mask) if has_values
+        }
+        out: list = [row for row in wa_scats if row["wa_code"] in with_values]
+        count_samples_with_data: int = len(out)
+
+        # Genepop / ML-relate (loci with almost one value)
+        ml_relate: list = loci_matrix.ml_relate_input(
+            f"Cluster id {cluster_id}",
+            [wa_code for wa_code in wa_codes if wa_code in with_values],
+            matrix[rows_mask],
+            loci_list,
+        )
 
         if mode == "export":
             file_content = export.export_wa_analysis(
@@ -1768,7 +1447,7 @@ def get_genotypes_from_wa(wa_list: list):
     """
 
     # wa_list_str = "','".join(wa_list)
-    with fn.conn_alchemy().connect() as con:
+    with fn.db_connection() as con:
         # fetch grouped genotypes
         genotype_id = (
             con.execute(
@@ -1796,7 +1475,7 @@ def get_genotypes_data(genotypes_info):
     data: dict = {}
     count_sex: dict = {"M": 0, "F": 0, "": 0}
 
-    with fn.conn_alchemy().connect() as con:
+    with fn.db_connection() as con:
         for row in genotypes_info:
             if row["genotype_id"] is None:
                 continue
@@ -1822,9 +1501,7 @@ def get_genotypes_data(genotypes_info):
             data[row["genotype_id"]]["n_recap"] = row["n_recap"]
             count_sex[result["sex"]] += 1
 
-            loci_values[row["genotype_id"]] = fn.get_genotype_loci_values_redis(
-                row["genotype_id"]
-            )
+    loci_values = fn.get_genotype_loci_values_bulk(list(data))
 
     return data, loci_values, count_sex
 
@@ -1833,33 +1510,9 @@ def create_ml_relate_input(title: str, loci_values) -> str:
     """
     create the input data for ML-Relate software
     """
-    ml_relate: list = [title]
-    for locus in fn.get_loci_list():
-        locus_has_values: bool = False
-        for genotype in loci_values:
-            for allele in ("a", "b"):
-                if allele not in loci_values[genotype][locus]:
-                    continue
-                if loci_values[genotype][locus][allele]["value"] not in (0, "-"):
-                    locus_has_values = True
-        if locus_has_values:
-            ml_relate.append(locus)
-    ml_relate.append("Pop")
-    for genotype in loci_values:
-        mrl = genotype + "\t,\t"
-        for locus in loci_values[genotype]:
-            if locus not in ml_relate:  # no value for locus
-                continue
-            for allele in ("a", "b"):
-                if loci_values[genotype][locus][allele]["value"] in (0, "-"):
-                    mrl += "000"
-                else:
-                    mrl += f"{loci_values[genotype][locus][allele]['value']:03}"
-            mrl += "\t"
-
-        ml_relate.append(mrl.strip())
-
-    return "\n".join(ml_relate)
+    loci_list: dict = fn.get_loci_list()
+    keys, matrix = loci_matrix.build(loci_values, loci_list)
+    return "\n".join(loci_matrix.ml_relate_input(title, keys, matrix, loci_list))
 
 
 @app.route("/view_wa_polygon/<polygon>")
@@ -1873,7 +1526,7 @@ def view_wa_polygon(polygon: str, mode: str = "web"):
     if mode not in accepted_mode:
         return f"mode error: mode must be {','.join(accepted_mode)}"
 
-    with fn.conn_alchemy().connect() as con:
+    with fn.db_connection() as con:
         # loci list
         loci_list: dict = fn.get_loci_list()
 
@@ -1881,7 +1534,8 @@ def view_wa_polygon(polygon: str, mode: str = "web"):
             "SELECT * "
             "FROM wa_genetic_samples_all "
             "WHERE (date BETWEEN :start_date AND :end_date OR date IS NULL) "
-            "AND ST_Within(geometry_utm, st_transform(ST_GeomFromText(:wkt_polygon, 4326), ST_SRID(geometry_utm)))"
+            "AND ST_Within(geometry_utm, st_transform(ST_GeomFromText(:wkt_polygon, 4326), ST_SRID(geometry_utm))) "
+            "ORDER BY wa_code"
         )
 
         wa_list = (
@@ -1900,12 +1554,13 @@ def view_wa_polygon(polygon: str, mode: str = "web"):
     if n_wa == 0:
         return "No WA codes in polygon"
 
+    genotype_loci_values: dict = fn.get_genotype_loci_values_bulk(
+        [wa["genotype_id"] for wa in wa_list]
+    )
     loci_values: dict = {}
     for wa in wa_list:
         if wa["genotype_id"]:
-            loci_values[wa["wa_code"]] = fn.get_genotype_loci_values_redis(
-                wa["genotype_id"]
-            )
+            loci_values[wa["wa_code"]] = genotype_loci_values[wa["genotype_id"]]
 
     if mode == "web":
         return render_template(
@@ -1942,7 +1597,7 @@ def wa_analysis_group(tool: str, mode: str):
     if mode not in accepted_mode:
         return f"mode error: mode must be {','.join(accepted_mode)}"
 
-    with fn.conn_alchemy().connect() as con:
+    with fn.db_connection() as con:
         # loci list
         loci_list: dict = fn.get_loci_list()
 
@@ -1951,26 +1606,9 @@ def wa_analysis_group(tool: str, mode: str):
         # DBScan
         if tool.startswith("DBSCAN"):
             distance, cluster_id = [int(x) for x in tool.split("-")[1:]]
-            wa_list: list = []
-            for row in (
-                con.execute(
-                    text(
-                        "SELECT wa_code, "
-                        f"ST_ClusterDBSCAN(geometry_utm, eps:={distance}, minpoints:=1) over() AS cluster_id "
-                        "FROM wa_scat_dw_all "
-                        "WHERE mtdna != 'Poor DNA' "
-                        "AND date BETWEEN :start_date AND :end_date "
-                    ),
-                    {
-                        "start_date": session["start_date"],
-                        "end_date": session["end_date"],
-                    },
-                )
-                .mappings()
-                .all()
-            ):
-                if row["cluster_id"] == cluster_id:
-                    wa_list.append(row["wa_code"])
+            wa_list: list = wa_clusters.cluster_wa_codes(
+                distance, cluster_id, session["start_date"], session["end_date"]
+            )
 
         if tool.startswith("POLYGON"):
             wa_codes = (
@@ -1994,7 +1632,7 @@ def wa_analysis_group(tool: str, mode: str):
                 return "No WA codes selected"
 
             # get postgresql geometry
-            with fn.conn_alchemy().connect() as con:
+            with fn.db_connection() as con:
                 text_geom_md5 = (
                     con.execute(
                         text(
@@ -2028,7 +1666,7 @@ def wa_analysis_group(tool: str, mode: str):
 
         # load the loci list to use with colony
         colony_loci: set = set()
-        with fn.conn_alchemy().connect() as con:
+        with fn.db_connection() as con:
             for row in (
                 con.execute(text("SELECT name FROM loci WHERE use_with_colony = true"))
                 .mappings()
@@ -2039,21 +1677,14 @@ def wa_analysis_group(tool: str, mode: str):
         with open("external_functions/loci_to_use_with_colony.txt", "r") as file_in:
             colony_loci = [x.strip().upper() for x in file_in.readlines()]
 
-        valid_locus: list = []
-        for locus in loci_list:
-            if locus.upper() not in colony_loci:
-                continue
-            locus_has_values: bool = False
-            for genotype in loci_values:
-                # print(f"{genotype=}")
-                for allele in ("a", "b"):
-                    if allele not in loci_values[genotype][locus]:
-                        continue
-                    # print(f"{allele} {loci_values[genotype][locus][allele]=}")
-                    if loci_values[genotype][locus][allele]["value"] not in (0, "-"):
-                        locus_has_values = True
-            if locus_has_values:
-                valid_locus.append(locus)
+        # loci to use with colony with almost one value
+        genotypes, matrix = loci_matrix.build(loci_values, loci_list)
+        loci_mask = loci_matrix.loci_with_values(matrix) & np.array(
+            [locus.upper() in colony_loci for locus in loci_list], dtype=bool
+        )
+        valid_locus: list = [
+            locus for locus, valid in zip(loci_list, loci_mask) if valid
+        ]
 
         allele_data = []
         allele_data.append("     " + ("     ".join(valid_locus)))
@@ -2062,41 +1693,18 @@ def wa_analysis_group(tool: str, mode: str):
         allele_data.append("  ".join(["0.01"] * len(valid_locus)))
         allele_data.append("  ".join(["0.01"] * len(valid_locus)))
         allele_data.extend(["", ""])
-        for genotype in loci_values:
-            row = genotype + " "
-
-            for locus in loci_values[genotype]:
-                if locus not in valid_locus:  # no value for locus
-                    continue
-                for allele in ("a", "b"):
-                    if loci_values[genotype][locus][allele]["value"] in (0, "-"):
-                        row += "0 "
-                    else:
-                        row += f"{loci_values[genotype][locus][allele]['value']:03} "
-                row += " "
-
-            allele_data.append(row.strip())
+        allele_data.extend(loci_matrix.colony_rows(genotypes, matrix, loci_mask))
 
         allele_sex: dict = {}
         for sex in ("M", "F"):
-            allele_sex[sex] = []
-            for genotype in loci_values:
-                if data[genotype]["sex"] != sex:
-                    continue
-                row = genotype + " "
-                for locus in loci_values[genotype]:
-                    if locus not in valid_locus:  # no value for locus
-                        continue
-                    for allele in ("a", "b"):
-                        if loci_values[genotype][locus][allele]["value"] in (0, "-"):
-                            row += "0 "
-                        else:
-                            row += (
-                                f"{loci_values[genotype][locus][allele]['value']:03} "
-                            )
-                    row += " "
-
-                allele_sex[sex].append(row.strip())
+            sex_mask = np.array(
+                [data[genotype]["sex"] == sex for genotype in genotypes], dtype=bool
+            )
+            allele_sex[sex] = loci_matrix.colony_rows(
+                [genotype for genotype in genotypes if data[genotype]["sex"] == sex],
+                matrix[sex_mask],
+                loci_mask,
+            )
 
         colony_out = [
             colony_template.render(
@@ -2161,40 +1769,33 @@ def wa_analysis_group(tool: str, mode: str):
             )
             return redirect(f"/wa_analysis_group/{tool}/web")
 
-        with open(f"{input_file_name}.stdout", "w") as colony_stdout:
-            _ = subprocess.Popen(
-                [
-                    params["colony_path"],
-                    f"IFN:{input_file_name}.dat",
-                    f"OFN:{input_file_name}",
-                ],
-                stdout=colony_stdout,
-            )
-
-        # wait few seconds for errormessage
-        time.sleep(4)
-
-        # check if colony errormessage file exists
-        colony_error_message: str = ""
-        if Path("Colony2.ErrorMessage").is_file():
-            # read file content
-            with open(Path("Colony2.ErrorMessage"), "r") as file_in:
-                colony_error_message = file_in.read()
-            Path("Colony2.ErrorMessage").unlink()
+        job_id = job_queue.submit(
+            session["email"],
+            kind="colony",
+            title=f"COLONY {Path(input_file_name).name}",
+            command=[
+                params["colony_path"],
+                f"IFN:{input_file_name}.dat",
+                f"OFN:{input_file_name}",
+            ],
+            stdout=f"{input_file_name}.stdout",
+            # COLONY writes the errors in the current directory
+            error_file="Colony2.ErrorMessage",
+            workdir=True,
+        )
+        if job_id is None:
             flash(
                 fn.alert_danger(
-                    (
-                        "<b>ERROR: Colony returns the following message</b>:<br>"
-                        f"<pre>{colony_error_message}</pre><br>"
-                        "Use the <b>Export for Colony</b> button to check the input file."
-                    )
+                    f"You have already {job_queue.JOBS_MAX_PER_USER} jobs running. Wait for their completion."
                 )
             )
             return redirect(f"/wa_analysis_group/{tool}/web")
 
         flash(
             fn.alert_success(
-                "<b>The Colony program is running</b>. Reload the page continuously (F5) until the results are displayed."
+                "<b>The Colony program was queued</b>. "
+                'Follow its progress on the <a href="/jobs">jobs page</a> '
+                "and reload this page when the job is done."
             )
         )
 
@@ -2280,7 +1881,7 @@ def view_genetic_data(wa_code: str):
 
     return_to = request.args.get("return_to", default=request.referrer)
 
-    with fn.conn_alchemy().connect() as con:
+    with fn.db_connection() as con:
         # get info about WA code
         row = (
             con.execute(
@@ -2353,7 +1954,7 @@ def add_genetic_data(wa_code: str):
     """
     Let user add loci values for WA code
     """
-    with fn.conn_alchemy().connect() as con:
+    with fn.db_connection() as con:
         # get info about WA code
         row = (
             con.execute(
@@ -2568,6 +2169,7 @@ def add_genetic_data(wa_code: str):
                                         )
                                     ),
                                 )
+                                wa_flags.update_genotypes([genotype_id])
 
             return redirect(f"/view_genetic_data/{wa_code}")
 
@@ -2575,7 +2177,7 @@ def add_genetic_data(wa_code: str):
 @app.route("/view_genetic_data_history/<wa_code>/<locus>")
 @fn.check_login
 def view_genetic_data_history(wa_code: str, locus: str):
-    with fn.conn_alchemy().connect() as con:
+    with fn.db_connection() as con:
         # get info about WA code
         row = (
             con.execute(
@@ -2635,7 +2237,7 @@ def wa_locus_note(wa_code: str, locus: str, allele: str):
 
     return_to = request.args.get("return_to", default=request.referrer)
 
-    with fn.conn_alchemy().connect() as con:
+    with fn.db_connection() as con:
         data = {"wa_code": wa_code, "locus": locus, "allele": allele}
 
         if request.method == "GET":
@@ -2833,7 +2435,7 @@ def genotype_locus_note(genotype_id: str, locus: str, allele: str):
 
     session["view_genotype_id"] = genotype_id
 
-    with fn.conn_alchemy().connect() as con:
+    with fn.db_connection() as con:
         data = {"genotype_id": genotype_id, "locus": locus, "allele": allele}
 
         genotype_locus = (
@@ -2987,6 +2589,9 @@ def genotype_locus_note(genotype_id: str, locus: str, allele: str):
 
                 update_loci_values_cache(row["wa_code"], loci_list)
 
+            # divergent alleles of the WA codes of the genotype
+            wa_flags.update_genotypes([genotype_id])
+
             return redirect(f"/genotype_locus_note/{genotype_id}/{locus}/{allele}")
 
 
@@ -3006,7 +2611,7 @@ def genotype_note(genotype_id: str):
     data = {"genotype_id": genotype_id}
 
     if request.method == "GET":
-        with fn.conn_alchemy().connect() as con:
+        with fn.db_connection() as con:
             notes_row = (
                 con.execute(
                     text(
@@ -3035,7 +2640,7 @@ def genotype_note(genotype_id: str):
             )
 
     if request.method == "POST":
-        with fn.conn_alchemy().connect() as con:
+        with fn.db_connection() as con:
             sql = text(
                 "UPDATE genotypes SET working_notes = :working_notes WHERE genotype_id = :genotype_id"
             )
@@ -3067,9 +2672,9 @@ def set_wa_genotype(wa_code: str):
 
     return_to = request.args.get("return_to", default=request.referrer)
 
-    with fn.conn_alchemy().connect() as con:
+    with fn.db_connection() as con:
         if request.method == "GET":
-            with fn.conn_alchemy().connect() as con:
+            with fn.db_connection() as con:
                 result = (
                     con.execute(
                         text(
@@ -3096,7 +2701,7 @@ def set_wa_genotype(wa_code: str):
 
         if request.method == "POST":
             # check if genotype exists
-            with fn.conn_alchemy().connect() as con:
+            with fn.db_connection() as con:
                 genotype_exists = (
                     con.execute(
                         text(
@@ -3116,7 +2721,7 @@ def set_wa_genotype(wa_code: str):
                     )
                     return redirect(url_for("genetic.set_wa_genotype", wa_code=wa_code))
 
-            with fn.conn_alchemy().connect() as con:
+            with fn.db_connection() as con:
                 sql = text(
                     "UPDATE wa_results SET genotype_id = :genotype_id WHERE wa_code = :wa_code"
                 )
@@ -3128,6 +2733,8 @@ def set_wa_genotype(wa_code: str):
                     },
                 )
 
+            wa_flags.update([wa_code])
+
             return redirect(session["url_wa_list"])
 
 
@@ -3144,7 +2751,7 @@ def set_status(genotype_id):
     let user set the status of the individual
     """
 
-    with fn.conn_alchemy().connect() as con:
+    with fn.db_connection() as con:
         if request.method == "GET":
             result = (
                 con.execute(
@@ -3206,7 +2813,7 @@ def set_pack(genotype_id):
     let user set the pack of the individual
     """
 
-    with fn.conn_alchemy().connect() as con:
+    with fn.db_connection() as con:
         if request.method == "GET":
             result = (
                 con.execute(
@@ -3266,7 +2873,7 @@ def set_sex(genotype_id):
     let user set the sex of the individual
     """
 
-    with fn.conn_alchemy().connect() as con:
+    with fn.db_connection() as con:
         if request.method == "GET":
             result = (
                 con.execute(
@@ -3352,7 +2959,7 @@ def set_status_1st_recap(genotype_id):
     let user set the status_1st_recap of the individual
     """
 
-    with fn.conn_alchemy().connect() as con:
+    with fn.db_connection() as con:
         if request.method == "GET":
             result = (
                 con.execute(
@@ -3417,7 +3024,7 @@ def set_dispersal(genotype_id):
     """
     let user set the dispersal of the individual
     """
-    with fn.conn_alchemy().connect() as con:
+    with fn.db_connection() as con:
         if request.method == "GET":
             result = (
                 con.execute(
@@ -3478,7 +3085,7 @@ def set_parent(genotype_id, parent_type):
     let user set the parent (father or mother) of the individual
     """
 
-    with fn.conn_alchemy().connect() as con:
+    with fn.db_connection() as con:
         if request.method == "GET":
             if parent_type not in ("father", "mother"):
                 flash(
@@ -3605,7 +3212,7 @@ def set_hybrid(genotype_id):
     let user set the hybrid state of the individual
     """
 
-    with fn.conn_alchemy().connect() as con:
+    with fn.db_connection() as con:
         if request.method == "GET":
             result = (
                 con.execute(
@@ -3695,13 +3302,15 @@ def load_definitive_genotypes_xlsx():
         # loci list
         loci_list = fn.get_loci_list()
 
-        r, msg, data = import_.extract_genotypes_data_from_xlsx(filename, loci_list)
+        r, msg, data = upload_staging.extract(
+            filename, import_.extract_genotypes_data_from_xlsx, loci_list
+        )
 
         if r:
             flash(msg)
             return redirect("/load_definitive_genotypes_xlsx")
 
-        with fn.conn_alchemy().connect() as con:
+        with fn.db_connection() as con:
             # check if genotype_id already in DB
             genotypes_list = "','".join([data[idx]["genotype_id"] for idx in data])
             sql = text(
@@ -3732,18 +3341,28 @@ def confirm_load_definitive_genotypes_xlsx(filename):
     """
     Load new definitive genotypes from XLSX file
     """
-    from threading import Thread
-
-    thread = Thread(target=import_.import_definitive_genotypes, args=(filename,))
-    thread.start()
+    job_id = job_queue.submit(
+        session["email"],
+        kind="import_definitive_genotypes",
+        title="Import of definitive genotypes from spreadsheet file",
+        function="genetic_bp.import_:import_definitive_genotypes",
+        kwargs={"filename": filename},
+    )
+    if job_id is None:
+        flash(
+            fn.alert_danger(
+                f"You have already {job_queue.JOBS_MAX_PER_USER} jobs running. Wait for their completion."
+            )
+        )
+        return redirect("/load_definitive_genotypes_xlsx")
 
     flash(
         fn.alert_success(
-            "The genotypes are being updated.<br>It will take several minutes to complete."
+            "The genotypes are being updated.<br>See the <a href='/jobs'>jobs page</a> for the result of the import."
         )
     )
 
-    return redirect("/")
+    return redirect("/jobs")
 
 
 @app.route("/select_on_map/<samples>", methods=["GET", "POST"])
@@ -3775,7 +3394,7 @@ def select_on_map(samples: str):
         if "coordinates" in data:
             # print(Polygon([data["coordinates"]]))
 
-            with fn.conn_alchemy().connect() as con:
+            with fn.db_connection() as con:
                 result = (
                     con.execute(
                         text(
@@ -3797,7 +3416,7 @@ def select_on_map(samples: str):
                 ), 400
 
             # convert polygon in WKT
-            with fn.conn_alchemy().connect() as con:
+            with fn.db_connection() as con:
                 wkt_polygon = (
                     con.execute(
                         text("SELECT ST_AsText(ST_GeomFromGeoJSON(:geojson_polygon))"),
@@ -3827,15 +3446,38 @@ def select_on_map(samples: str):
 def check_genetic_profile():
     """
     check if a genetic profile is present in database
+    using the genetic profile index (wa_genetic_profile table)
     """
 
+    loci_list: dict = fn.get_loci_list()
+    loci: str = " ".join(
+        [x for x in loci_list.keys() if x not in genetic_profile.EXCLUDED_LOCI]
+    )
+    n_values: int = len(genetic_profile.profile_loci(loci_list))
+
     if request.method == "GET":
         return render_template(
             "check_genetic_profile.html",
-            loci=" ".join([x for x in fn.get_loci_list().keys() if x != "SRY"]),
+            loci=loci,
+            max_differences=0,
         )
 
     if request.method == "POST":
+        try:
+            max_differences = int(request.form.get("max_differences", 0) or 0)
+            if max_differences < 0:
+                raise ValueError
+        except ValueError:
+            flash(
+                fn.alert_danger("The number of differences must be a positive integer")
+            )
+            return render_template(
+                "check_genetic_profile.html",
+                loci=loci,
+                default=request.form["genetic_profile"],
+                max_differences=0,
+            )
+
         if "\t" in request.form["genetic_profile"].strip():
             separator = "\t"
         elif " " in request.form["genetic_profile"].strip():
@@ -3848,95 +3490,48 @@ def check_genetic_profile():
             )
             return render_template(
                 "check_genetic_profile.html",
-                loci=" ".join([x for x in fn.get_loci_list().keys() if x != "SRY"]),
+                loci=loci,
                 default=request.form["genetic_profile"],
+                max_differences=max_differences,
             )
 
-        genetic_profile = [
+        genetic_profile_values = [
             x.replace("-", "")
             for x in request.form["genetic_profile"].strip().split(separator)
         ]
         # check number of values
-        if len(genetic_profile) != 42:
-            flash(fn.alert_danger("The number of loci must be 42."))
+        if len(genetic_profile_values) != n_values:
+            flash(fn.alert_danger(f"The number of loci must be {n_values}."))
             return render_template(
                 "check_genetic_profile.html",
-                loci=" ".join([x for x in fn.get_loci_list().keys() if x != "SRY"]),
+                loci=loci,
                 default=request.form["genetic_profile"],
+                max_differences=max_differences,
             )
 
         # check if loci values are numeric
         try:
-            [int(x) for x in genetic_profile if x != ""]
+            profile = [int(x) if x != "" else None for x in genetic_profile_values]
         except Exception:
             flash(fn.alert_danger("Some value are not numeric"))
             return render_template(
                 "check_genetic_profile.html",
-                loci=" ".join([x for x in fn.get_loci_list().keys() if x != "SRY"]),
+                loci=loci,
                 default=request.form["genetic_profile"],
+                max_differences=max_differences,
             )
 
-        out = []
-        with fn.conn_alchemy().connect() as con:
-            for row in (
-                con.execute(
-                    text(
-                        (
-                            "SELECT "
-                            "  wl.wa_code, "
-                            "  STRING_AGG(wl.val_text::text, ';' ORDER BY ld.position, wl.allele) AS loci_values "
-                            "FROM ( "
-                            "  SELECT DISTINCT ON (wa_code, locus, allele) "
-                            "    wa_code, "
-                            "    locus, "
-                            "    allele, "
-                            "COALESCE(val::text, '') AS val_text, "
-                            "    timestamp "
-                            "  FROM "
-                            "    wa_locus "
-                            "  ORDER BY "
-                            "    wa_code, locus, allele, timestamp DESC "
-                            ") wl "
-                            "JOIN "
-                            "  loci ld ON wl.locus = ld.name "
-                            "GROUP BY wl.wa_code; "
-                            #                            "SELECT "
-                            #                            "  wl.wa_code, "
-                            #                            "  STRING_AGG(wl.val::text, ';' ORDER BY ld.position, wl.allele) AS loci_values "
-                            #                            "FROM ( "
-                            #                            "  SELECT DISTINCT ON (wa_code, locus, allele) "
-                            #                            "    wa_code, "
-                            #                            "    locus, "
-                            #                            "    allele, "
-                            #                            "    val, "
-                            #                            "    timestamp "
-                            #                            "  FROM "
-                            #                            "    wa_locus "
-                            #                            "  ORDER BY "
-                            #                            "    wa_code, locus, allele, timestamp DESC "
-                            #                            ") wl "
-                            #                            "JOIN "
-                            #                            "  loci ld ON wl.locus = ld.name "
-                            #                            "GROUP BY wl.wa_code "
-                            #                            "ORDER BY wl.wa_code; "
-                        )
-                    )
-                )
-                .mappings()
-                .fetchall()
-            ):
-                if (
-                    row["loci_values"] is not None
-                    and row["loci_values"].split(";") == genetic_profile
-                ):
-                    print(row["wa_code"])
-                    out.append(row["wa_code"])
+        out = genetic_profile.search_profile(profile, max_differences)
 
         return render_template(
             "check_genetic_profile.html",
-            genetic_profile=" ".join(["-" if x == "" else x for x in genetic_profile]),
+            genetic_profile=" ".join(
+                ["-" if x == "" else x for x in genetic_profile_values]
+            ),
             out=out,
-            loci=" ".join([x for x in fn.get_loci_list().keys() if x != "SRY"]),
+            loci=loci,
+            default=request.form["genetic_profile"],
+            max_differences=max_differences,
         )
 
 
@@ -3984,8 +3579,8 @@ def load_wa_from_spreadsheet():
             )
             return redirect(url_for("genetic.load_wa_from_spreadsheet"))
 
-        r, msg, wa_results, wa_loci = wa_import.extract_wa_data_from_spreadsheet(
-            filename
+        r, msg, wa_results, wa_loci = upload_staging.extract(
+            filename, wa_import.extract_wa_data_from_spreadsheet
         )
         if r:
             flash(
@@ -3997,7 +3592,7 @@ def load_wa_from_spreadsheet():
 
         else:
             # check if tissue_id already in DB
-            with fn.conn_alchemy().connect() as con:
+            with fn.db_connection() as con:
                 wa_list = "','".join([wa_results[idx]["wa_code"] for idx in wa_results])
                 sql = text(
                     f"SELECT wa_code FROM wa_results WHERE wa_code IN ('{wa_list}')"
@@ -4026,94 +3621,38 @@ def confirm_load_wa_spreadsheet(filename, mode):
         flash(fn.alert_danger("Error: mode not allowed"))
         return redirect("/load_tissue_from_spreadsheet")
 
-    r, msg, wa_results, wa_loci = wa_import.extract_wa_data_from_spreadsheet(filename)
+    # rows parsed and validated at the upload (see upload_staging.py)
+    r, msg, _, _ = upload_staging.extract(
+        filename, wa_import.extract_wa_data_from_spreadsheet
+    )
     if r:
         flash(msg)
         return redirect(url_for("/load_wa_from_spreadsheet"))
 
-    with fn.conn_alchemy().connect() as con:
-        # check if wa already in DB
-        wa_list = "','".join([wa_results[idx]["wa_code"] for idx in wa_results])
-        sql = text(f"SELECT wa_code FROM wa_results WHERE wa_code in ('{wa_list}')")
-
-        wa_to_update = [row["wa_code"] for row in con.execute(sql).mappings().all()]
-
-        count_added: int = 0
-        count_updated: int = 0
-
-        for idx in wa_results:
-            data = dict(wa_results[idx])
-
-            if mode == "new" and (data["wa_code"] in wa_to_update):
-                continue
-
-            sql = text(
-                "INSERT INTO wa_results (wa_code, pack, notes, genotype_id, mtdna, sex_id, individual_id, quality_genotype "
-                ")"
-                "VALUES("
-                ":wa_code, :pack, :notes, :genotype_id, :mtdna, :sex_id, :individual_id, :quality_genotype "
-                ") "
-                "ON CONFLICT (wa_code) "
-                "DO UPDATE SET "
-                "pack = CASE WHEN EXCLUDED.pack <> '' THEN EXCLUDED.pack ELSE wa_results.pack END,"
-                "notes = CASE WHEN EXCLUDED.notes <> '' THEN EXCLUDED.notes ELSE wa_results.notes END,"
-                "genotype_id = CASE WHEN EXCLUDED.genotype_id <> '' THEN EXCLUDED.genotype_id ELSE wa_results.genotype_id END,"
-                "mtdna = CASE WHEN EXCLUDED.mtdna <> '' THEN EXCLUDED.mtdna ELSE wa_results.mtdna END,"
-                "sex_id = CASE WHEN EXCLUDED.sex_id <> '' THEN EXCLUDED.sex_id ELSE wa_results.sex_id END,"
-                "individual_id = CASE WHEN EXCLUDED.individual_id <> '' THEN EXCLUDED.individual_id ELSE wa_results.individual_id END,"
-                "quality_genotype = CASE WHEN EXCLUDED.quality_genotype <> '' THEN EXCLUDED.quality_genotype ELSE wa_results.quality_genotype END"
-            )
-
-            params = {
-                "wa_code": data["wa_code"],
-                "pack": data["pack"],
-                "notes": data["notes"],
-                "genotype_id": data["genotype_id"],
-                "mtdna": data["mtdna"],
-                "sex_id": data["sex_id"],
-                "individual_id": data["individual_id"],
-                "quality_genotype": data["quality_genotype"],
-            }
-
-            if data["wa_code"] in wa_to_update:
-                count_updated += 1
-            else:
-                count_added += 1
-            try:
-                con.execute(sql, params)
-            except Exception:
-                return (
-                    "An error occured during the loading of tissues. Contact the administrator.<br>"
-                    + fn.error_info(sys.exc_info())
-                )
-
-        for idx in wa_loci:
-            data = dict(wa_loci[idx])
-            sql = text(
-                "INSERT INTO wa_locus (wa_code, locus, allele, val, timestamp, user_id, definitive) "
-                "VALUES ("
-                ":wa_code, :locus, :allele, :val, NOW(), :user_id, TRUE"
-                ")"
+    # the rows are imported by a background job (see job_queue.py)
+    job_id = job_queue.submit(
+        session["email"],
+        kind="import_wa",
+        title="Import of WA codes from spreadsheet file",
+        function="genetic_bp.wa_import:import_wa",
+        kwargs={
+            "filename": filename,
+            "mode": mode,
+            "user_id": session.get("user_name", session["email"]),
+        },
+    )
+    if job_id is None:
+        flash(
+            fn.alert_danger(
+                f"You have already {job_queue.JOBS_MAX_PER_USER} jobs running. Wait for their completion."
             )
+        )
+        return redirect(url_for("genetic.load_wa_from_spreadsheet"))
 
-            for k in data:
-                if k == "wa_code":
-                    continue
-                locus, allele = k.split("_")
-                val = data[k] if data[k] != "-" else None
-                params = {
-                    "wa_code": data["wa_code"],
-                    "locus": locus,
-                    "allele": allele,
-                    "val": val,
-                    "user_id": session.get("user_name", session["email"]),
-                }
-                con.execute(sql, params)
-
-                # update cache
-                update_loci_values_cache(data["wa_code"], fn.get_loci_list())
-
-    msg = f"WA code successfully loaded from spreadsheet file. {count_added} wa code(s) added, {count_updated} wa code(s) updated."
-    flash(fn.alert_success(msg))
+    flash(
+        fn.alert_success(
+            "The WA codes are being imported.<br>See the <a href='/jobs'>jobs page</a> for the result of the import."
+        )
+    )
 
-    return redirect("/")
+    return redirect("/jobs")
@@ -0,0 +1,170 @@
+"""
+WolfDB web service
+(c) Olivier Friard
+
+genetic profile index (wa_genetic_profile table)
+
+one row per WA code with the latest allele values in loci.position order (SRY excluded).
+The index is updated by update_loci_values_cache and update_loci_values_cache_multi
+and is used to search a genetic profile (exact match or with up to k differences).
+
+The search with up to k differences selects the candidates on the GIN index of the profile tokens
+(position * TOKEN_BASE + value, see wa_profile_tokens): the values of the searched profile are split
+in k + 1 groups and a profile with at most k differences contains all the values of at least one group.
+Only the candidates are compared value by value.
+
+see database/wa_genetic_profile.sql
+"""
+
+from sqlalchemy import text
+
+import functions as fn
+
+EXCLUDED_LOCI = ("SRY",)
+
+# must be the same value as in the wa_profile_tokens function (database/wa_genetic_profile.sql)
+TOKEN_BASE = 100000
+
+
+def profile_loci(loci_list: dict) -> list:
+    """
+    returns the list of (locus, allele) of the genetic profile in loci.position order
+    """
+    return [
+        (locus, allele)
+        for locus, n_alleles in loci_list.items()
+        if locus not in EXCLUDED_LOCI
+        for allele in ("a", "b")[:n_alleles]
+    ]
+
+
+def build_profile(loci_values: dict, loci_list: dict) -> list:
+    """
+    build the genetic profile (list of int or None for missing values)
+    from the loci values returned by fn.get_wa_loci_values
+    """
+    profile: list = []
+    for locus, allele in profile_loci(loci_list):
+        value = loci_values.get(locus, {}).get(allele, {}).get("value", "-")
+        profile.append(None if value in ("-", "", None) else int(value))
+    return profile
+
+
+def update_profile(wa_code: str, loci_values: dict, loci_list: dict) -> None:
+    """
+    insert or update the genetic profile of the WA code
+    """
+    update_profiles({wa_code: loci_values}, loci_list)
+
+
+def update_profiles(wa_loci_values: dict, loci_list: dict) -> None:
+    """
+    insert or update the genetic profiles of the WA codes ({wa_code: loci_values})
+    """
+    rows: list = []
+    for wa_code, loci_values in wa_loci_values.items():
+        profile = build_profile(loci_values, loci_list)
+        rows.append(
+            {
+                "wa_code": wa_code,
+                "profile": profile,
+                "n_values": len([x for x in profile if x is not None]),
+            }
+        )
+    if not rows:
+        return
+
+    with fn.db_connection() as con:
+        con.execute(
+            text(
+                "INSERT INTO wa_genetic_profile (wa_code, profile, n_values) "
+                "VALUES (:wa_code, :profile, :n_values) "
+                "ON CONFLICT (wa_code) "
+                "DO UPDATE "
+                "SET profile = EXCLUDED.profile, "
+                "    n_values = EXCLUDED.n_values, "
+                "    updated_at = now() "
+            ),
+            rows,
+        )
+
+
+def token_groups(profile: list, n_groups: int) -> list:
+    """
+    returns the tokens (position from 1 * TOKEN_BASE + value) of the non missing values of the profile
+    split in n_groups groups
+    """
+    tokens = [
+        (position + 1) * TOKEN_BASE + value
+        for position, value in enumerate(profile)
+        if value is not None
+    ]
+    return [tokens[idx::n_groups] for idx in range(n_groups)]
+
+
+def search_profile(profile: list, max_differences: int = 0) -> list:
+    """
+    search the WA codes matching the genetic profile.
+    A difference is a mismatching value or a value missing in only one of the two profiles.
+
+    Args:
+        profile (list): values (int or None for missing value) in profile_loci order
+        max_differences (int): max number of differences allowed (0 for exact match)
+
+    Returns:
+        list: list of dict (wa_code, mismatches, missing) ranked by number of differences
+    """
+
+    with fn.db_connection() as con:
+        if max_differences == 0:
+            # exact match uses the index on profile
+            return [
+                dict(row)
+                for row in con.execute(
+                    text(
+                        "SELECT wa_code, 0 AS mismatches, 0 AS missing "
+                        "FROM wa_genetic_profile "
+                        "WHERE profile = CAST(:profile AS integer[]) "
+                        "ORDER BY wa_code"
+                    ),
+                    {"profile": profile},
+                )
+                .mappings()
+                .all()
+            ]
+
+        # candidates: the profiles containing all the values of at least one group
+        # (an empty group selects all the profiles)
+        groups = token_groups(profile, max_differences + 1)
+        candidates = " OR ".join(
+            f"wa_profile_tokens(p.profile) @> CAST(:group{idx} AS integer[])"
+            for idx in range(len(groups))
+        )
+        values: dict = {f"group{idx}": group for idx, group in enumerate(groups)}
+        values.update({"profile": profile, "max_differences": max_differences})
+
+        return [
+            dict(row)
+            for row in con.execute(
+                text(
+                    "SELECT wa_code, mismatches, missing "
+                    "FROM ( "
+                    "  SELECT p.wa_code, d.mismatches, d.missing "
+                    "  FROM wa_genetic_profile p "
+                    "  CROSS JOIN LATERAL ( "
+                    "    SELECT "
+                    "      count(*) FILTER (WHERE u.a IS NOT NULL AND u.b IS NOT NULL AND u.a != u.b) AS mismatches, "
+                    "      count(*) FILTER (WHERE (u.a IS NULL) != (u.b IS NULL)) AS missing "
+                    "    FROM unnest(p.profile, CAST(:profile AS integer[])) AS u(a, b) "
+                    "  ) d "
+                    "  WHERE cardinality(p.profile) = cardinality(CAST(:profile AS integer[])) "
+                    f"   AND ({candidates}) "
+                    ") candidates "
+                    "WHERE mismatches + missing <= :max_differences "
+                    "ORDER BY mismatches + missing, mismatches, wa_code"
+                ),
+                values,
+            )
+            .mappings()
+            .all()
+        ]
@@ -7,11 +7,16 @@ import pathlib as pl
 
 import pandas as pd
 import redis
+from markupsafe import Markup
 from sqlalchemy import text
 
 import functions as fn
+import job_queue
+import upload_staging
 from config import config
 
+from . import wa_flags
+
 params = config()
 # db wolf -> db 0
 rdis = redis.Redis(db=(0 if params["database"] == "wolf" else 1))
@@ -162,10 +167,18 @@ def extract_genotypes_data_from_xlsx(filename, loci_list):
 
 
 def import_definitive_genotypes(filename):
+    """
+    import the definitive genotypes of the uploaded file (background job, see job_queue.py)
+    """
     # loci list
     loci_list = fn.get_loci_list()
 
-    _, _, data = extract_genotypes_data_from_xlsx(filename, loci_list)
+    # rows parsed and validated at the upload (see upload_staging.py)
+    r, msg, data = upload_staging.extract(
+        filename, extract_genotypes_data_from_xlsx, loci_list
+    )
+    if r:
+        raise ValueError(Markup(msg).striptags())
 
     insert_sql = text(
         "INSERT INTO genotypes ("
@@ -219,7 +232,7 @@ def import_definitive_genotypes(filename):
         "mtdna = EXCLUDED.mtdna"
     )
 
-    with fn.conn_alchemy().connect() as con:
+    with fn.db_connection() as con:
         # check if genotype_id already in DB
         genotypes_list = "','".join([data[idx]["genotype_id"] for idx in data])
         sql = text(
@@ -283,3 +296,10 @@ def import_definitive_genotypes(filename):
                     fn.get_genotype_loci_values(values["genotype_id"], loci_list)
                 ),
             )
+
+    # divergent alleles of the WA codes of the genotypes
+    wa_flags.update_genotypes([data[idx]["genotype_id"] for idx in data])
+
+    upload_staging.discard(filename)
+
+    job_queue.progress(100, f"{len(data)} genotype(s) loaded")
@@ -0,0 +1,133 @@
+"""
+WolfDB web service
+(c) Olivier Friard
+
+loci matrix
+
+The loci values of a set of WA codes (or genotypes) are stored in an integer matrix
+(WA code × locus × allele) with MISSING for the missing values ("-" or 0).
+The matrix is built once from the loci values retrieved in bulk (see fn.get_wa_loci_values_bulk)
+and is used for the cluster analysis (wa_analysis, wa_analysis_group) and to create the
+ML-Relate and COLONY input files.
+"""
+
+import numpy as np
+
+import functions as fn
+
+# missing allele value ("-" or 0)
+MISSING: int = -1
+
+ALLELES: tuple = ("a", "b")
+
+
+def allele_value(value) -> int:
+    """
+    returns the allele value as int (MISSING if no value)
+    """
+    if value in ("-", "", None, 0, "0"):
+        return MISSING
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return MISSING
+
+
+def build(loci_values: dict, loci_list: dict) -> tuple[list, np.ndarray]:
+    """
+    build the loci matrix
+
+    Args:
+        loci_values (dict): {key: loci_values} (see fn.get_wa_loci_values_bulk)
+        loci_list (dict): see fn.get_loci_list
+
+    Returns:
+        list: keys (WA codes or genotypes) in the order of the rows of the matrix
+        np.ndarray: matrix of shape (n keys, n loci, 2)
+    """
+    keys: list = list(loci_values)
+    matrix = np.full((len(keys), len(loci_list), len(ALLELES)), MISSING, dtype=np.int32)
+    for row_idx, key in enumerate(keys):
+        for locus_idx, locus in enumerate(loci_list):
+            locus_values = loci_values[key].get(locus, {})
+            for allele_idx, allele in enumerate(ALLELES):
+                if allele in locus_values:
+                    matrix[row_idx, locus_idx, allele_idx] = allele_value(
+                        locus_values[allele]["value"]
+                    )
+    return keys, matrix
+
+
+def from_wa_codes(wa_codes: list, loci_list: dict) -> tuple[dict, list, np.ndarray]:
+    """
+    retrieve the loci values of the WA codes in bulk and build the loci matrix
+
+    Returns:
+        dict: {wa_code: loci_values}
+        list: WA codes in the order of the rows of the matrix
+        np.ndarray: loci matrix
+    """
+    loci_values: dict = fn.get_wa_loci_values_bulk(wa_codes)
+    return loci_values, *build(loci_values, loci_list)
+
+
+def loci_with_values(matrix: np.ndarray) -> np.ndarray:
+    """
+    returns a boolean mask of the loci with at least one value
+    """
+    return (matrix != MISSING).any(axis=(0, 2))
+
+
+def rows_with_values(matrix: np.ndarray) -> np.ndarray:
+    """
+    returns a boolean mask of the rows (WA codes or genotypes) with at least one value
+    """
+    return (matrix != MISSING).any(axis=(1, 2))
+
+
+def format_rows(
+    keys: list,
+    matrix: np.ndarray,
+    loci_mask: np.ndarray,
+    missing: str,
+    key_sep: str,
+    allele_sep: str,
+    locus_sep: str,
+) -> list:
+    """
+    returns the rows of the matrix as text for the selected loci (the missing values are replaced by missing)
+    """
+    rows: list = []
+    for key, values in zip(keys, matrix[:, loci_mask, :].tolist()):
+        rows.append(
+            (
+                key
+                + key_sep
+                + locus_sep.join(
+                    allele_sep.join(missing if x == MISSING else f"{x:03}" for x in locus)
+                    for locus in values
+                )
+            ).rstrip()
+        )
+    return rows
+
+
+def ml_relate_input(title: str, keys: list, matrix: np.ndarray, loci_list: dict) -> list:
+    """
+    create the lines of the input file for ML-Relate (Genepop format)
+    with the loci that have at least one value
+    """
+    loci_mask = loci_with_values(matrix)
+    return (
+        [title]
+        + [locus for locus, has_values in zip(loci_list, loci_mask) if has_values]
+        + ["Pop"]
+        + format_rows(keys, matrix, loci_mask, "000", "\t,\t", "", "\t")
+    )
+
+
+def colony_rows(keys: list, matrix: np.ndarray, loci_mask: np.ndarray) -> list:
+    """
+    create the allele lines of the input file for COLONY
+    """
+    return format_rows(keys, matrix, loci_mask, "0", " ", " ", "  ")
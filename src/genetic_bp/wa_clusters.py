@@ -0,0 +1,132 @@
+"""
+WolfDB web service
+(c) Olivier Friard
+
+DBSCAN clusters of the WA codes (ST_ClusterDBSCAN on wa_scat_dw_all)
+
+The cluster assignments are computed once by distance and date range
+and cached in redis (tiles cache db) in a hash:
+wa_clusters:{version}:{distance}:{start_date}:{end_date} -> {cluster_id: JSON list of WA codes}
+
+The version (fn.wa_clusters_version) is incremented by fn.invalidate_wa_clusters
+after a modification of the scats, of the dead wolves or of the WA results:
+the clusters are then recomputed at the next request and the old ones expire after fn.WA_CLUSTERS_CACHE_TTL.
+
+The cluster drill-down (wa_analysis, wa_analysis_group) reads only the field of the cluster.
+"""
+
+import json
+
+import redis
+from sqlalchemy import text
+
+import functions as fn
+
+MINPOINTS = 1
+
+# field marking a computed clustering (a clustering can be empty)
+COMPUTED = "computed"
+
+
+def cache_key(distance: int, start_date: str, end_date: str) -> str:
+    return f"wa_clusters:{fn.wa_clusters_version()}:{distance}:{start_date}:{end_date}"
+
+
+def compute(distance: int, start_date: str, end_date: str) -> dict:
+    """
+    compute the DBSCAN clusters of the WA codes
+
+    Returns:
+        dict: {cluster_id: [wa_code, ...]}
+    """
+    clusters: dict = {}
+    with fn.db_connection() as con:
+        for row in con.execute(
+            text(
+                "SELECT wa_code, "
+                "ST_ClusterDBSCAN(geometry_utm, eps:= :distance, minpoints:= :minpoints) OVER(ORDER BY wa_code) AS cluster_id "
+                "FROM wa_scat_dw_all "
+                "WHERE mtdna != 'Poor DNA' "
+                "AND date BETWEEN :start_date AND :end_date"
+            ),
+            {
+                "distance": distance,
+                "minpoints": MINPOINTS,
+                "start_date": start_date,
+                "end_date": end_date,
+            },
+        ).mappings():
+            if row["cluster_id"] is not None:
+                clusters.setdefault(row["cluster_id"], []).append(row["wa_code"])
+    return clusters
+
+
+def store(key: str, clusters: dict) -> None:
+    """
+    write the clusters in the redis cache
+    """
+    try:
+        with fn.rtiles.pipeline(transaction=True) as pipe:
+            pipe.delete(key)
+            pipe.hset(
+                key,
+                mapping={COMPUTED: "1"}
+                | {str(cluster_id): json.dumps(wa_codes) for cluster_id, wa_codes in clusters.items()},
+            )
+            pipe.expire(key, fn.WA_CLUSTERS_CACHE_TTL)
+            pipe.execute()
+    except redis.exceptions.ConnectionError:
+        pass
+
+
+def clusters(distance: int, start_date: str, end_date: str) -> dict:
+    """
+    returns the DBSCAN clusters of the WA codes (from the cache if available)
+
+    Returns:
+        dict: {cluster_id: [wa_code, ...]}
+    """
+    key = cache_key(distance, start_date, end_date)
+    try:
+        cached = fn.rtiles.hgetall(key)
+    except redis.exceptions.ConnectionError:
+        cached = {}
+    if cached:
+        return {
+            int(cluster_id): json.loads(wa_codes)
+            for cluster_id, wa_codes in cached.items()
+            if cluster_id != COMPUTED.encode()
+        }
+
+    result = compute(distance, start_date, end_date)
+    store(key, result)
+    return result
+
+
+def cluster_wa_codes(distance: int, cluster_id: int, start_date: str, end_date: str) -> list:
+    """
+    returns the WA codes of the cluster
+    """
+    key = cache_key(distance, start_date, end_date)
+    try:
+        computed, wa_codes = fn.rtiles.hmget(key, [COMPUTED, str(cluster_id)])
+    except redis.exceptions.ConnectionError:
+        computed, wa_codes = None, None
+    if computed is not None:
+        return json.loads(wa_codes) if wa_codes is not None else []
+
+    return clusters(distance, start_date, end_date).get(cluster_id, [])
+
+
+def assignments(distance: int, start_date: str, end_date: str) -> dict:
+    """
+    returns the cluster ID of every WA code
+
+    Returns:
+        dict: {wa_code: cluster_id}
+    """
+    return {
+        wa_code: cluster_id
+        for cluster_id, wa_codes in clusters(distance, start_date, end_date).items()
+        for wa_code in wa_codes
+    }
@@ -0,0 +1,185 @@
+"""
+WolfDB web service
+(c) Olivier Friard
+
+quality flags of the WA codes (columns of the wa_loci_values table)
+
+has_values: at least one allele with a value
+has_open_notes: at least one allele with a history not definitive (red flag)
+n_divergent_alleles: number of alleles with a value different from the value of the genotype (orange flag)
+last_changed: time of the last computation
+
+The flags are computed by update_loci_values_cache (loci values of a WA code),
+after a modification of the loci values of a genotype (update_genotypes)
+and after a modification of the genotype of a WA code.
+The filters and the pagination of the WA codes lists use the flags (see database/wa_loci_flags.sql),
+the colors of the alleles are computed only for the rows of the page (decorate).
+
+full rebuild: python update_db_with_wa_loci_values.py
+"""
+
+from markupsafe import Markup
+from sqlalchemy import text
+
+import functions as fn
+from config import config
+
+params = config()
+
+RED_FLAG = Markup("&#128681;")
+ORANGE_FLAG = Markup("&#128312;")
+DIVERGENT_ALLELE = Markup('<span style="font-size:24px">&#128312;</span>')
+
+
+def has_value(allele_values: dict) -> bool:
+    """
+    True if the allele has a value
+    """
+    return allele_values.get("value") not in (0, "-", "", None)
+
+
+def is_open_note(allele_values: dict) -> bool:
+    """
+    True if the allele has a history not definitive
+    """
+    return bool(allele_values.get("has_history")) and not allele_values.get("definitive")
+
+
+def is_divergent(allele_values: dict, genotype_loci_values: dict | None, locus: str, allele: str) -> bool:
+    """
+    True if the value of the allele is different from the value of the genotype
+    """
+    if not genotype_loci_values or not has_value(allele_values):
+        return False
+    try:
+        return genotype_loci_values[locus][allele]["value"] != allele_values["value"]
+    except KeyError:
+        return False
+
+
+def compute(loci_values: dict, genotype_loci_values: dict | None) -> dict:
+    """
+    returns the flags of the loci values of a WA code
+    """
+    flags: dict = {"has_values": False, "has_open_notes": False, "n_divergent_alleles": 0}
+    for locus in loci_values:
+        for allele in ("a", "b"):
+            if allele not in loci_values[locus]:
+                continue
+            allele_values = loci_values[locus][allele]
+            flags["has_values"] |= has_value(allele_values)
+            flags["has_open_notes"] |= is_open_note(allele_values)
+            flags["n_divergent_alleles"] += is_divergent(
+                allele_values, genotype_loci_values, locus, allele
+            )
+    return flags
+
+
+def update(wa_codes: list) -> None:
+    """
+    compute and store the flags of the WA codes (the loci values must be in the wa_loci_values table)
+    """
+    wa_codes = list(dict.fromkeys(x for x in wa_codes if x is not None))
+    if not wa_codes:
+        return
+
+    with fn.db_connection() as con:
+        genotypes: dict = {
+            row["wa_code"]: row["genotype_id"]
+            for row in con.execute(
+                text("SELECT wa_code, genotype_id FROM wa_results WHERE wa_code = ANY(:wa_codes)"),
+                {"wa_codes": wa_codes},
+            ).mappings()
+        }
+
+    loci_values: dict = fn.get_wa_loci_values_bulk(wa_codes)
+    genotype_loci_values: dict = fn.get_genotype_loci_values_bulk(list(genotypes.values()))
+
+    rows: list = []
+    for wa_code in wa_codes:
+        flags = compute(
+            loci_values.get(wa_code, {}),
+            genotype_loci_values.get(genotypes.get(wa_code)),
+        )
+        rows.append({"wa_code": wa_code, **flags})
+
+    with fn.db_connection() as con:
+        con.execute(
+            text(
+                "UPDATE wa_loci_values w "
+                "SET has_values = f.has_values, "
+                "    has_open_notes = f.has_open_notes, "
+                "    n_divergent_alleles = f.n_divergent_alleles, "
+                "    last_changed = now() "
+                "FROM unnest(CAST(:wa_codes AS text[]), CAST(:has_values AS boolean[]), "
+                "            CAST(:has_open_notes AS boolean[]), CAST(:n_divergent_alleles AS integer[])) "
+                "     AS f(wa_code, has_values, has_open_notes, n_divergent_alleles) "
+                "WHERE w.wa_code = f.wa_code"
+            ),
+            {
+                "wa_codes": [row["wa_code"] for row in rows],
+                "has_values": [row["has_values"] for row in rows],
+                "has_open_notes": [row["has_open_notes"] for row in rows],
+                "n_divergent_alleles": [row["n_divergent_alleles"] for row in rows],
+            },
+        )
+
+
+def update_genotypes(genotype_ids: list) -> None:
+    """
+    compute and store the flags of the WA codes of the genotypes
+    """
+    with fn.db_connection() as con:
+        wa_codes = [
+            row["wa_code"]
+            for row in con.execute(
+                text("SELECT wa_code FROM wa_results WHERE genotype_id = ANY(:genotype_ids)"),
+                {"genotype_ids": [x for x in genotype_ids if x is not None]},
+            ).mappings()
+        ]
+    update(wa_codes)
+
+
+def decorate(rows: list) -> tuple[dict, dict]:
+    """
+    returns the loci values of the WA codes of the rows (page of a list) with the colors of the notes
+    and the divergent alleles, and the flags of the WA codes (red flag: open notes, orange: divergent alleles)
+
+    Args:
+        rows (list): rows with wa_code, genotype_id, has_open_notes and n_divergent_alleles
+
+    Returns:
+        dict: {wa_code: loci_values}
+        dict: {wa_code: flags}
+    """
+    wa_loci_values: dict = fn.get_wa_loci_values_bulk([row["wa_code"] for row in rows])
+    genotype_loci_values: dict = fn.get_genotype_loci_values_bulk(
+        [row["genotype_id"] for row in rows]
+    )
+
+    loci_values: dict = {}
+    locus_notes: dict = {}
+    for row in rows:
+        loci_values[row["wa_code"]] = dict(wa_loci_values.get(row["wa_code"], {}))
+        genotype_values = genotype_loci_values.get(row["genotype_id"])
+        for locus in loci_values[row["wa_code"]]:
+            for allele in ("a", "b"):
+                if allele not in loci_values[row["wa_code"]][locus]:
+                    continue
+                allele_values = loci_values[row["wa_code"]][locus][allele]
+                if allele_values["has_history"]:
+                    allele_values["color"] = (
+                        params["green_note"] if allele_values["definitive"] else params["red_note"]
+                    )
+                allele_values["divergent_allele"] = (
+                    DIVERGENT_ALLELE
+                    if row["genotype_id"] and is_divergent(allele_values, genotype_values, locus, allele)
+                    else ""
+                )
+
+        if row["has_open_notes"]:
+            locus_notes[row["wa_code"]] = RED_FLAG
+        if row["n_divergent_alleles"]:
+            locus_notes[row["wa_code"]] = locus_notes.get(row["wa_code"], Markup("")) + ORANGE_FLAG
+
+    return loci_values, locus_notes
@@ -1,10 +1,14 @@
+import time
 from pathlib import Path
 
 import pandas as pd
 from markupsafe import Markup
 from sqlalchemy import text
 
+import bulk_import
 import functions as fn
+import job_queue
+import upload_staging
 from config import config
 
 DEBUG = False
@@ -92,7 +96,7 @@ def extract_wa_data_from_spreadsheet(filename: str):
         )
 
     # loci list
-    with fn.conn_alchemy().connect() as con:
+    with fn.db_connection() as con:
         rows = con.execute(
             text(
                 "(SELECT CONCAT(name, '_a') AS n, position FROM loci WHERE name != 'SRY' UNION SELECT CONCAT(name, '_b') AS n, position FROM loci WHERE name != 'SRY') ORDER BY position, n "
@@ -152,3 +156,116 @@ def extract_wa_data_from_spreadsheet(filename: str):
         index += 1
 
     return False, "", wa_results, wa_loci
+
+
+def import_wa(filename: str, mode: str, user_id: str) -> None:
+    """
+    import the WA codes and their loci values of the uploaded file (background job, see job_queue.py)
+
+    Args:
+        filename (str): name of the uploaded file (UUID)
+        mode (str): new (only the new WA codes are imported) or all (new and existing WA codes)
+        user_id (str): user of the loci values
+    """
+    # genetic.py imports this module
+    from .genetic import update_loci_values_cache_multi
+
+    # rows parsed and validated at the upload (see upload_staging.py)
+    r, msg, wa_results, wa_loci = upload_staging.extract(
+        filename, extract_wa_data_from_spreadsheet
+    )
+    if r:
+        raise ValueError(Markup(msg).striptags())
+
+    t0 = time.time()
+
+    with fn.db_connection() as con:
+        # check if wa already in DB
+        wa_to_update = set(
+            con.execute(
+                text("SELECT wa_code FROM wa_results WHERE wa_code = ANY(:wa_codes)"),
+                {"wa_codes": [wa_results[idx]["wa_code"] for idx in wa_results]},
+            )
+            .scalars()
+            .all()
+        )
+
+    results_rows: list = []
+    for idx in wa_results:
+        data = dict(wa_results[idx])
+
+        if mode == "new" and (data["wa_code"] in wa_to_update):
+            continue
+
+        results_rows.append(
+            {
+                "wa_code": data["wa_code"],
+                "pack": data["pack"],
+                "notes": data["notes"],
+                "genotype_id": data["genotype_id"],
+                "mtdna": data["mtdna"],
+                "sex_id": data["sex_id"],
+                "individual_id": data["individual_id"],
+                "quality_genotype": data["quality_genotype"],
+            }
+        )
+
+    count_updated: int = len([row for row in results_rows if row["wa_code"] in wa_to_update])
+    count_added: int = len(results_rows) - count_updated
+
+    # one row by allele
+    loci_rows: list = []
+    for idx in wa_loci:
+        data = dict(wa_loci[idx])
+        for k in data:
+            if k == "wa_code":
+                continue
+            locus, allele = k.split("_")
+            loci_rows.append(
+                {
+                    "wa_code": data["wa_code"],
+                    "locus": locus,
+                    "allele": allele,
+                    "val": data[k] if data[k] != "-" else None,
+                    "user_id": user_id,
+                }
+            )
+
+    job_queue.progress(10, f"{len(results_rows)} WA codes and {len(loci_rows)} alleles to import")
+
+    # staging tables, one upsert of the WA results and one insert of the alleles (see bulk_import.py)
+    with bulk_import.transaction() as con:
+        if results_rows:
+            columns: tuple = tuple(results_rows[0])
+            staging = bulk_import.stage(con, "wa_results", columns, results_rows)
+            bulk_import.merge(con, "wa_results", staging, "wa_code", columns)
+        if loci_rows:
+            columns = tuple(loci_rows[0])
+            staging = bulk_import.stage(con, "wa_locus", columns, loci_rows)
+            bulk_import.insert(
+                con,
+                "wa_locus",
+                staging,
+                columns,
+                {'"timestamp"': "NOW()", "definitive": "TRUE"},
+            )
+
+    upload_staging.discard(filename)
+
+    # the mtDNA of the WA codes may have changed
+    fn.invalidate_wa_clusters()
+
+    job_queue.progress(60, "updating the loci values cache")
+
+    # update cache (loci values, genetic profiles and quality flags) once by WA code
+    update_loci_values_cache_multi(
+        [wa_loci[idx]["wa_code"] for idx in wa_loci], fn.get_loci_list()
+    )
+
+    job_queue.progress(
+        100,
+        (
+            f"{count_added} wa code(s) added, {count_updated} wa code(s) updated "
+            f"({bulk_import.rate(len(results_rows) + len(loci_rows), t0)})."
+        ),
+    )
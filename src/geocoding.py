@@ -0,0 +1,189 @@
+"""
+WolfDB web service
+(c) Olivier Friard
+
+reverse geocoding of GPS coordinates (longitude, latitude)
+
+The municipality, the province, the region and the country of a point are found in the layers
+of the database: point in the polygons of the comuni table (GiST index) and geo_info table.
+The points outside the comuni polygons (outside Italy) are geocoded by Nominatim (fn.reverse_geocoding),
+max one request by NOMINATIM_INTERVAL seconds (Nominatim usage policy).
+The comuni layer has no localities: the location is empty for the points found in the database.
+
+The results are cached in memory by cell of a grid (GRID_CELL degrees, about 10 m):
+LRU cache of geocoding_cache_size cells (default 100000).
+The points not found by Nominatim are cached too (None),
+the points not geocoded because of a request error are not cached (the request is done again by the next call).
+
+reverse_geocoding_batch geocodes a list of points with one query by chunk of CHUNK_SIZE points
+(see add_location_info_to_scats.py and add_location_info_to_transects.py).
+"""
+
+import threading
+import time
+import urllib.error
+from collections import OrderedDict
+
+from sqlalchemy import text
+
+import functions as fn
+from config import config
+
+params = config()
+
+# size of the cells of the cache (degrees)
+GRID_CELL = 0.0001
+CACHE_SIZE = int(params.get("geocoding_cache_size", 100000))
+CHUNK_SIZE = 5000
+# min number of seconds between two Nominatim requests
+NOMINATIM_INTERVAL = 1.0
+
+# cached value of the cells outside the comuni layer not geocoded by Nominatim
+OUTSIDE = "outside"
+# result of a Nominatim request that failed (HTTP or URL error, timeout)
+NOMINATIM_ERROR = "error"
+
+_cache: OrderedDict = OrderedDict()
+_cache_lock = threading.Lock()
+_nominatim_lock = threading.Lock()
+_nominatim_last: float = 0.0
+
+# municipality, province and region of the points (comuni: EPSG 32632)
+LOCATE_SQL = (
+    "SELECT p.idx, c.comune, g.province_code, g.province_name, g.region, g.country "
+    "FROM unnest(CAST(:lon AS double precision[]), CAST(:lat AS double precision[])) "
+    "     WITH ORDINALITY AS p(lon, lat, idx) "
+    "LEFT JOIN LATERAL ( "
+    "    SELECT co.comune, co.cod_prov, co.cod_reg FROM comuni co "
+    "    WHERE ST_Intersects(co.wkb_geometry, "
+    "                        ST_Transform(ST_SetSRID(ST_MakePoint(p.lon, p.lat), 4326), 32632)) "
+    "    LIMIT 1 "
+    ") c ON TRUE "
+    "LEFT JOIN LATERAL ( "
+    "    SELECT gi.province_code, gi.province_name, gi.region, gi.country FROM geo_info gi "
+    "    WHERE gi.province_code_num = c.cod_prov::int AND gi.region_code_num = c.cod_reg::int "
+    "    LIMIT 1 "
+    ") g ON TRUE "
+    "ORDER BY p.idx"
+)
+
+
+def cell(lon_lat: list | tuple) -> tuple:
+    """
+    returns the cell of the grid containing the point
+    """
+    longitude, latitude = lon_lat
+    return round(float(longitude) / GRID_CELL), round(float(latitude) / GRID_CELL)
+
+
+def cell_center(key: tuple) -> tuple:
+    """
+    returns the coordinates (longitude, latitude) of the center of the cell
+    """
+    return key[0] * GRID_CELL, key[1] * GRID_CELL
+
+
+def locate(points: list) -> list:
+    """
+    returns the locations of the points (longitude, latitude) in the comuni layer
+    (None for the points outside the polygons)
+    """
+    out: list = []
+    with fn.db_connection() as con:
+        for idx in range(0, len(points), CHUNK_SIZE):
+            chunk = points[idx : idx + CHUNK_SIZE]
+            for row in con.execute(
+                text(LOCATE_SQL),
+                {"lon": [float(x[0]) for x in chunk], "lat": [float(x[1]) for x in chunk]},
+            ).mappings():
+                if row["comune"] is None:
+                    out.append(None)
+                    continue
+                out.append(
+                    {
+                        "continent": "Europe",
+                        "country": row["country"] or "",
+                        "region": row["region"] or "",
+                        "province": row["province_name"] or "",
+                        "province_code": row["province_code"] or "",
+                        "municipality": row["comune"],
+                        "location": "",
+                    }
+                )
+    return out
+
+
+def nominatim_reverse_geocoding(lon_lat: tuple) -> dict | str | None:
+    """
+    geocode the point with Nominatim (max one request by NOMINATIM_INTERVAL seconds for the process)
+
+    Returns:
+        the location, None if Nominatim found no address, NOMINATIM_ERROR if the request failed
+    """
+    global _nominatim_last
+
+    with _nominatim_lock:
+        wait = _nominatim_last + NOMINATIM_INTERVAL - time.monotonic()
+        if wait > 0:
+            time.sleep(wait)
+        try:
+            return fn.reverse_geocoding(list(lon_lat), raise_errors=True)
+        except (urllib.error.URLError, TimeoutError):
+            return NOMINATIM_ERROR
+        finally:
+            _nominatim_last = time.monotonic()
+
+
+def reverse_geocoding_batch(points: list, nominatim: bool = True) -> list:
+    """
+    returns the locations of a list of points (longitude, latitude), None for the points not found.
+
+    Args:
+        points (list): list of (longitude, latitude)
+        nominatim (bool): geocode the points outside the comuni layer with Nominatim
+                          (one request by second)
+    """
+    keys: list = [cell(point) for point in points]
+    results: dict = {}
+
+    with _cache_lock:
+        for key in keys:
+            if key in _cache:
+                results[key] = _cache[key]
+                _cache.move_to_end(key)
+
+    # cells not cached and cells outside the comuni layer not yet geocoded by Nominatim
+    missing: list = list(dict.fromkeys(key for key in keys if key not in results))
+    outside: list = list(
+        dict.fromkeys(key for key in keys if nominatim and results.get(key) == OUTSIDE)
+    )
+    if missing:
+        for key, location in zip(missing, locate([cell_center(key) for key in missing])):
+            results[key] = OUTSIDE if location is None else location
+            if location is None and nominatim:
+                outside.append(key)
+
+    # the cells with a failed request are cached as OUTSIDE, not as not found:
+    # Nominatim is requested again by the next call
+    for key in outside:
+        location = nominatim_reverse_geocoding(cell_center(key))
+        results[key] = OUTSIDE if location == NOMINATIM_ERROR else location
+
+    if missing or outside:
+        with _cache_lock:
+            for key in missing + outside:
+                _cache[key] = results[key]
+                _cache.move_to_end(key)
+            while len(_cache) > CACHE_SIZE:
+                _cache.popitem(last=False)
+
+    return [
+        dict(results[key]) if isinstance(results[key], dict) else None for key in keys
+    ]
+
+
+def reverse_geocoding(lon_lat: list) -> dict | None:
+    """
+    get place from GPS coordinates (longitude, latitude)
+    """
+    return reverse_geocoding_batch([lon_lat])[0]
@@ -124,7 +124,7 @@ def google_auth_redirect():
     user_info = get_user_info()
 
     # check if email contained in email field of users table
-    with fn.conn_alchemy().connect() as con:
+    with fn.db_connection() as con:
         row = (
             con.execute(
                 text("SELECT * FROM users WHERE email = :email"),
@@ -42,7 +42,7 @@ for shape in shapes:
     coord_list = shape["geometry"]["coordinates"][0]
     coord_str = ", ".join([f"{round(x[0])} {round(x[1])}" for x in coord_list])
 
-    with fn.conn_alchemy().connect() as con:
+    with fn.db_connection() as con:
         sql = text(
             f"SELECT transect_id FROM transects WHERE ST_INTERSECTS(ST_GeomFromText('POLYGON(({coord_str}))', 32632), multilines); "
         )
@@ -0,0 +1,456 @@
+"""
+WolfDB web service
+(c) Olivier Friard
+
+background jobs for long-running analyses
+
+Jobs are stored in redis (jobs_redis_db) and executed by worker processes.
+Every job runs in its own process and can report its progress with the progress function.
+The worker of a running job writes a heartbeat in the job: a running job without recent heartbeat
+or whose worker process does not exist anymore (worker stopped, restarted or killed)
+is set as failed when the jobs of the user are listed or when the job is cancelled.
+
+start the workers (from the directory of wolfdb.py) with:
+export WOLFDB_CONFIG_PATH=PATH_TO/config.ini; python job_queue.py [NUMBER_OF_WORKERS]
+
+config.ini options (all optional):
+jobs_redis_db: redis db used for the jobs (default 2, 3 for the dev database)
+jobs_workers: number of worker processes (default 2)
+jobs_max_per_user: max number of queued or running jobs for a user (default 2)
+jobs_retention_days: number of days the finished jobs are kept (default 7)
+"""
+
+import datetime as dt
+import importlib
+import json
+import multiprocessing
+import os
+import pathlib as pl
+import shutil
+import socket
+import subprocess
+import sys
+import time
+import uuid
+
+import redis
+
+from config import config
+
+params = config()
+
+JOBS_REDIS_DB = int(
+    params.get("jobs_redis_db", 2 if params.get("database") == "wolf" else 3)
+)
+JOBS_WORKERS = int(params.get("jobs_workers", 2))
+JOBS_MAX_PER_USER = int(params.get("jobs_max_per_user", 2))
+JOBS_RETENTION = int(params.get("jobs_retention_days", 7)) * 86400
+
+# job status
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+ACTIVE_STATUS = (QUEUED, RUNNING)
+
+QUEUE_KEY = "jobs:queue"
+# environment variable containing the job ID in the job process
+JOB_ID_ENV = "WOLFDB_JOB_ID"
+
+# seconds between two checks of the job process (and two heartbeats)
+POLL_INTERVAL = 1
+# seconds without heartbeat after which a running job is considered stale
+HEARTBEAT_TIMEOUT = 60
+# max length of the error message saved in the job
+MAX_ERROR_LENGTH = 4000
+
+rjobs = redis.Redis(db=JOBS_REDIS_DB, decode_responses=True)
+
+# count the active jobs of the user and add the job only if the max is not reached (atomic)
+# KEYS: user jobs, job, queue
+# ARGV: max jobs, job ID, score, queued status, running status, fields and values of the job
+SUBMIT_SCRIPT = rjobs.register_script(
+    """
+    local active = 0
+    for _, job_id in ipairs(redis.call('ZRANGE', KEYS[1], 0, -1)) do
+        local status = redis.call('HGET', 'job:' .. job_id, 'status')
+        if status == ARGV[4] or status == ARGV[5] then
+            active = active + 1
+        end
+    end
+    if active >= tonumber(ARGV[1]) then
+        return 0
+    end
+    redis.call('HSET', KEYS[2], unpack(ARGV, 6))
+    redis.call('ZADD', KEYS[1], ARGV[3], ARGV[2])
+    redis.call('RPUSH', KEYS[3], ARGV[2])
+    return 1
+    """
+)
+
+
+def job_key(job_id: str) -> str:
+    return f"job:{job_id}"
+
+
+def user_key(email: str) -> str:
+    return f"jobs:user:{email}"
+
+
+def now() -> str:
+    return dt.datetime.now().isoformat(sep=" ", timespec="seconds")
+
+
+def worker_id() -> str:
+    """
+    returns the ID of the current worker (host:pid)
+    """
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def get_job(job_id: str) -> dict | None:
+    """
+    returns the job or None if not found (or expired)
+    """
+    job = rjobs.hgetall(job_key(job_id))
+    return job if job else None
+
+
+def is_stale(job: dict) -> bool:
+    """
+    returns True if the job is running but its worker stopped
+    (no heartbeat since HEARTBEAT_TIMEOUT seconds or worker process not found on this host)
+    """
+    if job["status"] != RUNNING:
+        return False
+
+    try:
+        heartbeat = float(job.get("heartbeat", 0))
+    except ValueError:
+        heartbeat = 0
+    if time.time() - heartbeat > HEARTBEAT_TIMEOUT:
+        return True
+
+    host, _, pid = job.get("worker", "").rpartition(":")
+    if host == socket.gethostname() and pid.isdigit():
+        try:
+            os.kill(int(pid), 0)
+        except ProcessLookupError:
+            return True
+        except PermissionError:
+            pass
+
+    return False
+
+
+def finish_stale(job: dict, status: str = FAILED) -> None:
+    """
+    set the final status of a stale job.
+    Nothing is done if the job was modified by its worker in the meantime (status or heartbeat)
+    """
+    key = job_key(job["job_id"])
+    with rjobs.pipeline() as pipe:
+        try:
+            pipe.watch(key)
+            if pipe.hget(key, "status") != RUNNING or pipe.hget(
+                key, "heartbeat"
+            ) != job.get("heartbeat"):
+                return
+            pipe.multi()
+            pipe.hset(
+                key,
+                mapping=final_mapping(
+                    status, "" if status == CANCELLED else "The worker of the job stopped"
+                ),
+            )
+            pipe.expire(key, JOBS_RETENTION)
+            pipe.execute()
+        except redis.exceptions.WatchError:
+            pass
+
+
+def user_jobs(email: str) -> list:
+    """
+    returns the jobs of the user (newest first)
+    """
+    # remove expired jobs from the user index
+    rjobs.zremrangebyscore(user_key(email), 0, time.time() - JOBS_RETENTION)
+
+    jobs: list = []
+    for job_id in rjobs.zrevrange(user_key(email), 0, -1):
+        job = get_job(job_id)
+        if job is not None and is_stale(job):
+            finish_stale(job)
+            job = get_job(job_id)
+        if job is not None:
+            jobs.append(job)
+    return jobs
+
+
+def n_active_jobs(email: str) -> int:
+    """
+    returns the number of queued or running jobs of the user (the stale jobs are set as failed)
+    """
+    return len([job for job in user_jobs(email) if job["status"] in ACTIVE_STATUS])
+
+
+def submit(
+    email: str,
+    kind: str,
+    title: str,
+    command: list | None = None,
+    function: str | None = None,
+    kwargs: dict | None = None,
+    stdout: str = "",
+    error_file: str = "",
+    workdir: bool = False,
+) -> str | None:
+    """
+    add a job to the queue
+
+    Args:
+        email (str): user that submitted the job
+        kind (str): type of job (cell_occupancy, colony, ...)
+        title (str): description displayed on the jobs page
+        command (list): command to execute (argv)
+        function (str): function to execute as 'module:function' (if command is None)
+        kwargs (dict): arguments of the function (must be serializable in JSON)
+        stdout (str): path of the file for the standard output of the job
+        error_file (str): name of a file written by the program in case of error
+        workdir (bool): run the job in a new temporary directory
+
+    Returns:
+        str: job ID or None if the user has already the max number of active jobs
+    """
+    # set the stale jobs of the user as failed
+    user_jobs(email)
+
+    job_id = uuid.uuid4().hex
+    job = {
+        "job_id": job_id,
+        "kind": kind,
+        "title": title,
+        "user": email,
+        "status": QUEUED,
+        "progress": 0,
+        "message": "",
+        "error": "",
+        "created": now(),
+        "started": "",
+        "finished": "",
+        "spec": json.dumps(
+            {
+                "command": command,
+                "function": function,
+                "kwargs": kwargs or {},
+                "stdout": stdout,
+                "error_file": error_file,
+                "workdir": workdir,
+            }
+        ),
+    }
+    fields: list = []
+    for field, value in job.items():
+        fields.extend([field, value])
+
+    if not SUBMIT_SCRIPT(
+        keys=[user_key(email), job_key(job_id), QUEUE_KEY],
+        args=[JOBS_MAX_PER_USER, job_id, time.time(), QUEUED, RUNNING] + fields,
+    ):
+        return None
+
+    return job_id
+
+
+def cancel(job_id: str, email: str) -> bool:
+    """
+    cancel a queued job or ask the worker to stop a running job (a stale job is cancelled)
+
+    Returns:
+        bool: True if the job was found and belongs to the user
+    """
+    job = get_job(job_id)
+    if job is None or job["user"] != email:
+        return False
+
+    if job["status"] == QUEUED:
+        rjobs.lrem(QUEUE_KEY, 0, job_id)
+        finish(job_id, CANCELLED)
+    elif job["status"] == RUNNING:
+        if is_stale(job):
+            finish_stale(job, CANCELLED)
+        else:
+            rjobs.hset(job_key(job_id), "cancel", 1)
+
+    return True
+
+
+def progress(value: int, message: str = "") -> None:
+    """
+    report the progress (0-100) of the current job.
+    Does nothing if not executed in a job
+    """
+    job_id = os.environ.get(JOB_ID_ENV)
+    if not job_id:
+        return
+    try:
+        rjobs.hset(
+            job_key(job_id),
+            mapping={"progress": max(0, min(100, int(value))), "message": message},
+        )
+    except redis.exceptions.ConnectionError:
+        pass
+
+
+def final_mapping(status: str, error: str = "") -> dict:
+    """
+    returns the fields of a finished job
+    """
+    mapping = {"status": status, "finished": now()}
+    if status == DONE:
+        mapping["progress"] = 100
+    if error:
+        mapping["error"] = error[-MAX_ERROR_LENGTH:]
+    return mapping
+
+
+def finish(job_id: str, status: str, error: str = "") -> None:
+    """
+    set the final status of the job and its expiration
+    """
+    with rjobs.pipeline() as pipe:
+        pipe.hset(job_key(job_id), mapping=final_mapping(status, error))
+        pipe.expire(job_key(job_id), JOBS_RETENTION)
+        pipe.execute()
+
+
+def run_job(job_id: str) -> None:
+    """
+    execute the job in a child process and wait for its end
+    """
+    job = get_job(job_id)
+    if job is None or job["status"] != QUEUED:
+        return
+
+    rjobs.hset(
+        job_key(job_id),
+        mapping={
+            "status": RUNNING,
+            "started": now(),
+            "progress": 0,
+            "worker": worker_id(),
+            "heartbeat": time.time(),
+        },
+    )
+
+    spec = json.loads(job["spec"])
+
+    if spec["command"]:
+        command = spec["command"]
+    else:
+        command = [sys.executable, str(pl.Path(__file__).resolve()), "run", job_id]
+
+    cwd = None
+    if spec["workdir"]:
+        cwd = pl.Path(params["temp_folder"]) / pl.Path(f"job_{job_id}")
+        cwd.mkdir(parents=True, exist_ok=True)
+
+    stderr_path = pl.Path(params["temp_folder"]) / pl.Path(f"job_{job_id}.stderr")
+
+    # the job process must find the modules of WolfDB when executed in another directory
+    env = dict(os.environ, **{JOB_ID_ENV: job_id})
+    env["PYTHONPATH"] = os.pathsep.join(
+        [str(pl.Path(__file__).resolve().parent)]
+        + ([env["PYTHONPATH"]] if env.get("PYTHONPATH") else [])
+    )
+
+    try:
+        with (
+            open(spec["stdout"] or os.devnull, "w") as f_stdout,
+            open(stderr_path, "w") as f_stderr,
+        ):
+            process = subprocess.Popen(
+                command, stdout=f_stdout, stderr=f_stderr, cwd=cwd, env=env
+            )
+            rjobs.hset(job_key(job_id), "pid", process.pid)
+
+            cancelled = False
+            while process.poll() is None:
+                time.sleep(POLL_INTERVAL)
+                try:
+                    rjobs.hset(job_key(job_id), "heartbeat", time.time())
+                except redis.exceptions.ConnectionError:
+                    continue
+                if not cancelled and rjobs.hget(job_key(job_id), "cancel"):
+                    cancelled = True
+                    process.terminate()
+                    try:
+                        process.wait(timeout=10)
+                    except subprocess.TimeoutExpired:
+                        process.kill()
+
+        returncode = process.returncode
+        error = stderr_path.read_text(errors="replace").strip()
+
+        # some programs (e.g. COLONY) write the errors in a file
+        if spec["error_file"]:
+            error_file = (cwd or pl.Path(".")) / pl.Path(spec["error_file"])
+            if error_file.is_file():
+                error = error_file.read_text(errors="replace").strip()
+                error_file.unlink()
+                returncode = returncode or 1
+
+        if cancelled:
+            finish(job_id, CANCELLED)
+        elif returncode:
+            finish(job_id, FAILED, error or f"return code {returncode}")
+        else:
+            finish(job_id, DONE)
+
+    except Exception as e:
+        finish(job_id, FAILED, str(e))
+
+    finally:
+        stderr_path.unlink(missing_ok=True)
+        if cwd is not None:
+            shutil.rmtree(cwd, ignore_errors=True)
+
+
+def run_function(job_id: str) -> None:
+    """
+    execute the function of the job (in the job process)
+    """
+    spec = json.loads(get_job(job_id)["spec"])
+    module_name, function_name = spec["function"].split(":")
+    function = getattr(importlib.import_module(module_name), function_name)
+    function(**spec["kwargs"])
+
+
+def worker() -> None:
+    """
+    wait for jobs in the queue and execute them
+    """
+    while True:
+        try:
+            item = rjobs.blpop([QUEUE_KEY], timeout=5)
+        except redis.exceptions.ConnectionError:
+            time.sleep(5)
+            continue
+        if item is None:
+            continue
+        run_job(item[1])
+
+
+if __name__ == "__main__":
+    if len(sys.argv) == 3 and sys.argv[1] == "run":
+        run_function(sys.argv[2])
+        sys.exit()
+
+    n_workers = int(sys.argv[1]) if len(sys.argv) > 1 else JOBS_WORKERS
+    print(f"Starting {n_workers} job worker(s)")
+    workers = [multiprocessing.Process(target=worker) for _ in range(n_workers)]
+    for process in workers:
+        process.start()
+    for process in workers:
+        process.join()
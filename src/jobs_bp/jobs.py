@@ -0,0 +1,50 @@
+"""
+WolfDB web service
+(c) Olivier Friard
+
+flask blueprint for background jobs
+"""
+
+from flask import Blueprint, flash, redirect, render_template, session
+
+import functions as fn
+import job_queue
+from config import config
+
+app = Blueprint("jobs", __name__, template_folder="templates")
+
+params = config()
+app.debug = params["debug"]
+
+
+@app.route("/jobs")
+@fn.check_login
+def jobs():
+    """
+    display the background jobs of the current user
+    """
+
+    jobs_list = job_queue.user_jobs(session["email"])
+
+    return render_template(
+        "jobs.html",
+        header_title="My jobs",
+        jobs=jobs_list,
+        autoreload=any(job["status"] in job_queue.ACTIVE_STATUS for job in jobs_list),
+        max_jobs=job_queue.JOBS_MAX_PER_USER,
+    )
+
+
+@app.route("/cancel_job/<job_id>")
+@fn.check_login
+def cancel_job(job_id: str):
+    """
+    cancel a background job of the current user
+    """
+
+    if job_queue.cancel(job_id, session["email"]):
+        flash(fn.alert_success("The job will be cancelled"))
+    else:
+        flash(fn.alert_danger("Job not found"))
+
+    return redirect("/jobs")
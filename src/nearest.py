@@ -0,0 +1,103 @@
+"""
+WolfDB web service
+(c) Olivier Friard
+
+closest transect and closest snow track of scats and tracks
+
+The closest feature is found by a LATERAL join ordered by the KNN distance operator (<->)
+on the GiST indexes of transects.multilines and snow_tracks.multilines (see database/nearest_indexes.sql):
+all the scats or tracks are processed by one query.
+
+The closest feature of a layer is returned in the closest_{layer}_id and closest_{layer}_distance
+(meters, integer) columns, NULL if the layer has no feature.
+"""
+
+from sqlalchemy import text
+
+import functions as fn
+
+# layer -> table and ID of the features (multilines geometry)
+LAYERS: dict = {
+    "transect": {"table": "transects", "id": "transect_id"},
+    "track": {"table": "snow_tracks", "id": "snowtrack_id"},
+}
+
+
+def join(layer: str, geometry: str) -> str:
+    """
+    returns the LATERAL join adding the closest feature of the layer to the geometry
+    (closest_{layer}_id and closest_{layer}_distance columns)
+    """
+    table, id_ = LAYERS[layer]["table"], LAYERS[layer]["id"]
+    return (
+        "LEFT JOIN LATERAL ( "
+        f"    SELECT l.{id_} AS closest_{layer}_id, "
+        f"           ST_Distance({geometry}, l.multilines)::integer AS closest_{layer}_distance "
+        f"    FROM {table} l "
+        "    WHERE l.multilines IS NOT NULL "
+        f"    ORDER BY l.multilines <-> {geometry} "
+        "    LIMIT 1 "
+        f") AS closest_{layer} ON TRUE "
+    )
+
+
+def columns(layers: tuple) -> str:
+    """
+    returns the columns of the closest features of the layers
+    """
+    return ", ".join(f"closest_{layer}_id, closest_{layer}_distance" for layer in layers)
+
+
+def scats(conditions: str = "", values: dict | None = None, layers: tuple = ("transect", "track")) -> list:
+    """
+    returns the scats with their closest transect and/or track
+
+    Args:
+        conditions (str): conditions on the scats (to add to the WHERE clause, ex: "AND date BETWEEN ...")
+        values (dict): parameters of the conditions
+        layers (tuple): transect and/or track
+    """
+    with fn.db_connection() as con:
+        return (
+            con.execute(
+                text(
+                    "SELECT scat_id, sampling_type, path_id, snowtrack_id, "
+                    + columns(layers)
+                    + " FROM scats s "
+                    + "".join(join(layer, "s.geometry_utm") for layer in layers)
+                    + "WHERE s.geometry_utm IS NOT NULL "
+                    + conditions
+                    + " ORDER BY scat_id"
+                ),
+                values or {},
+            )
+            .mappings()
+            .all()
+        )
+
+
+def tracks(conditions: str = "", values: dict | None = None) -> list:
+    """
+    returns the snow tracks with their closest transect
+
+    Args:
+        conditions (str): conditions on the tracks (to add to the WHERE clause)
+        values (dict): parameters of the conditions
+    """
+    with fn.db_connection() as con:
+        return (
+            con.execute(
+                text(
+                    "SELECT snowtrack_id, "
+                    + columns(("transect",))
+                    + " FROM snow_tracks s "
+                    + join("transect", "s.multilines")
+                    + "WHERE s.multilines IS NOT NULL "
+                    + conditions
+                    + " ORDER BY snowtrack_id"
+                ),
+                values or {},
+            )
+            .mappings()
+            .all()
+        )
@@ -24,7 +24,7 @@ def packs():
     """
     Display the list of packs
     """
-    with fn.conn_alchemy().connect() as con:
+    with fn.db_connection() as con:
         packs_list = (
             con.execute(
                 text(
@@ -51,7 +51,7 @@ def view_pack(pack_name):
     """
     Display the pack composition
     """
-    with fn.conn_alchemy().connect() as con:
+    with fn.db_connection() as con:
         results = (
             con.execute(
                 text(
@@ -13,11 +13,13 @@ from config import config
 import json
 import pathlib as pl
 import os
-import sys
 import uuid
 from . import paths_import
 from .path_form import Path
 import functions as fn
+import job_queue
+import transects_activity
+import upload_staging
 from . import paths_export
 
 # import paths_completeness
@@ -66,7 +68,7 @@ def view_path(path_id):
     Display path data, samples and map
     """
 
-    with fn.conn_alchemy().connect() as con:
+    with fn.db_connection() as con:
         path = (
             con.execute(
                 text("SELECT * FROM paths WHERE path_id = :path_id"),
@@ -184,7 +186,7 @@ def paths_list():
     """
     get list of paths
     """
-    with fn.conn_alchemy().connect() as con:
+    with fn.db_connection() as con:
         results = (
             con.execute(
                 text(
@@ -223,7 +225,7 @@ def export_paths():
     export tracks in XLSX file
     """
 
-    with fn.conn_alchemy().connect() as con:
+    with fn.db_connection() as con:
         file_content = paths_export.export_paths(
             con.execute(
                 text(
@@ -300,7 +302,7 @@ def new_path():
         form.transect_id.choices = [("", "")] + [(x, x) for x in fn.all_transect_id()]
 
         if form.validate():
-            with fn.conn_alchemy().connect() as con:
+            with fn.db_connection() as con:
                 # path_id
                 path_id = f"{request.form['transect_id']}|{request.form['date'][2:].replace('-', '')}"
 
@@ -345,6 +347,7 @@ def new_path():
                         "category": request.form["category"],
                     },
                 )
+            transects_activity.refresh_cube([request.form["transect_id"]])
 
             return redirect("/paths_list")
 
@@ -357,7 +360,7 @@ def new_path():
 @app.route("/edit_path/<path_id>", methods=("GET", "POST"))
 @fn.check_login
 def edit_path(path_id):
-    with fn.conn_alchemy().connect() as con:
+    with fn.db_connection() as con:
         if request.method == "GET":
             default_values = (
                 con.execute(
@@ -447,6 +450,7 @@ def edit_path(path_id):
                     "WHERE path_id = :path_id"
                 )
 
+                old_transects = transects_activity.cube_transects(path_ids=[path_id])
                 con.execute(
                     sql,
                     {
@@ -464,6 +468,9 @@ def edit_path(path_id):
                         "path_id": path_id,
                     },
                 )
+                transects_activity.refresh_cube(
+                    old_transects | {request.form["transect_id"]}
+                )
 
                 return redirect(f"/view_path/{new_path_id}")
             else:
@@ -494,10 +501,12 @@ def del_path(path_id):
     delete a path
     """
 
-    with fn.conn_alchemy().connect() as con:
+    old_transects = transects_activity.cube_transects(path_ids=[path_id])
+    with fn.db_connection() as con:
         con.execute(
             text("DELETE FROM paths WHERE path_id = :path_id"), {"path_id": path_id}
         )
+    transects_activity.refresh_cube(old_transects)
     return redirect("/paths_list")
 
 
@@ -543,7 +552,9 @@ def load_paths_xlsx():
             flash(fn.alert_danger("Error with the uploaded file"))
             return redirect("/load_paths_xlsx")
 
-        r, msg, paths_data = paths_import.extract_data_from_paths_xlsx(filename)
+        r, msg, paths_data = upload_staging.extract(
+            filename, paths_import.extract_data_from_paths_xlsx
+        )
         if r:
             flash(
                 Markup(f"File name: <b>{new_file.filename}</b>")
@@ -553,7 +564,7 @@ def load_paths_xlsx():
             return redirect("/load_paths_xlsx")
 
         # check if path_id already in DB
-        with fn.conn_alchemy().connect() as con:
+        with fn.db_connection() as con:
             paths_list = "','".join([paths_data[idx]["path_id"] for idx in paths_data])
             sql = text(f"SELECT path_id FROM paths WHERE path_id IN ('{paths_list}')")
             paths_to_update = [
@@ -576,86 +587,34 @@ def confirm_load_paths_xlsx(filename, mode):
         flash(fn.alert_danger("Error: mode not allowed"))
         return redirect("/load_paths_xlsx")
 
-    r, msg, all_data = paths_import.extract_data_from_paths_xlsx(filename)
+    # rows parsed and validated at the upload (see upload_staging.py)
+    r, msg, _ = upload_staging.extract(
+        filename, paths_import.extract_data_from_paths_xlsx
+    )
     if r:
         flash(Markup(f"File name: <b>{filename}</b>") + Markup("<hr><br>") + msg)
         return redirect("/load_paths_xlsx")
 
-    # check if path_id already in DB
-    with fn.conn_alchemy().connect() as con:
-        paths_list = "','".join([all_data[idx]["path_id"] for idx in all_data])
-        sql = text(f"SELECT path_id FROM paths WHERE path_id IN ('{paths_list}')")
-        paths_to_update = [row["path_id"] for row in con.execute(sql).mappings().all()]
-
-        sql = text(
-            "UPDATE paths SET "
-            "path_id = :path_id, "
-            "transect_id = :transect_id,"
-            "date = :date,"
-            "sampling_season = :sampling_season,"
-            "completeness = :completeness,"
-            "observer = :operator, "
-            "institution = :institution, "
-            "notes = :notes "
-            "WHERE path_id = :path_id;"
-            "INSERT INTO paths ("
-            "path_id,"
-            "transect_id,"
-            "date,"
-            "sampling_season,"
-            "completeness,"
-            "observer,"
-            "institution,"
-            "notes "
-            ") "
-            "SELECT "
-            ":path_id,"
-            ":transect_id,"
-            ":date,"
-            ":sampling_season,"
-            ":completeness, "
-            ":operator,"
-            ":institution,"
-            ":notes "
-            "WHERE NOT EXISTS (SELECT 1 FROM paths WHERE path_id = :path_id)"
+    # the rows are imported by a background job (see job_queue.py)
+    job_id = job_queue.submit(
+        session["email"],
+        kind="import_paths",
+        title="Import of paths from spreadsheet file",
+        function="paths_bp.paths_import:import_paths",
+        kwargs={"filename": filename, "mode": mode},
+    )
+    if job_id is None:
+        flash(
+            fn.alert_danger(
+                f"You have already {job_queue.JOBS_MAX_PER_USER} jobs running. Wait for their completion."
+            )
         )
-        count_added = 0
-        count_updated = 0
-        for idx in all_data:
-            data = dict(all_data[idx])
-
-            if mode == "new" and (data["path_id"] in paths_to_update):
-                continue
-            if data["path_id"] in paths_to_update:
-                count_updated += 1
-            else:
-                count_added += 1
-
-            # print(f"{data=}")
-
-            try:
-                con.execute(
-                    sql,
-                    {
-                        "path_id": data["path_id"],
-                        "transect_id": data["transect_id"],
-                        "date": data["date"],
-                        "sampling_season": fn.sampling_season(data["date"]),
-                        "completeness": data["completeness"]
-                        if data["completeness"]
-                        else None,
-                        "operator": data["operator"].strip(),
-                        "institution": data["institution"].strip(),
-                        "notes": data["notes"].strip(),
-                    },
-                )
-            except Exception:
-                return (
-                    "An error occured during the import of paths. Contact the administrator.<br>"
-                    + error_info(sys.exc_info())
-                )
+        return redirect("/load_paths_xlsx")
 
-    msg = f"XLSX/ODS file successfully loaded. {count_added} paths added, {count_updated} paths updated."
-    flash(fn.alert_success(msg))
+    flash(
+        fn.alert_success(
+            "The paths are being imported.<br>See the <a href='/jobs'>jobs page</a> for the result of the import."
+        )
+    )
 
-    return redirect("/paths")
+    return redirect("/jobs")
@@ -4,8 +4,15 @@ import paths from XLSX file
 
 import pandas as pd
 import pathlib as pl
+import time
+from markupsafe import Markup
+from sqlalchemy import text
 from config import config
+import bulk_import
 import functions as fn
+import job_queue
+import transects_activity
+import upload_staging
 import datetime
 import utm
 
@@ -117,3 +124,78 @@ def extract_data_from_paths_xlsx(filename: str):
         return True, out, {}
 
     return False, "", paths_data
+
+
+def import_paths(filename: str, mode: str) -> None:
+    """
+    import the paths of the uploaded file (background job, see job_queue.py)
+
+    Args:
+        filename (str): name of the uploaded file (UUID)
+        mode (str): new (only the new paths are imported) or all (new and existing paths)
+    """
+
+    # rows parsed and validated at the upload (see upload_staging.py)
+    r, msg, all_data = upload_staging.extract(filename, extract_data_from_paths_xlsx)
+    if r:
+        raise ValueError(Markup(msg).striptags())
+
+    t0 = time.time()
+
+    # check if path_id already in DB
+    with fn.db_connection() as con:
+        paths_to_update = set(
+            con.execute(
+                text("SELECT path_id FROM paths WHERE path_id = ANY(:path_ids)"),
+                {"path_ids": [all_data[idx]["path_id"] for idx in all_data]},
+            )
+            .scalars()
+            .all()
+        )
+    old_transects = transects_activity.cube_transects(path_ids=list(paths_to_update))
+
+    rows: list = []
+    for idx in all_data:
+        data = dict(all_data[idx])
+
+        if mode == "new" and (data["path_id"] in paths_to_update):
+            continue
+
+        rows.append(
+            {
+                "path_id": data["path_id"],
+                "transect_id": data["transect_id"],
+                "date": data["date"],
+                "sampling_season": fn.sampling_season(data["date"]),
+                "completeness": data["completeness"] if data["completeness"] else None,
+                "observer": data["operator"].strip(),
+                "institution": data["institution"].strip(),
+                "notes": data["notes"].strip(),
+            }
+        )
+
+    count_updated = len([row for row in rows if row["path_id"] in paths_to_update])
+    count_added = len(rows) - count_updated
+
+    job_queue.progress(10, f"{len(rows)} paths to import")
+
+    # staging table and one upsert (see bulk_import.py)
+    if rows:
+        columns: tuple = tuple(rows[0])
+        with bulk_import.transaction() as con:
+            staging = bulk_import.stage(con, "paths", columns, rows)
+            bulk_import.merge(con, "paths", staging, "path_id", columns, replace=True)
+
+    upload_staging.discard(filename)
+
+    transects_activity.refresh_cube(
+        old_transects | {all_data[idx]["transect_id"] for idx in all_data}
+    )
+
+    job_queue.progress(
+        100,
+        (
+            f"{count_added} paths added, {count_updated} paths updated "
+            f"({bulk_import.rate(len(rows), t0)})."
+        ),
+    )
@@ -4,6 +4,7 @@ with all paths based on the completeness
 """
 
 import json
+import time
 import fiona
 import shutil
 from sqlalchemy import text
@@ -12,6 +13,17 @@ import pathlib as pl
 
 # sys.path.insert(1, os.path.join(sys.path[0], ".."))
 import functions as fn
+import paths_truncation
+
+# output formats: fiona driver, file extension
+FILE_FORMATS = {
+    "shp": ("ESRI Shapefile", ""),
+    "gpkg": ("GPKG", ".gpkg"),
+    "fgb": ("FlatGeobuf", ".fgb"),
+}
+
+# number of rows fetched from the server-side cursor and written at once
+BATCH_SIZE = 1000
 
 
 def paths_completeness_shapefile(
@@ -19,22 +31,22 @@ def paths_completeness_shapefile(
     log_file: str,
     start_date: str = "1900-01-01",
     end_date: str = "2100-01-01",
+    file_format: str = "shp",
 ) -> str:
-    log = open(log_file, "w")
+    """
+    create a file with the paths truncated by completeness
 
-    con = fn.conn_alchemy().connect()
+    Args:
+        dir_path (str): path of the output without extension
+        log_file (str): path of the log file (timing and number of rows)
+        file_format (str): shp (zipped ESRI Shapefile), gpkg (GeoPackage) or fgb (FlatGeobuf)
 
-    paths = (
-        con.execute(
-            text("SELECT * FROM paths WHERE date BETWEEN :start_date AND :end_date"),
-            {
-                "start_date": start_date,
-                "end_date": end_date,
-            },
-        )
-        .mappings()
-        .all()
-    )
+    Returns:
+        str: name of the created file
+    """
+
+    t0 = time.time()
+    driver, extension = FILE_FORMATS[file_format]
 
     schema = {
         "geometry": "LineString",
@@ -51,101 +63,104 @@ def paths_completeness_shapefile(
         ],
     }
 
-    with fiona.open(
-        dir_path, mode="w", driver="ESRI Shapefile", schema=schema, crs="EPSG:32632"
-    ) as layer:
-        for path in paths:
-            print(file=log)
-            print(path, file=log)
-            if path["transect_id"] is None or path["transect_id"] == "":
-                print("No transect in path", file=log)
-                continue
-
-            transect = (
-                con.execute(
-                    text(
-                        "SELECT *, "
-                        "ST_AsGeoJSON(multilines) AS transect_geojson, "
-                        "ROUND(ST_Length(multilines)) AS transect_length "
-                        "FROM transects "
-                        "WHERE transect_id = :transect_id"
-                    ),
-                    {"transect_id": path["transect_id"]},
+    counts: dict = {"paths": 0, "written": 0, "multilines": 0, "not complete": 0}
+    transects_cache: dict = {}
+
+    # paths without transect or without completeness are not selected
+    sql = text(
+        "SELECT p.path_id, p.transect_id, p.completeness, p.date, "
+        "       p.observer, p.institution, p.category, "
+        "       t.province, "
+        "       ST_AsGeoJSON(t.multilines) AS transect_geojson, "
+        "       ROUND(ST_Length(t.multilines)) AS transect_length "
+        "FROM paths p "
+        "JOIN transects t ON t.transect_id = p.transect_id "
+        "WHERE p.date BETWEEN :start_date AND :end_date "
+        "      AND p.completeness IS NOT NULL AND p.completeness != 0 "
+        "ORDER BY p.transect_id, p.date"
+    )
+
+    output_path = f"{dir_path}{extension}"
+
+    with (
+        fn.conn_alchemy().connect() as con,
+        fiona.open(
+            output_path, mode="w", driver=driver, schema=schema, crs="EPSG:32632"
+        ) as layer,
+    ):
+        # the server-side cursor needs a transaction (the engine is in autocommit)
+        con = con.execution_options(
+            isolation_level="READ COMMITTED", stream_results=True, yield_per=BATCH_SIZE
+        )
+        transaction = con.begin()
+        result = con.execute(sql, {"start_date": start_date, "end_date": end_date})
+
+        for rows in result.mappings().partitions():
+            features: list = []
+            for path in rows:
+                counts["paths"] += 1
+
+                if path["transect_id"] not in transects_cache:
+                    transect_geojson = json.loads(path["transect_geojson"])
+                    if len(transect_geojson["coordinates"]) != 1:
+                        counts["multilines"] += 1
+                        continue
+                    coordinates = transect_geojson["coordinates"][0]
+                else:
+                    coordinates = None
+
+                new_list, _ = paths_truncation.truncated_path(
+                    transects_cache,
+                    path["transect_id"],
+                    coordinates,
+                    path["transect_length"],
+                    path["completeness"],
+                )
+
+                if not paths_truncation.completeness_reached(
+                    transects_cache,
+                    path["transect_id"],
+                    path["transect_length"],
+                    path["completeness"],
+                ):
+                    counts["not complete"] += 1
+                    continue
+
+                features.append(
+                    {
+                        "geometry": {"type": "LineString", "coordinates": new_list},
+                        "properties": {
+                            "province": path["province"],
+                            "transect_id": path["transect_id"],
+                            "path_id": path["path_id"],
+                            "completeness": path["completeness"],
+                            "date": path["date"].isoformat(),
+                            "month": path["date"].isoformat().split("-")[1],
+                            "observer": path["observer"],
+                            "institution": path["institution"],
+                            "category": path["category"],
+                        },
+                    }
                 )
-                .mappings()
-                .fetchone()
-            )
-
-            if transect is None:
-                print("path['transect_id'] NOT FOUND", file=log)
-                continue
-
-            if path["completeness"]:
-                print(transect["transect_length"], file=log)
-
-                transect_geojson = json.loads(transect["transect_geojson"])
-                if len(transect_geojson["coordinates"]) == 1:
-                    tot_dist = 0
-                    new_list = []
-                    for idx, point in enumerate(transect_geojson["coordinates"][0]):
-                        if idx == 0:
-                            continue
-                        d = (
-                            (point[0] - transect_geojson["coordinates"][0][idx - 1][0])
-                            ** 2
-                            + (
-                                point[1]
-                                - transect_geojson["coordinates"][0][idx - 1][1]
-                            )
-                            ** 2
-                        ) ** 0.5
-                        tot_dist += d
-
-                        new_list.append(point)
-                        if (
-                            round((tot_dist / transect["transect_length"]) * 100)
-                            >= path["completeness"]
-                        ):
-                            break
-
-                    if (
-                        round((tot_dist / transect["transect_length"]) * 100)
-                        >= path["completeness"]
-                    ):
-                        print(
-                            f"{path['completeness']} COMPLETE OK  {tot_dist / transect['transect_length']}",
-                            file=log,
-                        )
-
-                        rowDict = {
-                            "geometry": {"type": "LineString", "coordinates": new_list},
-                            "properties": {
-                                "province": transect["province"],
-                                "transect_id": path["transect_id"],
-                                "path_id": path["path_id"],
-                                "completeness": path["completeness"],
-                                "date": path["date"].isoformat(),
-                                "month": path["date"].isoformat().split("-")[1],
-                                "observer": path["observer"],
-                                "institution": path["institution"],
-                                "category": path["category"],
-                            },
-                        }
-                        layer.write(rowDict)
-
-                    else:
-                        print(
-                            f"{path['completeness']} NOT COMPLETE {tot_dist / transect['transect_length']}",
-                            file=log,
-                        )
-
-    log.close()
-
-    # make a ZIP archive
-    zip_file_path: str = shutil.make_archive(dir_path, "zip", dir_path)
-
-    # remove directory
-    if pl.Path(dir_path).is_dir():
-        shutil.rmtree(dir_path)
-
-    return pl.Path(zip_file_path).name
+
+            layer.writerecords(features)
+            counts["written"] += len(features)
+
+        transaction.commit()
+
+    if file_format == "shp":
+        # make a ZIP archive
+        output_path = shutil.make_archive(dir_path, "zip", dir_path)
+
+        # remove directory
+        if pl.Path(dir_path).is_dir():
+            shutil.rmtree(dir_path)
+
+    with open(log_file, "w") as log:
+        print(f"paths completeness from {start_date} to {end_date}", file=log)
+        for key, value in counts.items():
+            print(f"{key}: {value}", file=log)
+        print(f"file: {output_path}", file=log)
+        print(f"duration: {time.time() - t0:.1f} s", file=log)
+
+    return pl.Path(output_path).name
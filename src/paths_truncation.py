@@ -0,0 +1,87 @@
+"""
+WolfDB web service
+(c) Olivier Friard
+
+truncation of transects by path completeness
+
+The path covers the first <completeness>% of the transect length.
+The cumulative lengths of the transect vertices are computed once per transect (cache)
+and the cut point is found by binary search and interpolated on the segment.
+"""
+
+import numpy as np
+
+
+def cumulative_lengths(coordinates: list) -> tuple[np.ndarray, np.ndarray]:
+    """
+    returns the vertices (x, y) and the cumulative length at each vertex of a line
+    """
+    points = np.asarray(coordinates, dtype=float)[:, :2]
+    segments = np.hypot(np.diff(points[:, 0]), np.diff(points[:, 1]))
+    return points, np.concatenate(([0.0], np.cumsum(segments)))
+
+
+def truncate(
+    points: np.ndarray,
+    cum_lengths: np.ndarray,
+    transect_length: float,
+    completeness: float | None,
+) -> tuple[list, float]:
+    """
+    truncate the line at <completeness>% of transect_length
+
+    Args:
+        points (np.ndarray): vertices of the line (see cumulative_lengths)
+        cum_lengths (np.ndarray): cumulative lengths (see cumulative_lengths)
+        transect_length (float): length of the transect
+        completeness (float): completeness of the path (%). None for 100%
+
+    Returns:
+        list: coordinates of the truncated line
+        float: length of the truncated line
+    """
+    completeness = completeness if completeness is not None else 100
+
+    target = min(completeness / 100 * transect_length, cum_lengths[-1])
+    if target <= 0:
+        return points[:1].tolist(), 0.0
+
+    # first vertex at or after the cut point
+    idx = int(np.searchsorted(cum_lengths, target, side="left"))
+    idx = min(max(idx, 1), len(points) - 1)
+
+    segment_length = cum_lengths[idx] - cum_lengths[idx - 1]
+    ratio = (target - cum_lengths[idx - 1]) / segment_length if segment_length else 0.0
+    cut_point = points[idx - 1] + ratio * (points[idx] - points[idx - 1])
+
+    return np.vstack([points[:idx], cut_point]).tolist(), float(target)
+
+
+def truncated_path(
+    cache: dict,
+    transect_id: str,
+    coordinates: list,
+    transect_length: float,
+    completeness: float | None,
+) -> tuple[list, float]:
+    """
+    truncate the transect line for the path completeness
+    using the cumulative lengths of the transect stored in cache (dict transect_id: (points, cumulative lengths))
+
+    Returns:
+        list: coordinates of the path
+        float: length of the path
+    """
+    if transect_id not in cache:
+        cache[transect_id] = cumulative_lengths(coordinates)
+
+    return truncate(*cache[transect_id], transect_length, completeness)
+
+
+def completeness_reached(
+    cache: dict, transect_id: str, transect_length: float, completeness: float
+) -> bool:
+    """
+    check if the transect (already in cache) is long enough for the path completeness
+    """
+    return round(cache[transect_id][1][-1] / transect_length * 100) >= completeness
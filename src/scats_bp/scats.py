@@ -10,7 +10,6 @@ import datetime as dt
 import json
 import os
 import pathlib as pl
-import subprocess
 import sys
 import uuid
 
@@ -29,6 +28,10 @@ from markupsafe import Markup
 from sqlalchemy import text
 
 import functions as fn
+import transects_activity
+import upload_staging
+import job_queue
+import search
 from config import config
 
 from . import scats_export, scats_import
@@ -88,11 +91,13 @@ def wa_form():
 @app.route("/add_wa", methods=("POST",))
 @fn.check_login
 def add_wa():
-    with fn.conn_alchemy().connect() as con:
+    with fn.db_connection() as con:
         con.execute(
             text("UPDATE scats SET wa_code = :wa_code WHERE scat_id = :scat_id"),
             {"wa_code": request.form["wa"].upper(), "scat_id": request.form["scat_id"]},
         )
+    fn.invalidate_tiles("scats")
+    fn.invalidate_wa_clusters()
 
     return redirect(f"/view_scat/{request.form['scat_id']}")
 
@@ -109,7 +114,7 @@ def view_scat(scat_id):
     scat_color = params["scat_color"]
     transect_color = params["transect_color"]
 
-    with fn.conn_alchemy().connect() as con:
+    with fn.db_connection() as con:
         results = (
             con.execute(
                 text(
@@ -184,7 +189,7 @@ def view_scat(scat_id):
     if results["path_id"]:
         # Systematic sampling
         transect_id = results["path_id"].split("|")[0]
-        with fn.conn_alchemy().connect() as con:
+        with fn.db_connection() as con:
             transect = (
                 con.execute(
                     text(
@@ -251,7 +256,7 @@ def plot_all_scats():
 
     scats_color = params["scat_color"]
 
-    with fn.conn_alchemy().connect() as con:
+    with fn.db_connection() as con:
         scat_features: list = []
 
         tot_min_lat, tot_min_lon = 90, 90
@@ -317,7 +322,7 @@ def plot_all_scats_markerclusters():
 
     scats_color = params["scat_color"]
 
-    with fn.conn_alchemy().connect() as con:
+    with fn.db_connection() as con:
         scat_features: list = []
 
         tot_min_lat, tot_min_lon = 90, 90
@@ -378,118 +383,47 @@ def plot_all_scats_markerclusters():
         )
 
 
-def get_scats(search_term: str = "", offset: int = 0, limit: str | int = "ALL"):
+def scats_query(search_term: str = "") -> tuple[str, dict, tuple]:
     """
-    Search scats.
+    returns the query (without order and limit), its parameters and the ordering columns to search scats.
+    The results of a search are ranked (see search.py)
 
     Supported syntax:
     - free text: "trento"
     - field search: "scat id:S123"
     - multiple field search: "municipality:trento; observer:mario"
+
+    Raises:
+        ValueError: invalid search syntax or unknown field
     """
 
+    conditions, values = search.where("scats", search_term)
+
     sql = (
-        "SELECT *, count(*) OVER() AS n_scats "
-        "FROM scats_list_all "
+        "SELECT *"
+        + (f", {search.rank('scats')} AS search_rank " if search_term else " ")
+        + "FROM scats_list_all "
         "WHERE date BETWEEN :start_date AND :end_date "
+        + conditions
     )
 
-    values = {
-        "start_date": session["start_date"],
-        "end_date": session["end_date"],
-    }
-
-    if search_term:
-        if ":" in search_term:
-            research_fields = {
-                "scat id": "scat_id",
-                "date": "date::text",
-                "wa code": "wa_code",
-                "sampling season": "sampling_season",
-                "sampling type": "sampling_type",
-                "path id": "path_id",
-                "snowtrack id": "snowtrack_id",
-                "location": "location",
-                "municipality": "municipality",
-                "province": "province",
-                "region": "region",
-                "deposition": "deposition",
-                "matrix": "matrix",
-                "collected scat": "collected_scat",
-                "scalp category": "scalp_category",
-                "genetic sample": "genetic_sample",
-                "observer": "observer",
-                "institution": "institution",
-                "notes": "notes",
-                "region auto": "region_auto",
-                "province auto": "province_auto",
-                "municipality auto": "municipality_auto",
-                "location auto": "location_auto",
-                "sample type": "sample_type",
-                "box number": "box_number",
-                "ispra id": "ispra_id",
-                "genotype": "genotype_id2",
-            }
-
-            for idx, field_term in enumerate(
-                x.strip() for x in search_term.split(";") if x.strip()
-            ):
-                if ":" not in field_term:
-                    raise ValueError(
-                        "Invalid search syntax. Use 'field:value' or free text."
-                    )
-
-                field, value = [x.strip() for x in field_term.split(":", 1)]
-                field_key = field.lower()
+    values.update(
+        {
+            "start_date": session["start_date"],
+            "end_date": session["end_date"],
+        }
+    )
 
-                if field_key not in research_fields:
-                    raise ValueError(
-                        "Search field not found. Must be one of: "
-                        + ", ".join(research_fields.keys())
-                    )
+    return sql, values, ("search_rank", "scat_id") if search_term else ("scat_id",)
 
-                sql += f" AND ({research_fields[field_key]} ILIKE :search{idx}) "
-                values[f"search{idx}"] = f"%{value}%"
 
-        else:
-            sql += (
-                "AND ("
-                "scat_id ILIKE :search "
-                "OR date::text ILIKE :search "
-                "OR wa_code ILIKE :search "
-                "OR sampling_season ILIKE :search "
-                "OR sampling_type ILIKE :search "
-                "OR path_id ILIKE :search "
-                "OR snowtrack_id ILIKE :search "
-                "OR location ILIKE :search "
-                "OR municipality ILIKE :search "
-                "OR province ILIKE :search "
-                "OR region ILIKE :search "
-                "OR deposition ILIKE :search "
-                "OR matrix ILIKE :search "
-                "OR collected_scat ILIKE :search "
-                "OR scalp_category ILIKE :search "
-                "OR genetic_sample ILIKE :search "
-                "OR observer ILIKE :search "
-                "OR institution ILIKE :search "
-                "OR notes ILIKE :search "
-                "OR region_auto ILIKE :search "
-                "OR province_auto ILIKE :search "
-                "OR municipality_auto ILIKE :search "
-                "OR location_auto ILIKE :search "
-                "OR sample_type ILIKE :search "
-                "OR box_number ILIKE :search "
-                "OR ispra_id ILIKE :search "
-                "OR genotype_id2 ILIKE :search "
-                ") "
-            )
-            values["search"] = f"%{search_term}%"
-
-    if limit != "ALL":
-        sql += f" LIMIT {int(limit)} OFFSET {int(offset)}"
+def get_scats(search_term: str = ""):
+    """
+    Search scats (all results ordered by rank and scat ID, see scats_query)
+    """
 
-    with fn.conn_alchemy().connect() as con:
-        results = con.execute(text(sql), values).mappings().all()
+    sql, values, order_by = scats_query(search_term)
+    results, _ = fn.paginate(sql, values, order_by, "ALL")
 
     return results
 
@@ -519,7 +453,7 @@ def get_scats_old(search_term: str = "", offset: int = 0, limit: str | int = "AL
                 "AND (date BETWEEN :start_date AND :end_date) "
             )
         )
-        with fn.conn_alchemy().connect() as con:
+        with fn.db_connection() as con:
             results = (
                 con.execute(
                     sql_search,
@@ -542,7 +476,7 @@ def get_scats_old(search_term: str = "", offset: int = 0, limit: str | int = "AL
                 f"OFFSET {offset}"
             )
         )
-        with fn.conn_alchemy().connect() as con:
+        with fn.db_connection() as con:
             results = (
                 con.execute(
                     sql_all,
@@ -599,7 +533,7 @@ def scats_list_limit(offset: int, limit: int | str, mode: str = ""):
     else:
         view_scat_id = None
 
-    with fn.conn_alchemy().connect() as con:
+    with fn.db_connection() as con:
         # sql_search = text(
         #    (
         #        "SELECT *, count(*) OVER() AS n_scats FROM scats_list_all WHERE ("
@@ -629,7 +563,13 @@ def scats_list_limit(offset: int, limit: int | str, mode: str = ""):
             else:
                 search_term = request.args.get("search")
 
-            results = get_scats(search_term)
+            try:
+                sql, values, order_by = scats_query(search_term)
+            except ValueError as e:
+                flash(fn.alert_danger(f"<b>{e}</b>"))
+                search_term = ""
+                sql, values, order_by = scats_query(search_term)
+            results, pages = fn.paginate(sql, values, order_by, "ALL")
 
             # results = (
             #    con.execute(
@@ -650,7 +590,22 @@ def scats_list_limit(offset: int, limit: int | str, mode: str = ""):
             else:
                 search_term: str = ""
 
-            results = get_scats(search_term, offset, limit)
+            # keyset pagination (offset is used for the display and for the URLs without cursor)
+            try:
+                sql, values, order_by = scats_query(search_term)
+            except ValueError as e:
+                flash(fn.alert_danger(f"<b>{e}</b>"))
+                search_term = ""
+                sql, values, order_by = scats_query(search_term)
+            results, pages = fn.paginate(
+                sql,
+                values,
+                order_by,
+                limit,
+                offset,
+                request.args.get("after"),
+                request.args.get("before"),
+            )
 
             # sql_all = text(
             #    (
@@ -679,8 +634,9 @@ def scats_list_limit(offset: int, limit: int | str, mode: str = ""):
     if "url_wa_list" in session:
         del session["url_wa_list"]
 
+    n_scats: int = fn.cached_count(sql, values)
     if results:
-        title = f"List of {results[0]['n_scats']} scat{'s' if results[0]['n_scats'] > 1 else ''}"
+        title = f"List of {n_scats} scat{'s' if n_scats > 1 else ''}"
     else:
         title = "No scat found"
 
@@ -688,10 +644,11 @@ def scats_list_limit(offset: int, limit: int | str, mode: str = ""):
         "scats_list_limit.html",
         title=title,
         header_title="List of scats",
-        n_scats=results[0]["n_scats"] if results else 0,
+        n_scats=n_scats,
         limit=limit,
         offset=offset,
         results=results,
+        pages=pages,
         search_term=search_term,
         view_scat_id=view_scat_id,
     )
@@ -825,7 +782,10 @@ def new_scat():
         except Exception:
             return not_valid("Error in UTM coordinates")
 
-        with fn.conn_alchemy().connect() as con:
+        with fn.db_connection() as con:
+            # new scat: no previous transect
+            old_transects: set = set()
+
             sql = text(
                 "INSERT INTO scats (scat_id, wa_code, ispra_id, date, sampling_season, sampling_type, path_id, snowtrack_id, "
                 "location, municipality, province, region, "
@@ -870,6 +830,12 @@ def new_scat():
                     + (32600 if request.form["hemisphere"] == "N" else 32700),
                 },
             )
+        fn.invalidate_tiles("scats")
+        fn.invalidate_wa_clusters()
+        transects_activity.refresh_cube(
+            old_transects
+            | transects_activity.cube_transects(scat_ids=[request.form["scat_id"]])
+        )
 
         return redirect(f"/view_scat/{request.form['scat_id']}")
 
@@ -901,7 +867,7 @@ def edit_scat(scat_id):
         )
 
     if request.method == "GET":
-        with fn.conn_alchemy().connect() as con:
+        with fn.db_connection() as con:
             default_values = dict(
                 con.execute(
                     text("SELECT * FROM scats WHERE scat_id = :scat_id"),
@@ -999,7 +965,7 @@ def edit_scat(scat_id):
                 "Some values are not set or are wrong. Please check and submit again",
             )
 
-        with fn.conn_alchemy().connect() as con:
+        with fn.db_connection() as con:
             # check if scat id already exists
             if scat_id != request.form["scat_id"]:
                 if len(
@@ -1089,6 +1055,8 @@ def edit_scat(scat_id):
                         ),
                     )
 
+            old_transects = transects_activity.cube_transects(scat_ids=[scat_id])
+
             sql = text(
                 "UPDATE scats SET "
                 " scat_id = :scat_id, "
@@ -1151,6 +1119,12 @@ def edit_scat(scat_id):
                     + (32600 if request.form["hemisphere"] == "N" else 32700),
                 },
             )
+        fn.invalidate_tiles("scats")
+        fn.invalidate_wa_clusters()
+        transects_activity.refresh_cube(
+            old_transects
+            | transects_activity.cube_transects(scat_ids=[request.form["scat_id"]])
+        )
 
         return redirect(f"/view_scat/{request.form['scat_id']}")
 
@@ -1161,10 +1135,14 @@ def del_scat(scat_id):
     """
     Delete scat
     """
-    with fn.conn_alchemy().connect() as con:
+    old_transects = transects_activity.cube_transects(scat_ids=[scat_id])
+    with fn.db_connection() as con:
         con.execute(
             text("DELETE FROM scats WHERE scat_id = :scat_id"), {"scat_id": scat_id}
         )
+    fn.invalidate_tiles("scats")
+    fn.invalidate_wa_clusters()
+    transects_activity.refresh_cube(old_transects)
 
     return redirect("/scats_list_limit/0/20")
 
@@ -1176,11 +1154,15 @@ def set_path_id(scat_id, path_id):
     Set path_id for scat
     """
 
-    with fn.conn_alchemy().connect() as con:
+    old_transects = transects_activity.cube_transects(scat_ids=[scat_id])
+    with fn.db_connection() as con:
         con.execute(
             text("UPDATE scats SET path_id = :path_id WHERE scat_id = :scat_id"),
             {"path_id": path_id, "scat_id": scat_id},
         )
+    transects_activity.refresh_cube(
+        old_transects | transects_activity.cube_transects(path_ids=[path_id])
+    )
 
     flash(fn.alert_danger("The path ID was updated. "))
     return redirect("/")
@@ -1231,7 +1213,9 @@ def load_scats_table():
             )
             return redirect(url_for("scats.load_scats_table"))
 
-        r, msg, all_data, _, _ = scats_import.extract_data_from_spreadsheet(filename)
+        r, msg, all_data, _, _ = upload_staging.extract(
+            filename, scats_import.extract_data_from_spreadsheet
+        )
         if r:
             flash(
                 Markup(f"File name: <b>{new_file.filename}</b>")
@@ -1242,7 +1226,7 @@ def load_scats_table():
 
         else:
             # check if scat_id already in DB
-            with fn.conn_alchemy().connect() as con:
+            with fn.db_connection() as con:
                 scats_list = "','".join([all_data[idx]["scat_id"] for idx in all_data])
                 sql = text(
                     f"SELECT scat_id FROM scats WHERE scat_id IN ('{scats_list}')"
@@ -1271,198 +1255,38 @@ def confirm_load_table(filename, mode):
         flash(fn.alert_danger("Error: mode not allowed"))
         return redirect(url_for("scats.load_scats_table"))
 
-    r, msg, all_data, all_paths, all_tracks = (
-        scats_import.extract_data_from_spreadsheet(filename)
+    # rows parsed and validated at the upload (see upload_staging.py)
+    r, msg, _, _, _ = upload_staging.extract(
+        filename, scats_import.extract_data_from_spreadsheet
     )
 
     if r:
         flash(msg)
         return redirect(url_for("scats.load_scats_table"))
 
-    with fn.conn_alchemy().connect() as con:
-        # check if scat_id already in DB
-        scats_list = "','".join([all_data[idx]["scat_id"] for idx in all_data])
-        sql = text(f"SELECT scat_id FROM scats WHERE scat_id in ('{scats_list}')")
-
-        scats_to_update = [row["scat_id"] for row in con.execute(sql).mappings().all()]
-
-        count_added: int = 0
-        count_updated: int = 0
-        for idx in all_data:
-            data = dict(all_data[idx])
-
-            if mode == "new" and (data["scat_id"] in scats_to_update):
-                continue
-
-            sql = text(
-                "INSERT INTO scats (scat_id, date, wa_code, sampling_season, sampling_type, path_id, snowtrack_id, "
-                "location, municipality, province, region, "
-                "deposition, matrix, collected_scat, scalp_category, genetic_sample, "
-                "coord_east, coord_north, coord_zone, observer, institution,"
-                "geometry_utm, notes, sample_type, box_number) "
-                "VALUES("
-                ":scat_id, :date, :wa_code, :sampling_season, :sampling_type, :path_id, :snowtrack_id, "
-                ":location, :municipality, :province, :region, "
-                ":deposition, :matrix, :collected_scat, :scalp_category, :genetic_sample,"
-                ":coord_east, :coord_north, :coord_zone, :operator, :institution, "
-                f"{data['geometry_utm']}, :notes, :sample_type, :box_number "
-                ") "
-                "ON CONFLICT (scat_id) "
-                "DO UPDATE SET "
-                "date = CASE WHEN EXCLUDED.date IS NOT NULL THEN EXCLUDED.date ELSE scats.date END,"
-                "wa_code = CASE WHEN EXCLUDED.wa_code <> '' THEN EXCLUDED.wa_code ELSE scats.wa_code END,"
-                "sampling_season = CASE WHEN EXCLUDED.sampling_season <> '' THEN EXCLUDED.sampling_season ELSE scats.sampling_season END,"
-                "sampling_type = CASE WHEN EXCLUDED.sampling_type <> '' THEN EXCLUDED.sampling_type ELSE scats.sampling_type END,"
-                "path_id = CASE WHEN EXCLUDED.path_id <> '' THEN EXCLUDED.path_id ELSE scats.path_id END,"
-                "snowtrack_id = CASE WHEN EXCLUDED.snowtrack_id <> '' THEN EXCLUDED.snowtrack_id ELSE scats.snowtrack_id END,"
-                "location = CASE WHEN EXCLUDED.location <> '' THEN EXCLUDED.location ELSE scats.location END,"
-                "municipality = CASE WHEN EXCLUDED.municipality <> '' THEN EXCLUDED.municipality ELSE scats.municipality END,"
-                "province = CASE WHEN EXCLUDED.province <> '' THEN EXCLUDED.province ELSE scats.province END,"
-                "region = CASE WHEN EXCLUDED.region <> '' THEN EXCLUDED.region ELSE scats.region END,"
-                "deposition = CASE WHEN EXCLUDED.deposition <> '' THEN EXCLUDED.deposition ELSE scats.deposition END,"
-                "matrix = CASE WHEN EXCLUDED.matrix <> '' THEN EXCLUDED.matrix ELSE scats.matrix END,"
-                "collected_scat = CASE WHEN EXCLUDED.collected_scat <> '' THEN EXCLUDED.collected_scat ELSE scats.collected_scat END,"
-                "scalp_category = CASE WHEN EXCLUDED.scalp_category <> '' THEN EXCLUDED.scalp_category ELSE scats.scalp_category END,"
-                "genetic_sample = CASE WHEN EXCLUDED.genetic_sample <> '' THEN EXCLUDED.genetic_sample ELSE scats.genetic_sample END,"
-                "coord_east = CASE WHEN EXCLUDED.coord_east  IS NOT NULL  THEN EXCLUDED.coord_east ELSE scats.coord_east END,"
-                "coord_north = CASE WHEN EXCLUDED.coord_north  IS NOT NULL  THEN EXCLUDED.coord_north ELSE scats.coord_north END,"
-                "coord_zone = CASE WHEN EXCLUDED.coord_zone <> '' THEN EXCLUDED.coord_zone ELSE scats.coord_zone END,"
-                "observer = CASE WHEN EXCLUDED.observer <> '' THEN EXCLUDED.observer ELSE scats.observer END,"
-                "institution = CASE WHEN EXCLUDED.institution <> '' THEN EXCLUDED.institution ELSE scats.institution END,"
-                "geometry_utm = CASE WHEN EXCLUDED.geometry_utm <> '' THEN EXCLUDED.geometry_utm ELSE scats.geometry_utm END,"
-                "notes = CASE WHEN EXCLUDED.notes <> '' THEN EXCLUDED.notes ELSE scats.notes END,"
-                "sample_type = CASE WHEN EXCLUDED.sample_type <> '' THEN EXCLUDED.sample_type ELSE scats.sample_type END,"
-                "box_number = CASE WHEN EXCLUDED.box_number <> '' THEN EXCLUDED.box_number ELSE scats.box_number END"
+    # the rows are imported by a background job (see job_queue.py)
+    job_id = job_queue.submit(
+        session["email"],
+        kind="import_scats",
+        title="Import of scats from spreadsheet file",
+        function="scats_bp.scats_import:import_scats",
+        kwargs={"filename": filename, "mode": mode},
+    )
+    if job_id is None:
+        flash(
+            fn.alert_danger(
+                f"You have already {job_queue.JOBS_MAX_PER_USER} jobs running. Wait for their completion."
             )
-
-            params = {
-                "scat_id": data["scat_id"].strip(),
-                "date": data["date"],
-                "wa_code": data["wa_code"].strip(),
-                "sampling_season": fn.sampling_season(data["date"]),
-                "sampling_type": data["sampling_type"],
-                "path_id": data["path_id"],
-                "snowtrack_id": data["snowtrack_id"].strip(),
-                "location": data["location"].strip(),
-                "municipality": data["municipality"].strip(),
-                "province": data["province"].strip().upper(),
-                "region": data["region"],
-                "deposition": data["deposition"],
-                "matrix": data["matrix"],
-                "collected_scat": data["collected_scat"],
-                "scalp_category": data["scalp_category"].strip(),
-                "genetic_sample": data["genetic_sample"],
-                "coord_east": data["coord_east"],
-                "coord_north": data["coord_north"],
-                "coord_zone": data["coord_zone"].strip(),
-                "operator": data["operator"],
-                "institution": data["institution"],
-                "notes": data["notes"],
-                "sample_type": data["sample_type"],
-                "box_number": data["box_number"],
-            }
-
-            if data["scat_id"] in scats_to_update:
-                count_updated += 1
-            else:
-                count_added += 1
-            try:
-                con.execute(sql, params)
-            except Exception:
-                return (
-                    "An error occured during the loading of scats. Contact the administrator.<br>"
-                    + error_info(sys.exc_info())
-                )
-
-        """
-        # paths
-        sql = text(
-            "INSERT INTO paths (path_id, transect_id, date, sampling_season, completeness, observer, institution, notes) "
-            "VALUES("
-            ":path_id,"
-            ":transect_id, "
-            ":date,"
-            ":sampling_season,"
-            ":completeness,"
-            ":operator,"
-            ":institution,"
-            ":notes "
-            ") "
-            "ON CONFLICT (path_id) "
-            "DO UPDATE SET "
-            "transect_id = EXCLUDED.transect_id, "
-            "date = EXCLUDED.date,"
-            "sampling_season = EXCLUDED.sampling_season,"
-            "completeness = EXCLUDED.completeness,"
-            "observer = EXCLUDED.operator,"
-            "institution = EXCLUDED.institution,"
-            "notes = EXCLUDED.notes "
         )
+        return redirect(url_for("scats.load_scats_table"))
 
-        for idx in all_paths:
-            data = dict(all_paths[idx])
-            try:
-                con.execute(
-                    sql,
-                    {
-                        "path_id": data["path_id"],
-                        "transect_id": data["transect_id"].strip(),
-                        "date": data["date"],
-                        "sampling_season": fn.sampling_season(data["date"]),
-                        "completeness": data["completeness"],
-                        "operator": data["operator"].strip(),
-                        "institution": data["institution"].strip(),
-                        "notes": data["notes"],
-                    },
-                )
-            except Exception:
-                return "An error occured during the loading of paths. Contact the administrator.<br>" + error_info(sys.exc_info())
-
-        # snow tracks
-        sql = text(
-            "INSERT INTO snow_tracks (snowtrack_id, path_id, date, sampling_season, observer, institution, notes) "
-            "VALUES("
-            ":snowtrack_id, "
-            ":path_id, "
-            ":date, "
-            ":sampling_season, "
-            ":operator, "
-            ":institution, "
-            ":notes "
-            ")"
-            "ON CONFLICT (snowtrack_id) "
-            "DO UPDATE SET "
-            "path_id = EXCLUDED.path_id, "
-            "date = EXCLUDED.date, "
-            "sampling_season = EXCLUDED.sampling_season, "
-            "operator = EXCLUDED.operator, "
-            "institution = EXCLUDED.institution, "
-            "notes = EXCLUDED.notes "
+    flash(
+        fn.alert_success(
+            "The scats are being imported.<br>See the <a href='/jobs'>jobs page</a> for the result of the import."
         )
-        for idx in all_tracks:
-            data = dict(all_paths[idx])
-
-            try:
-                con.execute(
-                    sql,
-                    {
-                        "path_id": data["path_id"],
-                        "snowtrack_id": data["snowtrack_id"].strip(),
-                        "date": data["date"],
-                        "sampling_season": fn.sampling_season(data["date"]),
-                        "operator": data["operator"].strip(),
-                        "institution": data["institution"].strip(),
-                        "notes": data["notes"],
-                    },
-                )
-            except Exception:
-                return "An error occured during the loading of tracks. Contact the administrator.<br>" + error_info(sys.exc_info())
-        """
-
-    msg = f"Scats successfully loaded from spreadsheet file. {count_added} scat(s) added, {count_updated} scat(s) updated."
-    flash(fn.alert_success(msg))
+    )
 
-    return redirect("/")
+    return redirect("/jobs")
 
 
 @app.route("/systematic_scats_transect_location")
@@ -1474,9 +1298,12 @@ def systematic_scats_transect_location():
     !require the check_systematic_scats_transect_location.py script
     """
 
-    _ = subprocess.Popen(
-        [
-            "python3",
+    job_id = job_queue.submit(
+        session["email"],
+        kind="systematic_scats_transect_location",
+        title=f"Location of systematic scats on transects and tracks from {session['start_date']} to {session['end_date']}",
+        command=[
+            sys.executable,
             "check_systematic_scats_transect_location.py",
             session["start_date"],
             session["end_date"],
@@ -1492,7 +1319,13 @@ def systematic_scats_transect_location():
                     )
                 )
             ),
-        ]
+        ],
     )
+    if job_id is None:
+        flash(
+            fn.alert_danger(
+                f"You have already {job_queue.JOBS_MAX_PER_USER} jobs running. Wait for their completion."
+            )
+        )
 
-    return redirect("/my_results")
+    return redirect("/jobs")
@@ -7,10 +7,17 @@ import functions as fn
 
 
 import pathlib as pl
+import time
 import pandas as pd
 import datetime as dt
 import utm
 from markupsafe import Markup
+from sqlalchemy import text
+
+import bulk_import
+import job_queue
+import transects_activity
+import upload_staging
 
 DEBUG = False
 params = config()
@@ -133,7 +140,7 @@ def extract_data_from_spreadsheet(filename: str) -> (bool, str, dict, dict, dict
 
     # check if scat id is not already present in DB
     """
-    with fn.conn_alchemy().connect() as con:
+    with fn.db_connection() as con:
         results = con.execute(text("SELECT scat_id FROM scats")).mappings().all()
         scat_id_list = [x["scat_id"] for x in results]
         found_scat_list: list = []
@@ -146,7 +153,7 @@ def extract_data_from_spreadsheet(filename: str) -> (bool, str, dict, dict, dict
 
     # check if genotype id already present in DB (should be)
     """
-    with fn.conn_alchemy().connect() as con:
+    with fn.db_connection() as con:
         results = con.execute(text("SELECT genotype_id FROM genotypes")).mappings().all()
         genotype_id_list = [x["genotype_id"] for x in results]
         not_found_genotypes: list = []
@@ -177,11 +184,15 @@ def extract_data_from_spreadsheet(filename: str) -> (bool, str, dict, dict, dict
                 {},
             )
 
+    # reference tables (loaded once)
+    province_codes: set = set(fn.province_code_list())
+    province_regions: dict = fn.province_code2region_dict()
+
     # check province code
     for idx, province in enumerate(scats_df["province"]):
         if isinstance(province, int):
             province = f"{province:02}"
-        if province not in fn.province_code_list():
+        if province not in province_codes:
             return (
                 True,
                 fn.alert_danger(f"Province '{province}' not found at row {idx + 2}"),
@@ -257,7 +268,7 @@ def extract_data_from_spreadsheet(filename: str) -> (bool, str, dict, dict, dict
             data["box_number"] = row["box_number"]
 
         # add region from province code
-        data["region"] = fn.province_code2region(data["province"])
+        data["region"] = province_regions.get(str(data["province"]).upper().strip())
 
         # UTM coord conversion
         # check zone
@@ -297,7 +308,7 @@ def extract_data_from_spreadsheet(filename: str) -> (bool, str, dict, dict, dict
 
         srid = zone + (32600 if hemisphere == "N" else 32700)
         data["geometry_utm"] = (
-            f"ST_GeomFromText('POINT({data['coord_east']} {data['coord_north']})', {srid})"
+            f"SRID={srid};POINT({data['coord_east']} {data['coord_north']})"
         )
 
         # sampling_type
@@ -397,3 +408,98 @@ def extract_data_from_spreadsheet(filename: str) -> (bool, str, dict, dict, dict
     all_tracks: dict = {}
 
     return False, "", scats_data, all_paths, all_tracks
+
+
+def import_scats(filename: str, mode: str) -> None:
+    """
+    import the scats of the uploaded file (background job, see job_queue.py)
+
+    Args:
+        filename (str): name of the uploaded file (UUID)
+        mode (str): new (only the new scats are imported) or all (new and existing scats)
+    """
+
+    # rows parsed and validated at the upload (see upload_staging.py)
+    r, msg, all_data, _, _ = upload_staging.extract(filename, extract_data_from_spreadsheet)
+    if r:
+        raise ValueError(Markup(msg).striptags())
+
+    t0 = time.time()
+    scat_ids: list = [all_data[idx]["scat_id"].strip() for idx in all_data]
+
+    with fn.db_connection() as con:
+        # check if scat_id already in DB
+        scats_to_update = set(
+            con.execute(
+                text("SELECT scat_id FROM scats WHERE scat_id = ANY(:scat_ids)"),
+                {"scat_ids": scat_ids},
+            )
+            .scalars()
+            .all()
+        )
+    old_transects = transects_activity.cube_transects(scat_ids=list(scats_to_update))
+
+    rows: list = []
+    for idx in all_data:
+        data = dict(all_data[idx])
+
+        if mode == "new" and (data["scat_id"].strip() in scats_to_update):
+            continue
+
+        rows.append(
+            {
+                "scat_id": data["scat_id"].strip(),
+                "date": data["date"],
+                "wa_code": data["wa_code"].strip(),
+                "sampling_season": fn.sampling_season(data["date"]),
+                "sampling_type": data["sampling_type"],
+                "path_id": data["path_id"],
+                "snowtrack_id": data["snowtrack_id"].strip(),
+                "location": data["location"].strip(),
+                "municipality": data["municipality"].strip(),
+                "province": data["province"].strip().upper(),
+                "region": data["region"],
+                "deposition": data["deposition"],
+                "matrix": data["matrix"],
+                "collected_scat": data["collected_scat"],
+                "scalp_category": data["scalp_category"].strip(),
+                "genetic_sample": data["genetic_sample"],
+                "coord_east": data["coord_east"],
+                "coord_north": data["coord_north"],
+                "coord_zone": data["coord_zone"].strip(),
+                "observer": data["operator"],
+                "institution": data["institution"],
+                "geometry_utm": data["geometry_utm"],
+                "notes": data["notes"],
+                "sample_type": data["sample_type"],
+                "box_number": data["box_number"],
+            }
+        )
+
+    count_updated: int = len([row for row in rows if row["scat_id"] in scats_to_update])
+    count_added: int = len(rows) - count_updated
+
+    job_queue.progress(10, f"{len(rows)} scats to import")
+
+    # staging table and one upsert (see bulk_import.py)
+    if rows:
+        columns: tuple = tuple(rows[0])
+        with bulk_import.transaction() as con:
+            staging = bulk_import.stage(con, "scats", columns, rows)
+            bulk_import.merge(con, "scats", staging, "scat_id", columns)
+
+    upload_staging.discard(filename)
+
+    fn.invalidate_tiles("scats")
+    fn.invalidate_wa_clusters()
+    transects_activity.refresh_cube(
+        old_transects | transects_activity.cube_transects(scat_ids=scat_ids)
+    )
+
+    job_queue.progress(
+        100,
+        (
+            f"{count_added} scat(s) added, {count_updated} scat(s) updated "
+            f"({bulk_import.rate(len(rows), t0)})."
+        ),
+    )
@@ -0,0 +1,313 @@
+"""
+WolfDB web service
+(c) Olivier Friard
+
+search of the lists (scats, genotypes, WA codes and dead wolves)
+
+The rows of every entity have one or more search documents: the searchable columns concatenated
+by the search_text function and indexed by a GIN trigram index (see database/search.sql).
+
+Supported syntax:
+- free text: "trento" (rows with a document containing the text)
+- field search: "municipality: trento"
+- multiple field search: "municipality: trento; observer: mario"
+
+A field search is checked on the document of the column (indexed) and then on the column.
+A date field accepts a year, a month or a day (2023, 2023-05, 2023-05-12) and is searched by range.
+
+The results are ranked by the word similarity distance between the search and the documents
+(search_rank: 0 for the best match), the rows with the same rank are ordered by their ID.
+
+The same conditions are used by the web lists and by their exports.
+"""
+
+import calendar
+import datetime as dt
+import re
+
+# documents: SQL expressions on the rows of the list (must be identical to the indexed expressions)
+# match: free-text search, queries returning the ID of the matching rows ({document} is the search document)
+# fields: field name -> (column, document containing the column or None)
+#         or predicate with a {value} placeholder
+ENTITIES: dict = {
+    "scats": {
+        "id": "scat_id",
+        "documents": {
+            "scat": (
+                "search_text(scat_id, search_date(date), wa_code, sampling_season, sampling_type, "
+                "path_id, snowtrack_id, location, municipality, province, region, deposition, "
+                "matrix, collected_scat, genetic_sample, observer, institution, notes, "
+                "region_auto, province_auto, municipality_auto, location_auto, "
+                "sample_type, box_number, ispra_id)"
+            ),
+        },
+        "match": (
+            "SELECT scat_id FROM scats WHERE {scat} ILIKE {value}",
+            # genotype of the WA code (genotype_id2 of scats_list_all)
+            "SELECT s.scat_id FROM scats s JOIN wa_scat_dw_mat w ON w.wa_code = s.wa_code "
+            "WHERE w.genotype_id ILIKE {value}",
+            # scalp category: C1 if the mtDNA of the WA code is wolf (scalp_category of scats_list_all)
+            "SELECT s.scat_id FROM scats s "
+            "LEFT JOIN LATERAL (SELECT w.mtdna FROM wa_scat_dw_mat w WHERE w.wa_code = s.wa_code "
+            "                   ORDER BY w.date DESC NULLS LAST LIMIT 1) w ON TRUE "
+            "WHERE CASE WHEN lower(w.mtdna) LIKE '%wolf%' THEN 'C1' ELSE s.scalp_category END ILIKE {value}",
+        ),
+        "fields": {
+            "scat id": ("scat_id", "scat"),
+            "date": ("date", "scat"),
+            "wa code": ("wa_code", "scat"),
+            "sampling season": ("sampling_season", "scat"),
+            "sampling type": ("sampling_type", "scat"),
+            "path id": ("path_id", "scat"),
+            "snowtrack id": ("snowtrack_id", "scat"),
+            "location": ("location", "scat"),
+            "municipality": ("municipality", "scat"),
+            "province": ("province", "scat"),
+            "region": ("region", "scat"),
+            "deposition": ("deposition", "scat"),
+            "matrix": ("matrix", "scat"),
+            "collected scat": ("collected_scat", "scat"),
+            # C1 if the mtDNA of the WA code is wolf (see scats_list_all)
+            "scalp category": ("scalp_category", None),
+            "genetic sample": ("genetic_sample", "scat"),
+            "observer": ("observer", "scat"),
+            "institution": ("institution", "scat"),
+            "notes": ("notes", "scat"),
+            "region auto": ("region_auto", "scat"),
+            "province auto": ("province_auto", "scat"),
+            "municipality auto": ("municipality_auto", "scat"),
+            "location auto": ("location_auto", "scat"),
+            "sample type": ("sample_type", "scat"),
+            "box number": ("box_number", "scat"),
+            "ispra id": ("ispra_id", "scat"),
+            "genotype": (
+                "scat_id IN (SELECT s.scat_id FROM scats s JOIN wa_scat_dw_mat w ON w.wa_code = s.wa_code "
+                "WHERE w.genotype_id ILIKE {value})"
+            ),
+        },
+    },
+    "genotypes": {
+        "id": "genotype_id",
+        "documents": {
+            "genotype": (
+                "genotype_search_text(genotype_id, notes, tmp_id, date, pack, sex, status, working_notes)"
+            ),
+        },
+        "match": ("SELECT genotype_id FROM genotypes WHERE {genotype} ILIKE {value}",),
+        "fields": {
+            "genotype": ("genotype_id", "genotype"),
+            "notes": ("notes", "genotype"),
+            "tmp id": ("tmp_id", "genotype"),
+            "date": ("date", "genotype"),
+            "pack": ("pack", "genotype"),
+            "sex": ("sex", "genotype"),
+            "status": ("status", "genotype"),
+            "working notes": ("working_notes", "genotype"),
+        },
+    },
+    # wa_genetic_samples_all: WA codes (wa_scat_dw_mat) and their genotype (genotypes)
+    "wa": {
+        "id": "wa_code",
+        "documents": {
+            "sample": (
+                "search_text(wa_code, sample_id, search_date(date), municipality, province, "
+                "genotype_id, tmp_id, sex_id, box_number)"
+            ),
+            # notes is the working_notes column of genotypes
+            "genotype": "search_text(notes, pack, hybrid)",
+        },
+        "match": (
+            "SELECT wa_code FROM wa_scat_dw_mat WHERE {sample} ILIKE {value}",
+            "SELECT w.wa_code FROM wa_scat_dw_mat w JOIN genotypes g ON g.genotype_id = w.genotype_id "
+            "WHERE search_text(g.working_notes, g.pack, g.hybrid) ILIKE {value}",
+        ),
+        "fields": {
+            "wa": ("wa_code", "sample"),
+            "date": ("date", "sample"),
+            "sample id": ("sample_id", "sample"),
+            "municipality": ("municipality", "sample"),
+            "province": ("province", "sample"),
+            "genotype id": ("genotype_id", "sample"),
+            "sex": ("sex_id", "sample"),
+            "tmp id": ("tmp_id", "sample"),
+            "box": ("box_number", "sample"),
+            "hybrid": ("hybrid", "genotype"),
+            "notes": ("notes", "genotype"),
+            "pack": ("pack", "genotype"),
+        },
+    },
+    # dead_wolves and the values of their fields (dead_wolves_attributes)
+    "dead_wolves": {
+        "id": "id",
+        "documents": {
+            "dead_wolf": (
+                "search_text(tissue_id, genotype_id, wa_code, search_date(discovery_date), "
+                "location, municipality, province, region, box_number, scalp_category, notes, "
+                "sampling_season, operator, institution)"
+            ),
+        },
+        "match": (
+            "SELECT id FROM dead_wolves WHERE {dead_wolf} ILIKE {value}",
+            "SELECT id FROM dead_wolves_attributes WHERE dead_wolf_attributes_text(attributes) ILIKE {value}",
+        ),
+        "fields": {
+            "tissue_id": ("tissue_id", "dead_wolf"),
+            "genotype_id": ("genotype_id", "dead_wolf"),
+            "wa_code": ("wa_code", "dead_wolf"),
+            "discovery_date": ("discovery_date", "dead_wolf"),
+            "location": ("location", "dead_wolf"),
+            "municipality": ("municipality", "dead_wolf"),
+            "province": ("province", "dead_wolf"),
+            "region": ("region", "dead_wolf"),
+            "box_number": ("box_number", "dead_wolf"),
+            "scalp_category": ("scalp_category", "dead_wolf"),
+            "notes": ("notes", "dead_wolf"),
+            "sampling_season": ("sampling_season", "dead_wolf"),
+            "operator": ("operator", "dead_wolf"),
+            "institution": ("institution", "dead_wolf"),
+            # main and specific cause of mortality
+            "mortality": (
+                "id IN (SELECT id FROM dead_wolves_attributes "
+                "WHERE dead_wolf_attributes_text(attributes) ILIKE {value} "
+                "AND (attributes ->> '12' ILIKE {value} OR attributes ->> '13' ILIKE {value}))"
+            ),
+        },
+    },
+}
+
+DATE_COLUMNS: tuple = ("date", "discovery_date")
+
+
+def dead_wolf_field(field_id: int) -> str:
+    """
+    returns the predicate of the field search of a field of dead wolves (dead_wolves_fields_definition)
+    """
+    return (
+        "id IN (SELECT id FROM dead_wolves_attributes "
+        "WHERE dead_wolf_attributes_text(attributes) ILIKE {value} "
+        f"AND attributes ->> '{int(field_id)}' ILIKE {{value}})"
+    )
+
+
+def parse(search_term: str, fields: dict) -> list:
+    """
+    returns the list of (field, value) of a field search ("field: value; field: value")
+
+    Raises:
+        ValueError: invalid syntax or unknown field
+    """
+    out: list = []
+    for field_term in (x.strip() for x in search_term.split(";") if x.strip()):
+        if ":" not in field_term:
+            raise ValueError("Invalid search syntax. Use 'field: value' or free text.")
+
+        field, value = [x.strip() for x in field_term.split(":", 1)]
+        field = " ".join(field.lower().split())
+        if field not in fields:
+            raise ValueError(
+                "Search field not found. Must be one of: " + ", ".join(fields.keys())
+            )
+        out.append((field, value))
+    return out
+
+
+def date_range(value: str) -> tuple | None:
+    """
+    returns the first and the last day of a year, a month or a day (None if the value is not a date)
+    """
+    match = re.fullmatch(r"(\d{4})(?:-(\d{1,2})(?:-(\d{1,2}))?)?", value)
+    if match is None:
+        return None
+    year, month, day = (int(x) if x else None for x in match.groups())
+    try:
+        if month is None:
+            return dt.date(year, 1, 1), dt.date(year, 12, 31)
+        if day is None:
+            return dt.date(year, month, 1), dt.date(year, month, calendar.monthrange(year, month)[1])
+        return dt.date(year, month, day), dt.date(year, month, day)
+    except ValueError:
+        return None
+
+
+def field_condition(entity: dict, field_spec, name: str) -> str:
+    """
+    returns the predicate of a field search (the value is the :{name} parameter)
+    """
+    if isinstance(field_spec, str):
+        return field_spec.format(value=f":{name}")
+
+    column, document = field_spec
+    if column in DATE_COLUMNS:
+        column = f"search_date({column})"
+    if document is None:
+        return f"{column} ILIKE :{name}"
+    return f"{entity['documents'][document]} ILIKE :{name} AND {column} ILIKE :{name}"
+
+
+def where(
+    entity_name: str,
+    search_term: str,
+    field: str | None = None,
+    extra_fields: dict | None = None,
+) -> tuple[str, dict]:
+    """
+    returns the conditions of the search (to add to a WHERE clause, empty string without search term)
+    and their parameters.
+
+    Args:
+        entity_name (str): scats, genotypes, wa or dead_wolves
+        search_term (str): free text or field search ("field: value; field: value")
+        field (str): field of the search term (the search term is the value of the field, "all" for free text)
+        extra_fields (dict): fields added to the fields of the entity (name -> predicate with {value})
+
+    Raises:
+        ValueError: invalid syntax or unknown field
+    """
+    if not search_term:
+        return "", {}
+
+    entity: dict = ENTITIES[entity_name]
+    fields: dict = dict(entity["fields"], **(extra_fields or {}))
+
+    if field is not None and field != "all":
+        if field not in fields:
+            raise ValueError(f"Search field not found: {field}")
+        field_terms = [(field, search_term)]
+    elif ":" in search_term:
+        field_terms = parse(search_term, fields)
+    else:
+        field_terms = []
+
+    if not field_terms:
+        match = " UNION ".join(
+            arm.format(value=":search", **entity["documents"]) for arm in entity["match"]
+        )
+        return f" AND {entity['id']} IN ({match}) ", {
+            "search": f"%{search_term}%",
+            "search_rank": search_term,
+        }
+
+    sql: str = ""
+    values: dict = {"search_rank": " ".join(value for _, value in field_terms)}
+    for idx, (field_name, value) in enumerate(field_terms):
+        field_spec = fields[field_name]
+        if not isinstance(field_spec, str) and field_spec[0] in DATE_COLUMNS:
+            if (interval := date_range(value)) is not None:
+                # B-tree index on the date
+                sql += f" AND ({field_spec[0]} BETWEEN :search{idx}_start AND :search{idx}_end) "
+                values[f"search{idx}_start"], values[f"search{idx}_end"] = interval
+                continue
+        sql += f" AND ({field_condition(entity, field_spec, f'search{idx}')}) "
+        values[f"search{idx}"] = f"%{value}%"
+
+    return sql, values
+
+
+def rank(entity_name: str) -> str:
+    """
+    returns the rank of the rows (0 for the best match) for the :search_rank parameter (see where)
+    """
+    documents = ENTITIES[entity_name]["documents"].values()
+    if len(documents) == 1:
+        return f"(:search_rank <<-> {next(iter(documents))})"
+    return f"LEAST({', '.join(f':search_rank <<-> {document}' for document in documents)})"
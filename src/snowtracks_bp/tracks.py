@@ -9,7 +9,6 @@ import datetime as dt
 import json
 import os
 import pathlib as pl
-import sys
 import time
 import uuid
 
@@ -19,6 +18,9 @@ from markupsafe import Markup
 from sqlalchemy import text
 
 import functions as fn
+import job_queue
+import nearest
+import upload_staging
 from config import config
 
 from . import tracks_export, tracks_import
@@ -69,7 +71,7 @@ def view_track(snowtrack_id):
     visualize the track
     """
 
-    with fn.conn_alchemy().connect() as con:
+    with fn.db_connection() as con:
         track = dict(
             (
                 con.execute(
@@ -209,7 +211,7 @@ def tracks_list():
     list of tracks
     """
 
-    with fn.conn_alchemy().connect() as con:
+    with fn.db_connection() as con:
         # split transects (more transects can be specified)
         results: list = []
         for row in (
@@ -263,7 +265,7 @@ def plot_tracks():
     Plot all tracks
     """
 
-    with fn.conn_alchemy().connect() as con:
+    with fn.db_connection() as con:
         features: list = []
         tot_min_lat, tot_min_lon = 90, 90
         tot_max_lat, tot_max_lon = -90, -90
@@ -390,7 +392,7 @@ def new_track():
         """
 
         if form.validate():
-            with fn.conn_alchemy().connect() as con:
+            with fn.db_connection() as con:
                 # check if track already exists
                 rows = (
                     con.execute(
@@ -494,6 +496,7 @@ def new_track():
                         "notes": request.form["notes"],
                     },
                 )
+                fn.invalidate_tiles("tracks")
 
                 return redirect("/snowtracks_list")
         else:
@@ -526,7 +529,7 @@ def edit_track(track_id):
         )
 
     if request.method == "GET":
-        with fn.conn_alchemy().connect() as con:
+        with fn.db_connection() as con:
             default_val = (
                 con.execute(
                     text(
@@ -587,7 +590,7 @@ def edit_track(track_id):
         """
 
         if form.validate():
-            with fn.conn_alchemy().connect() as con:
+            with fn.db_connection() as con:
                 # check if snowtrack_id already exists
                 if request.form["snowtrack_id"] != track_id:
                     rows = (
@@ -653,7 +656,7 @@ def edit_track(track_id):
             track_region = fn.get_region(request.form["province"])
             """
 
-            with fn.conn_alchemy().connect() as con:
+            with fn.db_connection() as con:
                 sql = text(
                     "UPDATE snow_tracks SET "
                     "snowtrack_id = :new_track_id,"
@@ -716,6 +719,7 @@ def edit_track(track_id):
                         )
                     except Exception:
                         return not_valid("Check the MultiLineString field")
+            fn.invalidate_tiles("tracks")
 
             return redirect(f"/view_snowtrack/{track_id}")
         else:
@@ -730,11 +734,12 @@ def del_snowtrack(track_id):
     """
     Delete the track from table
     """
-    with fn.conn_alchemy().connect() as con:
+    with fn.db_connection() as con:
         con.execute(
             text("DELETE FROM snow_tracks WHERE snowtrack_id = :track_id"),
             {"track_id": track_id},
         )
+    fn.invalidate_tiles("tracks")
     return redirect("/snowtracks_list")
 
 
@@ -779,7 +784,9 @@ def load_tracks_xlsx():
             flash(fn.alert_danger("Error with the uploaded file"))
             return redirect("/load_tracks_xlsx")
 
-        r, msg, tracks_data = tracks_import.extract_data_from_tracks_xlsx(filename)
+        r, msg, tracks_data = upload_staging.extract(
+            filename, tracks_import.extract_data_from_tracks_xlsx
+        )
         if r:
             flash(
                 Markup(f"File name: <b>{new_file.filename}</b>")
@@ -790,7 +797,7 @@ def load_tracks_xlsx():
 
         # check if scat_id already in DB
 
-        with fn.conn_alchemy().connect() as con:
+        with fn.db_connection() as con:
             tracks_list = "','".join(
                 [tracks_data[idx]["snowtrack_id"] for idx in tracks_data]
             )
@@ -822,122 +829,37 @@ def confirm_load_tracks_xlsx(filename, mode):
         flash(fn.alert_danger("Error: mode not allowed"))
         return redirect("/load_tracks_xlsx")
 
-    r, msg, all_data = tracks_import.extract_data_from_tracks_xlsx(filename)
+    # rows parsed and validated at the upload (see upload_staging.py)
+    r, msg, _ = upload_staging.extract(
+        filename, tracks_import.extract_data_from_tracks_xlsx
+    )
     if r:
         flash(Markup(f"File name: <b>{filename}</b>") + Markup("<hr><br>") + msg)
         return redirect("/load_tracks_xlsx")
 
-    with fn.conn_alchemy().connect() as con:
-        # check if scat_id already in DB
-        tracks_list = "','".join([all_data[idx]["snowtrack_id"] for idx in all_data])
-        sql = text(
-            f"SELECT snowtrack_id FROM snow_tracks WHERE snowtrack_id IN ('{tracks_list}')"
+    # the rows are imported by a background job (see job_queue.py)
+    job_id = job_queue.submit(
+        session["email"],
+        kind="import_tracks",
+        title="Import of tracks from spreadsheet file",
+        function="snowtracks_bp.tracks_import:import_tracks",
+        kwargs={"filename": filename, "mode": mode},
+    )
+    if job_id is None:
+        flash(
+            fn.alert_danger(
+                f"You have already {job_queue.JOBS_MAX_PER_USER} jobs running. Wait for their completion."
+            )
         )
+        return redirect("/load_tracks_xlsx")
 
-        tracks_to_update = [
-            row["snowtrack_id"] for row in con.execute(sql).mappings().all()
-        ]
-
-        sql = text(
-            "UPDATE snow_tracks SET "
-            "snowtrack_id = :snowtrack_id, "
-            "date = :date,"
-            "sampling_season = :sampling_season,"
-            "track_type = :track_type,"
-            "sampling_type = :sampling_type,"
-            "location = :location, "
-            "municipality = :municipality, "
-            "province = :province, "
-            "region = :region, "
-            "scalp_category = :scalp_category, "
-            "observer = :operator, "
-            "institution = :institution, "
-            "notes = :notes, "
-            "coord_east = :coord_east, "
-            "coord_north = :coord_north, "
-            "coord_zone = :coord_zone, "
-            "geometry_utm = :geometry_utm "
-            "WHERE snowtrack_id = :snowtrack_id;"
-            "INSERT INTO snow_tracks ("
-            "snowtrack_id,"
-            "date,"
-            "sampling_season,"
-            "track_type,"
-            "sampling_type,"
-            "location,"
-            "municipality,"
-            "province,"
-            "region,"
-            "scalp_category,"
-            "observer,"
-            "institution,"
-            "notes,"
-            "coord_east, coord_north, coord_zone, "
-            "geometry_utm"
-            ") "
-            "SELECT "
-            ":snowtrack_id,"
-            ":date,"
-            ":sampling_season,"
-            ":track_type,"
-            ":sampling_type,"
-            ":location,"
-            ":municipality,"
-            ":province,"
-            ":region,"
-            ":scalp_category, "
-            ":operator,"
-            ":institution,"
-            ":notes, "
-            ":coord_east, :coord_north, :coord_zone,"
-            ":geometry_utm "
-            "WHERE NOT EXISTS (SELECT 1 FROM snow_tracks WHERE snowtrack_id = :snowtrack_id)"
+    flash(
+        fn.alert_success(
+            "The tracks are being imported.<br>See the <a href='/jobs'>jobs page</a> for the result of the import."
         )
-        count_added = 0
-        count_updated = 0
-        for idx in all_data:
-            data = dict(all_data[idx])
-
-            if mode == "new" and (data["snowtrack_id"] in tracks_to_update):
-                continue
-            if data["snowtrack_id"] in tracks_to_update:
-                count_updated += 1
-            else:
-                count_added += 1
-            print(f"{data=}")
-            try:
-                con.execute(
-                    sql,
-                    {
-                        "snowtrack_id": data["snowtrack_id"].strip(),
-                        "date": data["date"],
-                        "track_type": data["track_type"],
-                        "sampling_season": fn.sampling_season(data["date"]),
-                        "sampling_type": data["sampling_type"],
-                        "scalp_category": data["scalp_category"].strip(),
-                        "location": data["location"].strip(),
-                        "municipality": data["municipality"].strip(),
-                        "province": data["province"].strip().upper(),
-                        "region": data["region"],
-                        "operator": data["operator"],
-                        "institution": data["institution"],
-                        "notes": data["notes"],
-                        "coord_east": data["coord_east"],
-                        "coord_north": data["coord_north"],
-                        "coord_zone": data["coord_zone"],
-                        "geometry_utm": data["geometry_utm"],
-                    },
-                )
-            except Exception:
-                return (
-                    "An error occured during the import of tracks. Contact the administrator.<br>"
-                    + error_info(sys.exc_info())
-                )
-
-    msg = f"XLSX/ODS file successfully loaded. {count_added} tracks added, {count_updated} tracks updated."
-    flash(fn.alert_success(msg))
+    )
 
-    return redirect("/tracks")
+    return redirect("/jobs")
 
 
 @app.route("/export_tracks")
@@ -946,7 +868,7 @@ def export_tracks():
     """
     export tracks in XLSX file
     """
-    with fn.conn_alchemy().connect() as con:
+    with fn.db_connection() as con:
         file_content = tracks_export.export_tracks(
             con.execute(
                 text(
@@ -1004,28 +926,16 @@ def check_tracks_location():
     check_tracks_location
     """
 
-    with fn.conn_alchemy().connect() as con:
-        tracks = (
-            con.execute(
-                text(
-                    "SELECT snowtrack_id,  "
-                    "(select concat(transect_id, '|', ROUND(st_distance(s.multilines, multilines))) FROM transects  "
-                    "   WHERE st_distance(s.multilines, multilines) = "
-                    "                 (select min(st_distance(s.multilines, multilines)) from transects) LIMIT 1) AS transect_dist "
-                    "FROM snow_tracks s "
-                    "WHERE sampling_type != 'Opportunistic' "
-                    "AND transect_id is null "
-                    "AND s.multilines IS NOT NULL "
-                    "AND (date BETWEEN :start_date AND :end_date OR date is NULL)"
-                ),
-                {
-                    "start_date": session["start_date"],
-                    "end_date": session["end_date"],
-                },
-            )
-            .mappings()
-            .all()
-        )
+    # closest transect (see nearest.py)
+    tracks = nearest.tracks(
+        "AND sampling_type != 'Opportunistic' "
+        "AND transect_id is null "
+        "AND (date BETWEEN :start_date AND :end_date OR date is NULL)",
+        {
+            "start_date": session["start_date"],
+            "end_date": session["end_date"],
+        },
+    )
 
     return render_template(
         "check_tracks_location.html",
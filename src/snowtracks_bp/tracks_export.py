@@ -79,7 +79,7 @@ def export_shapefile(dir_path: str, file_name: str, log_file: str) -> str:
 
     log = open(log_file, "w")
 
-    with fn.conn_alchemy().connect() as con:
+    with fn.db_connection() as con:
         tracks = (
             con.execute(
                 text(
@@ -4,8 +4,14 @@ import tracks from XLSX file
 
 import pandas as pd
 import pathlib as pl
+import time
+from markupsafe import Markup
+from sqlalchemy import text
 from config import config
+import bulk_import
 import functions as fn
+import job_queue
+import upload_staging
 import datetime
 import utm
 
@@ -74,6 +80,10 @@ def extract_data_from_tracks_xlsx(filename: str):
         if column not in list(tracks_df.columns) and column != "track_type":
             return True, fn.alert_danger(f"Column {column} is missing"), {}
 
+    # reference tables (loaded once)
+    province_regions: dict = fn.province_code2region_dict()
+    province_names: dict = fn.province_name2code_dict()
+
     tracks_data = {}
     for index, row in tracks_df.iterrows():
         data = {}
@@ -114,10 +124,14 @@ def extract_data_from_tracks_xlsx(filename: str):
         data["date"] = date_from_file
 
         # check province code
-        province = fn.check_province_code(data["province"])
+        province = (
+            str(data["province"]).upper()
+            if str(data["province"]).upper() in province_regions
+            else None
+        )
         if province is None:
             # check province name
-            province = fn.province_name2code(data["province"])
+            province = province_names.get(str(data["province"]).upper().strip())
             if province is None:
                 out += fn.alert_danger(
                     f"Row {index + 2}: The province {data['province']} was not found"
@@ -125,7 +139,11 @@ def extract_data_from_tracks_xlsx(filename: str):
         data["province"] = province
 
         # add region from province code
-        scat_region = fn.province_code2region(data["province"])
+        scat_region = (
+            province_regions.get(data["province"].upper().strip())
+            if data["province"] is not None
+            else None
+        )
         data["region"] = scat_region
 
         """
@@ -195,3 +213,86 @@ def extract_data_from_tracks_xlsx(filename: str):
         return True, out, {}
 
     return False, "", tracks_data
+
+
+def import_tracks(filename: str, mode: str) -> None:
+    """
+    import the tracks of the uploaded file (background job, see job_queue.py)
+
+    Args:
+        filename (str): name of the uploaded file (UUID)
+        mode (str): new (only the new tracks are imported) or all (new and existing tracks)
+    """
+
+    # rows parsed and validated at the upload (see upload_staging.py)
+    r, msg, all_data = upload_staging.extract(filename, extract_data_from_tracks_xlsx)
+    if r:
+        raise ValueError(Markup(msg).striptags())
+
+    t0 = time.time()
+
+    with fn.db_connection() as con:
+        # check if the track ID is already in DB
+        tracks_to_update = set(
+            con.execute(
+                text("SELECT snowtrack_id FROM snow_tracks WHERE snowtrack_id = ANY(:snowtrack_ids)"),
+                {"snowtrack_ids": [all_data[idx]["snowtrack_id"].strip() for idx in all_data]},
+            )
+            .scalars()
+            .all()
+        )
+
+    rows: list = []
+    for idx in all_data:
+        data = dict(all_data[idx])
+
+        if mode == "new" and (data["snowtrack_id"].strip() in tracks_to_update):
+            continue
+
+        rows.append(
+            {
+                "snowtrack_id": data["snowtrack_id"].strip(),
+                "date": data["date"],
+                "sampling_season": fn.sampling_season(data["date"]),
+                "track_type": data["track_type"],
+                "sampling_type": data["sampling_type"],
+                "location": data["location"].strip(),
+                "municipality": data["municipality"].strip(),
+                "province": data["province"].strip().upper(),
+                "region": data["region"],
+                "scalp_category": data["scalp_category"].strip(),
+                "observer": data["operator"],
+                "institution": data["institution"],
+                "notes": data["notes"],
+                "coord_east": data["coord_east"],
+                "coord_north": data["coord_north"],
+                "coord_zone": data["coord_zone"],
+                "geometry_utm": data["geometry_utm"],
+            }
+        )
+
+    count_updated = len([row for row in rows if row["snowtrack_id"] in tracks_to_update])
+    count_added = len(rows) - count_updated
+
+    job_queue.progress(10, f"{len(rows)} tracks to import")
+
+    # staging table and one upsert (see bulk_import.py)
+    if rows:
+        columns: tuple = tuple(rows[0])
+        with bulk_import.transaction() as con:
+            staging = bulk_import.stage(con, "snow_tracks", columns, rows)
+            bulk_import.merge(
+                con, "snow_tracks", staging, "snowtrack_id", columns, replace=True
+            )
+
+    upload_staging.discard(filename)
+
+    fn.invalidate_tiles("tracks")
+
+    job_queue.progress(
+        100,
+        (
+            f"{count_added} tracks added, {count_updated} tracks updated "
+            f"({bulk_import.rate(len(rows), t0)})."
+        ),
+    )
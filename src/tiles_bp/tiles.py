@@ -0,0 +1,177 @@
+"""
+WolfDB web service
+(c) Olivier Friard
+
+flask blueprint for vector tiles (Mapbox Vector Tiles)
+
+The tiles are built by PostGIS (ST_AsMVT) for the date interval of the session
+and are cached in redis (see fn.TILES_REDIS_DB).
+The cache of a layer is invalidated by fn.invalidate_tiles after an edit.
+
+see database/tiles_indexes.sql for the indexes used by the tiles queries
+"""
+
+import redis
+from flask import Blueprint, Response, abort, render_template, session
+from sqlalchemy import text
+
+import functions as fn
+from config import config
+
+app = Blueprint("tiles", __name__, template_folder="templates")
+
+params = config()
+app.debug = params["debug"]
+
+# extent of a tile (MVT coordinates) and buffer around the tile
+EXTENT = 4096
+BUFFER = 64
+
+# half of the Web Mercator world width (m)
+WEB_MERCATOR_MAX = 20037508.342789244
+
+MAX_ZOOM = 22
+
+# layer: table, geometry, id, date, properties, condition
+LAYERS: dict = {
+    "scats": {
+        "table": "scats",
+        "geometry": "geometry_utm",
+        "id": "scat_id",
+        "date": "date",
+        "properties": ["scat_id", "wa_code", "date::text AS date"],
+        "condition": "",
+    },
+    "transects": {
+        "table": "transects",
+        "geometry": "multilines",
+        "id": "transect_id",
+        "date": "",
+        "properties": ["transect_id", "province"],
+        "condition": "",
+    },
+    "tracks": {
+        "table": "snow_tracks",
+        "geometry": "multilines",
+        "id": "snowtrack_id",
+        "date": "date",
+        "properties": ["snowtrack_id", "date::text AS date"],
+        "condition": "",
+    },
+    "dead_wolves": {
+        "table": "dead_wolves",
+        "geometry": "geometry_utm",
+        "id": "id",
+        "date": "discovery_date",
+        "properties": [
+            "id",
+            "genotype_id",
+            "tissue_id",
+            "discovery_date::text AS discovery_date",
+        ],
+        "condition": "deleted IS NULL",
+    },
+}
+
+
+def tile_sql(layer: str, z: int) -> str:
+    """
+    returns the SQL query building the tile of the layer.
+    The lines are simplified with a tolerance of a tile pixel
+    """
+    definition = LAYERS[layer]
+
+    geometry = f"ST_Transform(t.{definition['geometry']}, 3857)"
+    if definition["geometry"] == "multilines":
+        tolerance = 2 * WEB_MERCATOR_MAX / (EXTENT * 2**z)
+        mvt_geometry = f"ST_Simplify({geometry}, {tolerance})"
+    else:
+        mvt_geometry = geometry
+
+    conditions = [f"{geometry} && bounds.geom"]
+    if definition["date"]:
+        conditions.append(f"t.{definition['date']} BETWEEN :start_date AND :end_date")
+    if definition["condition"]:
+        conditions.append(f"t.{definition['condition']}")
+
+    return (
+        "WITH bounds AS (SELECT ST_TileEnvelope(:z, :x, :y) AS geom), "
+        "mvtgeom AS ( "
+        f"  SELECT ST_AsMVTGeom({mvt_geometry}, bounds.geom, {EXTENT}, {BUFFER}, true) AS geom, "
+        f"         {', '.join('t.' + x for x in definition['properties'])} "
+        f"  FROM {definition['table']} t, bounds "
+        f"  WHERE {' AND '.join(conditions)} "
+        ") "
+        f"SELECT ST_AsMVT(mvtgeom.*, :layer, {EXTENT}, 'geom') AS tile "
+        "FROM mvtgeom "
+        "WHERE geom IS NOT NULL"
+    )
+
+
+def tile_key(layer: str, z: int, x: int, y: int, start_date: str, end_date: str) -> str:
+    """
+    returns the redis key of the tile
+    """
+    if not LAYERS[layer]["date"]:
+        start_date, end_date = "", ""
+    return f"tiles:{layer}:{fn.tiles_version(layer)}:{start_date}:{end_date}:{z}/{x}/{y}"
+
+
+@app.route("/tiles/<layer>/<int:z>/<int:x>/<int:y>.mvt")
+@fn.check_login
+def tile(layer: str, z: int, x: int, y: int):
+    """
+    returns the vector tile of the layer (scats, transects, tracks or dead_wolves)
+    for the date interval of the session
+    """
+
+    if layer not in LAYERS or not (0 <= z <= MAX_ZOOM) or not (0 <= x < 2**z and 0 <= y < 2**z):
+        abort(404)
+
+    key = tile_key(layer, z, x, y, session["start_date"], session["end_date"])
+
+    try:
+        mvt = fn.rtiles.get(key)
+    except redis.exceptions.ConnectionError:
+        mvt = None
+
+    if mvt is None:
+        with fn.db_connection() as con:
+            mvt = con.execute(
+                text(tile_sql(layer, z)),
+                {
+                    "z": z,
+                    "x": x,
+                    "y": y,
+                    "layer": layer,
+                    "start_date": session["start_date"],
+                    "end_date": session["end_date"],
+                },
+            ).scalar()
+        mvt = bytes(mvt) if mvt is not None else b""
+
+        try:
+            fn.rtiles.set(key, mvt, ex=fn.TILES_CACHE_TTL)
+        except redis.exceptions.ConnectionError:
+            pass
+
+    response = Response(mvt, mimetype="application/vnd.mapbox-vector-tile")
+    response.headers["Cache-Control"] = "private, max-age=300"
+    return response
+
+
+@app.route("/map_tiles")
+@fn.check_login
+def map_tiles():
+    """
+    map of scats, transects, tracks and dead wolves using the vector tiles
+    """
+
+    return render_template(
+        "map_tiles.html",
+        header_title="Map of scats, transects, tracks and dead wolves",
+        scat_color=params["scat_color"],
+        dead_wolf_color=params["dead_wolf_color"],
+        transect_color=params["transect_color"],
+        track_color=params["track_color"],
+    )
@@ -0,0 +1,223 @@
+"""
+WolfDB web service
+(c) Olivier Friard
+
+activity of transects: paths (date, completeness) and number of samples by path
+
+The activity is precomputed by transect, year and month in the transects_activity_cube table
+(see database/transects_activity_cube.sql).
+The rows of the transects are refreshed by refresh_cube after the edition or the import of paths and scats.
+
+The cube is pivoted in Python for the transects analysis and the TSV/CSV exports
+(transects_analysis, transects_n_samples_by_month, transects_n_samples, transects_dates
+and transects_completeness).
+"""
+
+from typing import Callable
+
+from sqlalchemy import text
+
+import functions as fn
+
+# months of the sampling season
+SEASON_MONTHS: list = [5, 6, 7, 8, 9, 10, 11, 12, 1, 2, 3, 4]
+
+# activity of the transects by year and month (see database/transects_activity_cube.sql)
+CUBE_SQL = (
+    "SELECT "
+    "    p.transect_id, "
+    "    CASE WHEN EXTRACT(MONTH FROM p.date) >= 5 "
+    "         THEN EXTRACT(YEAR FROM p.date)::int || '-' || (EXTRACT(YEAR FROM p.date)::int + 1) "
+    "         ELSE (EXTRACT(YEAR FROM p.date)::int - 1) || '-' || EXTRACT(YEAR FROM p.date)::int "
+    "    END AS sampling_season, "
+    "    EXTRACT(YEAR FROM p.date)::int AS year, "
+    "    EXTRACT(MONTH FROM p.date)::int AS month, "
+    "    COUNT(*) AS n_paths, "
+    "    array_agg(p.path_id::text ORDER BY p.date, p.path_id) AS path_ids, "
+    "    array_agg(p.date ORDER BY p.date, p.path_id) AS dates, "
+    "    array_agg(p.completeness ORDER BY p.date, p.path_id) AS completeness, "
+    "    array_agg(s.n_samples ORDER BY p.date, p.path_id) AS path_n_samples, "
+    "    SUM(s.n_samples) AS n_samples "
+    "FROM paths p "
+    "CROSS JOIN LATERAL (SELECT COUNT(*)::int AS n_samples FROM scats WHERE scats.path_id = p.path_id) s "
+    "WHERE p.transect_id IS NOT NULL AND p.transect_id != '' AND p.date IS NOT NULL "
+    "      {condition} "
+    "GROUP BY p.transect_id, EXTRACT(YEAR FROM p.date), EXTRACT(MONTH FROM p.date)"
+)
+
+CUBE_COLUMNS = (
+    "transect_id, sampling_season, year, month, n_paths, "
+    "path_ids, dates, completeness, path_n_samples, n_samples"
+)
+
+
+def cube_transects(path_ids: list | None = None, scat_ids: list | None = None) -> set:
+    """
+    returns the transect IDs of the paths and of the paths of the scats.
+    Must be called before and after a modification to refresh the old and the new transects
+    """
+    with fn.db_connection() as con:
+        return {
+            row["transect_id"]
+            for row in con.execute(
+                text(
+                    "SELECT DISTINCT transect_id FROM paths "
+                    "WHERE transect_id IS NOT NULL "
+                    "      AND (path_id = ANY(:path_ids) "
+                    "           OR path_id IN (SELECT path_id FROM scats WHERE scat_id = ANY(:scat_ids)))"
+                ),
+                {"path_ids": list(path_ids or []), "scat_ids": list(scat_ids or [])},
+            ).mappings()
+        }
+
+
+def refresh_cube(transect_ids: list | set | None = None) -> None:
+    """
+    recompute the rows of the transects in the cube (all transects if transect_ids is None)
+    """
+
+    if transect_ids is not None:
+        transect_ids = [x for x in transect_ids if x]
+        if not transect_ids:
+            return
+
+    # the rows are deleted and inserted in one transaction (the engine is in autocommit)
+    # on a dedicated connection (not the connection of the request)
+    with fn.conn_alchemy().connect() as con:
+        con = con.execution_options(isolation_level="READ COMMITTED")
+        with con.begin():
+            if transect_ids is None:
+                con.execute(text("DELETE FROM transects_activity_cube"))
+                condition = ""
+            else:
+                con.execute(
+                    text(
+                        "DELETE FROM transects_activity_cube WHERE transect_id = ANY(:transect_ids)"
+                    ),
+                    {"transect_ids": transect_ids},
+                )
+                condition = "AND p.transect_id = ANY(:transect_ids)"
+
+            con.execute(
+                text(
+                    f"INSERT INTO transects_activity_cube ({CUBE_COLUMNS}) "
+                    + CUBE_SQL.format(condition=condition)
+                ),
+                {"transect_ids": transect_ids},
+            )
+
+
+def transects_paths(start_date: str | None = None, end_date: str | None = None) -> dict:
+    """
+    returns the transects with their paths (ordered by date) and the number of samples of each path
+
+    Args:
+        start_date (str): first date of the paths (None for all paths)
+        end_date (str): last date of the paths (None for all paths)
+
+    Returns:
+        dict: {transect_id: {"region": ..., "province": ...,
+                             "paths": [{"path_id", "date", "completeness", "n_samples"}, ...]}}
+              ordered by transect ID
+    """
+
+    # the months of the cube are selected, the dates of the paths are checked below
+    start_month = int(start_date[:4]) * 100 + int(start_date[5:7]) if start_date else 0
+    end_month = int(end_date[:4]) * 100 + int(end_date[5:7]) if end_date else 999999
+
+    transects: dict = {}
+    with fn.db_connection() as con:
+        for row in con.execute(
+            text(
+                "SELECT t.transect_id, t.region, t.province, "
+                "       c.path_ids, c.dates, c.completeness, c.path_n_samples "
+                "FROM transects t "
+                "LEFT JOIN transects_activity_cube c "
+                "       ON c.transect_id = t.transect_id "
+                "          AND c.year * 100 + c.month BETWEEN :start_month AND :end_month "
+                "ORDER BY t.transect_id, c.year, c.month"
+            ),
+            {"start_month": start_month, "end_month": end_month},
+        ).mappings():
+            if row["transect_id"] not in transects:
+                transects[row["transect_id"]] = {
+                    "region": row["region"],
+                    "province": row["province"],
+                    "paths": [],
+                }
+            if row["path_ids"] is None:
+                continue
+            for path_id, date, completeness, n_samples in zip(
+                row["path_ids"], row["dates"], row["completeness"], row["path_n_samples"]
+            ):
+                if (start_date and str(date) < start_date) or (
+                    end_date and str(date) > end_date
+                ):
+                    continue
+                transects[row["transect_id"]]["paths"].append(
+                    {
+                        "path_id": path_id,
+                        "date": date,
+                        "completeness": completeness,
+                        "n_samples": n_samples,
+                    }
+                )
+
+    return transects
+
+
+def by_month(paths: list) -> dict:
+    """
+    returns the dates, completeness and number of samples of the paths by month
+
+    Returns:
+        dict: {month: {"dates": [...], "completeness": [...], "n_samples": int}}
+    """
+    months: dict = {}
+    for path in paths:
+        month = months.setdefault(
+            path["date"].month, {"dates": [], "completeness": [], "n_samples": 0}
+        )
+        month["dates"].append(str(path["date"]))
+        month["completeness"].append(str(path["completeness"]))
+        month["n_samples"] += path["n_samples"]
+    return months
+
+
+def n_samples_by_month(transects: dict, years: range):
+    """
+    yields the rows (list of str) of the number of samples by transect and by month
+    (NA if no path in the month)
+    """
+
+    yield ["path_id"] + [
+        f"{year}-{month:02}" for year in years for month in SEASON_MONTHS
+    ]
+
+    for transect_id, transect in transects.items():
+        n_samples: dict = {}
+        for path in transect["paths"]:
+            key = (path["date"].year, path["date"].month)
+            n_samples[key] = n_samples.get(key, 0) + path["n_samples"]
+
+        yield [transect_id] + [
+            str(n_samples[(year, month)]) if (year, month) in n_samples else "NA"
+            for year in years
+            for month in SEASON_MONTHS
+        ]
+
+
+def paths_values(transects: dict, value: Callable) -> tuple[int, dict]:
+    """
+    returns the max number of paths by transect and the values of the paths of every transect
+    (ordered by date)
+
+    Args:
+        transects (dict): see transects_paths
+        value (Callable): function returning the value (str) of a path
+    """
+    values: dict = {
+        transect_id: [value(path) for path in transect["paths"]]
+        for transect_id, transect in transects.items()
+    }
+    return max((len(x) for x in values.values()), default=0), values
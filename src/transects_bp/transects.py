@@ -15,6 +15,7 @@ from markupsafe import Markup
 from sqlalchemy import text
 
 import functions as fn
+import transects_activity
 from config import config
 
 from . import transects_export
@@ -37,7 +38,7 @@ def view_transect(transect_id):
     transects_color = params["transect_color"]
     tracks_color = params["track_color"]
 
-    with fn.conn_alchemy().connect() as con:
+    with fn.db_connection() as con:
         transect = (
             con.execute(
                 text(
@@ -112,6 +113,7 @@ def view_transect(transect_id):
                         "SELECT *, ST_AsGeoJSON(st_transform(geometry_utm, 4326)) AS scat_lonlat FROM scats_list_all "
                         "WHERE path_id LIKE :path_id "
                         " AND (date between :start_date AND :end_date OR date IS NULL) "
+                        "ORDER BY scat_id"
                     )
                 ),
                 {
@@ -225,7 +227,7 @@ def view_transect(transect_id):
 @fn.check_login
 def transects_list():
     # get all transects
-    with fn.conn_alchemy().connect() as con:
+    with fn.db_connection() as con:
         transects = (
             con.execute(text("SELECT * FROM transects ORDER BY transect_id"))
             .mappings()
@@ -247,7 +249,7 @@ def export_transects():
     export all transects in XLSX
     """
 
-    with fn.conn_alchemy().connect() as con:
+    with fn.db_connection() as con:
         file_content = transects_export.export_transects(
             con.execute(text("SELECT * FROM transects ORDER BY transect_id"))
             .mappings()
@@ -304,7 +306,7 @@ def new_transect():
         form = Transect(request.form)
 
         if form.validate():
-            with fn.conn_alchemy().connect() as con:
+            with fn.db_connection() as con:
                 # check if transect_id already exists
                 rows = (
                     con.execute(
@@ -367,6 +369,7 @@ def new_transect():
 
                 except Exception:
                     return not_valid("Check the MultiLineString field")
+                fn.invalidate_tiles("transects")
 
                 return redirect("/transects_list")
         else:
@@ -393,7 +396,7 @@ def edit_transect(transect_id):
         )
 
     if request.method == "GET":
-        with fn.conn_alchemy().connect() as con:
+        with fn.db_connection() as con:
             default_values = (
                 con.execute(
                     text(
@@ -428,7 +431,7 @@ def edit_transect(transect_id):
     if request.method == "POST":
         form = Transect(request.form)
         if form.validate():
-            with fn.conn_alchemy().connect() as con:
+            with fn.db_connection() as con:
                 # check if transect_id already exists
                 if request.form["transect_id"] != transect_id:
                     if len(
@@ -507,6 +510,7 @@ def edit_transect(transect_id):
 
                     except Exception:
                         return not_valid("Check the MultiLineString field")
+                fn.invalidate_tiles("transects")
 
                 return redirect(f"/view_transect/{transect_id}")
         else:
@@ -516,7 +520,7 @@ def edit_transect(transect_id):
 @app.route("/del_transect/<transect_id>")
 @fn.check_login
 def del_transect(transect_id):
-    with fn.conn_alchemy().connect() as con:
+    with fn.db_connection() as con:
         # check if path based on transect exist
         result = (
             con.execute(
@@ -535,6 +539,7 @@ def del_transect(transect_id):
             "DELETE FROM transects WHERE transect_id = :transect_id",
             {"transect_id": transect_id},
         )
+        fn.invalidate_tiles("transects")
         return redirect("/transects_list")
 
 
@@ -545,7 +550,7 @@ def plot_transects():
     Plot all transects
     """
 
-    with fn.conn_alchemy().connect() as con:
+    with fn.db_connection() as con:
         transects_features: list = []
         tot_min_lat, tot_min_lon = 90, 90
         tot_max_lat, tot_max_lon = -90, -90
@@ -607,172 +612,68 @@ def plot_transects():
 @app.route("/transects_analysis")
 @fn.check_login
 def transects_analysis():
-    with fn.conn_alchemy().connect() as con:
-        # check if path based on transect exist
-        transects = (
-            con.execute(
-                text("SELECT * FROM transects ORDER BY region, province, transect_id")
-            )
-            .mappings()
-            .all()
-        )
+    """
+    dates, completeness and number of samples of the paths of every transect by month
+    """
 
-        out = """<style>    table{    border-width: 0 0 1px 1px;    border-style: solid;} td{    border-width: 1px 1px 0 0;    border-style: solid;    margin: 0;    }</style>    """
+    transects = transects_activity.transects_paths()
 
-        season = [5, 6, 7, 8, 9, 10, 11, 12, 1, 2, 3, 4]
+    out = """<style>    table{    border-width: 0 0 1px 1px;    border-style: solid;} td{    border-width: 1px 1px 0 0;    border-style: solid;    margin: 0;    }</style>    """
 
-        out += "<table>"
-        out += "<tr><th>Region</th><th>Province</th><th>transect ID</th>"
-        for month in season:
-            out += f"<th>{calendar.month_abbr[month]}</th>"
-        out += "</tr>"
+    out += "<table>"
+    out += "<tr><th>Region</th><th>Province</th><th>transect ID</th>"
+    for month in transects_activity.SEASON_MONTHS:
+        out += f"<th>{calendar.month_abbr[month]}</th>"
+    out += "</tr>"
 
-        for row in transects:
-            transect_id = row["transect_id"]
+    # same order as ORDER BY region, province, transect_id (NULL last)
+    def order(transect_id: str) -> tuple:
+        region, province = transects[transect_id]["region"], transects[transect_id]["province"]
+        return (region is None, region or "", province is None, province or "", transect_id)
 
-            # print(f"{transect_id=}")
+    for transect_id in sorted(transects, key=order):
+        transect = transects[transect_id]
+        months = transects_activity.by_month(transect["paths"])
 
-            transect_month = {}
-            dates_list = {}
-            completeness_list = {}
+        out += f"<tr><td>{transect['region']}</td><td>{transect['province']}</td><td>{transect_id}</td>"
 
-            for row_path in (
-                con.execute(
-                    text("SELECT * FROM paths WHERE transect_id = :transect_id"),
-                    {"transect_id": transect_id},
+        for month in transects_activity.SEASON_MONTHS:
+            if month in months:
+                out += (
+                    f"<td>{', '.join(months[month]['dates'])}<br>"
+                    f"{', '.join(months[month]['completeness'])}<br>"
+                    f"{months[month]['n_samples']}<br>"
                 )
-                .mappings()
-                .all()
-            ):
-                # add date of path
-                path_date = str(row_path["date"])
-                path_month = int(path_date.split("-")[1])
-                if path_month not in dates_list:
-                    dates_list[path_month] = []
-                dates_list[path_month].append(path_date)
-
-                # add completeness
-                path_completeness = str(row_path["completeness"])
-                path_month = int(path_date.split("-")[1])
-                if path_month not in completeness_list:
-                    completeness_list[path_month] = []
-                completeness_list[path_month].append(path_completeness)
-
-                for row_scat in (
-                    con.execute(
-                        text("SELECT * FROM scats WHERE path_id = :path_id "),
-                        {"path_id": row_path["path_id"]},
-                    )
-                    .mappings()
-                    .all()
-                ):
-                    month = int(str(row_scat["date"]).split("-")[1])
-
-                    if month not in transect_month:
-                        transect_month[month] = {"samples": 0}
-
-                    transect_month[month]["samples"] += 1
-
-            out += f"<tr><td>{row['region']}</td><td>{row['province']}</td><td>{transect_id}</td>"
-
-            for month in season:
-                flag_path = False
-                # date
-                if month in dates_list:
-                    out += f"<td>{', '.join(dates_list[month])}<br>"
-                    flag_path = True
-                else:
-                    out += "<td>"
-
-                if month in completeness_list:
-                    out += f"{', '.join(completeness_list[month])}<br>"
-
-                if month in transect_month:
-                    out += f"{transect_month[month]['samples']}<br>"
-                else:
-                    if flag_path:
-                        out += "0<br>"
-                    else:
-                        out += "<br>"
+            else:
+                out += "<td><br>"
 
-                out += "</td>"
-            out += "</tr>"
+            out += "</td>"
+        out += "</tr>"
 
-        out += "</table>"
-        return out
+    out += "</table>"
+    return out
 
 
 @app.route("/transects_n_samples_by_month/<year_init>/<year_end>")
 @fn.check_login
 def transects_n_samples_by_month(year_init, year_end):
-    with fn.conn_alchemy().connect() as con:
-        # check if path based on transect exist
-        transects = (
-            con.execute(text("SELECT * FROM transects ORDER BY transect_id"))
-            .mappings()
-            .all()
-        )
-
-        sampling_years = range(int(year_init), int(year_end) + 1)
-        season_months: list = [5, 6, 7, 8, 9, 10, 11, 12, 1, 2, 3, 4]
-
-        out: list = []
-
-        # header
-        row = ["path_id"]
-        for year in sampling_years:
-            for month in season_months:
-                row.append(f"{year}-{month:02}")
-        out.append(row)
-
-        for transect in transects:
-            transect_id = transect["transect_id"]
-            row = [transect_id]
-
-            for year in sampling_years:
-                for month in season_months:
-                    paths = (
-                        con.execute(
-                            text(
-                                "SELECT path_id FROM paths "
-                                "WHERE transect_id = :transect_id "
-                                "AND EXTRACT(YEAR FROM date) = :year"
-                                "AND EXTRACT(MONTH FROM date) = :month"
-                            ),
-                            {"transect_id": transect_id, "year": year, "month": month},
-                        )
-                        .mappings()
-                        .all()
-                    )
-                    if len(paths):
-                        scats = (
-                            con.execute(
-                                text(
-                                    (
-                                        "SELECT count(*) AS n_scats FROM scats "
-                                        "WHERE path_id IN (SELECT path_id FROM paths WHERE transect_id = :transect_id AND EXTRACT(YEAR FROM date) = :year AND EXTRACT(MONTH FROM date) = :month)"
-                                    )
-                                ),
-                                {
-                                    "transect_id": transect_id,
-                                    "year": year,
-                                    "month": month,
-                                },
-                            )
-                            .mappings()
-                            .fetchone()
-                        )
-                        row.append(str(scats["n_scats"]))
-                    else:
-                        row.append("NA")
-            out.append(row)
+    """
+    TSV file with the number of samples by transect and by month (NA if no path)
+    """
 
-        out_str = "\n".join([z for z in ["\t".join(x) for x in out]])
+    transects = transects_activity.transects_paths(
+        f"{int(year_init)}-01-01", f"{int(year_end)}-12-31"
+    )
+    rows = transects_activity.n_samples_by_month(
+        transects, range(int(year_init), int(year_end) + 1)
+    )
 
-        response = make_response(out_str, 200)
-        response.headers["Content-type"] = "'text/tab-separated-values"
-        response.headers["Content-disposition"] = (
-            f"attachment; filename=transects_n-samples_{dt.datetime.now():%Y-%m-%d_%H%M%S}.tsv"
-        )
+    response = flask.Response(
+        ("\t".join(row) + "\n" for row in rows),
+        mimetype="text/tab-separated-values",
+    )
+    response.headers["Content-disposition"] = (
+        f"attachment; filename=transects_n-samples_{dt.datetime.now():%Y-%m-%d_%H%M%S}.tsv"
+    )
 
-        return response
+    return response
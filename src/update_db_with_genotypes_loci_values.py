@@ -34,7 +34,7 @@ def update_db_genotypes_loci():
     # loci list
     loci_list: dict = fn.get_loci_list()
 
-    with fn.conn_alchemy().connect() as con:
+    with fn.db_connection() as con:
         genotypes_list = [
             row["genotype_id"]
             for row in (
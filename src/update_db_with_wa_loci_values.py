@@ -16,6 +16,7 @@ from sqlalchemy.dialects.postgresql import JSONB
 
 import functions as fn
 from config import config
+from genetic_bp import wa_flags
 
 params = config()
 if not params:
@@ -25,7 +26,7 @@ if not params:
 
 def update_db_wa_loci():
     """
-    update db with loci values of WA codes
+    update db with loci values and quality flags of WA codes
     """
 
     print("Updating DB with WA codes loci")
@@ -35,7 +36,7 @@ def update_db_wa_loci():
     # loci list
     loci_list: dict = fn.get_loci_list()
 
-    with fn.conn_alchemy().connect() as con:
+    with fn.db_connection() as con:
         sql = text("SELECT DISTINCT wa_code FROM wa_scat_dw_all ")
 
         wa_list = [row["wa_code"] for row in con.execute(sql).mappings().all()]
@@ -55,6 +56,10 @@ def update_db_wa_loci():
                 },
             )
 
+    # quality flags of the WA codes
+    for idx in range(0, len(wa_list), 1000):
+        wa_flags.update(wa_list[idx : idx + 1000])
+
     print(f"DB updated with WA codes loci in {round(time.time() - t0, 1)} seconds")
 
 
@@ -1,30 +1,153 @@
 """
-update redis with WA loci values
+update redis with WA and genotypes loci values
 
 This script is required by wolfdb.py
 
+The loci values are retrieved with one query by chunk of WA codes (or genotypes)
+by a pool of processes and written in redis with pipelines.
+
+A full update (all) is written in a shadow redis db that is swapped atomically with the db in use
+at the end (SWAPDB): the readers never see an empty cache.
+An update of the WA codes or of the genotypes only overwrites the keys in the db in use.
+
+usage:
+export WOLFDB_CONFIG_PATH=PATH_TO/config.ini; python update_redis.py [all|wa|genotypes]
+
+config.ini options (all optional):
+redis_shadow_db: redis db used to build the new cache (default 6, 7 for the dev database)
+redis_update_processes: number of processes (default 4)
+redis_update_chunk_size: number of WA codes (or genotypes) by query (default 500)
 """
 
+import json
+import multiprocessing
 import sys
+import time
+from datetime import datetime
+
 import redis
+from sqlalchemy import text
 
+import functions as fn
+import job_queue
 from config import config
 
-from update_redis_with_wa_loci_values import update_redis_wa_loci
-from update_redis_with_genotypes_loci_values import update_redis_genotypes_loci
-
 params = config()
 if not params:
     print("Parameters not found")
     sys.exit(1)
 
 # dev version use db #1
-rdis = redis.Redis(db=(0 if params["database"] == "wolf" else 1))
+REDIS_DB = 0 if params["database"] == "wolf" else 1
+REDIS_SHADOW_DB = int(
+    params.get("redis_shadow_db", 6 if params["database"] == "wolf" else 7)
+)
+N_PROCESSES = int(params.get("redis_update_processes", 4))
+CHUNK_SIZE = int(params.get("redis_update_chunk_size", 500))
+
+# kind: (query of the keys, key of the update date)
+KINDS: dict = {
+    "wa": ("SELECT DISTINCT wa_code FROM wa_scat_dw_all ORDER BY wa_code", "UPDATE WA LOCI"),
+    "genotypes": ("SELECT genotype_id FROM genotypes ORDER BY genotype_id", "UPDATE GENOTYPES LOCI"),
+}
+
+
+def write_chunk(args: tuple) -> int:
+    """
+    retrieve the loci values of a chunk of WA codes (or genotypes) and write them in the redis db
+    (executed in a process of the pool)
+
+    Returns:
+        int: number of keys written
+    """
+    kind, keys, loci_list, db = args
+
+    if kind == "wa":
+        values = {
+            wa_code: loci_values
+            for wa_code, (loci_values, _) in fn.get_wa_loci_values_multi(keys, loci_list).items()
+        }
+    else:
+        values = fn.get_genotypes_loci_values_multi(keys, loci_list)
+
+    with redis.Redis(db=db).pipeline(transaction=False) as pipe:
+        for key, loci_values in values.items():
+            pipe.set(key, json.dumps(loci_values))
+        pipe.execute()
+
+    return len(values)
+
+
+def update(kinds: tuple, db: int) -> dict:
+    """
+    write the loci values of the kinds (wa, genotypes) in the redis db
+
+    Returns:
+        dict: number of keys by kind
+    """
+
+    loci_list: dict = fn.get_loci_list()
+
+    tasks: list = []
+    with fn.db_connection() as con:
+        for kind in kinds:
+            keys = [row[0] for row in con.execute(text(KINDS[kind][0])) if row[0]]
+            tasks.extend(
+                (kind, keys[i : i + CHUNK_SIZE], loci_list, db)
+                for i in range(0, len(keys), CHUNK_SIZE)
+            )
+
+    # the processes must create their own database connections
+    fn.conn_alchemy().dispose()
+
+    counts: dict = {kind: 0 for kind in kinds}
+    with multiprocessing.Pool(N_PROCESSES) as pool:
+        for idx, n_keys in enumerate(pool.imap(write_chunk, tasks)):
+            counts[tasks[idx][0]] += n_keys
+            job_queue.progress(
+                (idx + 1) / len(tasks) * 100, f"{sum(counts.values())} keys written"
+            )
+
+    rdis = redis.Redis(db=db)
+    for kind in kinds:
+        rdis.set(KINDS[kind][1], datetime.now().isoformat())
+
+    return counts
+
+
+def update_redis(kinds: tuple = ("wa", "genotypes")) -> None:
+    """
+    update redis with the loci values.
+    If all kinds are updated the new cache is built in the shadow db and swapped with the db in use
+    """
+
+    t0 = time.time()
+    full = set(kinds) == set(KINDS)
+
+    if full:
+        print(f"Building the new cache in redis db #{REDIS_SHADOW_DB}")
+        redis.Redis(db=REDIS_SHADOW_DB).flushdb()
+        counts = update(kinds, REDIS_SHADOW_DB)
+        # atomic swap: the new cache replaces the old one
+        redis.Redis(db=REDIS_DB).swapdb(REDIS_DB, REDIS_SHADOW_DB)
+        # remove the old cache
+        redis.Redis(db=REDIS_SHADOW_DB).flushdb()
+    else:
+        counts = update(kinds, REDIS_DB)
 
-# empty db
-rdis.flushdb()
+    duration = time.time() - t0
+    report = (
+        ", ".join(f"{kind}: {n_keys} keys" for kind, n_keys in counts.items())
+        + f" in {duration:.1f} s ({sum(counts.values()) / duration if duration else 0:.0f} keys/s)"
+    )
+    print(f"REDIS updated. {report} ({N_PROCESSES} processes, chunks of {CHUNK_SIZE})")
+    # displayed on the jobs page
+    job_queue.progress(100, report)
 
 
 if __name__ == "__main__":
-    update_redis_wa_loci()
-    update_redis_genotypes_loci()
+    kind = sys.argv[1] if len(sys.argv) > 1 else "all"
+    if kind not in ("all", *KINDS):
+        print(__doc__)
+        sys.exit(1)
+    update_redis(tuple(KINDS) if kind == "all" else (kind,))
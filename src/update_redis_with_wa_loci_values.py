@@ -3,23 +3,10 @@ update redis with WA loci values
 
 This script is required by wolfdb.py
 
+see update_redis.py
 """
 
-import json
-import sys
-import time
-from datetime import datetime
-
-import redis
-from sqlalchemy import text
-
-import functions as fn
-from config import config
-
-params = config()
-if not params:
-    print("Parameters not found")
-    sys.exit(1)
+from update_redis import update_redis
 
 
 def update_redis_wa_loci():
@@ -29,34 +16,7 @@ def update_redis_wa_loci():
     """
 
     print("Updating REDIS with WA codes loci")
-    t0 = time.time()
-    # dev version use db #1
-    rdis = redis.Redis(db=(0 if params["database"] == "wolf" else 1))
-
-    # loci list
-    loci_list: dict = fn.get_loci_list()
-
-    with fn.conn_alchemy().connect() as con:
-        sql = text("SELECT wa_code FROM wa_scat_dw_all ORDER BY wa_code")
-
-        for row in con.execute(sql).mappings().all():
-            # old = fn.get_wa_loci_values_old(row["wa_code"], loci_list)
-            # new = fn.get_wa_loci_values(row["wa_code"], loci_list)
-            # if old != new:
-            #    print(old)
-            #    print(new)
-            #    sys.exit()
-
-            # print(row["wa_code"])
-
-            rdis.set(
-                row["wa_code"],
-                json.dumps(fn.get_wa_loci_values(row["wa_code"], loci_list)[0]),
-            )
-
-    rdis.set("UPDATE WA LOCI", datetime.now().isoformat())
-
-    print(f"REDIS updated with WA codes loci in {round(time.time() - t0, 1)} seconds")
+    update_redis(("wa",))
 
 
 if __name__ == "__main__":
@@ -0,0 +1,73 @@
+"""
+WolfDB web service
+(c) Olivier Friard
+
+staging of the uploaded spreadsheets of the imports (scats, paths, tracks, tissues, WA codes and genotypes)
+
+The result of the extraction of an uploaded file (rows parsed and validated by the extract_* function
+of the importer) is saved in the upload folder, with the name of the upload (UUID):
+the confirm step of the import loads the staged rows instead of reading and validating the file again.
+The staged rows are removed after the import (discard).
+"""
+
+import pathlib as pl
+import pickle
+import uuid
+from typing import Callable
+
+from config import config
+
+params = config()
+
+SUFFIX = ".staged.pickle"
+
+
+def staged_path(filename: str) -> pl.Path | None:
+    """
+    returns the path of the staged rows of the uploaded file (None if the file name is not an upload UUID)
+    """
+    path = pl.Path(filename)
+    if path.name != filename:
+        return None
+    try:
+        uuid.UUID(path.stem)
+    except ValueError:
+        return None
+    return pl.Path(params["upload_folder"]) / f"{path.stem}{SUFFIX}"
+
+
+def extract(filename: str, extractor: Callable, *args) -> tuple:
+    """
+    returns the result of the extractor for the uploaded file (error flag, message, data...).
+    The staged result is returned if it exists, otherwise the file is parsed by the extractor
+    and the result is staged (if no error).
+    """
+    path = staged_path(filename)
+    if path is not None and path.is_file():
+        try:
+            with open(path, "rb") as f_in:
+                return pickle.load(f_in)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            pass
+
+    result = extractor(filename, *args)
+
+    if path is not None and not result[0]:
+        tmp_path = path.with_name(f"{path.name}.tmp")
+        try:
+            with open(tmp_path, "wb") as f_out:
+                pickle.dump(result, f_out, protocol=pickle.HIGHEST_PROTOCOL)
+            tmp_path.replace(path)
+        except (OSError, pickle.PicklingError):
+            tmp_path.unlink(missing_ok=True)
+
+    return result
+
+
+def discard(filename: str) -> None:
+    """
+    remove the staged rows of the uploaded file
+    """
+    path = staged_path(filename)
+    if path is not None:
+        path.unlink(missing_ok=True)
@@ -20,6 +20,7 @@ from markupsafe import Markup
 from sqlalchemy import text
 
 import functions as fn
+import geocoding
 
 # blueprints
 import google_auth
@@ -29,10 +30,12 @@ from config import config
 from dead_wolves_bp import dead_wolves
 from flask_session import Session
 from genetic_bp import genetic
+from jobs_bp import jobs
 from packs_bp import packs
 from paths_bp import paths
 from scats_bp import scats
 from snowtracks_bp import tracks
+from tiles_bp import tiles
 from transects_bp import transects
 
 __version__ = "2026-04-09"
@@ -61,6 +64,11 @@ app.register_blueprint(genetic.app)
 app.register_blueprint(dead_wolves.app)
 app.register_blueprint(admin.app)
 app.register_blueprint(analysis.app)
+app.register_blueprint(jobs.app)
+app.register_blueprint(tiles.app)
+
+# return the request-scoped database connection to the pool
+app.teardown_appcontext(fn.close_db)
 
 params = config()
 
@@ -130,7 +138,7 @@ def settings():
 
     if request.method == "GET":
         # check if current user can modify allele value (allele modifier)
-        with fn.conn_alchemy().connect() as con:
+        with fn.db_connection() as con:
             allele_modifier = (
                 "Yes"
                 if (
@@ -205,7 +213,7 @@ def rev_geocoding(east: int, north: int, zone: str):
             "location": "",
         }
 
-    r = fn.reverse_geocoding(lat_lon[::-1])
+    r = geocoding.reverse_geocoding(lat_lon[::-1])
 
     if r is None:
         return {
@@ -296,7 +304,7 @@ def query():
                 error="Error: The query cannot contain 'update'",
             )
 
-        with fn.conn_alchemy().connect() as con:
+        with fn.db_connection() as con:
             try:
                 error = ""
                 result = con.execute(text(sql_query))